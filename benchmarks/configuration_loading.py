@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Benchmark of loading a large tree of configuration files.
+
+The configuration consists of a base file that includes a number of files, some
+of them with prefixes, which define pipelines that use ``!path`` and ``!filepath``.
+The configuration is loaded with:
+
+pure-python
+    The pure-Python YAML loader, as the configuration was loaded before.
+libyaml
+    :class:`piped.conf.ConfigurationManager` without a parse cache, which uses
+    libyaml if PyYAML was built with it.
+cold cache
+    A parse cache that is empty, so every file is parsed and cached.
+warm cache
+    A parse cache that contains every file, as when a worker process or a
+    restarted process loads the configuration.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/configuration_loading.py --files 50 --pipelines 20
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import yaml
+
+from piped import conf
+
+
+PIPELINE = """
+    pipeline_%(index)i:
+        - decode-json:
+            input_path: !path request.content
+            output_path: decoded
+        - eval-lambda:
+            input_path: decoded
+            output_path: result
+            lambda: "value: [item * 2 for item in value]"
+        - for-each:
+            input_path: result
+            processor: pipeline.%(prefix)spipeline_%(index)i_item
+        - write-file:
+            file: !filepath /tmp/%(prefix)s%(index)i.out
+            input_path: result
+        - set-value:
+            path: status
+            value: {code: 200, message: ok, retries: [1, 2, 3]}
+"""
+
+
+class PurePythonConfigurationManager(conf.ConfigurationManager):
+
+    def _parse_file(self, filename):
+        with open(filename) as configuration_file:
+            return yaml.load(configuration_file, Loader=yaml.Loader)
+
+
+def write_configuration(directory, files, pipelines):
+    includes = list()
+    for i in range(files):
+        prefix = 'group_%i.' % i if i % 2 else ''
+        path = os.path.join(directory, 'pipelines_%i.yaml' % i)
+        with open(path, 'w') as configuration_file:
+            configuration_file.write('pipelines:\n')
+            for j in range(pipelines):
+                configuration_file.write(PIPELINE % dict(index=j, prefix=prefix))
+        includes.append({'group_%i' % i: path} if prefix else path)
+
+    base_path = os.path.join(directory, 'piped.yaml')
+    with open(base_path, 'w') as configuration_file:
+        yaml.dump(dict(includes=includes, service_name='benchmark'), configuration_file)
+    return base_path
+
+
+def measure(manager_factory, path, parse_cache_path, iterations):
+    start = time.time()
+    for i in range(iterations):
+        if parse_cache_path == 'cold':
+            cache_path = tempfile.mktemp(suffix='.cache')
+        else:
+            cache_path = parse_cache_path
+
+        manager = manager_factory()
+        manager.parse_cache_path = cache_path
+        manager.load_from_file(path)
+
+        if parse_cache_path == 'cold':
+            os.remove(cache_path)
+    return (time.time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure loading a tree of configuration files.')
+    parser.add_argument('--files', type=int, default=50, help='Number of included configuration files.')
+    parser.add_argument('--pipelines', type=int, default=20, help='Number of pipelines per included file.')
+    parser.add_argument('--iterations', type=int, default=5, help='Number of times the configuration is loaded per measurement.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = write_configuration(directory, args.files, args.pipelines)
+        warm_cache_path = os.path.join(directory, 'piped.yaml.cache')
+        manager = conf.ConfigurationManager()
+        manager.parse_cache_path = warm_cache_path
+        manager.load_from_file(path)
+
+        variants = [
+            ('pure-python', PurePythonConfigurationManager, None),
+            ('libyaml', conf.ConfigurationManager, None),
+            ('cold cache', conf.ConfigurationManager, 'cold'),
+            ('warm cache', conf.ConfigurationManager, warm_cache_path),
+        ]
+
+        print '%i files, %i pipelines' % (args.files + 1, args.files * args.pipelines)
+        for name, manager_factory, parse_cache_path in variants:
+            elapsed = measure(manager_factory, path, parse_cache_path, args.iterations)
+            print '    %-12s %8.1f ms' % (name, elapsed * 1e3)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Benchmark of building and resolving large dependency graphs.
+
+The graph mimics the startup of a large configuration: every pipeline depends on
+its processors, which depend on a few shared resources. Like pipelines that are
+made by providers when they are first depended on, resolving the pipelines of one
+round adds the pipelines of the next round, so the dependencies are resolved in
+many rounds. The graph is built and resolved with:
+
+full-sort
+    The resolution as it was before it was incremental, which checks the whole
+    graph for cycles and sorts it topologically in every round.
+incremental
+    :class:`piped.dependencies.DependencyManager`.
+
+If the resolution is linear in the number of dependencies, the time per dependency
+stays the same as the graph grows.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/dependency_resolution.py --nodes 50000
+"""
+import argparse
+import time
+
+import networkx
+
+from piped import dependencies, exceptions, processing
+
+
+class FullSortDependencyManager(dependencies.DependencyManager):
+
+    def resolve_initial_states(self):
+        if not networkx.is_directed_acyclic_graph(self._dependency_graph):
+            raise exceptions.CircularDependencyGraph('A dependency graph cannot contain cycles.')
+
+        while True:
+            topological_sort = networkx.topological_sort(self._dependency_graph)
+
+            unresolved_dependencies = [dependency for dependency in topological_sort if not self._dependency_graph.node[dependency]['resolved']]
+            if not unresolved_dependencies:
+                break
+
+            for dependency in unresolved_dependencies:
+                node_data = self._dependency_graph.node[dependency]
+                if node_data.get('resolved', False):
+                    continue
+                node_data['resolved'] = True
+                dependency.resolve_initial_state()
+
+
+class Node(dependencies.Dependency):
+
+    def __init__(self, name, on_resolved=None):
+        super(Node, self).__init__()
+        self.name = name
+        self.on_resolved = on_resolved
+
+    def resolve_initial_state(self):
+        super(Node, self).resolve_initial_state()
+        if self.on_resolved:
+            self.on_resolved()
+
+    def __repr__(self):
+        return 'Node(%r)' % self.name
+
+
+class GraphBuilder(object):
+
+    def __init__(self, manager, nodes, processors_per_pipeline=10, pipelines_per_round=50, resources=100):
+        self.manager = manager
+        self.processors_per_pipeline = processors_per_pipeline
+        self.pipelines_per_round = pipelines_per_round
+        self.pipelines = nodes // (processors_per_pipeline + 1)
+
+        self.resources = [Node('resource.%i' % i) for i in range(resources)]
+        self.added_pipelines = 0
+
+    def add_round(self):
+        for i in range(self.pipelines_per_round):
+            if self.added_pipelines == self.pipelines:
+                return
+            # the last pipeline of the round adds the next round when it is resolved.
+            is_last = i == self.pipelines_per_round - 1
+            self.add_pipeline(self.added_pipelines, on_resolved=self.add_round if is_last else None)
+            self.added_pipelines += 1
+
+    def add_pipeline(self, index, on_resolved=None):
+        pipeline = Node('pipeline.%i' % index, on_resolved)
+        self.manager.add_dependency(pipeline)
+        for i in range(self.processors_per_pipeline):
+            processor = Node('pipeline.%i.processor.%i' % (index, i))
+            self.manager.add_dependency(pipeline, processor)
+            self.manager.add_dependency(processor, self.resources[(index + i) % len(self.resources)])
+
+
+def measure(manager_factory, nodes):
+    manager = manager_factory()
+    manager.configure(processing.RuntimeEnvironment())
+
+    start = time.time()
+    builder = GraphBuilder(manager, nodes)
+    builder.add_round()
+    manager.resolve_initial_states()
+    elapsed = time.time() - start
+
+    assert builder.added_pipelines == builder.pipelines
+    return elapsed, len(manager._dependency_graph)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure how resolving dependency graphs scales.')
+    parser.add_argument('--nodes', type=int, default=50000, help='Number of dependencies in the largest graph.')
+    parser.add_argument('--steps', type=int, default=4, help='Number of graph sizes, from nodes/steps to nodes.')
+    parser.add_argument('--skip-full-sort', action='store_true', help='Only measure the incremental resolution.')
+    args = parser.parse_args()
+
+    variants = [('incremental', dependencies.DependencyManager)]
+    if not args.skip_full_sort:
+        variants.insert(0, ('full-sort', FullSortDependencyManager))
+
+    for name, manager_factory in variants:
+        print name
+        for step in range(1, args.steps + 1):
+            elapsed, nodes = measure(manager_factory, args.nodes * step // args.steps)
+            print '    %6d dependencies %8.2f s %8.2f us per dependency' % (nodes, elapsed, elapsed / nodes * 1e6)
+
+
+if __name__ == '__main__':
+    main()
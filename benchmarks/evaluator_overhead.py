@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Micro-benchmark of the per-processor overhead of evaluating pipelines whose
+processors return plain values.
+
+The pipeline is a chain of ``set-value``, ``set-values``, ``remap``, ``format-string``
+and ``encode-json`` processors, repeated until it has the requested length. It is
+evaluated with:
+
+inlineCallbacks
+    The evaluator and processors as they were before the synchronous fast path,
+    wrapping every step in :func:`twisted.internet.defer.inlineCallbacks`.
+twisted
+    :class:`piped.processing.TwistedProcessorGraphEvaluator`.
+compiled
+    :class:`piped.processing.CompiledProcessorGraphEvaluator`.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/evaluator_overhead.py --processors 30 --batons 2000
+"""
+import argparse
+import timeit
+
+from twisted.internet import defer
+
+from piped import processing
+from piped.processors import base, json_processors, util_processors
+
+
+class InlineCallbacksEvaluator(processing.TwistedProcessorGraphEvaluator):
+    _process = defer.inlineCallbacks(processing.TwistedProcessorGraphEvaluator._process.__wrapped__)
+
+
+def _with_inline_callbacks(processor):
+    """ Make *processor* force Deferreds like the base processors used to. """
+    for cls in base.InputOutputProcessor, base.MappingProcessor:
+        if isinstance(processor, cls):
+            process = defer.inlineCallbacks(cls.process.__wrapped__)
+            processor.process = lambda baton, process=process, processor=processor: process(processor, baton)
+    return processor
+
+
+def make_processors(count):
+    factories = [
+        lambda: util_processors.ValueSetter(path='value', value=42),
+        lambda: util_processors.MappingSetter(mapping=dict(a=1, b=2)),
+        lambda: util_processors.RemapProcessor(mapping=dict(a='c')),
+        lambda: util_processors.StringFormatter(input_path='value', output_path='formatted', format='{0}'),
+        lambda: json_processors.JsonEncoder(input_path='c', output_path='encoded'),
+    ]
+    return [factories[i % len(factories)]() for i in range(count)]
+
+
+def make_evaluator(evaluator_factory, processors):
+    pg = processing.ProcessorGraph()
+    builder = pg.get_builder()
+    for processor in processors:
+        builder = builder.add_processor(processor)
+    return evaluator_factory(pg)
+
+
+def measure(evaluator, batons):
+    def run():
+        for i in range(batons):
+            evaluator.process(dict())
+
+    return min(timeit.repeat(run, repeat=3, number=1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the per-processor overhead of the evaluators.')
+    parser.add_argument('--processors', type=int, default=30, help='Number of chained processors.')
+    parser.add_argument('--batons', type=int, default=2000, help='Number of batons to process.')
+    args = parser.parse_args()
+
+    variants = [
+        ('inlineCallbacks', InlineCallbacksEvaluator, _with_inline_callbacks),
+        ('twisted', processing.TwistedProcessorGraphEvaluator, lambda processor: processor),
+        ('compiled', processing.CompiledProcessorGraphEvaluator, lambda processor: processor),
+    ]
+
+    baseline = None
+    steps = float(args.processors * args.batons)
+    print '%d processors, %d batons' % (args.processors, args.batons)
+    for name, evaluator_factory, prepare in variants:
+        processors = [prepare(processor) for processor in make_processors(args.processors)]
+        evaluator = make_evaluator(evaluator_factory, processors)
+
+        elapsed = measure(evaluator, args.batons)
+        per_processor = elapsed / steps * 1e6
+        baseline = baseline or per_processor
+        print '%-16s %8.2f us per processor (%.2fx)' % (name, per_processor, baseline / per_processor)
+
+
+if __name__ == '__main__':
+    main()
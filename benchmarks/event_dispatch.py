@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Micro-benchmark of :class:`piped.event.Event`.
+
+The events are measured with a varying number of callbacks, and compared with:
+
+list
+    The event as it was before, which copies its list of callbacks every time
+    it is called and removes callbacks from the list.
+
+The following are measured, in microseconds per operation:
+
+call
+    Calling the event.
+handle/unhandle
+    Adding a callback and removing it again, as ``wait_until_fired`` does.
+call after change
+    Adding and removing a callback, then calling the event.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/event_dispatch.py --callbacks 1 10 1000
+"""
+import argparse
+import time
+
+from piped import event
+
+
+class ListEvent(event.Event):
+
+    def __init__(self, async=False):
+        self._callbacks = []
+        self.async = async
+
+    def handle(self, callback):
+        self._callbacks.append(callback)
+        return self
+    __iadd__ = handle
+
+    def unhandle(self, callback):
+        if not callback in self._callbacks:
+            raise ValueError("%s was not handling this event." % callback)
+        self._callbacks.remove(callback)
+        return self
+    __isub__ = unhandle
+
+    def __call__(self, *args, **kwargs):
+        callbacks = self._callbacks[:]
+        for callback in callbacks:
+            callback(*args, **kwargs)
+
+
+def make_callbacks(count):
+    return [lambda value: None for i in range(count)]
+
+
+def measure_call(e, callbacks, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        e(i)
+    return time.time() - start
+
+
+def measure_handle_unhandle(e, callbacks, iterations):
+    callback = lambda value: None
+
+    start = time.time()
+    for i in xrange(iterations):
+        e.handle(callback)
+        e.unhandle(callback)
+    return time.time() - start
+
+
+def measure_call_after_change(e, callbacks, iterations):
+    callback = lambda value: None
+
+    start = time.time()
+    for i in xrange(iterations):
+        e.handle(callback)
+        e.unhandle(callback)
+        e(i)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the overhead of events.')
+    parser.add_argument('--callbacks', type=int, nargs='+', default=[1, 10, 1000], help='Numbers of callbacks to measure with.')
+    parser.add_argument('--operations', type=int, default=100000, help='Number of callback invocations per measurement.')
+    args = parser.parse_args()
+
+    measurements = [('call', measure_call), ('handle/unhandle', measure_handle_unhandle), ('call after change', measure_call_after_change)]
+    for name, measure in measurements:
+        print name
+        for count in args.callbacks:
+            # calling the event calls every callback, so fewer calls are made with more callbacks.
+            iterations = max(args.operations // count, 100) if measure is not measure_handle_unhandle else args.operations
+            callbacks = make_callbacks(count)
+
+            timings = list()
+            for event_factory in ListEvent, event.Event:
+                e = event_factory()
+                for callback in callbacks:
+                    e.handle(callback)
+                timings.append(measure(e, callbacks, iterations) / iterations * 1e6)
+
+            print '    %5d callbacks    list %8.2f us    event %8.2f us' % (count, timings[0], timings[1])
+
+
+if __name__ == '__main__':
+    main()
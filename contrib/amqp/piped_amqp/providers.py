@@ -11,7 +11,7 @@ from twisted.application import service
 from twisted.internet import reactor, defer, task, endpoints, error
 from twisted.python import failure
 
-from piped import resource, util, event, exceptions
+from piped import resource, util, event, exceptions, processing
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +40,7 @@ class AMQPConnectionProvider(object, service.MultiService):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['amqp.connections']
 
     def __init__(self):
         self._connection_by_name = dict()
@@ -322,6 +323,7 @@ class AMQPConsumerProvider(object, service.MultiService):
     See :class:`AMQPConsumer` for more details about available consumer configuration options.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['amqp.connections']
 
     def __init__(self):
         self._consumer_by_name = dict()
@@ -352,7 +354,7 @@ class AMQPConsumer(object, service.Service):
                  no_ack = False, exclusive = False,
                  ack_after_failed_processing=False, ack_after_successful_processing=True,
                  nack_after_failed_processing=True, channel_reopen_interval=1,
-                 log_processor_exceptions='warn'):
+                 log_processor_exceptions='warn', deadline=None):
         """
         :param name: Logical name of this consumer.
         :param processor: The processor used to process the messages.
@@ -374,6 +376,8 @@ class AMQPConsumer(object, service.Service):
             channel if it closes.
         :param log_processor_exceptions: Log level for exceptions raised by our processor. Set to None
             to disable.
+        :param deadline: The number of seconds the processor may spend on a message before the
+            processing is cancelled, which counts as failed processing. Defaults to no deadline.
         """
         self.name = name
         self.processor_config = dict(provider=processor) if isinstance(processor, basestring) else processor
@@ -397,6 +401,8 @@ class AMQPConsumer(object, service.Service):
         self.exclusive = exclusive
         self.channel_reopen_interval = channel_reopen_interval
 
+        self.deadline = deadline
+
         self.log_processor_exceptions = log_processor_exceptions
         if log_processor_exceptions:
             # make sure the provided log level actually exists:
@@ -480,7 +486,11 @@ class AMQPConsumer(object, service.Service):
     @defer.inlineCallbacks
     def process(self, **baton):
         processor = yield self.processor_dependency.wait_for_resource()
-        yield processor(baton)
+        scope = util.CancellationScope(self.deadline)
+        try:
+            yield processing.call_in_scope(scope, processor, baton)
+        finally:
+            scope.close()
 
     def startService(self):
         if not self.running:
@@ -33,6 +33,7 @@ class RPCClientProvider(object, service.MultiService):
     See :class:`RPCClientBase`, which may serve as an useful base-class.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['amqp.rpc_clients']
 
     def __init__(self):
         service.MultiService.__init__(self)
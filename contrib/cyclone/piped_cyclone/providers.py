@@ -97,6 +97,7 @@ class CycloneProvider(object):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['cyclone']
 
     configuration_key = 'cyclone'
 
@@ -46,6 +46,7 @@ class DatabaseEngineProvider(object, service.MultiService):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['database.engines']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -108,6 +109,7 @@ class PostgresListenProvider(object, service.MultiService):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['database.engines']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -33,6 +33,7 @@ class ManholeProvider(object, service.MultiService):
                             username: password
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['manholes']
 
     def __init__(self):
         service.MultiService.__init__(self)
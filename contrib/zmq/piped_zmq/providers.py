@@ -213,6 +213,7 @@ class ZMQProcessorFeederProvider(object):
                     processor: processor_name
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['zmq.queues']
 
     _socket_poller = None
 
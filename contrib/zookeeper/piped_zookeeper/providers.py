@@ -44,6 +44,7 @@ class ZookeeperClientProvider(object, service.MultiService):
     Available keys for events are: 'starting', 'stopping', 'connected', 'reconnecting', 'reconnected', 'expired'
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['zookeeper.clients']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -1,5 +1,7 @@
 # Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import cPickle as pickle
+import hashlib
 import logging
 import os
 import warnings
@@ -8,9 +10,8 @@ from pprint import pformat
 import yaml
 from twisted.python import filepath
 
-# We don't use yamlutil directly here, but import it as it registers custom constructors and representers.
-from piped import yamlutil
-from piped import exceptions, util
+import piped
+from piped import exceptions, util, yamlutil
 
 
 logger = logging.getLogger(__name__)
@@ -33,6 +34,75 @@ def _warn_because_file_is_loaded_multiple_times(path, visited_files):
     logger.debug('HINT: %s' % hint)
 
 
+class ConfigurationParseCache(object):
+    """ Keeps the parsed contents of configuration files in the file *path*.
+
+    A file is parsed again if its modification time or size has changed, or if the
+    ``!filepath`` and ``!pipedpath`` in it refer to other files than when it was cached,
+    for example because the current working directory is different.
+
+    Only the files that were parsed since the cache was loaded are kept when the
+    cache is saved, so files that are no longer included are removed from it.
+    """
+    #: Incremented when the contents of the cache change, which makes older caches outdated.
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.key = (yamlutil.Loader.__name__, os.path.dirname(piped.__file__))
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._parsed_entries = dict()
+
+    def _load_entries(self):
+        entries = util.load_cache_file(self.path, (self.version, self.key), 'configuration cache')
+        if entries is None:
+            return dict()
+        return entries
+
+    def parse(self, filename):
+        """ Returns the parsed contents of *filename*, using the cache if it is up to date. """
+        if self._entries is None:
+            self._entries = self._load_entries()
+
+        stat = os.stat(filename)
+        stamp = (stat.st_mtime, stat.st_size)
+
+        entry = self._entries.get(filename)
+        if entry and entry[0] == stamp and yamlutil.paths_are_unchanged(entry[1]):
+            self.hits += 1
+            self._parsed_entries[filename] = entry
+            # unpickle a new copy every time, as the loaded configuration is modified while merging it
+            return pickle.loads(entry[2])
+
+        self.misses += 1
+        resolved_paths = list()
+        with open(filename) as configuration_file:
+            config = yamlutil.load(configuration_file, resolved_paths)
+
+        try:
+            self._parsed_entries[filename] = (stamp, resolved_paths, pickle.dumps(config, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            logger.debug('Not caching the configuration file %r, as it cannot be pickled.' % filename, exc_info=True)
+        return config
+
+    def save(self):
+        """ Replace the cached files with the files that have been parsed.
+
+        The file is replaced atomically, so other processes either see the previous
+        or the new cache. Nothing is written if no file has changed.
+        """
+        if self._parsed_entries == self._entries:
+            return True
+
+        if not util.save_cache_file(self.path, (self.version, self.key), self._parsed_entries, 'configuration cache'):
+            return False
+
+        self._entries = dict(self._parsed_entries)
+        return True
+
+
 class ConfigurationManager(object):
     """ Responsible for loading and accessing the configuration.
 
@@ -65,9 +135,19 @@ class ConfigurationManager(object):
             foo: 123
             zip: zap
 
+    The configuration files are parsed with libyaml if it is available. If
+    :attr:`parse_cache_path` is set, the parsed files are kept in a
+    :class:`ConfigurationParseCache`, which avoids parsing the files that
+    have not changed the next time the configuration is loaded.
     """
+    #: The path of the :class:`ConfigurationParseCache` to use, if any.
+    parse_cache_path = None
+
     def __init__(self):
         self._config = dict()
+        self.loaded_files = list()
+        self.overrides = list()
+        self.parse_cache = None
 
     def configure(self, runtime_environment):
         """ Configures this manager with the runtime environment.
@@ -85,13 +165,97 @@ class ConfigurationManager(object):
         logger.debug('Loading configuration from: %s'%filename)
         self._fail_if_configuration_file_does_not_exist(filename)
 
-        base_config = yaml.load(open(filename))
-        complete_config = self._load_config(base_config, [filename])
+        if self.parse_cache_path:
+            self.parse_cache = ConfigurationParseCache(util.expand_filepath(self.parse_cache_path))
+
+        base_config = self._parse_file(filename)
+        visited_files = [filename]
+        complete_config = self._load_config(base_config, visited_files)
         self._resolve_aliases(complete_config)
 
+        if self.parse_cache:
+            self.parse_cache.save()
+
         self._config = complete_config
+        self.loaded_files = visited_files
+
+        # formatting a large configuration takes longer than loading it, so only do it if it is logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Loaded configuration: '+pformat(complete_config))
+
+    def reload(self):
+        """ Load the configuration files again, and apply the same overrides.
+
+        Values that were set by other means than :meth:`load_overrides` are lost.
+        """
+        overrides = self.overrides
+        self.load_from_file(self.loaded_files[0])
+        self.overrides = list()
+        self.load_overrides(overrides)
+
+    def get_state(self):
+        """ Returns the loaded configuration, files and overrides, which may be
+        restored with :meth:`restore_state`. """
+        return self._config, list(self.loaded_files), list(self.overrides)
 
-        logger.debug('Loaded configuration: '+pformat(complete_config))
+    def restore_state(self, state):
+        """ Restores a state that was returned by :meth:`get_state`. """
+        config, loaded_files, overrides = state
+        self._config, self.loaded_files, self.overrides = config, list(loaded_files), list(overrides)
+
+    def load_overrides(self, overrides):
+        """ Set the configuration overrides in *overrides*, which is a list of
+        ``path:value`` strings, where the values are YAML-serialized.
+
+        .. seealso::
+
+            :ref:`piped-configuration-overrides`
+        """
+        for override in overrides:
+            # in yaml, a mapping uses a colon followed by a space, but we want to be able to
+            # specify -O some.nested.option:42 on the command line, without the space, so we
+            # add a space after the first colon in the override specification, as doing so does
+            # not affect an otherwise correct yaml mapping.
+            adjusted_override = override.replace(':', ': ', 1)
+            override_as_dict = yaml.load(adjusted_override)
+
+            if not isinstance(override_as_dict, dict):
+                e_msg = 'Invalid override specification.'
+                detail = 'Expected a yaml mapping, but got %r.' % override
+                raise exceptions.ConfigurationError(e_msg, detail)
+
+            for path, value in override_as_dict.items():
+                logger.debug('Setting configuration override %r.'%path)
+                self.set(path, value)
+
+            self.overrides.append(override)
+
+    def get_content_hash(self):
+        """ Returns a hash of the contents of the loaded configuration files and the
+        overrides, or None if the configuration was not loaded from a file.
+
+        Configuration values that are set by other means than :meth:`load_overrides`
+        are not part of the hash.
+        """
+        if not self.loaded_files:
+            return None
+
+        content_hash = hashlib.sha1()
+        # the configuration depends on whether we are running the unit tests (see runmodes)
+        content_hash.update(repr(util.in_unittest()))
+        for loaded_file in self.loaded_files:
+            content_hash.update(loaded_file)
+            content_hash.update(open(loaded_file, 'rb').read())
+        for override in self.overrides:
+            content_hash.update(override)
+        return content_hash.hexdigest()
+
+    def _parse_file(self, filename):
+        if self.parse_cache:
+            return self.parse_cache.parse(filename)
+
+        with open(filename) as configuration_file:
+            return yamlutil.load(configuration_file)
 
     def _load_config(self, config, visited_files):
         """ Handles the configuration object, including referenced configurations as
@@ -142,7 +306,7 @@ class ConfigurationManager(object):
             self._fail_if_configuration_file_does_not_exist(include_path)
 
             try:
-                included_config = yaml.load(open(include_path))
+                included_config = self._parse_file(include_path)
                 included_config = self._load_config(included_config, visited_files)
 
                 if include_prefix:
@@ -3,9 +3,11 @@
 """
 This module contains base implementations and managers for the resource system.
 """
+import collections
 import copy
+
 import networkx
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.python import failure, components
 from zope import interface
 
@@ -301,12 +303,49 @@ components.registerAdapter(DictResourceDependencyAdapter, dict, IDependency)
 
 
 class DependencyManager(object):
-    """ Manages a directed, acyclic graph of dependencies. """
+    """ Manages a directed, acyclic graph of dependencies.
+
+    The manager keeps the dependencies in a topological order that is updated
+    as dependencies are added, so resolving the new dependencies only has to
+    visit them, and cycles are detected when the edge that completes them is
+    added.
+
+    By default, a dependency that becomes ready or lost is propagated to its
+    consumers immediately. If ``coalesce`` is true, the transitions are instead
+    propagated in one pass in a later reactor iteration, and only the final state
+    of a dependency is propagated. If ``debounce`` is set, a dependency must have
+    kept its state for that many seconds before it is propagated. See
+    :ref:`topic-dependencies-coalescing`.
+
+    :ivar coalesce: Whether ready/lost transitions are coalesced.
+    :ivar debounce: The number of seconds a dependency must keep its state before
+        its consumers are told about it, if ``coalesce`` is true.
+    :ivar suppressed_transitions: A :class:`collections.Counter` of the transitions
+        that were never propagated to the consumers, by dependency.
+    """
+    coalesce = False
+    debounce = 0
+    clock = reactor
 
     def __init__(self):
         self._dependency_graph = networkx.DiGraph()
         self._instance_dependencies = dict()
 
+        # the position of every dependency in a topological order of the graph, not
+        # counting the edges in _cyclic_edges, which would make the graph cyclic.
+        self._order = dict()
+        self._lowest_order = 0
+        self._highest_order = 0
+        self._cyclic_edges = set()
+        # the dependencies that have not been resolved yet
+        self._unresolved = set()
+
+        # the transitions that have not been propagated yet, by dependency
+        self._pending_transitions = dict()
+        self._flush_call = None
+        self._cascading_synchronously = False
+        self.suppressed_transitions = collections.Counter()
+
     def configure(self, runtime_environment):
         """ Configures this manager with the runtime environment.
 
@@ -314,6 +353,17 @@ class DependencyManager(object):
         """
         self.runtime_environment = runtime_environment
 
+    def _configure_coalescing(self):
+        # the configuration is loaded after we are configured, so it is read when resolving.
+        self.coalesce = self.runtime_environment.get_configuration_value('dependencies.coalesce', self.coalesce)
+        self.debounce = self.runtime_environment.get_configuration_value('dependencies.debounce', self.debounce)
+
+        if not isinstance(self.debounce, (int, float)) or self.debounce < 0:
+            e_msg = 'invalid dependency debounce delay: %r' % (self.debounce, )
+            detail = 'The debounce delay is the number of seconds a dependency must keep its state before it is propagated.'
+            hint = 'Use a non-negative number.'
+            raise exceptions.ConfigurationError(e_msg, detail, hint)
+
     def _get_instance_dependency(self, instance):
         if instance not in self._instance_dependencies:
             dependency = InstanceDependency(instance, self)
@@ -326,12 +376,23 @@ class DependencyManager(object):
         self._bind_dependency_to_graph(dependency)
         return self._dependency_graph.node[dependency]['resolved']
 
-    def _bind_dependency_to_graph(self, dependency):
+    def _bind_dependency_to_graph(self, dependency, first=False):
         self._fail_if_bound_to_other_dependency_manager(dependency)
         dependency.manager = self
 
         if not dependency in self._dependency_graph:
             self._dependency_graph.add_node(dependency, resolved=False, ready=None)
+            self._unresolved.add(dependency)
+
+            # a dependency without edges may go anywhere in the topological order. placing
+            # new dependencies of existing consumers first means the edge to the consumer
+            # is already in order.
+            if first:
+                self._lowest_order -= 1
+                self._order[dependency] = self._lowest_order
+            else:
+                self._highest_order += 1
+                self._order[dependency] = self._highest_order
 
             # configure the dependency with our runtime environment,
             # letting the dependency get the resource manager, the
@@ -386,11 +447,13 @@ class DependencyManager(object):
             return consumer
 
         dependency = self.as_dependency(dependency)
-        self._bind_dependency_to_graph(dependency)
+        self._bind_dependency_to_graph(dependency, first=True)
 
         self._fail_if_dependency_already_exists(dependency, consumer)
 
         self._dependency_graph.add_edge(dependency, consumer, provided=False)
+        if not self._order_edge(dependency, consumer):
+            self._cyclic_edges.add((dependency, consumer))
 
         self._wire_events_for_consumer_and_dependency(dependency, consumer)
 
@@ -425,6 +488,10 @@ class DependencyManager(object):
 
         # remove the edge from the graph
         self._dependency_graph.remove_edge(dependency, consumer)
+        self._cyclic_edges.discard((dependency, consumer))
+        if self._cyclic_edges:
+            # removing the edge may have broken the cycles
+            self._reorder_cyclic_edges()
 
         # If the dependency was lost, we pretend that it is ready so
         # that the consumer gets a chance to become ready. This might
@@ -435,6 +502,75 @@ class DependencyManager(object):
         if not dependency_node_data['ready']:
             consumer.on_dependency_ready(dependency)
 
+    def discard_dependency(self, dependency):
+        """ Removes *dependency* from the dependency graph if it has neither dependencies
+        nor consumers.
+
+        :return: Whether the dependency was removed.
+        """
+        dependency = self.as_dependency(dependency)
+        if dependency not in self._dependency_graph or self._dependency_graph.degree(dependency):
+            return False
+
+        self._dependency_graph.remove_node(dependency)
+        del self._order[dependency]
+        self._unresolved.discard(dependency)
+        self._pending_transitions.pop(dependency, None)
+        if isinstance(dependency, InstanceDependency):
+            self._instance_dependencies.pop(dependency.instance, None)
+        return True
+
+    def _order_edge(self, dependency, consumer):
+        """ Update the topological order after the edge from *dependency* to *consumer*
+        has been added, and return whether the edge could be ordered, which it cannot
+        if it completes a cycle.
+
+        Only the dependencies between the two in the current order that are reachable
+        from them are visited and reordered, as described by Pearce and Kelly in "A
+        dynamic topological sort algorithm for directed acyclic graphs".
+        """
+        if dependency is consumer:
+            return False
+
+        order = self._order
+        lower_bound, upper_bound = order[consumer], order[dependency]
+        if upper_bound < lower_bound:
+            return True
+
+        # the consumers of the consumer that are before the dependency, which must be moved after it
+        forward = self._get_affected(consumer, True, lambda node: order[node] < upper_bound, stop=dependency)
+        if forward is None:
+            return False
+        # and the dependencies of the dependency that are after the consumer, which must be moved before it
+        backward = self._get_affected(dependency, False, lambda node: order[node] > lower_bound)
+
+        affected = sorted(backward, key=order.get) + sorted(forward, key=order.get)
+        for node, position in zip(affected, sorted(order[node] for node in affected)):
+            order[node] = position
+        return True
+
+    def _get_affected(self, start, forward, is_affected, stop=None):
+        adjacency = self._dependency_graph.succ if forward else self._dependency_graph.pred
+        affected = set([start])
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            for neighbour in adjacency[node]:
+                if ((node, neighbour) if forward else (neighbour, node)) in self._cyclic_edges:
+                    continue
+                if neighbour is stop:
+                    return None
+                if neighbour not in affected and is_affected(neighbour):
+                    affected.add(neighbour)
+                    stack.append(neighbour)
+        return affected
+
+    def _reorder_cyclic_edges(self):
+        for dependency, consumer in list(self._cyclic_edges):
+            self._cyclic_edges.discard((dependency, consumer))
+            if not self._order_edge(dependency, consumer):
+                self._cyclic_edges.add((dependency, consumer))
+
     def _replay_ready_event_if_required(self, consumer, dependency):
         node_data = self._dependency_graph.node[dependency]
 
@@ -442,12 +578,69 @@ class DependencyManager(object):
         ready = node_data.get('ready', None)
 
         if ready:
-            self._consider_cascading_ready(dependency, consumer)
-        else:
+            self._cascade_ready(dependency, consumer)
+        elif self._dependency_graph[dependency][consumer]['provided']:
+            # creating the failure is expensive, so only do it if it is going to be used.
             reason = failure.Failure(('No exception stored',), exceptions.ReplayedLost)
-            self._consider_cascading_lost(dependency, consumer, reason=reason)
+            self._cascade_lost(dependency, consumer, reason=reason)
 
     def _consider_cascading_ready(self, dependency, consumer):
+        if self.coalesce and not self._cascading_synchronously and self.has_resolved(dependency):
+            self._add_pending_transition(dependency, True, None)
+            return
+        self._cascade_ready(dependency, consumer)
+
+    def _consider_cascading_lost(self, dependency, consumer, reason):
+        if self.coalesce and not self._cascading_synchronously and self.has_resolved(dependency):
+            self._add_pending_transition(dependency, False, reason)
+            return
+        self._cascade_lost(dependency, consumer, reason)
+
+    def _add_pending_transition(self, dependency, ready, reason):
+        # this is called once for every consumer of the dependency, but a transition is only counted once.
+        pending = self._pending_transitions.get(dependency)
+        if pending is None:
+            pending = self._pending_transitions[dependency] = dict(ready=ready, transitions=1)
+        elif pending['ready'] != ready:
+            pending['ready'] = ready
+            pending['transitions'] += 1
+        pending['reason'] = reason
+        pending['changed'] = self.clock.seconds()
+
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(self.debounce, self._flush_pending_transitions)
+
+    def _flush_pending_transitions(self):
+        self._flush_call = None
+        now = self.clock.seconds()
+        due = [dependency for dependency, pending in self._pending_transitions.items() if now >= pending['changed'] + self.debounce]
+
+        # the transitions of the consumers are propagated in the same pass, which visits
+        # the dependencies in topological order, so every consumer is only updated once.
+        self._cascading_synchronously = True
+        try:
+            for dependency in sorted(due, key=self._order.get):
+                pending = self._pending_transitions.pop(dependency)
+                ready = bool(self._dependency_graph.node[dependency]['ready'])
+                consumers = self._dependency_graph.succ[dependency]
+
+                propagated = any(edge_data['provided'] != ready for edge_data in consumers.values())
+                if pending['transitions'] > propagated:
+                    self.suppressed_transitions[dependency] += pending['transitions'] - propagated
+
+                for consumer in list(consumers):
+                    if ready:
+                        self._cascade_ready(dependency, consumer)
+                    else:
+                        self._cascade_lost(dependency, consumer, pending['reason'])
+        finally:
+            self._cascading_synchronously = False
+
+        if self._pending_transitions:
+            next_due = min(pending['changed'] for pending in self._pending_transitions.values()) + self.debounce
+            self._flush_call = self.clock.callLater(max(next_due - now, 0), self._flush_pending_transitions)
+
+    def _cascade_ready(self, dependency, consumer):
         edge_data = self._dependency_graph[dependency][consumer]
         if edge_data['provided']:
             # no change in the status, so no cascading necessary
@@ -461,7 +654,7 @@ class DependencyManager(object):
 
         consumer.on_dependency_ready(dependency)
 
-    def _consider_cascading_lost(self, dependency, consumer, reason):
+    def _cascade_lost(self, dependency, consumer, reason):
         edge_data = self._dependency_graph[dependency][consumer]
         if not edge_data['provided']:
             # no change in the status, so no cascading necessary
@@ -498,7 +691,7 @@ class DependencyManager(object):
             dependency graph, this function keeps resolving any unresolved dependencies until there
             are no unresolved nodes left in the dependency graph.
         """
-        if not networkx.is_directed_acyclic_graph(self._dependency_graph):
+        if self._cyclic_edges:
             e_msg = 'A dependency graph cannot contain cycles.'
             detail = 'The following cycles were piped: \n\n %s'
 
@@ -510,12 +703,20 @@ class DependencyManager(object):
             detail = detail % ('\n'.join(formatted_cycles))
             raise exceptions.CircularDependencyGraph(e_msg, detail)
 
-        while True:
-            topological_sort = networkx.topological_sort(self._dependency_graph)
-
-            unresolved_dependencies = [dependency for dependency in topological_sort if not self._dependency_graph.node[dependency]['resolved']]
-            if not unresolved_dependencies:
-                break
+        self._configure_coalescing()
+        # the initial states are propagated immediately, since the consumers are resolved
+        # after their dependencies.
+        cascading_synchronously, self._cascading_synchronously = self._cascading_synchronously, True
+        try:
+            self._resolve_unresolved()
+        finally:
+            self._cascading_synchronously = cascading_synchronously
+
+    def _resolve_unresolved(self):
+        while self._unresolved:
+            # resolving may add dependencies, which are resolved in the next round.
+            unresolved_dependencies = sorted(self._unresolved, key=self._order.get)
+            self._unresolved.clear()
 
             for dependency in unresolved_dependencies:
                 node_data = self._dependency_graph.node[dependency]
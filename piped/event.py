@@ -1,5 +1,7 @@
 # Copyright (c) 2010-2012, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import weakref
+
 from twisted.internet import defer, reactor
 
 from piped import exceptions
@@ -19,47 +21,181 @@ class Event(object):
         >>> event(123)
         >>> print some_list
         ['42', 123]
+
+    The callbacks are called in the order they were added. Callbacks that are
+    added or removed while the event is being called take effect the next time
+    the event is called.
+
+    An event may keep only a weak reference to a callback, or to the instance of
+    a bound method, in which case the callback is removed when it is garbage
+    collected:
+
+        >>> class Consumer(object):
+        ...     def foo(self, arg):
+        ...         some_list.append(arg)
+        >>> consumer = Consumer()
+        >>> event.handle(consumer.foo, weak=True) # doctest: +ELLIPSIS
+        <piped.event.Event object at ...>
+        >>> len(event)
+        2
+        >>> del consumer
+        >>> len(event)
+        1
     """
     def __init__(self, async=False):
-        self._callbacks = []
         self.async = async
 
-    def handle(self, callback):
-        self._callbacks.append(callback)
+        # the callables to call, in the order they were added. removed callbacks leave
+        # a None behind until more than half of the list is None. while the event is
+        # being called, the list is copied before it is changed.
+        self._calls = list()
+        self._holes = 0
+        self._dispatching = 0
+        # the token of each callable in _calls, which does not change when the list is compacted.
+        self._call_tokens = list()
+        self._next_token = 0
+        # (key, index in _calls) by token
+        self._entries = dict()
+        # the tokens of the callbacks by key, in the order they were added.
+        self._tokens_by_key = dict()
+
+    def handle(self, callback, weak=False):
+        """ Add *callback*, which is called every time the event is called.
+
+        :param weak: Whether to keep only a weak reference to the callback, or to
+            its instance if it is a bound method. The callback is removed when it
+            is garbage collected.
+        """
+        token = self._next_token
+        self._next_token += 1
+
+        if weak:
+            key, call = self._make_weak_callback(callback, token)
+        else:
+            key, call = callback, callback
+
+        if self._dispatching:
+            self._calls = self._calls[:]
+
+        self._entries[token] = (key, len(self._calls))
+        self._calls.append(call)
+        self._call_tokens.append(token)
+        self._tokens_by_key.setdefault(key, []).append(token)
         return self
     __iadd__ = handle
 
     def unhandle(self, callback):
-        if not callback in self._callbacks:
+        """ Remove *callback*. If it has been added more than once, the first one is removed. """
+        tokens = self._get_tokens(callback)
+        if not tokens:
             raise ValueError("%s was not handling this event." % callback)
-        self._callbacks.remove(callback)
+        self._remove(tokens[0])
         return self
     __isub__ = unhandle
 
+    def _get_tokens(self, callback):
+        return self._tokens_by_key.get(callback) or self._tokens_by_key.get(self._get_weak_key(callback))
+
+    def _get_weak_key(self, callback):
+        # the key must not refer to the callback, since that would keep it alive
+        instance = getattr(callback, 'im_self', None)
+        if instance is not None:
+            return id(instance), callback.im_func
+        return id(callback)
+
+    def _make_weak_callback(self, callback, token):
+        event_reference = weakref.ref(self)
+
+        def remove(reference):
+            event = event_reference()
+            if event is not None:
+                event._remove(token)
+
+        instance = getattr(callback, 'im_self', None)
+        if instance is not None:
+            instance_reference = weakref.ref(instance, remove)
+            function = callback.im_func
+
+            def call_method(*args, **kwargs):
+                instance = instance_reference()
+                if instance is not None:
+                    return function(instance, *args, **kwargs)
+            return self._get_weak_key(callback), call_method
+
+        callback_reference = weakref.ref(callback, remove)
+
+        def call_function(*args, **kwargs):
+            callback = callback_reference()
+            if callback is not None:
+                return callback(*args, **kwargs)
+        return self._get_weak_key(callback), call_function
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            # a weakly referenced callback that was removed before it was collected
+            return
+        key, index = entry
+
+        tokens = self._tokens_by_key[key]
+        tokens.remove(token)
+        if not tokens:
+            del self._tokens_by_key[key]
+
+        self._holes += 1
+        if self._holes * 2 > len(self._calls):
+            self._compact()
+            return
+
+        if self._dispatching:
+            self._calls = self._calls[:]
+        self._calls[index] = None
+        self._call_tokens[index] = None
+
+    def _compact(self):
+        # creates new lists, so the current list may still be being called.
+        calls = list()
+        call_tokens = list()
+        for call, token in zip(self._calls, self._call_tokens):
+            entry = self._entries.get(token)
+            if entry is None:
+                continue
+            self._entries[token] = (entry[0], len(calls))
+            calls.append(call)
+            call_tokens.append(token)
+
+        self._calls = calls
+        self._call_tokens = call_tokens
+        self._holes = 0
+
     def __contains__(self, callback):
-        return callback in self._callbacks
+        return bool(self._get_tokens(callback))
 
     def __call__(self, *args, **kwargs):
         if self.async:
             return self._async_call(*args, **kwargs)
 
-        # Make a copy in case the callback wants to remove itself from
-        # the list, since we can't iterate over a modified list.
-        callbacks = self._callbacks[:]
-        for callback in callbacks:
-            callback(*args, **kwargs)
+        self._dispatching += 1
+        try:
+            for callback in self._calls:
+                if callback is not None:
+                    callback(*args, **kwargs)
+        finally:
+            self._dispatching -= 1
 
     def _async_call(self, *args, **kwargs):
-        # Make a copy in case the callback wants to remove itself from
-        # the list, since we can't iterate over a modified list.
-        callbacks = self._callbacks[:]
         ds = []
-        for callback in callbacks:
-            ds.append(callback(*args, **kwargs))
+        self._dispatching += 1
+        try:
+            for callback in self._calls:
+                if callback is not None:
+                    ds.append(callback(*args, **kwargs))
+        finally:
+            self._dispatching -= 1
         return defer.DeferredList(ds, consumeErrors=True)
 
     def __len__(self):
-        return len(self._callbacks)
+        return len(self._entries)
 
     @defer.inlineCallbacks
     def wait_until_fired(self, timeout=None):
@@ -184,3 +184,16 @@ class AllPipelinesFailedError(PipedError):
 
 class TimeoutError(PipedError):
     """ Something timed out. """
+
+
+class OverloadedError(PipedError):
+    """ Raised when a pipeline is processing as many batons as it is allowed to,
+    and cannot queue the baton it was asked to process. """
+
+
+class ThreadPoolStoppedError(PipedError):
+    """ Raised when a call is submitted to a thread pool that has been stopped. """
+
+
+class ProcessPoolError(PipedError):
+    """ Raised when a baton cannot be processed by a worker process of a process pool. """
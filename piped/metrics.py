@@ -0,0 +1,499 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Latency histograms and counters that are kept by the processor graph evaluators,
+and the profile of starting piped. """
+from __future__ import absolute_import
+
+import contextlib
+import cProfile
+import ctypes
+import ctypes.util
+import gc
+import math
+import os
+import resource
+import signal
+import sys
+import time
+
+
+def _get_monotonic_clock():
+    """ Returns a function that returns the seconds of a monotonic clock, or
+    :func:`time.time` if no monotonic clock is available on this platform. """
+    monotonic = getattr(time, 'monotonic', None)
+    if monotonic:
+        return monotonic
+
+    clock_ids = dict(linux2=1, linux=1, darwin=6, freebsd=4)
+    clock_id = clock_ids.get(sys.platform, clock_ids.get(sys.platform.rstrip('0123456789')))
+    if clock_id is None:
+        return time.time
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return time.time
+
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+    def monotonic_time():
+        # the call releases the GIL, so every call needs its own timespec to be thread-safe
+        now = timespec()
+        if clock_gettime(clock_id, ctypes.byref(now)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return now.tv_sec + now.tv_nsec * 1e-9
+
+    try:
+        monotonic_time()
+    except OSError:
+        return time.time
+    return monotonic_time
+
+
+#: Returns the current time in seconds of a clock that is not affected by changes to
+#: the system time. Falls back to :func:`time.time` on platforms without such a clock.
+monotonic_time = _get_monotonic_clock()
+
+
+class LatencyHistogram(object):
+    """ A histogram of latencies, in seconds, that uses a fixed amount of memory.
+
+    The buckets grow exponentially, so the relative error of the percentiles is the
+    same for short and long latencies. Latencies below *min_latency* and above
+    *max_latency* are counted in the first and last bucket, respectively.
+
+    Example: ::
+
+        >>> histogram = LatencyHistogram()
+        >>> for latency in 0.001, 0.002, 0.003, 0.004, 1:
+        ...     histogram.record(latency)
+        >>> histogram.count
+        5
+        >>> 0.003 <= histogram.percentile(50) < 0.0036
+        True
+        >>> histogram.percentile(100)
+        1
+
+    :param min_latency: The lowest latency that gets its own bucket.
+    :param max_latency: The highest latency that gets its own bucket.
+    :param buckets_per_doubling: The number of buckets the latencies between *x*
+        and *2x* are split into, which decides the precision of the percentiles.
+    """
+
+    def __init__(self, min_latency=1e-6, max_latency=1e3, buckets_per_doubling=4):
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self._scale = buckets_per_doubling / math.log(2)
+
+        self.counts = [0] * (self._get_bucket(max_latency) + 2)
+        self.reset()
+
+    def reset(self):
+        """ Forget all recorded latencies. """
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _get_bucket(self, latency):
+        if latency <= self.min_latency:
+            return 0
+        return int(math.log(latency / self.min_latency) * self._scale) + 1
+
+    def _get_bucket_upper_bound(self, bucket):
+        return self.min_latency * math.exp(bucket / self._scale)
+
+    def record(self, latency, _log=math.log):
+        """ Record a single latency. """
+        # this is called for every processed baton, so _get_bucket is inlined
+        counts = self.counts
+        if latency <= self.min_latency:
+            bucket = 0
+        else:
+            bucket = min(int(_log(latency / self.min_latency) * self._scale) + 1, len(counts) - 1)
+        counts[bucket] += 1
+
+        self.count += 1
+        self.total += latency
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    def merge(self, other):
+        """ Add the latencies recorded by *other*, which must have the same buckets,
+        to this histogram. """
+        if len(other.counts) != len(self.counts):
+            raise ValueError('Cannot merge histograms with different buckets.')
+
+        counts = self.counts
+        for bucket, count in enumerate(other.counts):
+            counts[bucket] += count
+
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """ Returns the latency that *percent* percent of the recorded latencies are
+        lower than or equal to, or None if no latencies have been recorded.
+
+        The returned value is the upper bound of the bucket the percentile is in,
+        but never higher than the highest or lower than the lowest recorded latency.
+        """
+        if not self.count:
+            return None
+        if percent <= 0:
+            return self.min
+        if percent >= 100:
+            return self.max
+
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                break
+
+        if bucket == len(self.counts) - 1:
+            # the last bucket has no upper bound
+            return self.max
+        return max(self.min, min(self.max, self._get_bucket_upper_bound(bucket)))
+
+    def as_dict(self):
+        """ Returns a summary of the recorded latencies. """
+        return dict(
+            count = self.count,
+            total = self.total,
+            mean = self.mean,
+            min = self.min,
+            max = self.max,
+            p50 = self.percentile(50),
+            p90 = self.percentile(90),
+            p99 = self.percentile(99),
+        )
+
+
+class PipelineStats(object):
+    """ Latencies and counters of a processor graph evaluator.
+
+    :ivar latency: A :class:`LatencyHistogram` of the time it takes to process batons
+        through the whole pipeline.
+    :ivar processor_latency: A dict of :class:`LatencyHistogram`\s of the time each
+        processor spends processing a baton, keyed by processor.
+    :ivar in_flight: The number of batons that are currently being processed.
+    :ivar completed: The number of batons that were processed successfully.
+    :ivar failed: The number of batons whose processing failed.
+    :ivar error_routed: The number of times a failure was handled by error consumers.
+    :ivar queue_latency: A :class:`LatencyHistogram` of the time batons spend waiting
+        to be processed when the pipeline limits the number of batons in flight.
+    :ivar queued: The number of batons that are waiting to be processed.
+    :ivar max_queued: The highest number of batons that have been waiting at the same time.
+    :ivar rejected: The number of batons that were rejected because the pipeline was overloaded.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.processor_latency = dict()
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.error_routed = 0
+
+        self.queue_latency = LatencyHistogram()
+        self.queued = 0
+        self.max_queued = 0
+        self.rejected = 0
+
+    def get_processor_latency(self, processor):
+        """ Returns the latency histogram of *processor*. """
+        histogram = self.processor_latency.get(processor)
+        if histogram is None:
+            histogram = self.processor_latency[processor] = LatencyHistogram()
+        return histogram
+
+    def started(self):
+        """ Called when a baton is about to be processed.
+
+        :return: The time the processing started.
+        """
+        self.in_flight += 1
+        return monotonic_time()
+
+    def finished(self, started, failed=False):
+        """ Called when the processing of a baton that started at *started* is finished. """
+        self.latency.record(monotonic_time() - started)
+        self.in_flight -= 1
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def enqueued(self):
+        """ Called when a baton has to wait before it can be processed.
+
+        :return: The time the baton started waiting.
+        """
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        return monotonic_time()
+
+    def dequeued(self, enqueued):
+        """ Called when a baton that started waiting at *enqueued* stops waiting. """
+        self.queue_latency.record(monotonic_time() - enqueued)
+        self.queued -= 1
+
+    def reset(self):
+        """ Reset the histograms and counters, except the number of batons in flight
+        or waiting. """
+        self.latency.reset()
+        self.queue_latency.reset()
+        for histogram in self.processor_latency.values():
+            histogram.reset()
+        self.completed = self.failed = self.error_routed = self.rejected = 0
+        self.max_queued = self.queued
+
+    def merge(self, other):
+        """ Add the histograms and counters of *other* to these stats.
+
+        The processors are matched by key, so stats from other processes should be
+        keyed by processor id, as the stats returned by :meth:`by_processor_id` are.
+        The merged *max_queued* is the sum of the highest number of batons that
+        waited in each, which is an upper bound.
+        """
+        self.latency.merge(other.latency)
+        self.queue_latency.merge(other.queue_latency)
+        for processor, histogram in other.processor_latency.items():
+            self.get_processor_latency(processor).merge(histogram)
+
+        for counter in 'in_flight', 'completed', 'failed', 'error_routed', 'queued', 'max_queued', 'rejected':
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+
+    def by_processor_id(self):
+        """ Returns a copy of these stats where the processors are keyed by their id,
+        which can be pickled and merged with the stats of the same pipeline in
+        another process. """
+        stats = PipelineStats()
+        stats.merge(self)
+        stats.processor_latency = dict()
+        for processor, histogram in self.processor_latency.items():
+            stats.get_processor_latency(_get_processor_id(processor)).merge(histogram)
+        return stats
+
+    def as_dict(self):
+        """ Returns the counters and a summary of the latencies. Processors are keyed
+        by their id. """
+        return dict(
+            in_flight = self.in_flight,
+            completed = self.completed,
+            failed = self.failed,
+            error_routed = self.error_routed,
+            queued = self.queued,
+            max_queued = self.max_queued,
+            rejected = self.rejected,
+            latency = self.latency.as_dict(),
+            queue_latency = self.queue_latency.as_dict(),
+            processors = dict((_get_processor_id(processor), histogram.as_dict())
+                for processor, histogram in self.processor_latency.items()),
+        )
+
+
+def _get_processor_id(processor):
+    if isinstance(processor, basestring):
+        return processor
+    return getattr(processor, 'id', None) or repr(processor)
+
+
+class ThreadPoolStats(object):
+    """ Latencies and counters of a thread pool.
+
+    :ivar queue_latency: A :class:`LatencyHistogram` of the time calls wait for a thread.
+    :ivar latency: A :class:`LatencyHistogram` of the time calls spend in a thread.
+    :ivar submitted: The number of calls that have been submitted to the thread pool.
+    :ivar saturated: The number of calls that were submitted while every thread was busy.
+    :ivar completed: The number of calls that returned.
+    :ivar failed: The number of calls that raised an exception.
+    """
+
+    def __init__(self):
+        self.queue_latency = LatencyHistogram()
+        self.latency = LatencyHistogram()
+        self.reset()
+
+    def submitted_call(self, saturated=False):
+        """ Called when a call is submitted to the thread pool.
+
+        :return: The time the call was submitted.
+        """
+        self.submitted += 1
+        if saturated:
+            self.saturated += 1
+        return monotonic_time()
+
+    def finished_call(self, submitted, started, finished, failed=False):
+        """ Called when a call that was submitted at *submitted*, and started
+        running in a thread at *started*, is finished. """
+        self.queue_latency.record(started - submitted)
+        self.latency.record(finished - started)
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def reset(self):
+        """ Reset the histograms and counters. """
+        self.queue_latency.reset()
+        self.latency.reset()
+        self.submitted = self.saturated = self.completed = self.failed = 0
+
+    def as_dict(self):
+        """ Returns the counters and a summary of the latencies. """
+        return dict(
+            submitted = self.submitted,
+            saturated = self.saturated,
+            completed = self.completed,
+            failed = self.failed,
+            queue_latency = self.queue_latency.as_dict(),
+            latency = self.latency.as_dict(),
+        )
+
+
+class _NoPhase(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+_no_phase = _NoPhase()
+_startup_profile = None
+
+
+def startup_phase(name):
+    """ Returns a context manager that records a phase called *name* in the
+    :class:`StartupProfile` that is being recorded, if any. """
+    if _startup_profile is None:
+        return _no_phase
+    return _startup_profile.phase(name)
+
+
+class StartupProfile(object):
+    """ Records how long the phases of starting piped take, and how much they allocate.
+
+    While the profile is started, the phases are recorded with :func:`startup_phase`,
+    and may be nested. Python 2 cannot trace allocations, so the objects tracked by the
+    garbage collector and the peak resident memory of the process are counted instead.
+
+    The whole startup may also be profiled, by setting *profiler* to:
+
+    ``pstats``
+        Profile every call with :mod:`cProfile`.
+    ``collapsed``
+        Sample the stack every *interval* seconds of CPU time. The samples are
+        written as collapsed stacks, which is the input format of flame graph tools.
+    """
+    profilers = ('pstats', 'collapsed')
+
+    def __init__(self, profiler=None, interval=0.001):
+        assert profiler in self.profilers + (None, )
+        self.profiler = profiler
+        self.interval = interval
+
+        self.phases = list()
+        self.stack_counts = dict()
+        self._depth = 0
+        self._call_profile = None
+        self._previous_signal_handler = None
+
+    def start(self):
+        global _startup_profile
+        _startup_profile = self
+
+        if self.profiler == 'pstats':
+            self._call_profile = cProfile.Profile()
+            self._call_profile.enable()
+        elif self.profiler == 'collapsed':
+            self._previous_signal_handler = signal.signal(signal.SIGPROF, self._sample)
+            # restart interrupted system calls instead of failing them with EINTR
+            signal.siginterrupt(signal.SIGPROF, False)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        global _startup_profile
+        if _startup_profile is self:
+            _startup_profile = None
+
+        if self._call_profile:
+            self._call_profile.disable()
+        elif self.profiler == 'collapsed':
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_signal_handler or signal.SIG_DFL)
+
+    def _sample(self, signal_number, frame):
+        stack = list()
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%i)' % (code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.stack_counts[key] = self.stack_counts.get(key, 0) + 1
+
+    def _get_max_rss(self):
+        # kilobytes on linux, bytes on os x
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """ Records the time, objects and memory that are used in this context. """
+        phase = dict(name=name, depth=self._depth)
+        self.phases.append(phase)
+        self._depth += 1
+
+        objects = len(gc.get_objects())
+        max_rss = self._get_max_rss()
+        started = monotonic_time()
+        try:
+            yield phase
+        finally:
+            phase['seconds'] = monotonic_time() - started
+            phase['objects'] = len(gc.get_objects()) - objects
+            phase['max_rss'] = self._get_max_rss() - max_rss
+            self._depth -= 1
+
+    def format(self):
+        """ Returns a table of the phases, where nested phases are indented. """
+        lines = ['%10s %10s %12s  %s' % ('seconds', 'objects', 'peak memory', 'phase')]
+        for phase in self.phases:
+            if 'seconds' not in phase:
+                continue
+            memory = '+%.1f MiB' % (phase['max_rss'] / 1048576.0)
+            lines.append('%10.3f %+10i %12s  %s%s' % (phase['seconds'], phase['objects'], memory, '    ' * phase['depth'], phase['name']))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """ Writes the profile of the whole startup to *path*. """
+        if self.profiler == 'pstats':
+            self._call_profile.dump_stats(path)
+        elif self.profiler == 'collapsed':
+            with open(path, 'w') as collapsed_file:
+                for stack, count in sorted(self.stack_counts.items()):
+                    collapsed_file.write('%s %i\n' % (stack, count))
@@ -0,0 +1,414 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+
+""" Rewrite processor graphs into equivalent graphs that are cheaper to evaluate. """
+import logging
+
+import networkx as nx
+
+from piped import util
+from piped.processors import base, pipeline_processors, util_processors
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessorGraphOptimizer(object):
+    """ Rewrites a :class:`~piped.processing.ProcessorGraph` before it is evaluated.
+
+    The optimizer repeatedly:
+
+        * inlines the processors of small pipelines that are run with a static
+          ``run-pipeline`` processor, replacing the ``run-pipeline`` processor,
+        * removes ``passthrough`` processors, connecting their producers directly
+          to their consumers, and
+        * merges adjacent ``set-value`` and ``set-values`` processors into a single
+          ``set-values`` processor, and adjacent ``remap`` processors with the same
+          options into a single ``remap`` processor.
+
+    Only rewrites that do not change the results of the pipeline are performed, so
+    processors with error consumers, processors that choose their own consumers and
+    processors that run in thread pools are left alone, as are graphs with cycles.
+
+    Every rewrite is described in the ``optimizations`` of the processor graph.
+    """
+    #: The maximum number of processors in a pipeline that is inlined.
+    max_inlined_processors = 10
+    #: Options of a pipeline that prevents it from being inlined, since they affect
+    #: how the pipeline is evaluated.
+    non_inlinable_pipeline_options = ('evaluator', 'max_in_flight', 'optimize', 'prune_batons')
+    #: Options that must be equal for two ``remap`` processors to be merged.
+    remap_options = ('extend', 'copy', 'deep_copy', 'skip_if_nonexistent', 'input_fallback')
+
+    def __init__(self, processor_graph_factory):
+        self.processor_graph_factory = processor_graph_factory
+
+    def optimize(self, processor_graph, pipeline_name):
+        """ Optimize *processor_graph*, which is a graph of the pipeline *pipeline_name*. """
+        if not nx.is_directed_acyclic_graph(processor_graph.consumers):
+            logger.debug('Not optimizing pipeline "%s", since its processor graph has cycles.' % pipeline_name)
+            return
+
+        optimized = True
+        while optimized:
+            optimized = (self._inline_pipeline_runners(processor_graph, pipeline_name)
+                or self._remove_passthroughs(processor_graph)
+                or self._merge_processors(processor_graph))
+
+        for optimization in processor_graph.optimizations:
+            logger.debug('Optimized pipeline "%s": %r' % (pipeline_name, optimization))
+
+    def _inline_pipeline_runners(self, processor_graph, pipeline_name):
+        for processor in processor_graph.consumers.nodes():
+            if type(processor) is not pipeline_processors.PipelineRunner or not self._is_replaceable(processor_graph, processor):
+                continue
+            if processor.pipeline_path is not Ellipsis or processor.trace_path is not None or not processor.only_last_result:
+                continue
+            if processor.input_path != '' or processor.output_path != '':
+                continue
+
+            target_pipeline_name = util.resolve_sibling_import(processor.pipeline_name, pipeline_name)
+            chain = self._get_inlinable_chain(target_pipeline_name, pipeline_name)
+            if not chain:
+                continue
+
+            for inlined_processor in chain:
+                inlined_processor.id = u'%s.%s' % (processor.id, inlined_processor.id)
+            for producer, consumer in zip(chain, chain[1:]):
+                processor_graph.consumers.add_edge(producer, consumer, dict(is_error_consumer=False))
+            processor_graph.consumers.add_node(chain[0])
+
+            self._copy_consumer_options(processor, chain[-1])
+            self._replace_processors(processor_graph, [processor], chain[0], chain[-1])
+            processor_graph.optimizations.append(dict(optimization='inlined', processor=processor.id, pipeline=target_pipeline_name,
+                                                      processors=[inlined_processor.id for inlined_processor in chain]))
+            return True
+
+        return False
+
+    def _get_inlinable_chain(self, target_pipeline_name, pipeline_name):
+        """ Returns the processors of *target_pipeline_name* in the order they are
+        evaluated, or None if the pipeline cannot be inlined. Only pipelines that
+        are a single chain of processors without error consumers are inlined. """
+        pipelines_configuration = self.processor_graph_factory.pipelines_configuration
+        if target_pipeline_name == pipeline_name or target_pipeline_name not in pipelines_configuration:
+            return None
+
+        target_configuration = pipelines_configuration[target_pipeline_name]
+        if any(target_configuration.get(key) is not None for key in self.non_inlinable_pipeline_options):
+            return None
+
+        target_graph = self.processor_graph_factory.make_processor_graph(target_pipeline_name, suppress_warnings=True)
+        if len(target_graph.sources) != 1 or len(target_graph.consumers) > self.max_inlined_processors:
+            return None
+
+        chain = list()
+        processor = target_graph.sources[0]
+        while processor is not None:
+            if processor in chain or not self._is_replaceable(target_graph, processor):
+                return None
+            if isinstance(processor, pipeline_processors.PipelineRunner):
+                # relative pipeline names would be resolved relative to the wrong pipeline.
+                return None
+            if target_graph.consumers.predecessors(processor) != chain[-1:]:
+                return None
+
+            chain.append(processor)
+            consumers = target_graph.consumers.successors(processor)
+            if len(consumers) > 1:
+                return None
+            processor = consumers[0] if consumers else None
+
+        if len(chain) != len(target_graph.consumers):
+            return None
+        return chain
+
+    def _remove_passthroughs(self, processor_graph):
+        graph = processor_graph.consumers
+        for processor in graph.nodes():
+            if type(processor) is not util_processors.Passthrough or not self._is_replaceable(processor_graph, processor):
+                continue
+
+            consumers = graph.successors(processor)
+            producers = graph.predecessors(processor)
+            if not consumers or processor.concurrent_consumers:
+                continue
+            if processor in processor_graph.sources and set(consumers) & set(processor_graph.sources):
+                continue
+            if not all(self._uses_default_consumers(producer) and not producer.concurrent_consumers for producer in producers):
+                continue
+            if any(set(consumers) & set(graph.successors(producer)) for producer in producers):
+                continue
+
+            for producer in producers:
+                edges = graph.ordered_dictionary_factory()
+                for consumer, edge_data in graph.succ[producer].items():
+                    if consumer is not processor:
+                        edges[consumer] = edge_data
+                        continue
+                    # the consumers of the passthrough takes its place among the consumers of the producer.
+                    for processor_consumer in consumers:
+                        edges[processor_consumer] = graph.pred[processor_consumer][producer] = dict(edge_data)
+                graph.succ[producer] = edges
+                del graph.pred[processor][producer]
+
+            if processor in processor_graph.sources:
+                index = processor_graph.sources.index(processor)
+                processor_graph.sources[index:index+1] = consumers
+            graph.remove_node(processor)
+
+            processor_graph.optimizations.append(dict(optimization='removed', processor=processor.id,
+                                                      configuration=processor.processor_configuration))
+            return True
+
+        return False
+
+    def _merge_processors(self, processor_graph):
+        graph = processor_graph.consumers
+        for processor in graph.nodes():
+            consumers = graph.successors(processor)
+            if len(consumers) != 1 or not self._is_replaceable(processor_graph, processor):
+                continue
+
+            consumer = consumers[0]
+            if graph.predecessors(consumer) != [processor] or not self._is_replaceable(processor_graph, consumer):
+                continue
+
+            processor_configuration = self._get_merged_configuration(processor, consumer)
+            if processor_configuration is None:
+                continue
+
+            processor_configuration['id'] = processor.id
+            merged = self.processor_graph_factory._make_processor(processor_configuration)
+            self._copy_consumer_options(consumer, merged)
+            graph.add_node(merged)
+
+            self._replace_processors(processor_graph, [processor, consumer], merged, merged)
+            processor_graph.optimizations.append(dict(optimization='merged', processors=[processor.id, consumer.id], processor=merged.id,
+                                                      configuration=merged.processor_configuration))
+            return True
+
+        return False
+
+    def _get_merged_configuration(self, processor, consumer):
+        """ Returns the configuration of a processor that does the same as
+        *processor* followed by *consumer*, or None if they cannot be merged. """
+        mappings = [self._get_setter_mapping(processor), self._get_setter_mapping(consumer)]
+        if None not in mappings:
+            mapping = dict(mappings[0])
+            for path, value in mappings[1].items():
+                # the paths are set in no particular order, so they must not overlap.
+                if any(self._is_path_prefix(path, other_path) for other_path in mapping if other_path != path):
+                    return None
+                mapping[path] = value
+            return {'__processor__': 'set-values', 'mapping': mapping}
+
+        remaps = [processor, consumer]
+        if all(type(remap) is util_processors.RemapProcessor for remap in remaps):
+            options = [dict((key, getattr(remap, key)) for key in self.remap_options) for remap in remaps]
+            if options[0] != options[1]:
+                return None
+
+            mapping = list()
+            for remap in remaps:
+                for map_entry in remap.mapping:
+                    mapping.append(dict(map_entry['additional_kwargs'], input_path=map_entry['input_path'], output_path=map_entry['output_path']))
+
+            processor_configuration = {'__processor__': 'remap', 'mapping': mapping}
+            processor_configuration.update(options[0])
+            return processor_configuration
+
+        return None
+
+    def _get_setter_mapping(self, processor):
+        if type(processor) is util_processors.ValueSetter:
+            mapping = {processor.path: processor.value}
+        elif type(processor) is util_processors.MappingSetter:
+            mapping = dict((processor.path_prefix + path, value) for path, value in processor.mapping.items())
+        else:
+            return None
+
+        paths = mapping.keys()
+        if not all(isinstance(path, basestring) and path for path in paths):
+            return None
+        if any(self._is_path_prefix(path, other_path) for path in paths for other_path in paths if path != other_path):
+            return None
+        return mapping
+
+    def _is_path_prefix(self, path, other_path):
+        return path == other_path or other_path.startswith(path + '.') or path.startswith(other_path + '.')
+
+    def _is_replaceable(self, processor_graph, processor):
+        """ Whether *processor* may be replaced without changing how errors are
+        handled or which consumers are processed. """
+        if getattr(processor, 'run_in_thread', None) is not None:
+            return False
+        if not self._uses_default_consumers(processor):
+            return False
+        for edge_data in processor_graph.consumers.succ[processor].values():
+            if edge_data['is_error_consumer']:
+                return False
+        return True
+
+    def _uses_default_consumers(self, processor):
+        processor_type = type(processor)
+        for method_name in 'get_consumers', 'get_error_consumers':
+            method = getattr(processor_type, method_name, None)
+            if getattr(method, 'im_func', None) is not getattr(base.Processor, method_name).im_func:
+                return False
+        return True
+
+    def _copy_consumer_options(self, processor, replacement):
+        replacement.concurrent_consumers = processor.concurrent_consumers
+        replacement.consumer_baton_copy = processor.consumer_baton_copy
+
+    def _replace_processors(self, processor_graph, processors, head, tail):
+        """ Replace the chain of *processors* with the chain from *head* to *tail*,
+        which must already be in the graph. """
+        graph = processor_graph.consumers
+        first, last = processors[0], processors[-1]
+
+        for producer in graph.predecessors(first):
+            graph.replace_edge_from(producer, first, head, **graph.get_edge_data(producer, first))
+        for consumer, edge_data in graph.succ[last].items():
+            graph.add_edge(tail, consumer, dict(edge_data))
+
+        processor_graph.sources = [head if source is first else source for source in processor_graph.sources]
+        processor_graph.sinks = [tail if sink is last else sink for sink in processor_graph.sinks]
+
+        for processor in processors:
+            graph.remove_node(processor)
+
+
+class BatonPruner(object):
+    """ Removes values from the batons of a pipeline as soon as no processor that
+    may still see the baton reads them.
+
+    Only the paths that the processors of the pipeline provide are removed, by
+    ``clean-baton`` processors that are inserted between the processors. A path
+    is only removed if every processor that may see the baton afterwards --- its
+    consumers, the other consumers of its producers, and the error consumers of
+    the processors before it --- declares what it reads with ``instance_reads``,
+    and none of them reads the path.
+
+    The paths in *keep* are never removed, since the results of the pipeline
+    are batons too.
+
+    Every inserted processor is described in the ``optimizations`` of the
+    processor graph.
+    """
+
+    def __init__(self, processor_graph_factory):
+        self.processor_graph_factory = processor_graph_factory
+
+    def prune(self, processor_graph, pipeline_name, keep=()):
+        """ Insert processors that prune the batons of *processor_graph*, which is
+        a graph of the pipeline *pipeline_name*, keeping the paths in *keep*. """
+        graph = processor_graph.consumers
+        if not nx.is_directed_acyclic_graph(graph):
+            logger.debug('Not pruning batons of pipeline "%s", since its processor graph has cycles.' % pipeline_name)
+            return
+
+        processors = nx.topological_sort(graph)
+        provided = dict((processor, self._get_provided_paths(processor)) for processor in processors)
+
+        prunable = set()
+        for paths in provided.values():
+            prunable.update(path for path in paths if not any(self._overlaps(path, kept) for kept in keep))
+        if not prunable:
+            return
+
+        for processor in processors:
+            provided[processor] &= prunable
+
+        live = self._get_live_paths(processor_graph, processors, prunable)
+
+        provided_before = dict()
+        for processor in processors:
+            provided_before[processor] = set()
+            for producer in graph.predecessors(processor):
+                provided_before[processor] |= provided_before[producer] | provided[producer]
+
+        for processor in processors:
+            # the paths that may be in the baton after this processor, and have not been pruned already.
+            present = provided[processor] | (live[processor] & provided_before[processor])
+            for consumer, edge_data in graph.succ[processor].items():
+                if edge_data['is_error_consumer']:
+                    continue
+                dead = present - live[consumer]
+                if dead:
+                    self._insert_cleaner(processor_graph, processor, consumer, sorted(dead))
+
+    def _get_live_paths(self, processor_graph, processors, prunable):
+        """ Returns the prunable paths that may be read by a processor or anything
+        that may see the baton after it, for every processor. """
+        graph = processor_graph.consumers
+
+        # the paths that are read by a processor or one of its (error) consumers.
+        read = dict()
+        for processor in reversed(processors):
+            read[processor] = self._get_read_paths(processor, prunable)
+            for consumer in graph.successors(processor):
+                read[processor] |= read[consumer]
+
+        # the paths that are read by the processors that see the baton after a processor
+        # and its consumers are done with it: the later consumers of its producers, which
+        # share the baton, and the error consumers of the processors before it. The
+        # sources share the baton in the same way.
+        after = dict()
+        for processor in processors:
+            after[processor] = set()
+            producers = graph.predecessors(processor)
+            if processor in processor_graph.sources:
+                after[processor] |= self._get_read_after(processor, processor_graph.sources, [], read, concurrent=False)
+            for producer in producers:
+                consumers = list()
+                error_consumers = list()
+                for consumer, edge_data in graph.succ[producer].items():
+                    (error_consumers if edge_data['is_error_consumer'] else consumers).append(consumer)
+
+                after[processor] |= after[producer]
+                after[processor] |= self._get_read_after(processor, consumers, error_consumers, read, producer.concurrent_consumers)
+
+        return dict((processor, read[processor] | after[processor]) for processor in processors)
+
+    def _get_read_after(self, processor, consumers, error_consumers, read, concurrent):
+        paths = set()
+        if processor in consumers:
+            if concurrent:
+                later_consumers = [consumer for consumer in consumers if consumer is not processor]
+            else:
+                later_consumers = consumers[consumers.index(processor)+1:]
+            for consumer in later_consumers + error_consumers:
+                paths |= read[consumer]
+        return paths
+
+    def _get_provided_paths(self, processor):
+        paths = list(getattr(processor, 'provides', list())) + list(getattr(processor, 'instance_provides', list()))
+        return set(path for path in paths if isinstance(path, basestring) and path)
+
+    def _get_read_paths(self, processor, prunable):
+        paths = getattr(processor, 'instance_reads', None)
+        if paths is None:
+            return set(prunable)
+
+        paths = list(paths) + list(getattr(processor, 'depends_on', list())) + list(getattr(processor, 'instance_depends_on', list()))
+        return set(path for path in prunable if any(self._overlaps(path, read_path) for read_path in paths))
+
+    def _overlaps(self, path, other_path):
+        if not isinstance(other_path, basestring) or other_path == '':
+            return True
+        return path == other_path or other_path.startswith(path + '.') or path.startswith(other_path + '.')
+
+    def _insert_cleaner(self, processor_graph, processor, consumer, paths):
+        graph = processor_graph.consumers
+        number = 1 + sum(1 for optimization in processor_graph.optimizations
+                         if optimization['optimization'] == 'pruned' and optimization['producer'] == processor.id)
+
+        cleaner = self.processor_graph_factory._make_processor({'__processor__': 'clean-baton', 'remove': paths,
+                                                               'id': u'%s.clean-baton-%i' % (processor.id, number)})
+        graph.replace_edge_from(processor, consumer, cleaner, **graph.get_edge_data(processor, consumer))
+        graph.add_edge(cleaner, consumer, dict(is_error_consumer=False))
+
+        processor_graph.optimizations.append(dict(optimization='pruned', processor=cleaner.id, producer=processor.id,
+                                                  consumer=consumer.id, paths=paths))
@@ -1,19 +1,55 @@
 # Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import contextlib
 import functools
+import hashlib
 import logging
+import os
 import pkgutil
 import re
+import sys
 import warnings
 
 from twisted import plugin as twisted_plugin
 from twisted.python import reflect, failure, log as twisted_log
 
-from piped import event, exceptions, util
+from piped import event, exceptions, metrics, util
 
 
 logger = logging.getLogger(__name__)
 
+#: What was imported while loading plugins, as dicts with the ``name`` of the imported
+#: plugin or package, the ``seconds`` the import took and the ``modules`` it imported.
+import_records = list()
+
+
+@contextlib.contextmanager
+def recording_imports(name):
+    """ Adds an entry to `import_records` for the modules that are imported in this context. """
+    modules_before = set(sys.modules)
+    started = metrics.monotonic_time()
+    try:
+        yield
+    finally:
+        seconds = metrics.monotonic_time() - started
+        # sys.modules contains None for failed relative imports in Python 2
+        modules = sorted(module_name for module_name, module in sys.modules.items() if module is not None and module_name not in modules_before)
+        import_records.append(dict(name=name, seconds=seconds, modules=modules))
+
+
+def format_import_report(records=None):
+    """ Returns a report of the imports in *records*, which defaults to `import_records`,
+    with the most expensive imports first. """
+    if records is None:
+        records = import_records
+
+    lines = ['Imported %i modules in %.3f seconds while loading plugins:' % (sum(len(record['modules']) for record in records), sum(record['seconds'] for record in records))]
+    for record in sorted(records, key=lambda record: record['seconds'], reverse=True):
+        lines.append('    %8.3f s %4i modules  %s' % (record['seconds'], len(record['modules']), record['name']))
+        if record['modules']:
+            lines.append('                             %s' % ', '.join(record['modules']))
+    return '\n'.join(lines)
+
 
 def _plugin_error_handler(package):
     f = failure.Failure()
@@ -38,15 +74,91 @@ def getPlugins(interface, package):
         twisted_log.err = original_err
 
 
+class PluginIndex(object):
+    """ Keeps the names of the plugins that were found in *packages* in the file
+    *path*, which saves searching the packages for plugins.
+
+    The index is only used if it was saved with the same *key* and no source file
+    in the packages has been added, removed or changed since, which is determined
+    by the modification times and sizes of the files.
+    """
+    source_extensions = ('.py', '.so', '.pyd')
+    #: Incremented when the contents of the index change, which makes older indexes outdated.
+    version = 2
+
+    def __init__(self, path, key, packages):
+        self.path = path
+        self.key = key
+        self.packages = packages
+        self._stamps = None
+
+    def get_stamps(self):
+        """ Returns the modification time and size of every source file in the packages, by path. """
+        if self._stamps is None:
+            self._stamps = dict()
+            for package in self.packages:
+                for package_path in package.__path__:
+                    for directory, directory_names, file_names in os.walk(package_path):
+                        for file_name in file_names:
+                            if os.path.splitext(file_name)[1] not in self.source_extensions:
+                                continue
+                            file_path = os.path.join(directory, file_name)
+                            stat = os.stat(file_path)
+                            self._stamps[file_path] = (stat.st_mtime, stat.st_size)
+        return self._stamps
+
+    def load(self):
+        """ Returns the indexed ``(name, qualified_name, provided_keywords, configuration_paths)``
+        of the plugins, or None if the index is missing or outdated. """
+        # the stamps are only computed if there is an index to compare them with
+        if not os.path.exists(self.path):
+            return None
+        return util.load_cache_file(self.path, self._get_key(), 'plugin index')
+
+    def save(self, entries):
+        """ Replace the indexed plugins with *entries*. """
+        return util.save_cache_file(self.path, self._get_key(), entries, 'plugin index')
+
+    def _get_key(self):
+        return self.version, self.key, self.get_stamps()
+
+
 class PluginManager(object):
-    # TODO: Docs
+    """ Finds the plugins that provide `plugin_interface` in the `plugin_packages`
+    and the configured plugin bundles.
+
+    Searching the packages imports every module in them. The names of the plugins
+    that are found may be kept in a :class:`PluginIndex`, which is used until
+    the packages change::
+
+        plugins:
+            index:
+                enabled: true
+                directory: /var/cache/piped
+
+    ``directory`` defaults to the directory of the configuration file. When the
+    plugins are loaded from the index, the plugins of managers that set
+    `import_plugins_lazily` are not imported until they are requested by name,
+    unless ``lazy_imports`` is set to false in the index configuration.
+
+    Plugins may have a list of ``configuration_paths``. Such plugins are only
+    imported by :meth:`import_configured_plugins` if one of the paths is set in
+    the configuration.
+
+    The imports are recorded in `import_records`.
+    """
     plugin_interface = None
     plugin_packages = None
     plugin_configuration_path = 'plugins'
+    #: Whether the plugins that are found in the plugin index are imported the first
+    #: time they are requested by name, instead of when the plugins are loaded.
+    import_plugins_lazily = False
 
     def __init__(self):
         self._plugins = set()
         self._plugin_factory_by_name = dict()
+        self._qualified_name_by_name = dict()
+        self._configuration_paths_by_name = dict()
         self._providers_by_keyword = dict()
         self.runtime_environment = None
         self.plugins_loaded = False
@@ -57,31 +169,133 @@ class PluginManager(object):
     def configure(self, runtime_environment):
         self.runtime_environment = runtime_environment
         self.plugins_config = runtime_environment.get_configuration_value(self.plugin_configuration_path, dict())
-        self.load_plugins()
+        with metrics.startup_phase('load plugins: %s' % reflect.qual(self.plugin_interface)):
+            self.load_plugins()
 
     def load_plugins(self, reload=False):
         """ Return the plugins implementing `plugin_interface` found in
         the mentioned `plugin_packages`. """
 
         if not self.plugins_loaded or reload:
-            self._plugins = set()
-            for package in self.plugin_packages:
-                for plugin in self._get_plugins_from_package(package):
-                    self._plugins.add(plugin)
+            packages = self.plugin_packages + self._get_bundled_packages()
+            index = self._get_plugin_index(packages)
+            entries = index.load() if index else None
+
+            plugins = None
+            if entries is None:
+                plugins = set()
+                for package in packages:
+                    with recording_imports(package.__name__):
+                        plugins.update(self._get_plugins_from_package(package))
 
-            for package in self._get_bundled_packages():
-                for plugin in self._get_plugins_from_package(package):
-                    self._plugins.add(plugin)
+                entries = self._get_index_entries(plugins)
+                if index and entries is not None:
+                    index.save(entries)
 
-            # Map the plugin's name to the class.
+            self._plugins = set()
             self._plugin_factory_by_name = dict()
-            for plugin in self._plugins:
-                self._register_plugin(plugin)
+            self._qualified_name_by_name = dict()
+            self._configuration_paths_by_name = dict()
+            self._providers_by_keyword = dict()
+
+            if plugins is not None:
+                for plugin in plugins:
+                    self._register_plugin(plugin)
+            else:
+                for name, qualified_name, provided_keywords, configuration_paths in entries:
+                    self._register_plugin_name(name, qualified_name, provided_keywords, configuration_paths)
+                if not self._imports_plugins_lazily():
+                    self._import_all_plugins()
 
             self.plugins_loaded = True
 
         self.on_plugins_loaded(self._plugins)
 
+    def _get_plugin_index(self, packages):
+        index_config = self.plugins_config.get('index', dict())
+        if not index_config.get('enabled', False):
+            return None
+
+        directory = index_config.get('directory')
+        if directory is None:
+            loaded_files = self.runtime_environment.configuration_manager.loaded_files
+            if not loaded_files:
+                return None
+            directory = os.path.dirname(os.path.abspath(loaded_files[0]))
+
+        interface_name = reflect.qual(self.plugin_interface)
+        key = hashlib.sha1(interface_name)
+        for package in packages:
+            key.update('%s;' % package.__name__)
+        for disabled_pattern in self.plugins_config.get('disabled', list()):
+            key.update('disabled=%s;' % disabled_pattern)
+
+        path = os.path.join(util.expand_filepath(directory), '%s.plugins.index' % interface_name)
+        return PluginIndex(path, key.hexdigest(), packages)
+
+    def _get_index_entries(self, plugins):
+        entries = list()
+        for plugin in plugins:
+            qualified_name = reflect.fullyQualifiedName(plugin)
+            try:
+                is_importable = reflect.namedAny(qualified_name) is plugin
+            except Exception:
+                is_importable = False
+
+            if not is_importable:
+                logger.debug('Not indexing the plugins, since %r cannot be imported by its name.' % plugin)
+                return None
+
+            entries.append((self._get_plugin_name(plugin), qualified_name, list(getattr(plugin, 'provides', [])), self._get_configuration_paths(plugin)))
+        return entries
+
+    def _get_configuration_paths(self, plugin):
+        configuration_paths = getattr(plugin, 'configuration_paths', None)
+        if configuration_paths is None:
+            return None
+        return list(configuration_paths)
+
+    def _imports_plugins_lazily(self):
+        return self.import_plugins_lazily and self.plugins_config.get('index', dict()).get('lazy_imports', True)
+
+    def _is_configured(self, plugin_name):
+        configuration_paths = self._configuration_paths_by_name.get(plugin_name)
+        if configuration_paths is None:
+            return True
+
+        for configuration_path in configuration_paths:
+            if self.runtime_environment.get_configuration_value(configuration_path, Ellipsis) is not Ellipsis:
+                return True
+        return False
+
+    def import_configured_plugins(self):
+        """ Imports the plugins that do not have ``configuration_paths``, or have at least one of
+        their configuration paths set in the configuration, and returns all the imported plugins. """
+        for name in self._qualified_name_by_name:
+            if name not in self._plugin_factory_by_name and self._is_configured(name):
+                self._import_plugin(name)
+        return self._plugins
+
+    def _import_all_plugins(self):
+        for name in self._qualified_name_by_name:
+            if name not in self._plugin_factory_by_name:
+                self._import_plugin(name)
+
+    def _import_plugin(self, name):
+        qualified_name = self._qualified_name_by_name[name]
+        try:
+            with recording_imports(qualified_name):
+                plugin = reflect.namedAny(qualified_name)
+        except Exception as e:
+            e_msg = 'could not import the plugin "%s"' % name
+            detail = 'Importing %r failed: %s: %s' % (qualified_name, type(e).__name__, e)
+            hint = 'If the plugin has been removed, delete the plugin index to have it rebuilt.'
+            raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+        self._plugins.add(plugin)
+        self._plugin_factory_by_name[name] = plugin
+        return plugin
+
     def _get_bundled_packages(self):
         """ Return a list of additional packages that are configured as bundles in the
         configuration file.
@@ -145,19 +359,28 @@ class PluginManager(object):
             detail = 'A plugin bundle configuration should be a list. Found: %r' % bundle_config
             raise exceptions.ConfigurationError(e_msg, detail)
 
+    def _get_plugin_name(self, plugin):
+        return getattr(plugin, 'name', None) or reflect.fullyQualifiedName(plugin)
+
     def _register_plugin(self, plugin):
-        name = getattr(plugin, 'name', None) or reflect.fullyQualifiedName(plugin)
-        self._fail_if_plugin_name_is_already_registered(plugin, name)
+        name = self._get_plugin_name(plugin)
+        self._register_plugin_name(name, reflect.fullyQualifiedName(plugin), getattr(plugin, 'provides', []), self._get_configuration_paths(plugin))
 
+        self._plugins.add(plugin)
         self._plugin_factory_by_name[name] = plugin
-        provided_keywords = getattr(plugin, 'provides', [])
+
+    def _register_plugin_name(self, name, qualified_name, provided_keywords, configuration_paths=None):
+        self._fail_if_plugin_name_is_already_registered(qualified_name, name)
+
+        self._qualified_name_by_name[name] = qualified_name
+        self._configuration_paths_by_name[name] = configuration_paths
         for keyword in provided_keywords:
             self._providers_by_keyword.setdefault(keyword, []).append(name)
 
-    def _fail_if_plugin_name_is_already_registered(self, plugin, plugin_name):
-        if plugin_name in self._plugin_factory_by_name:
+    def _fail_if_plugin_name_is_already_registered(self, qualified_name, plugin_name):
+        if plugin_name in self._qualified_name_by_name:
             e_msg = 'multiple plugins with the same name: %s ' % plugin_name
-            details = (plugin, self._plugin_factory_by_name[plugin_name])
+            details = (qualified_name, self._qualified_name_by_name[plugin_name])
             detail = 'Attempted to register "%s" with that name, but it is already registered by "%s" ' % details
             raise exceptions.ConfigurationError(e_msg, detail)
 
@@ -165,7 +388,9 @@ class PluginManager(object):
         """ Return plugin factory for *plugin_name*. """
         plugin_factory = self._plugin_factory_by_name.get(plugin_name)
         if not plugin_factory:
-            self._fail_because_of_nonexisting_plugin(plugin_name)
+            if plugin_name not in self._qualified_name_by_name:
+                self._fail_because_of_nonexisting_plugin(plugin_name)
+            plugin_factory = self._import_plugin(plugin_name)
         return plugin_factory
 
     def _fail_because_of_nonexisting_plugin(self, plugin_name):
@@ -173,7 +398,7 @@ class PluginManager(object):
             warnings.warn('Tried getting a plugin without first loading the plugin manager.')
         e_msg = 'invalid plugin name: "%s" ' % (plugin_name, )
         details = dict(
-            available_plugins=sorted(self._plugin_factory_by_name.keys()),
+            available_plugins=sorted(self._qualified_name_by_name.keys()),
             interface=self.plugin_interface.__name__,
             packages=sorted([package.__name__ for package in self.plugin_packages + self._get_bundled_packages()]),
         )
@@ -190,4 +415,10 @@ class PluginManager(object):
 
     def get_all_plugins(self):
         """ Returns a tuple of (plugin_name, plugin_factory)-tuples. """
+        self._import_all_plugins()
         return tuple(self._plugin_factory_by_name.items())
+
+    def get_qualified_plugin_names(self):
+        """ Returns a tuple of (plugin_name, fully qualified name of the plugin factory)-tuples,
+        without importing the plugins. """
+        return tuple(self._qualified_name_by_name.items())
@@ -0,0 +1,442 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Serving with several worker processes that share the listening sockets.
+
+When piped is started with ``--workers N``, a :class:`Supervisor` binds the sockets
+the web sites, perspective broker servers and SMTP servers of the configuration
+listen to, and starts *N* piped processes that are given the sockets as inherited
+file descriptors. The workers accept connections from the same sockets, so the
+kernel spreads the connections over them.
+
+Every worker has a pair of pipes to the supervisor, which it uses to tell the
+supervisor that it has started and to report the stats of its pipelines. Workers
+stop when they are asked to, or when the supervisor goes away.
+"""
+import cPickle as pickle
+import json
+import logging
+import os
+import socket
+import struct
+import sys
+
+from twisted.application import internet, service, strports
+from twisted.internet import abstract, defer, endpoints, error, interfaces, protocol, reactor, task
+from twisted.protocols import basic
+from zope import interface
+
+from piped import exceptions, metrics
+
+
+logger = logging.getLogger(__name__)
+
+# the file descriptors of the pipes, as seen by the worker
+_WORKER_IN = 3
+_WORKER_OUT = 4
+# the inherited listening sockets are given file descriptors from here and up
+_FIRST_LISTENER = 5
+
+_length_prefix = struct.Struct('!I')
+
+
+def _dumps(*message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _length_prefix.pack(len(data)) + data
+
+
+def is_worker():
+    """ Returns whether this process is a worker that was started by a :class:`Supervisor`. """
+    return 'PIPED_WORKER' in os.environ
+
+
+def get_inherited_listeners():
+    """ Returns the file descriptors and address families of the listening sockets this
+    process has inherited from a :class:`Supervisor`, keyed by the strports description
+    they were bound for. """
+    listeners = json.loads(os.environ.get('PIPED_INHERITED_LISTENERS', '{}'))
+    return dict((description, tuple(listener)) for description, listener in listeners.items())
+
+
+def get_listen_descriptions(configuration_manager):
+    """ Returns the strports descriptions the enabled web sites, perspective broker
+    servers and SMTP servers in the configuration listen to. """
+    descriptions = list()
+
+    for site_configuration in configuration_manager.get('web', dict()).values():
+        if not site_configuration.get('enabled', True):
+            continue
+        descriptions.append(site_configuration.get('listen', str(site_configuration.get('port', 8080))))
+
+    servers = configuration_manager.get('pb.servers', dict()).values() + configuration_manager.get('smtp', dict()).values()
+    for server_configuration in servers:
+        listen = server_configuration['listen']
+        if isinstance(listen, basestring):
+            listen = [listen]
+        descriptions.extend(listen)
+
+    return descriptions
+
+
+def bind(description):
+    """ Returns a listening, non-blocking socket for the strports *description*.
+
+    Only TCP and SSL descriptions are supported. The TLS of SSL descriptions is
+    handled by the processes that adopt the socket.
+
+    :raises: :class:`.exceptions.ConfigurationError` if the description is of another kind.
+    """
+    # the endpoint of the description tells the stand-in reactor what it would listen to.
+    # endpoints of other kinds call other methods of the reactor, which fail.
+    arguments = _ListenArguments()
+    endpoint = endpoints.serverFromString(arguments, description)
+    defer.maybeDeferred(endpoint.listen, None).addErrback(lambda reason: None)
+    if arguments.kind is None:
+        e_msg = 'Cannot share the socket %r between worker processes.' % description
+        detail = 'Only TCP and SSL sockets can be shared when piped is started with --workers.'
+        hint = 'Listen to a TCP port instead, or start piped without --workers.'
+        raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+    host = arguments.interface
+    family = socket.AF_INET6 if abstract.isIPv6Address(host) else socket.AF_INET
+
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, arguments.port))
+        listener.listen(arguments.backlog)
+    except socket.error as e:
+        listener.close()
+        raise error.CannotListenError(host, arguments.port, e)
+    listener.setblocking(False)
+    return listener
+
+
+class _ListenArguments(object):
+    """ Stands in for the reactor when an endpoint listens, and records the
+    port it would have listened to. """
+    kind = None
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        self.kind, self.port, self.backlog, self.interface = 'TCP', port, backlog, interface
+
+    def listenSSL(self, port, factory, contextFactory, backlog=50, interface=''):
+        self.listenTCP(port, factory, backlog, interface)
+        self.kind = 'SSL'
+
+
+def listening_service(description, factory):
+    """ Returns a service that makes *factory* listen to the strports *description*.
+
+    In a worker process, the socket that was inherited from the supervisor for the
+    same description is used instead of binding a new one.
+    """
+    listener = get_inherited_listeners().get(description)
+    if listener is None:
+        return strports.service(description, factory)
+
+    fileno, family = listener
+    return internet.StreamServerEndpointService(InheritedListenerEndpoint(fileno, family, description), factory)
+
+
+class InheritedListenerEndpoint(object):
+    """ An endpoint that listens to an inherited socket, which was bound for the
+    strports *description*.
+
+    Unlike :class:`twisted.internet.endpoints.AdoptedStreamServerEndpoint`, the
+    socket is kept open, so the endpoint may listen again after it has stopped
+    listening. The endpoint of the description is told to listen with this
+    endpoint standing in for the reactor, so SSL descriptions get their TLS.
+    """
+    interface.implements(interfaces.IStreamServerEndpoint)
+
+    def __init__(self, fileno, family, description):
+        self.fileno = fileno
+        self.family = family
+        self.description = description
+
+    def listen(self, factory):
+        return endpoints.serverFromString(self, self.description).listen(factory)
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        return reactor.adoptStreamPort(self.fileno, self.family, factory)
+
+    def listenSSL(self, port, factory, contextFactory, backlog=50, interface=''):
+        from twisted.protocols import tls
+        return self.listenTCP(port, tls.TLSMemoryBIOFactory(contextFactory, False, factory), backlog, interface)
+
+
+class SupervisorConnection(basic.Int32StringReceiver):
+    """ The supervisor, as seen from a worker process.
+
+    The worker reports the stats of its pipelines to the supervisor every
+    *stats_interval* seconds, and stops when the supervisor tells it to or goes away.
+    """
+    MAX_LENGTH = 2 ** 31
+
+    def __init__(self):
+        self.stats_dependency = None
+        self.reporter = task.LoopingCall(self.report_stats)
+
+    def configure(self, runtime_environment):
+        self.stats_interval = runtime_environment.get_configuration_value('workers.stats_interval', 10)
+        if 'pipeline_stats' in runtime_environment.resource_manager.get_registered_resources():
+            self.stats_dependency = runtime_environment.dependency_manager.add_dependency(self, dict(provider='pipeline_stats'))
+
+    def connect(self):
+        """ Connect to the supervisor, and tell it that the worker has started. """
+        from twisted.internet import stdio
+        stdio.StandardIO(self, stdin=_WORKER_IN, stdout=_WORKER_OUT)
+
+    def connectionMade(self):
+        self._send('ready')
+        if self.stats_interval:
+            self.reporter.start(self.stats_interval)
+
+    def report_stats(self):
+        if self.stats_dependency is None or not self.stats_dependency.is_ready:
+            return
+        stats = self.stats_dependency.get_resource()
+        self._send('stats', dict((pipeline_name, pipeline_stats.by_processor_id()) for pipeline_name, pipeline_stats in stats.items()))
+
+    def _send(self, *message):
+        self.transport.write(_dumps(*message))
+
+    def stringReceived(self, data):
+        message = pickle.loads(data)
+        getattr(self, '_handle_' + message[0])(*message[1:])
+
+    def _handle_stop(self):
+        if reactor.running:
+            reactor.stop()
+
+    def connectionLost(self, reason):
+        if self.reporter.running:
+            self.reporter.stop()
+        if reactor.running:
+            reactor.stop()
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    """ A worker process of a :class:`Supervisor`, as seen from the supervisor.
+
+    :ivar state: One of ``starting``, ``running``, ``stopping`` and ``stopped``.
+    :ivar pipeline_stats: The :class:`~piped.metrics.PipelineStats` the worker last
+        reported, keyed by pipeline name.
+    """
+    pid = None
+
+    def __init__(self, supervisor, index):
+        self.supervisor = supervisor
+        self.index = index
+        self.state = 'starting'
+        self.started = metrics.monotonic_time()
+        self.pipeline_stats = dict()
+        self.ended = defer.Deferred()
+
+        self._buffer = ''
+
+    def get_health(self):
+        return dict(index=self.index, pid=self.pid, state=self.state, uptime=metrics.monotonic_time() - self.started)
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+
+    def stop(self):
+        if self.state == 'stopped':
+            return
+        self.state = 'stopping'
+        try:
+            self.transport.writeToChild(_WORKER_IN, _dumps('stop'))
+        except (KeyError, error.ProcessExitedAlready):
+            # the pipe is already closed, which we notice when the process ends
+            pass
+
+    def kill(self):
+        try:
+            self.transport.signalProcess('KILL')
+        except error.ProcessExitedAlready:
+            pass
+
+    def childDataReceived(self, fd, data):
+        if fd != _WORKER_OUT:
+            return
+
+        self._buffer += data
+        while len(self._buffer) >= _length_prefix.size:
+            length, = _length_prefix.unpack_from(self._buffer)
+            if len(self._buffer) < _length_prefix.size + length:
+                break
+            message = pickle.loads(self._buffer[_length_prefix.size:_length_prefix.size + length])
+            self._buffer = self._buffer[_length_prefix.size + length:]
+            getattr(self, '_handle_' + message[0])(*message[1:])
+
+    def _handle_ready(self):
+        if self.state == 'starting':
+            self.state = 'running'
+        logger.info('Worker process %i (PID %s) has started.' % (self.index, self.pid))
+
+    def _handle_stats(self, pipeline_stats):
+        self.pipeline_stats = pipeline_stats
+
+    def processEnded(self, reason):
+        state, self.state = self.state, 'stopped'
+        self.supervisor._worker_ended(self, state, reason)
+        self.ended.callback(None)
+
+
+class Supervisor(service.Service):
+    """ Starts *size* worker processes that share the sockets of the *listen*
+    descriptions, and replaces the workers that exit unexpectedly.
+
+    The workers are started with *worker_arguments* as the command line arguments of
+    ``piped``, which should not daemonize.
+
+    :param restart_delay: The number of seconds to wait before starting a new worker
+        when a worker exited before it had started.
+    :param stop_timeout: The number of seconds a stopping worker is given to finish,
+        after which it is killed.
+    :param stats_interval: The number of seconds between the stats reports of the workers.
+    :param stats_file: The path of a file the aggregated stats of the workers are
+        written to, as JSON, every *stats_interval* seconds.
+    """
+
+    def __init__(self, size, worker_arguments, listen=(), restart_delay=1, stop_timeout=60, stats_interval=10, stats_file=None):
+        self.size = size
+        self.worker_arguments = list(worker_arguments)
+        self.listen = list(listen)
+        self.restart_delay = restart_delay
+        self.stop_timeout = stop_timeout
+        self.stats_interval = stats_interval
+        self.stats_file = stats_file
+
+        self.listeners = dict()
+        self.workers = list()
+        self.crashed = 0
+
+        self._delayed_spawns = dict()
+        self._stats_writer = task.LoopingCall(self.write_stats)
+
+    def privilegedStartService(self):
+        # the sockets are bound before the privileges are shed, as when twistd listens
+        service.Service.privilegedStartService(self)
+        self._bind()
+
+    def _bind(self):
+        if not self.listen:
+            logger.warn('Starting %i worker processes, but there are no sockets to share between them.' % self.size)
+        for description in self.listen:
+            if description not in self.listeners:
+                self.listeners[description] = bind(description)
+
+    def startService(self):
+        service.Service.startService(self)
+        self._bind()
+
+        for index in range(self.size):
+            self._spawn(index)
+
+        if self.stats_file and self.stats_interval:
+            self._stats_writer.start(self.stats_interval, now=False)
+
+    @defer.inlineCallbacks
+    def stopService(self):
+        """ Stop the workers one at a time, so the remaining workers keep serving while
+        each worker finishes. """
+        service.Service.stopService(self)
+
+        for delayed_call in self._delayed_spawns.values():
+            delayed_call.cancel()
+        self._delayed_spawns.clear()
+
+        if self._stats_writer.running:
+            self._stats_writer.stop()
+
+        for worker in list(self.workers):
+            yield self._stop_worker(worker)
+
+        if self.stats_file:
+            self.write_stats()
+
+        for listener in self.listeners.values():
+            listener.close()
+        self.listeners.clear()
+
+    @defer.inlineCallbacks
+    def _stop_worker(self, worker):
+        worker.stop()
+        timeout = reactor.callLater(self.stop_timeout, worker.kill)
+        yield worker.ended
+        if timeout.active():
+            timeout.cancel()
+        else:
+            logger.warn('Worker process %i (PID %s) was killed, as it did not stop within %s seconds.' % (worker.index, worker.pid, self.stop_timeout))
+
+    def get_stats(self):
+        """ Returns the health of the workers and the stats of the pipelines, summed
+        over the stats the workers last reported. """
+        pipeline_stats = dict()
+        for worker in self.workers:
+            for pipeline_name, stats in worker.pipeline_stats.items():
+                pipeline_stats.setdefault(pipeline_name, metrics.PipelineStats()).merge(stats)
+
+        return dict(
+            crashed = self.crashed,
+            workers = [worker.get_health() for worker in self.workers],
+            pipelines = dict((pipeline_name, stats.as_dict()) for pipeline_name, stats in pipeline_stats.items()),
+        )
+
+    def write_stats(self):
+        """ Replace the contents of the stats file with the current :meth:`get_stats`. """
+        temporary_path = '%s.%i.tmp' % (self.stats_file, os.getpid())
+        try:
+            with open(temporary_path, 'w') as stats_file:
+                json.dump(self.get_stats(), stats_file, indent=4, sort_keys=True)
+            os.rename(temporary_path, self.stats_file)
+        except Exception:
+            logger.warn('Could not write the stats of the workers to %r.' % self.stats_file, exc_info=True)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def _spawn(self, index):
+        worker = WorkerProcess(self, index)
+        self.workers.append(worker)
+
+        childFDs = {1: 1, 2: 2, _WORKER_IN: 'w', _WORKER_OUT: 'r'}
+        inherited_listeners = dict()
+        for fileno, (description, listener) in enumerate(sorted(self.listeners.items()), _FIRST_LISTENER):
+            childFDs[fileno] = listener.fileno()
+            inherited_listeners[description] = (fileno, listener.family)
+
+        # the worker must be able to import the same modules as we can
+        env = dict(os.environ,
+            PYTHONPATH = os.pathsep.join(path or '.' for path in sys.path),
+            PIPED_WORKER = str(index),
+            PIPED_INHERITED_LISTENERS = json.dumps(inherited_listeners),
+        )
+        args = [sys.executable, '-c', 'from piped import scripts; scripts.run_piped()'] + self.worker_arguments
+        reactor.spawnProcess(worker, sys.executable, args=args, env=env, childFDs=childFDs)
+
+    def _spawn_later(self, index):
+        def spawn():
+            del self._delayed_spawns[index]
+            self._spawn(index)
+        self._delayed_spawns[index] = reactor.callLater(self.restart_delay, spawn)
+
+    def _worker_ended(self, worker, state, reason):
+        self.workers.remove(worker)
+        if state == 'stopping':
+            logger.info('Worker process %i (PID %s) has stopped.' % (worker.index, worker.pid))
+            return
+
+        self.crashed += 1
+        if not self.running:
+            return
+
+        if state == 'running':
+            logger.warn('Worker process %i (PID %s) exited unexpectedly: %s' % (worker.index, worker.pid, reason.getErrorMessage()))
+            self._spawn(worker.index)
+            return
+
+        # the worker failed to start, which is likely to happen again, so we wait a while before retrying
+        logger.error('Worker process %i (PID %s) failed to start: %s' % (worker.index, worker.pid, reason.getErrorMessage()))
+        self._spawn_later(worker.index)
@@ -0,0 +1,472 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+""" Evaluating pipelines in a pool of worker processes.
+
+Every worker process is given the configuration of the parent process, and builds
+only the pipeline it is a worker for. Only the providers of pipelines, contexts and
+thread pools are configured in the workers. Batons and results are pickled and sent
+over length-prefixed pipes, one baton at a time per worker.
+"""
+import collections
+import cPickle as pickle
+import logging
+import multiprocessing
+import os
+import struct
+import sys
+
+from twisted.internet import defer, error, protocol, reactor
+from twisted.protocols import basic
+from twisted.python import failure, reflect
+
+from piped import exceptions, metrics, processing, util
+
+
+logger = logging.getLogger(__name__)
+
+# the file descriptors of the pipes, as seen by the worker
+_WORKER_IN = 3
+_WORKER_OUT = 4
+
+_length_prefix = struct.Struct('!I')
+
+# the providers that are configured in the workers, besides the pipeline provider
+_worker_providers = [
+    'piped.providers.context_provider.ContextProvider',
+    'piped.providers.context_provider.PersistedContextProvider',
+    'piped.providers.thread_pool_provider.ThreadPoolProvider',
+]
+
+
+def _dumps(*message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return _length_prefix.pack(len(data)) + data
+
+
+class ProcessPoolStats(metrics.PipelineStats):
+    """ The stats of a :class:`ProcessPoolEvaluator`.
+
+    In addition to the stats of the pipeline as seen from the parent process, it
+    contains the health of every worker.
+
+    :ivar workers: The current :class:`Worker`\s of the pool.
+    :ivar crashed: The number of workers that exited unexpectedly.
+    :ivar recycled: The number of workers that were replaced after processing
+        *max_tasks* batons.
+    """
+
+    def __init__(self):
+        super(ProcessPoolStats, self).__init__()
+        self.workers = list()
+        self.crashed = 0
+        self.recycled = 0
+
+    def reset(self):
+        super(ProcessPoolStats, self).reset()
+        self.crashed = self.recycled = 0
+
+    def as_dict(self):
+        summary = super(ProcessPoolStats, self).as_dict()
+        summary['crashed'] = self.crashed
+        summary['recycled'] = self.recycled
+        summary['workers'] = [worker.get_health() for worker in self.workers]
+        return summary
+
+
+class Worker(protocol.ProcessProtocol):
+    """ A worker process of a :class:`ProcessPool`, as seen from the parent process.
+
+    :ivar state: One of ``starting``, ``idle``, ``busy``, ``stopping`` and ``stopped``.
+    :ivar tasks: The number of batons the worker has processed.
+    """
+    pid = None
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.state = 'starting'
+        self.tasks = 0
+        self.started = metrics.monotonic_time()
+        self.task = None
+        self.startup_error = None
+        self.ended = defer.Deferred()
+
+        self._buffer = ''
+
+    def get_health(self):
+        return dict(pid=self.pid, state=self.state, tasks=self.tasks, uptime=metrics.monotonic_time() - self.started)
+
+    def connectionMade(self):
+        self.pid = self.transport.pid
+        self._send('start', self.pool.pipeline_name, self.pool.configuration)
+
+    def process(self, data, d):
+        """ Process the pickled baton *data*, and fire *d* with the results. """
+        self.state = 'busy'
+        self.task = d
+        self.transport.writeToChild(_WORKER_IN, data)
+
+    def stop(self):
+        if self.state == 'stopped':
+            return
+        self.state = 'stopping'
+        self._send('stop')
+
+    def _send(self, *message):
+        try:
+            self.transport.writeToChild(_WORKER_IN, _dumps(*message))
+        except (KeyError, error.ProcessExitedAlready):
+            # the pipe is already closed, which we notice when the process ends
+            pass
+
+    def childDataReceived(self, fd, data):
+        if fd != _WORKER_OUT:
+            return
+
+        self._buffer += data
+        while len(self._buffer) >= _length_prefix.size:
+            length, = _length_prefix.unpack_from(self._buffer)
+            if len(self._buffer) < _length_prefix.size + length:
+                break
+            message = pickle.loads(self._buffer[_length_prefix.size:_length_prefix.size + length])
+            self._buffer = self._buffer[_length_prefix.size + length:]
+            getattr(self, '_handle_' + message[0])(*message[1:])
+
+    def _handle_ready(self):
+        self.state = 'idle'
+        self.pool._worker_idle(self)
+
+    def _handle_error(self, traceback):
+        self.startup_error = traceback
+
+    def _handle_result(self, results):
+        self._finish_task(results)
+
+    def _handle_failure(self, traceback, exception=None):
+        if exception is None:
+            e_msg = 'processing failed in worker process %s of pipeline %s' % (self.pid, self.pool.pipeline_name)
+            exception = exceptions.ProcessPoolError(e_msg, traceback)
+        self._finish_task(failure.Failure(exception))
+
+    def _finish_task(self, result):
+        d, self.task = self.task, None
+        self.tasks += 1
+        if self.state == 'busy':
+            self.state = 'idle'
+            self.pool._worker_idle(self)
+        if not d.called:
+            d.callback(result)
+
+    def processEnded(self, reason):
+        state, self.state = self.state, 'stopped'
+        self.pool._worker_ended(self, state, reason)
+        self.ended.callback(None)
+
+
+class ProcessPool(object):
+    """ A pool of worker processes that process batons in the pipeline *pipeline_name*.
+
+    :param configuration: The complete configuration the workers build the pipeline from.
+    :param size: The number of workers. Defaults to the number of CPUs.
+    :param max_tasks: The number of batons a worker processes before it is replaced
+        by a new worker, or None to never replace workers.
+    :param restart_delay: The number of seconds to wait before starting a new worker
+        when a worker failed to start.
+    :param stats: The :class:`ProcessPoolStats` the workers are added to.
+    """
+
+    def __init__(self, pipeline_name, configuration, size=None, max_tasks=None, restart_delay=1, stats=None):
+        self.pipeline_name = pipeline_name
+        self.configuration = configuration
+        self.size = size or multiprocessing.cpu_count()
+        self.max_tasks = max_tasks
+        self.restart_delay = restart_delay
+        self.stats = stats or ProcessPoolStats()
+
+        self.workers = self.stats.workers
+        self.queue = collections.deque()
+        self.running = False
+
+        self._delayed_spawns = set()
+        self._shutdown_trigger = None
+
+    def start(self):
+        """ Start the workers. The pool is stopped when the reactor shuts down. """
+        if self.running:
+            return
+        self.running = True
+        self._shutdown_trigger = reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+        for i in range(self.size):
+            self._spawn()
+
+    def stop(self):
+        """ Stop the workers. Batons that are waiting for a worker fail.
+
+        :returns: A Deferred that callbacks when all the workers have exited.
+        """
+        self.running = False
+        if self._shutdown_trigger is not None:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+
+        for delayed_call in self._delayed_spawns:
+            delayed_call.cancel()
+        self._delayed_spawns.clear()
+
+        self._fail_queued(exceptions.ProcessPoolError('the process pool of pipeline %s was stopped' % self.pipeline_name))
+
+        for worker in self.workers:
+            worker.stop()
+        return defer.DeferredList([worker.ended for worker in self.workers])
+
+    def submit(self, baton):
+        """ Process *baton* in a worker.
+
+        :returns: A Deferred that callbacks with the results of the pipeline.
+        """
+        try:
+            data = _dumps('process', baton)
+        except Exception:
+            e_msg = 'cannot send the baton to a worker process of pipeline %s' % self.pipeline_name
+            detail = 'The baton could not be pickled: %s' % failure.Failure().getErrorMessage()
+            return defer.fail(exceptions.ProcessPoolError(e_msg, detail))
+
+        if not self.running:
+            self.start()
+
+        # cancelling a baton that waits for a worker removes it from the queue. A baton
+        # that is already being processed is not interrupted, but its result is dropped.
+        entry = [data]
+        d = defer.Deferred(lambda d: self._cancel(entry))
+        entry.append(d)
+        self.queue.append(entry)
+        self._dispatch()
+        return d
+
+    def _cancel(self, entry):
+        try:
+            self.queue.remove(entry)
+        except ValueError:
+            pass
+
+    def _dispatch(self):
+        for worker in self.workers:
+            if not self.queue:
+                return
+            if worker.state == 'idle':
+                data, d = self.queue.popleft()
+                worker.process(data, d)
+
+    def _spawn(self):
+        worker = Worker(self)
+        self.workers.append(worker)
+
+        # the worker must be able to import the same modules as we can
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(path or '.' for path in sys.path))
+        args = [sys.executable, '-m', __name__]
+        childFDs = {1: 1, 2: 2, _WORKER_IN: 'w', _WORKER_OUT: 'r'}
+        reactor.spawnProcess(worker, sys.executable, args=args, env=env, childFDs=childFDs)
+
+    def _spawn_later(self):
+        def spawn():
+            self._delayed_spawns.discard(delayed_call)
+            self._spawn()
+        delayed_call = reactor.callLater(self.restart_delay, spawn)
+        self._delayed_spawns.add(delayed_call)
+
+    def _worker_idle(self, worker):
+        if self.max_tasks is not None and worker.tasks >= self.max_tasks:
+            self.stats.recycled += 1
+            worker.stop()
+            if self.running:
+                self._spawn()
+            return
+        self._dispatch()
+
+    def _worker_ended(self, worker, state, reason):
+        self.workers.remove(worker)
+        # replace the worker before failing its baton, since the callbacks may stop the pool
+        if state != 'stopping':
+            self._replace_crashed_worker(worker, state, reason)
+
+        if worker.task is not None:
+            e_msg = 'worker process %s of pipeline %s exited while processing a baton' % (worker.pid, self.pipeline_name)
+            d, worker.task = worker.task, None
+            if not d.called:
+                d.errback(exceptions.ProcessPoolError(e_msg, reason.getErrorMessage()))
+
+    def _replace_crashed_worker(self, worker, state, reason):
+        self.stats.crashed += 1
+        if not self.running:
+            return
+
+        if state != 'starting':
+            logger.warn('Worker process %s of pipeline %s exited unexpectedly: %s' % (worker.pid, self.pipeline_name, reason.getErrorMessage()))
+            self._spawn()
+            return
+
+        # the worker failed to build the pipeline, which is likely to happen again, so
+        # we wait a while before retrying, and fail the batons nobody can process.
+        e_msg = 'worker process %s of pipeline %s failed to start' % (worker.pid, self.pipeline_name)
+        logger.error('%s:\n%s' % (e_msg, worker.startup_error or reason.getErrorMessage()))
+        self._spawn_later()
+        if not any(other.state in ('idle', 'busy') for other in self.workers):
+            self._fail_queued(exceptions.ProcessPoolError(e_msg, worker.startup_error))
+
+    def _fail_queued(self, exception):
+        while self.queue:
+            data, d = self.queue.popleft()
+            d.errback(exception)
+
+
+class ProcessPoolEvaluator(processing.TwistedProcessorGraphEvaluator):
+    """ An evaluator that processes batons in a :class:`ProcessPool`, which makes it
+    possible to use more than one CPU for CPU-bound pipelines.
+
+    Select it with ``evaluator: process-pool`` in the pipeline definition. The options
+    of the :class:`ProcessPool` may be given in the same mapping::
+
+        my_pipeline:
+            evaluator:
+                kind: process-pool
+                size: 4
+                max_tasks: 1000
+            consumers:
+                - # processor definition
+
+    The processors of the pipeline are created, but not configured, in the parent
+    process. The workers do not start the services of the runtime environment, so
+    resources that are only provided by running services are not available to the
+    processors. Batons and results must be picklable.
+    """
+
+    def __init__(self, processor_graph, name=None, size=None, max_tasks=None, restart_delay=1):
+        super(ProcessPoolEvaluator, self).__init__(processor_graph, name)
+        self.stats = ProcessPoolStats()
+        self.pool_options = dict(size=size, max_tasks=max_tasks, restart_delay=restart_delay)
+        self.pool = None
+
+    def configure_processors(self, runtime_environment):
+        # the processors are configured in the workers.
+        configuration = runtime_environment.configuration_manager.get('')
+        self.pool = ProcessPool(self.name, configuration, stats=self.stats, **self.pool_options)
+
+    def _start(self, baton, context=None, source=None):
+        # the processors run in the workers, so the scope is checked before the baton is
+        # sent to a worker, and a trace only shows the baton entering and leaving the pool.
+        scope = context and context.scope
+        if scope is not None and scope.cancelled:
+            return defer.maybeDeferred(scope.raise_if_cancelled)
+
+        if context:
+            context.add_trace_entry('process_source', source=source, destination=self, baton=baton)
+
+        started = self.stats.started()
+        d = self.pool.submit(baton)
+        d.addBoth(self._finished, started, context, source, baton)
+        if scope is not None:
+            d = scope.cancellable(d)
+        if context is None:
+            return d
+        return context.chain(d)
+
+    def _finished(self, result, started, context=None, source=None, baton=None):
+        failed = isinstance(result, failure.Failure)
+        self.stats.finished(started, failed=failed)
+        if context and failed:
+            context.add_trace_entry('process_source_raised', reason=result, source=self, destination=source, baton=baton)
+        return result
+
+    def process_batch(self, batons):
+        ds = [self.process(baton) for baton in batons]
+        d = defer.DeferredList(ds, consumeErrors=True)
+        return d.addCallback(lambda results: [result for success, result in results])
+
+    def stop(self):
+        """ Stop the worker processes. """
+        if self.pool is None:
+            return defer.succeed(None)
+        return self.pool.stop()
+
+
+class _WorkerServer(basic.Int32StringReceiver):
+    """ The parent process, as seen from a worker process. """
+    MAX_LENGTH = 2 ** 31
+    pipeline = None
+
+    def stringReceived(self, data):
+        message = pickle.loads(data)
+        getattr(self, '_handle_' + message[0])(*message[1:])
+
+    def _send(self, *message):
+        self.transport.write(_dumps(*message))
+
+    @defer.inlineCallbacks
+    def _handle_start(self, pipeline_name, configuration):
+        try:
+            self.pipeline = yield _build_pipeline(pipeline_name, configuration)
+        except Exception:
+            self._send('error', failure.Failure().getTraceback())
+            reactor.stop()
+            return
+        self._send('ready')
+
+    def _handle_process(self, baton):
+        d = defer.maybeDeferred(self.pipeline.process, baton)
+        d.addCallback(lambda results: self._send('result', results))
+        d.addErrback(self._send_failure)
+
+    def _send_failure(self, reason):
+        try:
+            self._send('failure', reason.getTraceback(), reason.value)
+        except Exception:
+            # the exception could not be pickled, so we just send the traceback.
+            self._send('failure', reason.getTraceback())
+
+    def _handle_stop(self):
+        reactor.stop()
+
+    def connectionLost(self, reason):
+        if reactor.running:
+            reactor.stop()
+
+
+def _build_pipeline(pipeline_name, configuration):
+    from piped.providers import pipeline_provider
+
+    runtime_environment = processing.RuntimeEnvironment()
+    runtime_environment.configure()
+    for key, value in configuration.items():
+        runtime_environment.configuration_manager.set(key, value)
+    # the parent process reloads the pipelines, which replaces the workers
+    util.dict_remove_path(runtime_environment.configuration_manager.get(''), 'pipeline_reload')
+
+    # pipelines that are evaluated in a process pool are evaluated directly in the workers
+    provider = pipeline_provider.PipelineProvider()
+    factory = provider.processor_graph_factory
+    factory.evaluator_kinds = dict(factory.evaluator_kinds)
+    factory.evaluator_kinds['process-pool'] = lambda processor_graph, name, **options: factory.default_graph_evaluator(processor_graph, name)
+
+    # providers that accept work from outside the process, such as web sites and startup
+    # events, would do so once per worker, so only the providers of the resources a
+    # pipeline may depend on are configured.
+    providers = [provider] + [reflect.namedAny(qualified_name)() for qualified_name in _worker_providers]
+    for provider in providers:
+        provider.configure(runtime_environment)
+
+    dependency = runtime_environment.dependency_manager.add_dependency(_build_pipeline, dict(provider='pipeline.%s' % pipeline_name))
+    runtime_environment.dependency_manager.resolve_initial_states()
+    return dependency.wait_for_resource()
+
+
+def run_worker():
+    """ Run a worker process, which is started by a :class:`ProcessPool`. """
+    from twisted.internet import stdio
+
+    logging.basicConfig()
+    stdio.StandardIO(_WorkerServer(), stdin=_WORKER_IN, stdout=_WORKER_OUT)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    run_worker()
@@ -6,28 +6,42 @@ dataflow graphs and evaluating them.
 
 """
 import collections
+import hashlib
 import inspect
 import logging
 import pprint
-import time
 import warnings
 import sys
-import uuid
 import json
-from copy import deepcopy
+from copy import copy, deepcopy
 
 from twisted.application import service
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.plugin import IPlugin
-from twisted.python import failure
+from twisted.python import failure, reflect
 from zope import interface
 
-from piped import exceptions, graph, util, conf, resource, dependencies, processors as piped_processors, plugin, plugins
+import piped
+from piped import exceptions, graph, metrics, util, conf, resource, dependencies, processors as piped_processors, plugin, plugins
+from piped.processors import base
 
 
 logger = logging.getLogger(__name__)
 
 
+#: Functions that copy the baton for every consumer of a processor with
+#: ``concurrent_consumers``, by the processors ``consumer_baton_copy`` option.
+baton_copiers = dict(
+    none = lambda baton: baton,
+    shallow = copy,
+    deep = util.safe_deepcopy,
+)
+
+
+def _get_baton_copier(processor):
+    return baton_copiers[getattr(processor, 'consumer_baton_copy', 'shallow')]
+
+
 class IProcessor(IPlugin):
     """ Defines the interface for all processors that are used in the pipelines.
 
@@ -149,6 +163,7 @@ class ProcessorGraph(object):
         self.sinks = []
         self.entry_point = object() # sentinel to make the graph builder simpler.
         self.configuration_anomalies = []
+        self.optimizations = []
         self.suppress_warnings = False
         self._processor_ids = collections.defaultdict(lambda: 0)
         self.is_configured = False
@@ -229,19 +244,39 @@ class ProcessorGraph(object):
             processor.configure(runtime_environment)
         self.is_configured = True
 
-    def get_dot(self, draw_dependency_edges=False):
+    def get_dot(self, draw_dependency_edges=False, color_by='mean'):
+        """ Returns a dot-representation of the processor graph.
+
+        :param draw_dependency_edges: Whether to draw edges from processors to the
+            processors that provide what they depend on.
+        :param color_by: Either ``mean``, which colors the processors by the total time
+            they have spent compared to the mean of all the processors, or a percentile
+            such as ``p50`` or ``p99``, which colors the processors by that percentile
+            of their latencies compared to the mean of the same percentile of all the
+            processors.
+        """
         nodes = []
         edges = []
 
         processors = list(self)
-        evaluator_time = processors[0].evaluator.time_spent
-        mean_time = sum([processor.time_spent for processor in processors]) / len(processors)
+        evaluator = processors[0].evaluator
+
+        if color_by == 'mean':
+            time_by_processor = dict((processor, processor.time_spent) for processor in processors)
+        else:
+            percent = self._get_percent(color_by)
+            time_by_processor = dict((processor, evaluator.stats.get_processor_latency(processor).percentile(percent) or 0) for processor in processors)
+
+        evaluator_time = evaluator.time_spent
+        mean_time = sum(time_by_processor.values()) / len(processors)
 
         for processor in self:
             # Color the border of the node according to how much time has been spent processing in that node.
-            color = self._get_color_for_time(processor.time_spent, mean_time)
+            color = self._get_color_for_time(time_by_processor[processor], mean_time)
 
-            if evaluator_time:
+            if color_by != 'mean':
+                time_profile = '%s: %.02f ms' % (color_by, 1000 * time_by_processor[processor])
+            elif evaluator_time:
                 time_profile = '%.02f (%.02f%%)' % (processor.time_spent, 100 * processor.time_spent / evaluator_time)
             else:
                 time_profile = ''
@@ -268,6 +303,20 @@ class ProcessorGraph(object):
 
         return u'digraph G {\n%s\n}' % '\n'.join(nodes + edges)
 
+    @classmethod
+    def _get_percent(cls, percentile):
+        try:
+            if not percentile.startswith('p'):
+                raise ValueError(percentile)
+            percent = float(percentile[1:])
+            if not 0 <= percent <= 100:
+                raise ValueError(percentile)
+            return percent
+        except (AttributeError, ValueError):
+            e_msg = 'invalid percentile: %r' % (percentile, )
+            detail = 'Processors are colored either by "mean" or by a percentile, such as "p50" or "p99".'
+            raise exceptions.ConfigurationError(e_msg, detail)
+
     @classmethod
     def _get_color_for_time(cls, t, mean_time):
         """ Return a yellow color for t-s close to *mean_time*, green
@@ -286,102 +335,194 @@ class _ProcessTracer(object):
     The :meth:`TwistedProcessorGraphEvaluator.traced_process` uses this class in order to create
     a list of dicts that shows each of the steps a baton has actually taken through a processor graph.
 
-    All active tracers are invoked by :meth:`TwistedProcessorGraphEvaluator.process` and
-    :meth:`TwistedProcessorGraphEvaluator._process` whenever an entry may be added to the current
-    trace.
+    Tracers are not looked up while processing. Instead, every traced evaluation carries an
+    :class:`_EvaluationContext` with the tracers it should add entries to.
 
-    Before a trace entry is added to the list of traced batons, the process tracer searches through the
-    stack of frames in order to find its own trace token. The existence of the trace token in the
-    stack indicates that it is not part of any unrelated concurrent processing, and should be traced.
+    By default, every entry gets a copy of the baton, made by encoding and decoding it as JSON.
+    If *snapshots* is true, the entries get :class:`~piped.util.BatonSnapshot`\s instead, which
+    share the parts of the baton that did not change between the steps.
 
-    .. note:: Tracing a pipeline that also traces is currently not supported.
-    
+    :param snapshots: Whether to use snapshots instead of copies of the batons.
+    :param max_value_size: The maximum length of strings in the snapshots. Only used
+        with snapshots.
     """
 
-    def __init__(self):
+    def __init__(self, snapshots=False, max_value_size=None):
         self.traced = list()
-        self.token_value = uuid.uuid4().get_hex()
-        self.token_name = 'trace_token_'+self.token_value
-
-        self.sentinel = object()
         self.encoder = util.BatonJSONEncoder()
+        self.snapshotter = None
 
-    def refresh_trace_token(self, frame):
-        """ Attempt to find and refresh the trace token in the given stack of frames.
+        if snapshots:
+            self.snapshotter = util.BatonSnapshotter(max_value_size=max_value_size)
 
-        :return: The value of the trace token value if it is found.
-        """
-        if self._refresh_trace_token_if_found_in_the_current_stack(frame):
-            return self.token_value
-
-    def add_trace_entry(self, frame, kind, **state):
-        """ Add an entry to the trace if the correct trace token is in the current stack of frames.
+    def append_trace_entry(self, kind, reason=None, **state):
+        """ Add an entry to the trace.
 
+        :param reason: The failure to describe in the entry. Defaults to the
+            exception currently being handled.
         :return: The state added to the trace.
         """
-        if not self._refresh_trace_token_if_found_in_the_current_stack(frame):
-            return
-
-        if state['source'] is None:
-            state['source'] = self._find_nearest_possible_source(frame)
-
-        # encode + load is used to get a copy of the current baton that is not affected by further processing
-        state['baton'] = json.loads(self.encoder.encode(state['baton']))
+        if self.snapshotter:
+            state['baton'] = self.snapshotter.snapshot(state['baton'])
+        else:
+            # encode + load is used to get a copy of the current baton that is not affected by further processing
+            state['baton'] = json.loads(self.encoder.encode(state['baton']))
 
         if kind in ('process_source', '_process_consumer'):
             # these calls already have all information they need
             pass
         elif kind in ('process_source_raised', '_process_consumer_raised', '_process_error_consumer', '_process_error_consumer_raised'):
-            state['failure'] = self._get_trace_failure()
+            state['failure'] = self._get_trace_failure(reason)
 
         self._append_to_trace(**state)
 
         return state
 
-    def _find_nearest_possible_source(self, frame):
-        """ Returns the first 'self' variable in a stack of frames that is not part of piped.processing """
-        while frame:
-            possible_source = frame.f_locals.get('self', None)
-            if possible_source and not isinstance(possible_source, (TwistedProcessorGraphEvaluator, failure.Failure, defer.Deferred)):
-                return possible_source
-            frame = frame.f_back
+    def finish(self):
+        """ Called when the tracing is done. """
+        if self.snapshotter:
+            # the snapshotter keeps references to the snapshotted objects
+            self.snapshotter.clear()
 
-    def _get_trace_failure(self):
+    def _get_trace_failure(self, reason=None):
         """ Returns a dict that semi-neatly describes a failure without using much memory. """
-        reason = failure.Failure()
+        if reason is None:
+            reason = failure.Failure()
         return dict(
             type = reason.type,
             args = reason.value.args,
             traceback = reason.getTraceback(elideFrameworkCode=True, detail='brief')
         )
 
-    def _refresh_trace_token_if_found_in_the_current_stack(self, frame):
-        """ Looks for the trace token in a stack of frames and copies it to all frames
-        leading from the frame the token was found in to the given frame.
+    def _append_to_trace(self, **kw):
+        kw.setdefault('is_error_consumer', False)
+        kw.setdefault('failure', None)
+        self.traced.append(kw)
+
+
+class _EvaluationContext(object):
+    """ The tracers and the cancellation scope of an evaluation.
+
+    Evaluations that are neither traced nor started by :func:`call_in_scope` have no
+    context, and pay nothing for tracing or cancellation. Other evaluations make their
+    context :attr:`current` while they invoke processors and while they fire their
+    result, so that pipelines invoked by the processors are traced and cancelled as well.
+
+    If a traced evaluation starts another traced evaluation, the nested evaluation is
+    traced by both the outer and the inner tracers.
+    """
+    __slots__ = ('tracers', 'scope')
+
+    current = None
+
+    def __init__(self, tracers, scope=None):
+        self.tracers = tracers
+        self.scope = scope
+
+    def with_tracer(self, tracer):
+        """ Returns a new context that also traces to *tracer*. """
+        return _EvaluationContext(self.tracers + (tracer,), self.scope)
 
-        :return: True if the token was found, False otherwise.
+    def with_scope(self, scope):
+        """ Returns a new context with the cancellation *scope*. """
+        return _EvaluationContext(self.tracers, scope)
+
+    def add_trace_entry(self, kind, **state):
+        """ Add an entry to the trace of every tracer in this context. """
+        for tracer in self.tracers:
+            tracer.append_trace_entry(kind, **state)
+
+    def call(self, f, *a, **kw):
+        """ Call *f* with this context as the current context. """
+        previous = _EvaluationContext.current
+        _EvaluationContext.current = self
+        try:
+            return f(*a, **kw)
+        finally:
+            _EvaluationContext.current = previous
+
+    def process(self, process, baton):
+        """ Call the *process* method of a processor with this context as the current context.
+
+        If the scope of this context is cancelled, the processor is not called, and the
+        Deferred it returns is cancelled along with the scope.
         """
+        if self.scope is None:
+            return self.call(process, baton)
+        self.scope.raise_if_cancelled()
+        return self.scope.cancellable(self.call(process, baton))
+
+    def chain(self, d):
+        """ Returns a Deferred that fires with the result of *d* while this context
+        is the current context. """
+        result = defer.Deferred()
+        d.addBoth(self._fire, result)
+        return result
+
+    def _fire(self, result, d):
+        if isinstance(result, failure.Failure):
+            self.call(d.errback, result)
+        else:
+            self.call(d.callback, result)
 
-        frames_visited = list()
+    @classmethod
+    def find_source(cls, frame):
+        """ Returns the first 'self' variable in a stack of frames that is not part of piped.processing.
 
+        This describes what started a traced evaluation, and is only looked up once
+        per evaluation.
+        """
         while frame:
-            # It may be in the locals of the current frame
-            if frame.f_locals.get(self.token_name, self.sentinel) == self.token_value:
-                # if it is found, add it to the locals of the intermediary frames
-                for visited_frame in frames_visited:
-                    visited_frame.f_locals[self.token_name] = self.token_value
+            possible_source = frame.f_locals.get('self', None)
+            if possible_source and not isinstance(possible_source, (cls, TwistedProcessorGraphEvaluator, failure.Failure, defer.Deferred)):
+                return possible_source
+            frame = frame.f_back
 
-                return True
 
-            frames_visited.append(frame)
-            frame = frame.f_back
+def _call_without_context(f, *a, **kw):
+    # an evaluation without a context may be resumed while another evaluation is invoking
+    # a processor, whose context must not leak into the processors of this evaluation.
+    previous = _EvaluationContext.current
+    if previous is None:
+        return f(*a, **kw)
+    _EvaluationContext.current = None
+    try:
+        return f(*a, **kw)
+    finally:
+        _EvaluationContext.current = previous
 
-        return False
 
-    def _append_to_trace(self, **kw):
-        kw.setdefault('is_error_consumer', False)
-        kw.setdefault('failure', None)
-        self.traced.append(kw)
+def call_in_scope(scope, f, *args, **kwargs):
+    """ Call *f* with *scope* as the cancellation scope of the evaluations it starts.
+
+    The scope is inherited by the pipelines that are invoked by the processors of
+    these evaluations. When the scope is cancelled or its deadline passes, the
+    evaluations stop invoking processors, and the Deferreds returned by processors
+    that have not fired yet are cancelled. If *f* returns a Deferred, it is cancelled
+    as well.
+
+    :param scope: A :class:`~piped.util.CancellationScope`.
+    """
+    context = _EvaluationContext.current
+    if context is None:
+        context = _EvaluationContext((), scope)
+    else:
+        context = context.with_scope(scope)
+    return scope.cancellable(context.call(f, *args, **kwargs))
+
+
+def get_current_scope():
+    """ Returns the cancellation scope of the current evaluation, or None.
+
+    Processors may use the scope to limit the time they spend waiting on other
+    services to the :attr:`~piped.util.CancellationScope.remaining` time. The
+    scope is only current while a processor is invoked, so it should be looked
+    up before the processor waits for anything.
+    """
+    context = _EvaluationContext.current
+    if context is None:
+        return None
+    return context.scope
 
 
 class TwistedProcessorGraphEvaluator(object):
@@ -391,133 +532,228 @@ class TwistedProcessorGraphEvaluator(object):
     * Processors used in the graph are assumed to be "Twisted-safe" (non-blocking).
     """
 
-    tracers = list()
-
     def __init__(self, processor_graph, name=None):
         self.processor_graph = processor_graph
         self.name = name
         self.time_spent = 0
+        self.stats = metrics.PipelineStats()
+        self.admission_control = None
 
         for processor in self.processor_graph.consumers:
             self._connect_producer_to_consumers(processor)
 
-    @classmethod
-    def _add_trace_entry(cls, *a, **kw):
-        for tracer in cls.tracers:
-            frame = sys._getframe(1)
-            entry = tracer.add_trace_entry(frame, *a, **kw)
-            if entry:
-                return entry
-
-
-    @classmethod
-    def _refresh_trace_token(cls):
-        for tracer in cls.tracers:
-            frame = sys._getframe(1)
-            token = tracer.refresh_trace_token(frame)
-            if token:
-                return token
-            else:
-                pass
-
-    @defer.inlineCallbacks
-    def _process(self, processor, baton, results):
-        # Refresh the trace token, which will copy the trace token as far down the stack
-        # as possible, so that it is easier to find by the tracer.
-        # This fixes a corner case where a processor performs some deep magic that would
-        # change the stack, making it hard (or even impossible) to locate the original
-        # trace token location.
-        self._refresh_trace_token()
-
+    @util.maybe_inline_callbacks
+    def _process(self, processor, baton, results, context=None, batch=None):
+        # Processors that return plain values are continued inline, so this only
+        # returns a Deferred if a processor returned a Deferred that has not fired yet.
         try:
-            # Profile the time each processor spends.
-            s = time.time()
-            processed_baton = yield processor.process(baton)
-            d = time.time() - s
+            if batch is not None and hasattr(processor, 'process_batch'):
+                # the baton is processed along with the other batons of the batch that
+                # reach this processor, and accounted for its share of the time spent.
+                processed_baton, d = yield batch.process(processor, baton)
+            else:
+                # Profile the time each processor spends.
+                s = metrics.monotonic_time()
+                if context is None:
+                    processed_baton = yield _call_without_context(processor.process, baton)
+                else:
+                    processed_baton = yield context.process(processor.process, baton)
+                d = metrics.monotonic_time() - s
             # Update the time the processor spends
             processor.time_spent += d
+            self.stats.get_processor_latency(processor).record(d)
             # ... and the accumulative total.
             self.time_spent += d
 
             consumers = processor.get_consumers(processed_baton)
-            for consumer in consumers:
-                try:
-                    self._add_trace_entry('_process_consumer', source=processor, destination=consumer, baton=baton, time_spent=d)
-                    yield self._process(consumer, processed_baton, results)
-                except Exception:
-                    self._add_trace_entry('_process_consumer_raised', source=consumer, destination=processor, baton=baton)
-                    raise
+            if len(consumers) > 1 and getattr(processor, 'concurrent_consumers', False):
+                yield self._process_concurrently(processor, consumers, baton, processed_baton, results, context, d, batch)
+            else:
+                for consumer in consumers:
+                    try:
+                        if context:
+                            context.add_trace_entry('_process_consumer', source=processor, destination=consumer, baton=baton, time_spent=d)
+                        yield self._process(consumer, processed_baton, results, context, batch)
+                    except Exception:
+                        if context:
+                            context.add_trace_entry('_process_consumer_raised', source=consumer, destination=processor, baton=baton)
+                        raise
 
             if not consumers:
                 # this means it is a sink, so we store the result we got from it.
                 # we cannot rely on the processor being in ``self.processor_graph.sinks``
                 # because the processor might have provided its own implementation
                 # of :func:`.base.Processor.get_consumers`.
-                self._add_trace_entry('_process_result', source=processor, destination=None, baton=processed_baton, time_spent=d)
+                if context:
+                    context.add_trace_entry('_process_result', source=processor, destination=None, baton=processed_baton, time_spent=d)
                 results.append(processed_baton)
 
         except Exception:
             error_consumers = processor.get_error_consumers(baton)
             if error_consumers:
+                self.stats.error_routed += 1
                 for error_consumer in error_consumers:
-                    self._add_trace_entry('_process_error_consumer', source=processor, destination=error_consumer, baton=baton, is_error_consumer=True)
+                    if context:
+                        context.add_trace_entry('_process_error_consumer', source=processor, destination=error_consumer, baton=baton, is_error_consumer=True)
                     try:
-                        yield self._process(error_consumer, baton, results)
+                        yield self._process(error_consumer, baton, results, context, batch)
                     except Exception:
-                        self._add_trace_entry('_process_error_consumer_raised', source=error_consumer, destination=processor, baton=baton)
+                        if context:
+                            context.add_trace_entry('_process_error_consumer_raised', source=error_consumer, destination=processor, baton=baton)
                         raise
             else:
                 raise
 
-    @defer.inlineCallbacks
+    @util.maybe_inline_callbacks
+    def _process_concurrently(self, processor, consumers, baton, processed_baton, results, context, time_spent, batch=None):
+        # every consumer gets its own copy of the baton and its own list of results, which are
+        # collected in the order of the consumers when all of them are done.
+        copy_baton = _get_baton_copier(processor)
+        consumer_results = list()
+        ds = list()
+        for consumer in consumers:
+            if context:
+                context.add_trace_entry('_process_consumer', source=processor, destination=consumer, baton=baton, time_spent=time_spent)
+            consumer_results.append(list())
+            ds.append(defer.maybeDeferred(self._process, consumer, copy_baton(processed_baton), consumer_results[-1], context, batch))
+
+        outcomes = yield defer.DeferredList(ds, consumeErrors=True)
+
+        for consumer, results_of_consumer, (success, result) in zip(consumers, consumer_results, outcomes):
+            results.extend(results_of_consumer)
+            if not success:
+                # just like when the consumers are processed one at a time, the failure of
+                # the first failing consumer is raised, and the results of any later consumers
+                # are discarded.
+                if context:
+                    context.add_trace_entry('_process_consumer_raised', source=consumer, destination=processor, baton=baton)
+                result.raiseException()
+
     def process(self, baton):
         """ Processes a baton asynchronously through the processor graph.
 
-        :param consume_errors: Whether to consume unhandled errors. Consumed
-            exceptions are appended to the list of results.
-        :returns: A list of batons, one for each sink that was encountered
-            during the processing of the baton.
+        If a traced evaluation is invoking this pipeline, the baton is traced as well.
+
+        If the number of batons in flight is limited by :meth:`limit_in_flight`, the
+        processing may have to wait for other batons to finish first.
+
+        :returns: A Deferred that callbacks with a list of batons, one for each sink
+            that was encountered during the processing of the baton.
         """
+        context = _EvaluationContext.current
+        source = None
+        if context is not None:
+            source = context.find_source(sys._getframe(1))
+
+        if self.admission_control is not None:
+            return self.admission_control.submit(self._start, baton, context, source)
+        return self._start(baton, context, source)
+
+    def _start(self, baton, context=None, source=None):
+        if context is None:
+            return self._process_sources(baton)
+        return context.chain(self._process_sources(baton, context, source))
+
+    @defer.inlineCallbacks
+    def _process_sources(self, baton, context=None, source=None, batch=None):
         # collect the resulting baton from the sinks
         results = list()
+        started = self.stats.started()
 
         for source_processor in self.processor_graph.sources:
-            # store the trace entry before processing in order to use it as a destination if the processing raises an Exception
-            entry = self._add_trace_entry('process_source', source=None, destination=source_processor, baton=baton)
+            if context:
+                context.add_trace_entry('process_source', source=source, destination=source_processor, baton=baton)
             try:
-                yield self._process(source_processor, baton, results)
-            except Exception as e:
-                source = entry['source'] if entry else None
-                self._add_trace_entry('process_source_raised', source=source_processor, destination=source, baton=baton)
+                yield self._process(source_processor, baton, results, context, batch)
+            except Exception:
+                self.stats.finished(started, failed=True)
+                if context:
+                    context.add_trace_entry('process_source_raised', source=source_processor, destination=source, baton=baton)
                 raise
 
+        self.stats.finished(started)
         defer.returnValue(results)
 
     # Calling the evaluator directly should be the same as starting to process a baton in a pipeline:
     __call__ = process
 
+    def process_batch(self, batons):
+        """ Processes several batons asynchronously through the processor graph.
+
+        Every baton is processed as if by :meth:`process`, except that processors with
+        a ``process_batch(batons)`` method are given all the batons that reach them at
+        the same time, and return a list of the processed batons, in the same order.
+        Other processors process the batons one at a time.
+
+        :returns: A Deferred that callbacks with a list with an element for every baton
+            in *batons*, in the same order. The element is either a list of batons, one
+            for each sink that was encountered during the processing of the baton, or
+            a :class:`~twisted.python.failure.Failure` if the processing failed.
+        """
+        context = _EvaluationContext.current
+        source = None
+        if context is not None:
+            source = context.find_source(sys._getframe(1))
+
+        batch = _Batch(context)
+        ds = list()
+        for baton in batons:
+            if self.admission_control is not None:
+                ds.append(self.admission_control.submit(self._process_batched, baton, batch, context, source))
+            else:
+                ds.append(self._process_batched(baton, batch, context, source))
+        batch.submitted()
+
+        d = defer.DeferredList(ds, consumeErrors=True)
+        d.addCallback(lambda results: [result for success, result in results])
+        if context is None:
+            return d
+        return context.chain(d)
+
+    def _process_batched(self, baton, batch, context=None, source=None):
+        batch.started()
+        d = self._process_sources(baton, context, source, batch)
+        return d.addBoth(batch.finished)
+
     @defer.inlineCallbacks
-    def traced_process(self, *a, **kw):
+    def traced_process(self, baton, snapshots=False, max_value_size=None):
         """ Traces and processes a baton asynchronously through a processor graph.
 
-        .. warn:: The act of tracing introduces a new variable in the locals of
-            all the traced frames on the form ``trace_token_UUID4``.
+        Pipelines invoked by the traced processors are traced as well. If the baton
+        is already being traced, the outer traces also get the entries of this trace.
+
+        :param snapshots: If true, the batons in the trace are
+            :class:`~piped.util.BatonSnapshot`\s instead of copies, which is cheaper
+            when tracing large batons.
+        :param max_value_size: The maximum length of strings in the snapshots.
+        :returns: A tuple of the results, or the failure, and the trace.
 
         .. seealso:: :class:`_ProcessTracer` and :meth:`process`.
         """
-        tracer = _ProcessTracer()
-        # add the token to the current locals, so _refresh_trace_token may find it
-        locals()[tracer.token_name] = tracer.token_value
+        tracer = _ProcessTracer(snapshots=snapshots, max_value_size=max_value_size)
+
+        context = _EvaluationContext.current
+        if context is None:
+            context = _EvaluationContext((tracer,))
+        else:
+            context = context.with_tracer(tracer)
 
         try:
-            self.tracers.append(tracer)
-            results = yield self.process(*a, **kw)
+            results = yield context.call(self.process, baton)
         except Exception:
             results = failure.Failure()
         finally:
-            self.tracers.remove(tracer)
+            tracer.finish()
         defer.returnValue((results, tracer.traced))
 
+    def limit_in_flight(self, max_in_flight, max_queued=None, queue_timeout=None):
+        """ Limit the number of batons that are processed at the same time.
+
+        :returns: The :class:`AdmissionControl` of this evaluator.
+        """
+        self.admission_control = AdmissionControl(self.stats, max_in_flight, max_queued, queue_timeout, name=self.name)
+        return self.admission_control
+
     def configure_processors(self, runtime_environment):
         # give the processor a reference to its evaluator
         for processor in self.processor_graph:
@@ -543,27 +779,754 @@ class TwistedProcessorGraphEvaluator(object):
         return self.processor_graph[item]
 
 
+class _Batch(object):
+    """ The batons of a :meth:`TwistedProcessorGraphEvaluator.process_batch` that are
+    waiting for processors with a ``process_batch`` method.
+
+    The waiting batons are given to their processors when every baton of the batch
+    that is being processed is waiting, so the processors get as many batons at a
+    time as possible.
+    """
+
+    def __init__(self, context=None):
+        self.context = context
+
+        self.running = 0
+        self.waiting = util.OrderedDict()
+        self.number_of_waiting = 0
+
+        self._submitting = True
+        self._flushing = False
+
+    def started(self):
+        """ Called when a baton of the batch starts being processed. """
+        self.running += 1
+
+    def finished(self, result):
+        """ Called with the *result* of a baton of the batch. """
+        self.running -= 1
+        self._maybe_flush()
+        return result
+
+    def submitted(self):
+        """ Called when all the batons of the batch have been submitted. """
+        self._submitting = False
+        self._maybe_flush()
+
+    def process(self, processor, baton):
+        """ Wait for *processor* to process *baton* along with the other batons of the batch.
+
+        :returns: A Deferred that callbacks with a tuple of the processed baton and its
+            share of the time spent processing the batch.
+        """
+        d = defer.Deferred()
+        self.waiting.setdefault(processor, list()).append((baton, d))
+        self.number_of_waiting += 1
+        self._maybe_flush()
+        return d
+
+    def _maybe_flush(self):
+        # batons that are processed synchronously may finish or start waiting again while
+        # we are flushing, in which case they are flushed by the loop.
+        if self._flushing or self._submitting:
+            return
+
+        self._flushing = True
+        try:
+            while self.waiting and self.number_of_waiting == self.running:
+                waiting = self.waiting
+                self.waiting = util.OrderedDict()
+                self.number_of_waiting = 0
+                for processor, entries in waiting.items():
+                    self._process_batch(processor, entries)
+        finally:
+            self._flushing = False
+
+    def _process_batch(self, processor, entries):
+        batons = [baton for baton, d in entries]
+        started = metrics.monotonic_time()
+        if self.context is None:
+            d = defer.maybeDeferred(_call_without_context, processor.process_batch, batons)
+        else:
+            d = defer.maybeDeferred(self.context.call, processor.process_batch, batons)
+        d.addBoth(self._distribute, processor, entries, started)
+
+    def _distribute(self, result, processor, entries, started):
+        # the time spent is recorded by the evaluator, for every baton.
+        time_spent_per_baton = (metrics.monotonic_time() - started) / len(entries)
+
+        if not isinstance(result, failure.Failure) and len(result) != len(entries):
+            e_msg = 'processor %r returned %i batons for a batch of %i batons' % (processor, len(result), len(entries))
+            detail = 'The "process_batch" method of a processor must return a list with an element for every baton.'
+            result = failure.Failure(exceptions.ProcessorGraphError(e_msg, detail))
+
+        for i, (baton, d) in enumerate(entries):
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback((result[i], time_spent_per_baton))
+
+
+def _uses_default_method(processor, method_name):
+    """ Returns True if *processor* uses the :class:`~piped.processors.base.Processor`
+    implementation of *method_name*. """
+    if method_name in getattr(processor, '__dict__', dict()):
+        return False
+    method = getattr(type(processor), method_name, None)
+    return getattr(method, 'im_func', None) is getattr(base.Processor, method_name).im_func
+
+
+class _PlanStep(object):
+    """ A processor in an :class:`_ExecutionPlan`.
+
+    If the processor uses the default implementations of ``get_consumers`` and
+    ``get_error_consumers``, its consumers are resolved when the plan is compiled.
+    Otherwise, they are ``None`` and the processor is asked during the evaluation.
+
+    If the processor has ``concurrent_consumers``, *copy_baton* copies the baton
+    for each of its consumers.
+    """
+    __slots__ = ('processor', 'process', 'latency', 'consumers', 'error_consumers', 'copy_baton')
+
+    def __init__(self, processor, latency):
+        self.processor = processor
+        self.process = processor.process
+        self.latency = latency
+        self.consumers = None
+        self.error_consumers = None
+        self.copy_baton = None
+        if getattr(processor, 'concurrent_consumers', False):
+            self.copy_baton = _get_baton_copier(processor)
+
+
+class _ExecutionPlan(object):
+    """ A flattened representation of a :class:`ProcessorGraph`.
+
+    Every processor becomes a :class:`_PlanStep` that refers directly to the steps
+    of its consumers, so a linear chain of processors is a sequence of steps with a
+    single consumer each, and a fan-out is a step with several consumers.
+    """
+
+    def __init__(self, processor_graph, stats):
+        self.stats = stats
+        self.step_by_processor = dict()
+        self.sources = self.get_steps(processor_graph.sources)
+        self.get_steps(list(processor_graph))
+
+    def get_steps(self, processors):
+        """ Returns the steps of *processors*, compiling steps for processors that
+        are not already part of the plan. """
+        new_steps = collections.deque()
+        steps = [self._get_or_create_step(processor, new_steps) for processor in processors]
+
+        # link the new steps after registering them, since the graph may contain cycles.
+        while new_steps:
+            step = new_steps.popleft()
+            if _uses_default_method(step.processor, 'get_consumers'):
+                step.consumers = [self._get_or_create_step(consumer, new_steps) for consumer in step.processor.consumers]
+            if _uses_default_method(step.processor, 'get_error_consumers'):
+                step.error_consumers = [self._get_or_create_step(consumer, new_steps) for consumer in step.processor.error_consumers]
+
+        return steps
+
+    def _get_or_create_step(self, processor, new_steps):
+        step = self.step_by_processor.get(processor)
+        if step is None:
+            step = self.step_by_processor[processor] = _PlanStep(processor, self.stats.get_processor_latency(processor))
+            new_steps.append(step)
+        return step
+
+    def get_consumers(self, step, baton):
+        if step.consumers is not None:
+            return step.consumers
+        return self.get_steps(step.processor.get_consumers(baton))
+
+    def get_error_consumers(self, step, baton):
+        if step.error_consumers is not None:
+            return step.error_consumers
+        return self.get_steps(step.processor.get_error_consumers(baton))
+
+
+class _PlanFrame(object):
+    """ A step whose consumers (or error consumers, if *reason* is set) are being evaluated. """
+    __slots__ = ('step', 'baton', 'processed_baton', 'consumers', 'index', 'time_spent', 'reason')
+
+    def __init__(self, step, baton, processed_baton, consumers, index=0, time_spent=None, reason=None):
+        self.step = step
+        self.baton = baton
+        self.processed_baton = processed_baton
+        self.consumers = consumers
+        self.index = index
+        self.time_spent = time_spent
+        self.reason = reason
+
+
+_suspended = object()
+
+
+class _PlanEvaluation(object):
+    """ The evaluation of a single baton by a :class:`CompiledProcessorGraphEvaluator`.
+
+    Instead of recursing into every consumer, the evaluation keeps an explicit stack
+    of :class:`_PlanFrame`\s. When a processor fails, the stack is unwound until a step
+    with error consumers is found, just as the exception would have propagated through
+    the recursive :meth:`TwistedProcessorGraphEvaluator._process`.
+    """
+
+    def __init__(self, evaluator, baton, context=None, source=None):
+        self.evaluator = evaluator
+        self.plan = evaluator.plan
+        self.context = context
+        self.source = source
+
+        self.results = list()
+        self.reason = None
+        self.deferred = None
+        self.started = evaluator.stats.started()
+
+        # the root frame has no step, and the sources of the graph as its consumers.
+        self.stack = [_PlanFrame(None, baton, baton, self.plan.sources)]
+
+    def run(self):
+        """ Evaluate the remaining consumers on the stack until the evaluation is
+        either finished or suspended while waiting for a processor. """
+        stack = self.stack
+        while stack:
+            frame = stack[-1]
+            if frame.index == len(frame.consumers):
+                stack.pop()
+                continue
+
+            step = frame.consumers[frame.index]
+            frame.index += 1
+
+            if self.context:
+                self._trace_dispatch(frame, step)
+
+            if not self._evaluate(step, frame.processed_baton):
+                return
+
+        self._finish()
+
+    def _evaluate(self, step, baton):
+        """ Evaluate *step* and follow its linear chain of consumers.
+
+        :return: False if the evaluation was suspended.
+        """
+        context = self.context
+        while step is not None:
+            started = metrics.monotonic_time()
+            try:
+                if context is None:
+                    result = step.process(baton)
+                else:
+                    result = context.process(step.process, baton)
+            except Exception:
+                self._unwind(step, baton, failure.Failure())
+                return True
+
+            if isinstance(result, defer.Deferred):
+                result = self._wait_for(result, step, baton, started)
+                if result is _suspended:
+                    return False
+
+            step, baton = self._advance(step, baton, result, started)
+            if step is _suspended:
+                return False
+
+        return True
+
+    def _wait_for(self, d, step, baton, started):
+        """ Returns the result of *d* if it has already fired. Otherwise, the evaluation
+        is suspended, and resumed when *d* fires. """
+        waiting = [True, None]
+
+        def on_result(result):
+            if waiting[0]:
+                waiting[0] = False
+                waiting[1] = result
+            else:
+                self._resume(step, baton, result, started)
+
+        d.addBoth(on_result)
+
+        if waiting[0]:
+            waiting[0] = False
+            if self.deferred is None:
+                self.deferred = defer.Deferred()
+            return _suspended
+
+        return waiting[1]
+
+    def _resume(self, step, baton, result, started):
+        # the evaluation may be resumed while another evaluation is invoking a processor,
+        # whose context must not leak into the processors of this evaluation.
+        previous = _EvaluationContext.current
+        _EvaluationContext.current = self.context
+        try:
+            step, baton = self._advance(step, baton, result, started)
+            if step is _suspended:
+                return
+            if step is None or self._evaluate(step, baton):
+                self.run()
+        finally:
+            _EvaluationContext.current = previous
+
+    def _advance(self, step, baton, result, started):
+        """ Handle the *result* of *step* processing *baton*.
+
+        :return: A tuple of the next step in a linear chain and the baton it should
+            process, ``(None, None)`` if the chain ends here, or ``(_suspended, None)``
+            if the evaluation was suspended while waiting for concurrent consumers.
+        """
+        if isinstance(result, failure.Failure):
+            self._unwind(step, baton, result)
+            return None, None
+
+        time_spent = metrics.monotonic_time() - started
+        step.processor.time_spent += time_spent
+        step.latency.record(time_spent)
+        self.evaluator.time_spent += time_spent
+
+        try:
+            consumers = self.plan.get_consumers(step, result)
+        except Exception:
+            self._unwind(step, baton, failure.Failure())
+            return None, None
+
+        if not consumers:
+            # this means it is a sink, so we store the result we got from it.
+            if self.context:
+                self._trace('_process_result', source=step.processor, destination=None, baton=result, time_spent=time_spent)
+            self.results.append(result)
+            return None, None
+
+        if len(consumers) == 1:
+            # a linear chain, which we keep evaluating without going through the stack
+            self.stack.append(_PlanFrame(step, baton, result, consumers, 1, time_spent))
+            if self.context:
+                self._trace('_process_consumer', source=step.processor, destination=consumers[0].processor, baton=baton, time_spent=time_spent)
+            return consumers[0], result
+
+        if step.copy_baton is not None:
+            return self._fork(step, baton, result, consumers, time_spent)
+
+        self.stack.append(_PlanFrame(step, baton, result, consumers, 0, time_spent))
+        return None, None
+
+    def _fork(self, step, baton, processed_baton, consumers, time_spent):
+        """ Evaluate the *consumers* of *step* concurrently, each in a :class:`_PlanBranch`
+        with its own copy of *processed_baton*. """
+        branches = list()
+        for consumer in consumers:
+            branch = _PlanBranch(self, step, baton, step.copy_baton(processed_baton), consumer, time_spent)
+            branch.run()
+            branches.append(branch)
+
+        pending = [branch.deferred for branch in branches if branch.deferred is not None and not branch.deferred.called]
+        if not pending:
+            self._join(step, baton, branches)
+            return None, None
+
+        if self.deferred is None:
+            self.deferred = defer.Deferred()
+        defer.DeferredList(pending).addCallback(lambda _: self._rejoin(step, baton, branches))
+        return _suspended, None
+
+    def _join(self, step, baton, branches):
+        """ Collect the results of the *branches* in the order of the consumers. If a
+        branch failed, its failure is handled as if *step* had failed. """
+        for branch in branches:
+            self.results.extend(branch.results)
+            if branch.reason is not None:
+                self._unwind(step, baton, branch.reason)
+                return
+
+    def _rejoin(self, step, baton, branches):
+        previous = _EvaluationContext.current
+        _EvaluationContext.current = self.context
+        try:
+            self._join(step, baton, branches)
+            self.run()
+        finally:
+            _EvaluationContext.current = previous
+
+    def _unwind(self, step, baton, reason):
+        """ Route the failure of *step* processing *baton* to the nearest error consumers.
+
+        If no step on the stack has error consumers, the evaluation fails with *reason*.
+        """
+        stack = self.stack
+        failed = step
+
+        while True:
+            if step is not None:
+                try:
+                    error_consumers = self.plan.get_error_consumers(step, baton)
+                except Exception:
+                    reason = failure.Failure()
+                    error_consumers = None
+
+                if error_consumers:
+                    self.evaluator.stats.error_routed += 1
+                    stack.append(_PlanFrame(step, baton, baton, error_consumers, reason=reason))
+                    return
+
+            # the failure propagates to the frame that dispatched the failed step
+            frame = stack.pop()
+            if self.context:
+                self._trace_raised(frame, failed, reason)
+
+            if not stack:
+                self.reason = reason
+                return
+
+            failed = frame.step
+            if frame.reason is None:
+                step, baton = frame.step, frame.baton
+            else:
+                # failures raised by error consumers are not handled by the same error consumers
+                step, baton = None, None
+
+    def _finish(self):
+        self.evaluator.stats.finished(self.started, failed=self.reason is not None)
+
+        if self.deferred is None or self.deferred.called:
+            return
+
+        if self.reason is not None:
+            self.deferred.errback(self.reason)
+        else:
+            self.deferred.callback(self.results)
+
+    def _trace(self, kind, **state):
+        self.context.add_trace_entry(kind, **state)
+
+    def _trace_dispatch(self, frame, step):
+        if frame.step is None:
+            self._trace('process_source', source=self.source, destination=step.processor, baton=frame.baton)
+        elif frame.reason is not None:
+            self._trace('_process_error_consumer', source=frame.step.processor, destination=step.processor,
+                        baton=frame.baton, is_error_consumer=True, reason=frame.reason)
+        else:
+            self._trace('_process_consumer', source=frame.step.processor, destination=step.processor,
+                        baton=frame.baton, time_spent=frame.time_spent)
+
+    def _trace_raised(self, frame, failed, reason):
+        if frame.step is None:
+            self._trace('process_source_raised', source=failed.processor, destination=self.source, baton=frame.baton, reason=reason)
+        elif frame.reason is not None:
+            self._trace('_process_error_consumer_raised', source=failed.processor, destination=frame.step.processor,
+                        baton=frame.baton, reason=reason)
+        else:
+            self._trace('_process_consumer_raised', source=failed.processor, destination=frame.step.processor,
+                        baton=frame.baton, reason=reason)
+
+
+class _PlanBranch(_PlanEvaluation):
+    """ The evaluation of one of the consumers of a step with concurrent consumers.
+
+    The root frame of the branch is the frame of the step, so failures that are not
+    handled within the branch end the branch instead of being routed to the error
+    consumers of the step. That is left to the evaluation that forked the branch.
+    """
+
+    def __init__(self, parent, step, baton, processed_baton, consumer, time_spent):
+        self.evaluator = parent.evaluator
+        self.plan = parent.plan
+        self.context = parent.context
+        self.source = parent.source
+
+        self.results = list()
+        self.reason = None
+        self.deferred = None
+
+        self.stack = [_PlanFrame(step, baton, processed_baton, [consumer], 0, time_spent)]
+
+    def _finish(self):
+        # the branch always callbacks, since the evaluation that forked it inspects its reason.
+        if self.deferred is not None and not self.deferred.called:
+            self.deferred.callback(self)
+
+
+class CompiledProcessorGraphEvaluator(TwistedProcessorGraphEvaluator):
+    """ A `ProcessorGraph` evaluator that compiles the graph into a flat execution plan.
+
+    The results and the handling of error consumers are the same as for
+    :class:`TwistedProcessorGraphEvaluator`, but instead of recursing through every
+    consumer with a new generator per processor, batons are evaluated iteratively,
+    and processors that return plain values are continued inline. Deferreds are only
+    waited upon when a processor actually returns one that has not already fired.
+
+    The plan is compiled when the first baton is processed. Processors that override
+    ``get_consumers`` or ``get_error_consumers`` are still asked for their consumers
+    for every baton. Batches of batons given to :meth:`process_batch` are evaluated
+    as by :class:`TwistedProcessorGraphEvaluator`.
+    """
+
+    def __init__(self, processor_graph, name=None):
+        super(CompiledProcessorGraphEvaluator, self).__init__(processor_graph, name)
+        self.plan = None
+
+    def compile(self):
+        """ Compile the processor graph into an execution plan. """
+        self.plan = _ExecutionPlan(self.processor_graph, self.stats)
+        return self.plan
+
+    def _start(self, baton, context=None, source=None):
+        if self.plan is None:
+            self.compile()
+
+        if context is None:
+            return self._run(_PlanEvaluation(self, baton))
+        return context.chain(self._run(_PlanEvaluation(self, baton, context, source)))
+
+    def _run(self, evaluation):
+        evaluation.run()
+
+        if evaluation.deferred is not None:
+            return evaluation.deferred
+        if evaluation.reason is not None:
+            return defer.fail(evaluation.reason)
+        return defer.succeed(evaluation.results)
+
+
+class _QueuedBaton(object):
+    __slots__ = ('deferred', 'f', 'args', 'enqueued', 'timeout')
+
+    def __init__(self, deferred, f, args, enqueued):
+        self.deferred = deferred
+        self.f = f
+        self.args = args
+        self.enqueued = enqueued
+        self.timeout = None
+
+
+class AdmissionControl(object):
+    """ Limits the number of batons an evaluator processes at the same time.
+
+    When *max_in_flight* batons are being processed, the processing of further batons
+    waits in a FIFO queue until another baton is done. If *max_queued* batons are
+    already waiting, or a baton has waited for more than *queue_timeout* seconds, the
+    processing fails with an :exc:`~piped.exceptions.OverloadedError`.
+
+    The depth of the queue and the time batons spend in it is recorded in *stats*.
+
+    :param stats: The :class:`~piped.metrics.PipelineStats` of the evaluator.
+    :param max_in_flight: The maximum number of batons processed at the same time.
+    :param max_queued: The maximum number of waiting batons, or None for no limit.
+        If 0, batons are rejected as soon as *max_in_flight* is reached.
+    :param queue_timeout: The maximum number of seconds a baton may wait, or None
+        for no limit.
+    :param name: The name of the pipeline, used in error messages.
+    """
+
+    def __init__(self, stats, max_in_flight, max_queued=None, queue_timeout=None, name=None):
+        self._fail_if_invalid_limit('max_in_flight', max_in_flight, minimum=1)
+        self._fail_if_invalid_limit('max_queued', max_queued, minimum=0, optional=True)
+        self._fail_if_invalid_limit('queue_timeout', queue_timeout, minimum=0, optional=True, types=(int, long, float))
+
+        self.stats = stats
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.name = name
+
+        self.in_flight = 0
+        self.queue = collections.deque()
+        self._admitting = False
+
+    @classmethod
+    def _fail_if_invalid_limit(cls, option, value, minimum, optional=False, types=(int, long)):
+        if value is None and optional:
+            return
+        if isinstance(value, types) and not isinstance(value, bool) and value >= minimum:
+            return
+
+        e_msg = 'invalid %s: %r' % (option, value)
+        detail = '%s must be a number that is at least %s.' % (option, minimum)
+        if optional:
+            detail += ' Use null for no limit.'
+        raise exceptions.ConfigurationError(e_msg, detail)
+
+    def submit(self, f, *args):
+        """ Call *f* with *args* when fewer than *max_in_flight* calls are in flight.
+
+        :returns: A Deferred that fires with the result of *f*. Cancelling it while
+            the call is waiting removes the call from the queue.
+        """
+        if self.in_flight < self.max_in_flight:
+            return self._start(f, args)
+
+        if self.max_queued is not None and len(self.queue) >= self.max_queued:
+            self.stats.rejected += 1
+            return defer.fail(self._get_overloaded_error())
+
+        queued = _QueuedBaton(defer.Deferred(self._cancel), f, args, self.stats.enqueued())
+        if self.queue_timeout is not None:
+            queued.timeout = reactor.callLater(self.queue_timeout, self._time_out, queued)
+        self.queue.append(queued)
+        return queued.deferred
+
+    def _start(self, f, args):
+        self.in_flight += 1
+        d = defer.maybeDeferred(f, *args)
+        d.addBoth(self._release)
+        return d
+
+    def _release(self, result):
+        self.in_flight -= 1
+
+        # batons that are processed synchronously are released while we are admitting
+        # them, in which case the outer loop admits the next one.
+        if not self._admitting:
+            self._admitting = True
+            try:
+                while self.queue and self.in_flight < self.max_in_flight:
+                    self._admit(self.queue.popleft())
+            finally:
+                self._admitting = False
+
+        return result
+
+    def _admit(self, queued):
+        self._dequeue(queued)
+        self._start(queued.f, queued.args).chainDeferred(queued.deferred)
+
+    def _dequeue(self, queued):
+        self.stats.dequeued(queued.enqueued)
+        if queued.timeout is not None and queued.timeout.active():
+            queued.timeout.cancel()
+
+    def _remove(self, queued):
+        self.queue.remove(queued)
+        self._dequeue(queued)
+
+    def _cancel(self, d):
+        for queued in self.queue:
+            if queued.deferred is d:
+                self._remove(queued)
+                return
+
+    def _time_out(self, queued):
+        self._remove(queued)
+        self.stats.rejected += 1
+        queued.deferred.errback(self._get_overloaded_error(timed_out=True))
+
+    def _get_overloaded_error(self, timed_out=False):
+        e_msg = 'pipeline %s is overloaded' % (self.name or '')
+        if timed_out:
+            detail = 'The baton waited for more than %s seconds before it could be processed.' % self.queue_timeout
+        else:
+            detail = '%i batons are being processed, and %i batons are waiting.' % (self.in_flight, len(self.queue))
+        hint = 'Consider increasing max_in_flight, max_queued or queue_timeout of the pipeline.'
+        return exceptions.OverloadedError(e_msg, detail, hint)
+
+
+class PipelineDefinitionCache(object):
+    """ Keeps normalized pipeline definitions in the file *path*, along with the
+    *key* they were created with.
+
+    The cached definitions are only used if they were cached with the same key.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        """ Returns the cached pipeline definitions, or None if there are no
+        usable definitions in the cache. """
+        return util.load_cache_file(self.path, self.key, 'pipeline cache')
+
+    def save(self, pipelines_configuration):
+        """ Replace the cached pipeline definitions with *pipelines_configuration*. """
+        return util.save_cache_file(self.path, self.key, pipelines_configuration, 'pipeline cache')
+
+
 class ProcessorGraphFactory(object):
     """ Takes a plugin manager and a pipeline configuration and produces a
-    processor graph. """
+    processor graph.
+
+    Resolving inheritance and nesting chained consumers and nested pipelines may
+    take a while when there are many pipelines. The resulting pipeline definitions
+    may be cached on disk, in which case they are reused for as long as the
+    configuration files, configuration overrides and processor plugins are unchanged::
+
+        pipeline_cache:
+            enabled: true
+            path: pipelines.cache # defaults to the configuration file name + ".pipelines.cache"
+
+    The cache may be built ahead of time with ``piped --precompile``.
+    """
 
     default_graph_evaluator = TwistedProcessorGraphEvaluator
+    #: Evaluators that may be selected by name, either with the ``evaluator`` key of
+    #: a pipeline definition or by :meth:`make_evaluator`. Strings are the fully
+    #: qualified names of evaluators that are imported when first used.
+    evaluator_kinds = {
+        'twisted': TwistedProcessorGraphEvaluator,
+        'compiled': CompiledProcessorGraphEvaluator,
+        'process-pool': 'piped.process_pool.ProcessPoolEvaluator',
+    }
+    #: Processor options that may be set for all the processors of a pipeline by
+    #: setting them in the pipeline definition.
+    pipeline_wide_options = ('concurrent_consumers', 'consumer_baton_copy')
+    #: Options of the evaluator that may be set in the pipeline definition, which
+    #: are passed to :meth:`TwistedProcessorGraphEvaluator.limit_in_flight`.
+    admission_control_options = ('max_in_flight', 'max_queued', 'queue_timeout')
+    #: The optimizer that is used for pipelines that set ``optimize``. Like the
+    #: :attr:`evaluator_kinds`, it may be the fully qualified name of the optimizer.
+    graph_optimizer = 'piped.optimizer.ProcessorGraphOptimizer'
+    #: The pruner that is used for pipelines that set ``prune_batons``, or its fully
+    #: qualified name.
+    baton_pruner = 'piped.optimizer.BatonPruner'
 
     def __init__(self, inline_pipeline_config=Ellipsis):
         self.inline_pipeline_config = inline_pipeline_config
 
     def configure(self, runtime_environment):
-        self.pipelines_configuration = self._get_pipeline_configuration(runtime_environment)
+        self.plugin_manager = ProcessorPluginManager()
+        self.plugin_manager.configure(runtime_environment)
+
+        self.pipeline_cache = self._get_pipeline_cache(runtime_environment)
+        self.pipelines_configuration = self.pipeline_cache.load() if self.pipeline_cache else None
+
+        if self.pipelines_configuration is None:
+            self.pipelines_configuration = self._get_pipeline_configuration(runtime_environment)
+
+            self._nest_chained_consumers()
+            self._flatten_nested_pipelines()
+            self._resolve_inheritance()
+
+            if self.pipeline_cache:
+                self.pipeline_cache.save(self.pipelines_configuration)
 
         if not self.pipelines_configuration:
             logger.info('No pipeline definitions were found in the configuration.')
 
-        self.plugin_manager = ProcessorPluginManager()
-        self.plugin_manager.configure(runtime_environment)
+    def _get_pipeline_cache(self, runtime_environment):
+        """ Returns a :class:`PipelineDefinitionCache` if caching is enabled and the
+        pipelines are defined in configuration files, otherwise None. """
+        if self.inline_pipeline_config is not Ellipsis:
+            return None
+
+        configuration_manager = runtime_environment.configuration_manager
+        cache_configuration = configuration_manager.get('pipeline_cache', dict())
+        if not cache_configuration.get('enabled', False):
+            return None
+
+        content_hash = configuration_manager.get_content_hash()
+        if content_hash is None:
+            return None
 
-        self._nest_chained_consumers()
-        self._flatten_nested_pipelines()
-        self._resolve_inheritance()
+        key = hashlib.sha1(str(piped.version))
+        key.update(content_hash)
+        for plugin_name, qualified_name in sorted(self.plugin_manager.get_qualified_plugin_names()):
+            key.update('%s=%s;' % (plugin_name, qualified_name))
+
+        path = cache_configuration.get('path') or configuration_manager.loaded_files[0] + '.pipelines.cache'
+        return PipelineDefinitionCache(util.expand_filepath(path), key.hexdigest())
 
     def _get_pipeline_configuration(self, runtime_environment):
         if self.inline_pipeline_config is Ellipsis:
@@ -852,6 +1815,10 @@ class ProcessorGraphFactory(object):
             replacement_pipeline = deepcopy(parent_pipeline)
             # Keep a note of how the pipeline is assembled:
             replacement_pipeline['inherits'] = name_of_parent_pipeline
+            # ... and the options of the inheriting pipeline itself.
+            for key in self.pipeline_wide_options + self.admission_control_options + ('evaluator', 'optimize', 'prune_batons'):
+                if key in configuration:
+                    replacement_pipeline[key] = configuration[key]
 
             self._merge_pipeline_with_overrides(replacement_pipeline, configuration['overrides'], pipeline_name)
             self.pipelines_configuration[pipeline_name] = replacement_pipeline
@@ -954,8 +1921,12 @@ class ProcessorGraphFactory(object):
             ascii_processor_configuration[key] = value
         return ascii_processor_configuration
 
-    def _make_processor(self, processor_configuration):
-        """ Return a processor instance provided its configuration. """
+    def _make_processor(self, processor_configuration, pipeline_wide_options=None):
+        """ Return a processor instance provided its configuration.
+
+        :param pipeline_wide_options: The defaults of the processor options, which are
+            set on the pipeline the processor is in.
+        """
         assert not 'inline-pipeline' in processor_configuration, "Unflattened configuration provided"
 
         if 'existing' in processor_configuration:
@@ -969,6 +1940,8 @@ class ProcessorGraphFactory(object):
         error_consumers = processor_configuration.pop('error_consumers', None)
 
         copied_processor_configuration = deepcopy(processor_configuration)
+        for key, value in (pipeline_wide_options or dict()).items():
+            copied_processor_configuration.setdefault(key, value)
 
         # add the consumers and error_consumers back into the original configuration:
         if consumers is not None:
@@ -980,6 +1953,11 @@ class ProcessorGraphFactory(object):
         # configuration values.
         plugin_name = copied_processor_configuration.pop('__processor__')
         processor_id = copied_processor_configuration.pop('id', None)
+        concurrent_consumers = copied_processor_configuration.pop('concurrent_consumers', None)
+        consumer_baton_copy = copied_processor_configuration.pop('consumer_baton_copy', None)
+        if consumer_baton_copy is not None:
+            self._fail_if_unknown_baton_copy(consumer_baton_copy, plugin_name)
+        run_in_thread = copied_processor_configuration.pop('run_in_thread', None)
 
         plugin_factory = self._get_plugin_factory_or_fail(plugin_name)
         try:
@@ -993,8 +1971,49 @@ class ProcessorGraphFactory(object):
         processor.processor_configuration = copied_processor_configuration
         processor.id = processor_id
 
+        if concurrent_consumers is not None:
+            processor.concurrent_consumers = concurrent_consumers
+        if consumer_baton_copy is not None:
+            processor.consumer_baton_copy = consumer_baton_copy
+        if run_in_thread is not None:
+            self._run_in_thread_pool(processor, run_in_thread)
+
         return processor
 
+    def _run_in_thread_pool(self, processor, thread_pool_name):
+        """ Make *processor* depend on the thread pool *thread_pool_name*, and
+        process batons in that thread pool.
+
+        The processor must not use the reactor or return Deferreds, as its
+        :meth:`process` is called in another thread.
+        """
+        processor.run_in_thread = thread_pool_name
+        configure = processor.configure
+        process = processor.process
+        process_batch = getattr(processor, 'process_batch', None)
+
+        def configure_and_depend_on_thread_pool(runtime_environment):
+            configure(runtime_environment)
+            thread_pool_dependency = dict(provider='thread_pool.%s' % thread_pool_name)
+            processor.thread_pool_dependency = runtime_environment.dependency_manager.add_dependency(processor, thread_pool_dependency)
+
+        def process_in_thread_pool(baton):
+            return processor.thread_pool_dependency.get_resource().run(process, baton)
+
+        processor.configure = configure_and_depend_on_thread_pool
+        processor.process = process_in_thread_pool
+
+        if process_batch is not None:
+            processor.process_batch = lambda batons: processor.thread_pool_dependency.get_resource().run(process_batch, batons)
+
+    def _fail_if_unknown_baton_copy(self, consumer_baton_copy, plugin_name):
+        if consumer_baton_copy in baton_copiers:
+            return
+
+        e_msg = 'invalid consumer_baton_copy for processor %s: %r' % (plugin_name, consumer_baton_copy)
+        detail = 'The baton may be copied in one of the following ways: "%s".' % '", "'.join(sorted(baton_copiers))
+        raise exceptions.ConfigurationError(e_msg, detail)
+
     def _explain_instantiation_typeerror(self, type_error, plugin_name, plugin_factory, processor_configuration):
         message = type_error.args[0]
         if '__init__() got an unexpected keyword argument' in message:
@@ -1029,23 +2048,23 @@ class ProcessorGraphFactory(object):
             raise
         raise exceptions.ConfigurationError(e_msg, detail, hint)
 
-    def _make_processors_and_wire_relations(self, processor_configuration, builder, existing_processors_by_id, is_error_consumer=False):
+    def _make_processors_and_wire_relations(self, processor_configuration, builder, existing_processors_by_id, is_error_consumer=False, pipeline_wide_options=None):
         """ Takes a processor configuration and instantiates the processor and its
         consumers, while also wiring up the producer-consumer-relationships.
 
         `builder` is a `ProcessorGraphBuilder`-object, upon which we'll tack consumers.
         """
-        processor = self._make_processor(processor_configuration)
+        processor = self._make_processor(processor_configuration, pipeline_wide_options)
         if 'id' in processor_configuration:
             existing_processors_by_id[processor_configuration['id']] = processor
 
         builder = builder.add_processor(processor, is_error_consumer)
 
         for consumer in processor_configuration.get('consumers', []):
-            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id, is_error_consumer=False)
+            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id, False, pipeline_wide_options)
 
         for consumer in processor_configuration.get('error_consumers', []):
-            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id, is_error_consumer=True)
+            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id, True, pipeline_wide_options)
 
     def _replace_references_to_existing_with_processors(self, pg, existing_processors_by_id):
         # Replace all references to existing processors with references to the actual processor.
@@ -1073,38 +2092,144 @@ class ProcessorGraphFactory(object):
             if pg.consumers.successors(node):
                 del pg.sinks[i]
 
-    def make_processor_graph(self, pipeline_name):
+    def make_processor_graph(self, pipeline_name, suppress_warnings=False):
         """ Make a processor graph of the provided pipeline.
 
-        :param collector: If provided, the output of all sinks will be
-            appended to this list-like.
+        :param suppress_warnings: Whether to suppress the warnings about
+            configuration anomalies in the pipeline.
         """
         assert pipeline_name in self.pipelines_configuration, "No pipeline '%s'." % pipeline_name
 
         existing_processors_by_id = dict()
 
         pg = ProcessorGraph()
+        pg.suppress_warnings = suppress_warnings
         builder = pg.get_builder()
 
-        for consumer in self.pipelines_configuration[pipeline_name]['consumers']:
-            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id)
+        pipeline_configuration = self.pipelines_configuration[pipeline_name]
+        pipeline_wide_options = self._get_pipeline_wide_options(pipeline_configuration)
+
+        for consumer in pipeline_configuration['consumers']:
+            self._make_processors_and_wire_relations(consumer, builder, existing_processors_by_id, pipeline_wide_options=pipeline_wide_options)
 
         self._replace_references_to_existing_with_processors(pg, existing_processors_by_id)
 
         self._annotate_configuration_anomalies(pg, pipeline_name)
         return pg
 
+    def _get_pipeline_wide_options(self, pipeline_configuration):
+        """ Returns the processor options that are set on the pipeline itself, which
+        are the defaults of every processor in the pipeline. """
+        options = dict()
+        for key in self.pipeline_wide_options:
+            if key in pipeline_configuration:
+                options[key] = pipeline_configuration[key]
+        return options
+
     def make_evaluator(self, pipeline_name, evaluator_factory=None):
         """ Make a processor graph evaluator of the provided pipeline.
 
-        :param collector: If provided, the output of all sinks will be
-            appended to this list-like.
+        :param evaluator_factory: A callable that takes a processor graph and
+            the pipeline name and returns an evaluator, or the name of one of
+            the :attr:`evaluator_kinds`. Defaults to the ``evaluator`` of the
+            pipeline definition, then :attr:`default_graph_evaluator`.
         """
         pg = self.make_processor_graph(pipeline_name)
+        if self.pipelines_configuration[pipeline_name].get('optimize'):
+            self._optimize(pg, pipeline_name)
+        if self.pipelines_configuration[pipeline_name].get('prune_batons'):
+            self._prune_batons(pg, pipeline_name)
+
+        options = dict()
+        if evaluator_factory is None:
+            evaluator_factory, options = self._get_configured_evaluator(pipeline_name)
+
+        if isinstance(evaluator_factory, basestring):
+            evaluator_factory = self._get_evaluator_kind(evaluator_factory)
+
+        evaluator_factory = evaluator_factory or self.default_graph_evaluator
+        self._fail_if_invalid_evaluator_options(evaluator_factory, options, pipeline_name)
+        evaluator = evaluator_factory(pg, pipeline_name, **options)
+
+        self._limit_in_flight(evaluator, pipeline_name)
+        return evaluator
+
+    def _optimize(self, processor_graph, pipeline_name):
+        graph_optimizer = self.graph_optimizer
+        if isinstance(graph_optimizer, basestring):
+            graph_optimizer = reflect.namedAny(graph_optimizer)
+        graph_optimizer(self).optimize(processor_graph, pipeline_name)
+
+    def _prune_batons(self, processor_graph, pipeline_name):
+        keep = self.pipelines_configuration[pipeline_name]['prune_batons']
+        if keep is True:
+            keep = list()
+        elif not isinstance(keep, (list, tuple)) or not all(isinstance(path, basestring) for path in keep):
+            e_msg = 'invalid prune_batons in pipeline "%s"' % pipeline_name
+            detail = 'prune_batons is %r.' % (keep, )
+            hint = 'prune_batons must be true, or a list of the paths the results of the pipeline must keep.'
+            raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+        baton_pruner = self.baton_pruner
+        if isinstance(baton_pruner, basestring):
+            baton_pruner = reflect.namedAny(baton_pruner)
+        baton_pruner(self).prune(processor_graph, pipeline_name, keep)
+
+    def _get_configured_evaluator(self, pipeline_name):
+        evaluator = self.pipelines_configuration[pipeline_name].get('evaluator')
+        if not isinstance(evaluator, dict):
+            return evaluator, dict()
+
+        options = dict(evaluator)
+        kind = options.pop('kind', None)
+        if kind is None:
+            e_msg = 'the evaluator of pipeline "%s" has no kind' % pipeline_name
+            hint = 'Available kinds: %s' % ', '.join(sorted(self.evaluator_kinds))
+            raise exceptions.ConfigurationError(e_msg, hint=hint)
+        return kind, options
+
+    def _fail_if_invalid_evaluator_options(self, evaluator_factory, options, pipeline_name):
+        if not options:
+            return
+
+        # the processor graph and the pipeline name are the first arguments of the factory
+        function, skipped_arguments = evaluator_factory, 2
+        if isinstance(evaluator_factory, type):
+            function, skipped_arguments = evaluator_factory.__init__, 3
+        try:
+            argspec = inspect.getargspec(function)
+        except TypeError:
+            # not a Python function, so its arguments are unknown
+            return
+        if argspec.keywords:
+            return
+
+        valid_options = argspec.args[skipped_arguments:]
+        unknown_options = sorted(set(options) - set(valid_options))
+        if unknown_options:
+            e_msg = 'invalid evaluator options in pipeline "%s"' % pipeline_name
+            detail = 'Unknown options: %s.' % ', '.join(unknown_options)
+            hint = 'The evaluator %s accepts the options: %s.' % (reflect.qual(evaluator_factory), ', '.join(valid_options))
+            raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+    def _get_evaluator_kind(self, kind):
+        if kind not in self.evaluator_kinds:
+            self._fail_unknown_evaluator_kind(kind)
+        evaluator_factory = self.evaluator_kinds[kind]
+        if isinstance(evaluator_factory, basestring):
+            evaluator_factory = reflect.namedAny(evaluator_factory)
+        return evaluator_factory
+
+    def _limit_in_flight(self, evaluator, pipeline_name):
+        pipeline_configuration = self.pipelines_configuration[pipeline_name]
+        if pipeline_configuration.get('max_in_flight') is None:
+            return
 
-        if evaluator_factory:
-            return evaluator_factory(pg, pipeline_name)
-        return self.default_graph_evaluator(pg, pipeline_name)
+        options = dict()
+        for key in self.admission_control_options:
+            if key in pipeline_configuration:
+                options[key] = pipeline_configuration[key]
+        evaluator.limit_in_flight(**options)
 
     def _fail_unknown_evaluator_kind(self, kind):
         msg = 'Unknown evaluator kind: %s.' % kind
@@ -1241,3 +2366,4 @@ class ProcessorPluginManager(plugin.PluginManager):
     plugin_packages = [piped_processors, plugins]
     plugin_interface = IProcessor
     plugin_configuration_name = 'processors'
+    import_plugins_lazily = True
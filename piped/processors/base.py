@@ -19,6 +19,8 @@ class Processor(object):
 
     :ivar instance_provides: list of strings identifying keywords this processor provides for the pipeline.
     :ivar instance_depends_on: list of string identifying keywords this processor depends on from the pipeline.
+    :ivar instance_reads: list of paths in the baton this processor reads, or ``None`` if it may read any
+        part of the baton. Used when batons are pruned, see :ref:`topic-pipelines-prune-batons`.
     """
     __metaclass__ = abc.ABCMeta
 
@@ -31,6 +33,14 @@ class Processor(object):
     #: list of string identifying keywords processes of this class depends on from the pipeline.
     depends_on = list()
 
+    #: whether the consumers of this processor are evaluated concurrently instead of one at a time.
+    concurrent_consumers = False
+    #: how the baton is copied for each consumer when the consumers are evaluated concurrently.
+    #: One of ``shallow``, ``deep`` and ``none``.
+    consumer_baton_copy = 'shallow'
+    #: the name of the thread pool :meth:`process` runs in, or None to run it in the reactor thread.
+    run_in_thread = None
+
     def __init__(self, node_name=None):
         super(Processor, self).__init__()
         self.consumers = list()
@@ -56,7 +66,7 @@ class Processor(object):
         :param fallback: The value to use if the input does not exist.
         """
         if isinstance(value, yamlutil.BatonPath):
-            return util.dict_get_path(baton, value, fallback)
+            return util.get_path_accessor(value).get(baton, fallback)
         return value
 
     def get_resulting_baton(self, baton, path, value):
@@ -83,7 +93,7 @@ class Processor(object):
         elif path == '':
             return value
 
-        util.dict_set_path(baton, path, value)
+        util.get_path_accessor(path).set(baton, value)
         return baton
 
     @property
@@ -93,6 +103,10 @@ class Processor(object):
     @property
     def instance_provides(self):
         return list()
+
+    @property
+    def instance_reads(self):
+        return None
     
     @property
     def node_name(self):
@@ -128,6 +142,8 @@ class InputOutputProcessor(Processor):
         and :func:`piped.util.dict_set_path`, respectively.
 
     """
+    #: whether :meth:`process_input` only reads its input, and not the rest of the baton.
+    reads_only_input = False
 
     def __init__(self, input_path='', output_path=Ellipsis, skip_if_nonexistent=True, input_fallback=None, *a, **kw):
         """
@@ -152,6 +168,26 @@ class InputOutputProcessor(Processor):
         self.skip_if_nonexistent = skip_if_nonexistent
         self.input_fallback = input_fallback
 
+    @property
+    def input_path(self):
+        return self._input_path
+
+    @input_path.setter
+    def input_path(self, input_path):
+        self._input_path = input_path
+        self._get_input = util.get_path_accessor(input_path).get
+
+    @property
+    def output_path(self):
+        return self._output_path
+
+    @output_path.setter
+    def output_path(self, output_path):
+        self._output_path = output_path
+        self._set_output = None
+        if output_path and output_path is not Ellipsis:
+            self._set_output = util.get_path_accessor(output_path).set
+
     @property
     def instance_depends_on(self):
         """ Return a list of keywords this instance depends on.
@@ -172,9 +208,23 @@ class InputOutputProcessor(Processor):
             return [self.output_path]
         return list()
 
-    @defer.inlineCallbacks
+    @property
+    def instance_reads(self):
+        """ Return the paths this instance reads, which is only the input path if
+        :attr:`reads_only_input` is true, or ``None`` if it may read the whole baton. """
+        if self.reads_only_input:
+            return [self.input_path]
+        return None
+
+    @util.maybe_inline_callbacks
     def process(self, baton):
-        input = util.dict_get_path(baton, self.input_path, Ellipsis)
+        """ Processes a baton by calling :func:`process_input` with the input.
+
+        If :func:`process_input` returns a plain value, so does this method. A
+        Deferred is only returned if :func:`process_input` returns one that has
+        not fired yet.
+        """
+        input = self._get_input(baton, Ellipsis)
 
         if input is Ellipsis:
             if self.skip_if_nonexistent:
@@ -182,15 +232,38 @@ class InputOutputProcessor(Processor):
             input = self.input_fallback
 
         output = yield self.process_input(input=input, baton=baton)
+        defer.returnValue(self._get_processed_baton(baton, output))
+
+    def process_batch_synchronously(self, batons):
+        """ Processes a batch of batons one at a time, without Deferreds.
+
+        Processors whose :func:`process_input` never returns a Deferred may use this
+        as their ``process_batch``, which avoids the per-baton overhead of
+        :func:`process` when a batch of batons is evaluated.
+        """
+        processed_batons = list()
+        for baton in batons:
+            input = self._get_input(baton, Ellipsis)
+
+            if input is Ellipsis:
+                if self.skip_if_nonexistent:
+                    processed_batons.append(baton)
+                    continue
+                input = self.input_fallback
 
+            output = self.process_input(input=input, baton=baton)
+            processed_batons.append(self._get_processed_baton(baton, output))
+        return processed_batons
+
+    def _get_processed_baton(self, baton, output):
         if self.output_path == '':
-            defer.returnValue(output) # the output replaces the baton
+            return output # the output replaces the baton
 
         if self.output_path is None:
-            defer.returnValue(baton) # discard the output
+            return baton # discard the output
 
-        util.dict_set_path(baton, self.output_path, output)
-        defer.returnValue(baton)
+        self._set_output(baton, output)
+        return baton
 
     @abc.abstractmethod
     def process_input(self, input, baton):
@@ -376,11 +449,13 @@ class MappingProcessor(Processor):
         """
         return [map_entry['output_path'] for map_entry in self.mapping if map_entry['output_path']]
 
-    @defer.inlineCallbacks
+    @util.maybe_inline_callbacks
     def process(self, baton):
         """ Processes a baton.
 
         This function will call :func:`process_mapping` with the input for each input in the mapping.
+        As long as :func:`process_mapping` returns plain values, the processed baton is returned
+        directly instead of through a Deferred.
         """
         for map_entry in self.mapping:
             input_path = map_entry['input_path']
@@ -411,11 +486,11 @@ class MappingProcessor(Processor):
 
     def get_input(self, baton, input_path, **kwargs):
         """ Return the appropriate input for the given input_path and baton. """
-        return util.dict_get_path(baton, input_path, Ellipsis)
+        return util.get_path_accessor(input_path).get(baton, Ellipsis)
 
     def set_output(self, baton, output, output_path, **kwargs):
         """ Set the output. """
-        util.dict_set_path(baton, output_path, output)
+        util.get_path_accessor(output_path).set(baton, output)
 
     @abc.abstractmethod
     def process_mapping(self, input, input_path, output_path, baton, **additional_kwargs):
@@ -15,6 +15,7 @@ class DateTimeParser(base.InputOutputProcessor):
     """
     interface.classProvides(processing.IProcessor)
     name = 'parse-datetime'
+    reads_only_input = True
 
     def __init__(self, format_string, as_date=False, **kw):
         super(DateTimeParser, self).__init__(**kw)
@@ -32,6 +33,7 @@ class DateFormatter(base.InputOutputProcessor):
     """ Formats a date according to a format. """
     interface.classProvides(processing.IProcessor)
     name = 'format-date'
+    reads_only_input = True
 
     def __init__(self, format_string, **kw):
         super(DateFormatter, self).__init__(**kw)
@@ -54,14 +54,27 @@ class FileAppender(base.Processor):
         self.formatter = util.create_lambda_function(self.formatter_definition, self=self, **self.namespace)
 
     def process(self, baton):
-        input = util.dict_get_path(baton, self.input_path)
-        if input:
-            output = self.format % self.formatter(input)
-            if self.encode:
-                output = output.encode(self.encode)
+        output = self._get_output(baton)
+        if output:
             self.file.write(output)
         return baton
 
+    def process_batch(self, batons):
+        """ Append the outputs of a batch of batons with a single write. """
+        outputs = [self._get_output(baton) for baton in batons]
+        self.file.write(''.join(output for output in outputs if output))
+        return batons
+
+    def _get_output(self, baton):
+        input = util.dict_get_path(baton, self.input_path)
+        if not input:
+            return None
+
+        output = self.format % self.formatter(input)
+        if self.encode:
+            output = output.encode(self.encode)
+        return output
+
 
 class LogAppender(FileAppender):
     """ Append something to a log. """
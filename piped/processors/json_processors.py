@@ -17,6 +17,7 @@ class JsonDecoder(base.InputOutputProcessor):
     The input may either be a string or a file-like object.
     """
     name = 'decode-json'
+    reads_only_input = True
     interface.classProvides(processing.IProcessor)
 
     def __init__(self, decoder='json.JSONDecoder', **kw):
@@ -33,10 +34,14 @@ class JsonDecoder(base.InputOutputProcessor):
 
         return loader(input, cls=self.json_decoder)
 
+    def process_batch(self, batons):
+        return self.process_batch_synchronously(batons)
+
 
 class JsonEncoder(base.InputOutputProcessor):
     """ Encodes JSON. """
     name = 'encode-json'
+    reads_only_input = True
     interface.classProvides(processing.IProcessor)
 
     def __init__(self, encoder='piped.util.PipedJSONEncoder', indent=None, **kw):
@@ -55,6 +60,9 @@ class JsonEncoder(base.InputOutputProcessor):
     def process_input(self, input, baton):
         return json.dumps(input, cls=self.json_encoder, indent=self.indent)
 
+    def process_batch(self, batons):
+        return self.process_batch_synchronously(batons)
+
 
 class JSONPEncoder(JsonEncoder):
     """ Encodes the input as JSON, wrapping the encoded object with
@@ -24,6 +24,13 @@ class ScatterGatherer(base.Processor):
         self.input_path_prefix = input_path_prefix
         self.output_path_prefix = output_path_prefix
 
+        self._accessors = list()
+        for mapped_attribute in mapping or list():
+            pipeline_name = mapped_attribute['pipeline']
+            input_path = input_path_prefix + mapped_attribute.get('input_path', '')
+            output_path = output_path_prefix + mapped_attribute.get('output_path', pipeline_name)
+            self._accessors.append((pipeline_name, util.get_path_accessor(input_path), util.get_path_accessor(output_path)))
+
     def configure(self, runtime_environment):
         super(ScatterGatherer, self).configure(runtime_environment)
         self.runtime_environment = runtime_environment
@@ -50,20 +57,17 @@ class ScatterGatherer(base.Processor):
         # result in the supplied attribute.
 
         ds = []
-        for mapped_attribute in self.mapping:
-            input_path = self.input_path_prefix + mapped_attribute.get('input_path', '')
-            input_baton = util.dict_get_path(baton, input_path, Ellipsis)
+        for pipeline_name, input_accessor, output_accessor in self._accessors:
+            input_baton = input_accessor.get(baton, Ellipsis)
             if input_baton is Ellipsis:
                 continue
 
-            pipeline_name = mapped_attribute['pipeline']
-            output_path = self.output_path_prefix + mapped_attribute.get('output_path', pipeline_name)
             pipeline = self.get_pipeline(pipeline_name)
 
             input_baton = self.preprocess_baton(self._maybe_copy(input_baton))
 
             d = defer.maybeDeferred(pipeline, input_baton)
-            d.addCallback(lambda _, resulting_baton=input_baton, output_path=output_path: util.dict_set_path(baton, output_path, resulting_baton))
+            d.addCallback(lambda _, resulting_baton=input_baton, set_output=output_accessor.set: set_output(baton, resulting_baton))
 
             ds.append(d)
 
@@ -80,7 +84,7 @@ class ScatterGatherer(base.Processor):
 
     def _maybe_copy(self, baton):
         if self.copy:
-            return baton.copy()
+            return util.copy_on_write(baton)
         return baton
 
     def preprocess_baton(self, baton):
@@ -101,7 +105,7 @@ class PipelineRunner(base.InputOutputProcessor):
     interface.classProvides(processing.IProcessor)
     name = 'run-pipeline'
 
-    def __init__(self, pipeline=Ellipsis, pipeline_path=Ellipsis, only_last_result=True, trace_path=None, *a, **kw):
+    def __init__(self, pipeline=Ellipsis, pipeline_path=Ellipsis, only_last_result=True, trace_path=None, trace_snapshots=False, trace_max_value_size=None, *a, **kw):
         """
         :param pipeline: The name of the pipeline to process the baton in. A name
             may either be absolute or relative. Relative names start with a ``.``,
@@ -116,7 +120,12 @@ class PipelineRunner(base.InputOutputProcessor):
             be a `list`, and this option discards any output from any baton except
             the last.
         :param trace_path: Path to store tracing results to. Cannot be an empty string.
-            Defaults to ``None``, which means no tracing.
+            Defaults to ``None``, which means no tracing. If the baton is already being
+            traced, the entries of this trace are also added to the outer trace.
+        :param trace_snapshots: Whether the trace should contain snapshots of the batons
+            instead of copies. Snapshots are a lot cheaper for large batons. See
+            :class:`piped.util.BatonSnapshotter`.
+        :param trace_max_value_size: The maximum length of strings in the snapshots.
         """
         super(PipelineRunner, self).__init__(*a, **kw)
 
@@ -125,6 +134,8 @@ class PipelineRunner(base.InputOutputProcessor):
         self.only_last_result = only_last_result
 
         self.trace_path = trace_path
+        self.trace_snapshots = trace_snapshots
+        self.trace_max_value_size = trace_max_value_size
 
         self._fail_if_trace_path_is_invalid(trace_path)
         self._fail_if_pipeline_is_invalid()
@@ -199,7 +210,7 @@ class PipelineRunner(base.InputOutputProcessor):
     @defer.inlineCallbacks
     def process_input_using_pipeline(self, input, baton, pipeline):
         if self.trace_path:
-            results, trace = yield pipeline.traced_process(input)
+            results, trace = yield pipeline.traced_process(input, snapshots=self.trace_snapshots, max_value_size=self.trace_max_value_size)
             util.dict_set_path(baton, self.trace_path, trace)
         else:
             results = yield pipeline(input)
@@ -256,9 +267,19 @@ class PipelineDiagrammer(base.Processor):
     interface.classProvides(processing.IProcessor)
     name = 'diagram-pipelines'
 
-    def __init__(self, output_path='dot', **kw):
+    def __init__(self, output_path='dot', color_by='mean', **kw):
+        """
+        :param output_path: The path to save the dot graph to.
+        :param color_by: What to color the processors by. See
+            :meth:`piped.processing.ProcessorGraph.get_dot`.
+        """
         super(PipelineDiagrammer, self).__init__(**kw)
         self.output_path = output_path
+        self.color_by = color_by
+
+        if color_by != 'mean':
+            # fail early if the percentile is invalid
+            processing.ProcessorGraph._get_percent(color_by)
 
     def configure(self, runtime_environment):
         dm = runtime_environment.dependency_manager
@@ -270,7 +291,7 @@ class PipelineDiagrammer(base.Processor):
 
         subgraphs = []
         for pipeline_name, pipeline in pipeline_provider.pipeline_by_name.items():
-            dot = pipeline.processor_graph.get_dot()
+            dot = pipeline.processor_graph.get_dot(color_by=self.color_by)
             dot = dot.replace('digraph G {', 'subgraph "cluster%s" { label="%s"; ' % (pipeline_name, pipeline_name))
             subgraphs.append(dot)
 
@@ -297,6 +318,35 @@ class DependencyDiagrammer(base.Processor):
         return baton
 
 
+class PipelineReloader(base.Processor):
+    """ Rebuilds the pipelines that have changed in the configuration.
+
+    See :meth:`piped.providers.pipeline_provider.PipelineProvider.reload`. This
+    processor may be used to reload the pipelines from a web endpoint, for example.
+    """
+    interface.classProvides(processing.IProcessor)
+    name = 'reload-pipelines'
+
+    def __init__(self, output_path='reloaded', **kw):
+        """
+        :param output_path: The path to store the names of the ``reloaded``, ``added``
+            and ``removed`` pipelines at.
+        """
+        super(PipelineReloader, self).__init__(**kw)
+        self.output_path = output_path
+
+    def configure(self, runtime_environment):
+        dm = runtime_environment.dependency_manager
+        self.pipeline_provider_dependency = dm.add_dependency(self, dict(provider='pipeline_provider'))
+
+    @defer.inlineCallbacks
+    def process(self, baton):
+        pipeline_provider = yield self.pipeline_provider_dependency.wait_for_resource()
+        reloaded = yield pipeline_provider.reload()
+        util.dict_set_path(baton, self.output_path, reloaded)
+        defer.returnValue(baton)
+
+
 class ForEach(base.InputOutputProcessor):
     """ ForEach is an In/Out-processor that invokes a pipeline for
     every item in its input.
@@ -304,6 +354,11 @@ class ForEach(base.InputOutputProcessor):
     If the input is a dict, the processor will iterate over the values and
     the output will also be a dict where the values are the results from the
     processing.
+
+    If *copy* is true, items that are dicts are given to the pipeline as
+    :class:`~piped.util.CopyOnWriteDict`\s, so the pipeline does not change
+    the input through the dict methods. See the class for the ways a copy may
+    still share nested dicts with the input.
     """
     interface.classProvides(processing.IProcessor)
     name = 'for-each'
@@ -311,7 +366,7 @@ class ForEach(base.InputOutputProcessor):
     def __init__(self, pipeline, chunk_size=None,
                  namespace=None, result_processor='results: results[-1]',
                  parallel=False, done_on_first=False, fail_on_error=False,
-                 **kw):
+                 copy=False, **kw):
         """
         :param pipeline: The pipeline to process the items in.
         :param chunk_size: If specified, the input-iterable is chunked. E.g
@@ -329,11 +384,14 @@ class ForEach(base.InputOutputProcessor):
         :param done_on_first: If true, then the result of the pipeline that
             completes first is returned. The results/failures of the other
             pipelines are dropped, unless they all fail. In that case, an
-            `exceptions.AllPipelinesFailedError` is raised.
+            `exceptions.AllPipelinesFailedError` is raised. When processing
+            in parallel, the processing of the other items is cancelled.
         :param fail_on_error: If true, then any failure in the processing
             will cause the result to be that failure. If it is false, which is
             the default, then the errors are represented as failure-instances
             in the output.
+        :param copy: If true, items that are dicts are copied on write before
+            they are processed. Defaults to false.
         """
         super(ForEach, self).__init__(**kw)
         self.pipeline_name = pipeline
@@ -342,6 +400,7 @@ class ForEach(base.InputOutputProcessor):
         self.result_processor_definition = result_processor
         self.fail_on_error = fail_on_error
         self.done_on_first = done_on_first
+        self.copy = copy
 
         self.parallel = parallel
         if parallel:
@@ -361,13 +420,18 @@ class ForEach(base.InputOutputProcessor):
         if isinstance(input, dict):
             keys = input.keys()
             values = input.values()
-            new_values = yield self._process_iterable(values)
+            new_values = yield self._process_iterable(self._maybe_copy_items(values))
             result = dict(zip(keys, new_values))
         else:
-            result = yield self._process_iterable(input)
+            result = yield self._process_iterable(self._maybe_copy_items(input))
 
         defer.returnValue(result)
 
+    def _maybe_copy_items(self, input):
+        if not self.copy:
+            return input
+        return (util.CopyOnWriteDict(item) if isinstance(item, dict) else item for item in input)
+
     @defer.inlineCallbacks
     def _process_serially(self, input):
         results = list()
@@ -398,12 +462,20 @@ class ForEach(base.InputOutputProcessor):
 
     @defer.inlineCallbacks
     def _process_in_parallel(self, input):
+        scope = None
+        if self.done_on_first or self.fail_on_error:
+            # we may be done before all the items are processed, so process them in a child
+            # scope of the current evaluation, which lets us cancel the remaining items.
+            scope = util.CancellationScope(parent=processing.get_current_scope())
         pipeline = yield self.pipeline_dependency.wait_for_resource()
         ds = list()
 
         # Prepare running all pipelines in parallel.
         for sub_baton in input:
-            d = defer.maybeDeferred(pipeline, sub_baton)
+            if scope is None:
+                d = defer.maybeDeferred(pipeline, sub_baton)
+            else:
+                d = defer.maybeDeferred(processing.call_in_scope, scope, pipeline, sub_baton)
             # ... the result must be processed as usual.
             d.addCallback(lambda result: self.result_processor(result))
             ds.append(d)
@@ -414,6 +486,11 @@ class ForEach(base.InputOutputProcessor):
                                               fireOnOneErrback=self.fail_on_error, consumeErrors=True)
         except defer.FirstError, e:
             e.subFailure.raiseException()
+        finally:
+            if scope is not None:
+                # stop processing the items whose results are no longer needed.
+                scope.cancel()
+                scope.close()
 
         # Unpack the results.
         if isinstance(result, list):
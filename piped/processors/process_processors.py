@@ -14,6 +14,7 @@ from piped.processors import base
 class RenderDot(base.InputOutputProcessor):
     """ Renders a dot graph. """
     name = 'render-dot'
+    reads_only_input = True
     interface.classProvides(processing.IProcessor)
 
     def __init__(self, type='png', **kw):
@@ -69,6 +70,7 @@ class IOStatParser(base.InputOutputProcessor):
     """
     interface.classProvides(processing.IProcessor)
     name = 'parse-iostat-output'
+    reads_only_input = True
 
     default_format = [
         ('disk0', ('KB/t', 'tps', 'MB/s'))
@@ -74,3 +74,13 @@ class TestFileAppender(unittest.TestCase):
 
         expected_lines = ['¡foo! bar\n', '123 42\n']
         self.assertLinesEqual(fake_file, expected_lines)
+
+    def test_appending_a_batch(self):
+        fake_file, fake_file_path = self.make_fake_file_and_path()
+
+        processor = file_processors.FileAppender(fake_file_path, input_path='input')
+        processor.configure(self.runtime_environment)
+        batons = [dict(input='foo'), dict(), dict(input=u'æøå')]
+        self.assertEquals(processor.process_batch(batons), batons)
+
+        self.assertLinesEqual(fake_file, ['foo\n', 'æøå\n'])
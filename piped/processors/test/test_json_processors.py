@@ -40,6 +40,11 @@ class JsonDecoderTest(unittest.TestCase):
         baton = yield processor.process(StringIO.StringIO(json.dumps(dict(foo=42))))
         self.assertEquals(baton, dict(foo=42))
 
+    def test_decoding_a_batch(self):
+        processor = json_processors.JsonDecoder(input_path='json', output_path='decoded')
+        batons = processor.process_batch([dict(json='[1]'), dict(), dict(json='{"foo": 42}')])
+        self.assertEquals(batons, [dict(json='[1]', decoded=[1]), dict(), dict(json='{"foo": 42}', decoded=dict(foo=42))])
+
     @defer.inlineCallbacks
     def test_custom_decoder(self):
         processor = json_processors.JsonDecoder(decoder=reflect.fullyQualifiedName(StubDecoder))
@@ -56,6 +61,10 @@ class JsonEncoderTest(unittest.TestCase):
         baton = yield processor.process(dict(foo=42))
         self.assertEquals(baton, expected_result)
 
+    def test_encoding_a_batch(self):
+        processor = json_processors.JsonEncoder()
+        self.assertEquals(processor.process_batch([dict(foo=42), [1]]), [json.dumps(dict(foo=42)), '[1]'])
+
     @defer.inlineCallbacks
     def test_encoding_with_custom_encoder(self):
         processor = json_processors.JsonEncoder(encoder=reflect.fullyQualifiedName(StubEncoder))
@@ -98,4 +107,4 @@ class JSONPEncoderTest(unittest.TestCase):
     def test_encoding_with_no_callback_fails_when_it_should(self):
         expected_result = json.dumps(dict(foo=42))
         processor = json_processors.JSONPEncoder(input_path='to_encode', fallback_to_json=False)
-        return self.assertFailure(processor.process(dict(to_encode=dict(foo=42))), ValueError)
+        return self.assertFailure(defer.maybeDeferred(processor.process, dict(to_encode=dict(foo=42))), ValueError)
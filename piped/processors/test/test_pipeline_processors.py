@@ -216,6 +216,29 @@ class PipelineRunnerTest(unittest.TestCase):
         self.assertEquals(len(results[0]['trace']), 2)
         self.assertEquals(dm.get_dependencies_of(pipeline[0]), [pipeline[0].pipeline_dependency])
 
+    @defer.inlineCallbacks
+    def test_static_with_snapshot_tracing(self):
+        cm = self.runtime_environment.configuration_manager
+        cm.set('pipelines.test', [{'run-pipeline':dict(pipeline='foo', trace_path='trace', trace_snapshots=True, trace_max_value_size=3)}])
+        cm.set('pipelines.foo', [{'set-value':dict(path='foo', value='a long value')}])
+
+        pp = pipeline_provider.PipelineProvider()
+        pp.configure(self.runtime_environment)
+
+        dm = self.runtime_environment.dependency_manager
+        test_pipeline = dm.add_dependency(self, dict(provider='pipeline.test'))
+        dm.resolve_initial_states()
+
+        pipeline = test_pipeline.get_resource()
+
+        results = yield pipeline(dict())
+
+        self.assertEquals(results[0]['foo'], 'a long value')
+        trace = results[0]['trace']
+        self.assertEquals(len(trace), 2)
+        self.assertEquals(trace[0]['baton'].rebuild(), dict())
+        self.assertEquals(trace[1]['baton'].rebuild(), dict(foo='a l... (9 characters truncated)'))
+
     @defer.inlineCallbacks
     def test_dynamic_with_tracing(self):
         cm = self.runtime_environment.configuration_manager
@@ -514,6 +537,9 @@ class TestForEach(unittest.TestCase):
         yield d
 
         self.assertEqual(baton, dict(iterable=range(3), results='fake result'))
+        # The processing of the other items should have been cancelled.
+        self.assertTrue(deferreds[0].called)
+        self.assertTrue(deferreds[2].called)
 
     @defer.inlineCallbacks
     def test_succeeding_when_the_first_one_is_done_serially(self):
@@ -674,4 +700,50 @@ class TestForEach(unittest.TestCase):
         yield processor.process(baton)
 
         # the pipeline should only be invoked with the values, but the output should still be a dict
-        self.assertEqual(baton, dict(iterable=dict(foo='bar', bar='baz'), results=dict(foo=42, bar=93)))
\ No newline at end of file
+        self.assertEqual(baton, dict(iterable=dict(foo='bar', bar='baz'), results=dict(foo=42, bar=93)))
+
+    def test_dict_items_are_copied_on_write(self):
+        class ChangingPipeline(FakePipeline):
+            def __call__(self, baton):
+                baton['nested']['value'] += 1
+                return [baton]
+
+        pipeline_resource = dependencies.InstanceDependency(ChangingPipeline())
+        pipeline_resource.is_ready = True
+
+        for copy, expected_original in (True, 1), (False, 2):
+            processor = self.make_and_configure_processor(copy=copy)
+            processor.pipeline_dependency = pipeline_resource
+
+            baton = dict(iterable=[dict(nested=dict(value=1))])
+            processor.process(baton)
+
+            self.assertEqual(baton['results'], [dict(nested=dict(value=2))])
+            self.assertEqual(baton['iterable'][0]['nested']['value'], expected_original)
+
+class TestPipelineReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+
+    @defer.inlineCallbacks
+    def test_reloading_pipelines(self):
+        configuration_manager = self.runtime_environment.configuration_manager
+        configuration_manager.set('pipelines.reload', ['reload-pipelines'])
+        configuration_manager.set('pipelines.changed', [{'set-value': dict(path='value', value=1)}])
+
+        provider = pipeline_provider.PipelineProvider()
+        provider.configure(self.runtime_environment)
+
+        dependency_manager = self.runtime_environment.dependency_manager
+        reload_dependency = dependency_manager.add_dependency(self, dict(provider='pipeline.reload'))
+        changed_dependency = dependency_manager.add_dependency(self, dict(provider='pipeline.changed'))
+        dependency_manager.resolve_initial_states()
+
+        configuration_manager.set('pipelines.changed', [{'set-value': dict(path='value', value=2)}])
+        results = yield reload_dependency.get_resource()(dict())
+        self.assertEquals(results, [dict(reloaded=dict(reloaded=['changed'], added=[], removed=[]))])
+
+        results = yield changed_dependency.get_resource()(dict())
+        self.assertEquals(results, [dict(value=2)])
@@ -143,6 +143,15 @@ class TestRemapProcessor(unittest.TestCase):
         result = yield util_processors.RemapProcessor(mapping=mapping).process(baton)
         self.assertEquals(result, expected_result)
 
+    @defer.inlineCallbacks
+    def test_copying(self):
+        baton = dict(a=dict(b=dict(c='d')))
+        result = yield util_processors.RemapProcessor(mapping=dict(a='e'), copy=True).process(baton)
+
+        self.assertIsInstance(result['e'], util.CopyOnWriteDict)
+        result['e']['b']['c'] = 'f'
+        self.assertEquals(result['a'], dict(b=dict(c='d')))
+
 
 class TestBatonCollector(unittest.TestCase):
 
@@ -215,7 +215,7 @@ class RenderTrace(base.InputOutputProcessor):
         for trace_step in trace:
             steps.append(
                 dict(
-                    baton = trace_step['baton'],
+                    baton = self._get_baton(trace_step),
                     failure = trace_step.get('failure'),
                     source = id(trace_step['source']),
                     destination = id(trace_step['destination']),
@@ -238,4 +238,11 @@ class RenderTrace(base.InputOutputProcessor):
         trace_template = open(self.template).read()
         html = trace_template % variables
 
-        defer.returnValue(html)
\ No newline at end of file
+        defer.returnValue(html)
+
+    def _get_baton(self, trace_step):
+        baton = trace_step['baton']
+        if isinstance(baton, util.BatonSnapshot):
+            # traces may contain snapshots, which we rebuild before rendering.
+            return baton.rebuild()
+        return baton
\ No newline at end of file
@@ -143,6 +143,9 @@ class RemapProcessor(base.MappingProcessor):
     For example, giving the mapping `{'b.c': 'a'}` and the baton
     `dict(b=dict(c='d'))`, the output will be
     `dict(a='d', b=dict(c='d'))`.
+
+    If *copy* is true, dicts are copied with a :class:`~piped.util.CopyOnWriteDict`,
+    which shares the nested dicts with the original until they are changed.
     """
     name = 'remap'
     interface.classProvides(processing.IProcessor)
@@ -153,13 +156,20 @@ class RemapProcessor(base.MappingProcessor):
         self.copy = copy
         self.deep_copy = deep_copy
 
+    @property
+    def instance_reads(self):
+        paths = [map_entry['input_path'] for map_entry in self.mapping]
+        if self.extend:
+            paths.extend(map_entry['output_path'] for map_entry in self.mapping if map_entry['output_path'])
+        return paths
+
     def process_mapping(self, input, input_path, output_path, baton, **additional_kwargs):
         output = input
 
         if self.deep_copy:
             output = copy.deepcopy(output)
         elif self.copy:
-            output = copy.copy(output)
+            output = util.copy_on_write(output)
 
         if self.extend:
             output = util.dict_get_path(baton, output_path, list()) + [output]
@@ -188,6 +198,10 @@ class BatonCleaner(base.Processor):
 
         assert self.keep or self.remove, "Useless configuration -- nothing to remove or keep"
 
+    @property
+    def instance_reads(self):
+        return list(self.keep)
+
     def process(self, baton):
         for path in self.remove:
             util.dict_remove_path(baton, path)
@@ -328,6 +342,7 @@ class FlattenDictionaryList(base.InputOutputProcessor):
 
     interface.classProvides(processing.IProcessor)
     name = 'flatten-list-of-dictionaries'
+    reads_only_input = True
 
     def __init__(self, key_path, uniquify=False, sort=True, **kw):
         super(FlattenDictionaryList, self).__init__(**kw)
@@ -372,6 +387,7 @@ class LambdaProcessor(base.InputOutputProcessor):
     """
     interface.classProvides(processing.IProcessor)
     name = 'eval-lambda'
+    reads_only_input = True
 
     def __init__(self, namespace=None, dependencies=None, **kw):
         if not 'lambda' in kw:
@@ -526,6 +542,10 @@ class Passthrough(base.Processor):
     interface.classProvides(processing.IProcessor)
     name = 'passthrough'
 
+    @property
+    def instance_reads(self):
+        return list()
+
     def process(self, baton):
         return baton
 
@@ -677,6 +697,7 @@ class NestedListFlattener(base.Processor):
 
 class StringEncoder(base.InputOutputProcessor):
     name = 'encode-string'
+    reads_only_input = True
     interface.classProvides(processing.IProcessor)
 
     def __init__(self, encoding, **kw):
@@ -689,6 +710,7 @@ class StringEncoder(base.InputOutputProcessor):
 
 class StringDecoder(base.InputOutputProcessor):
     name = 'decode-string'
+    reads_only_input = True
     interface.classProvides(processing.IProcessor)
 
     def __init__(self, encoding, **kw):
@@ -815,6 +837,14 @@ class MappingSetter(base.Processor):
         self.mapping = mapping
         self.path_prefix = path_prefix
 
+    @property
+    def instance_provides(self):
+        return [self.path_prefix + path for path in self.mapping]
+
+    @property
+    def instance_reads(self):
+        return list()
+
     def process(self, baton):
         for path, value in self.mapping.items():
             path = self.path_prefix + path
@@ -832,6 +862,14 @@ class ValueSetter(base.Processor):
         self.path = path
         self.value = value
 
+    @property
+    def instance_provides(self):
+        return [self.path]
+
+    @property
+    def instance_reads(self):
+        return list()
+
     def process(self, baton):
         util.dict_set_path(baton, self.path, self.value)
         return baton
@@ -279,7 +279,9 @@ class ClientGetPage(base.Processor):
         :param method: The HTTP method to use in the request.
         :param headers: Dict of headers.
         :param agent: Client agent string.
-        :param timeout: Set a max
+        :param timeout: The maximum number of seconds to wait for the page. If the baton is processed
+            with a deadline, the remaining time until the deadline is used if it is shorter.
+            See :func:`piped.processing.call_in_scope`.
         :param cookies: Dict of cookies
         :param follow_redirect: Whether to follow redirects.
         :param redirect_limit: The maximum number of HTTP redirects that can occur before it is assumed that the redirection is endless
@@ -308,8 +310,16 @@ class ClientGetPage(base.Processor):
 
         self.output_path = output_path
 
+    @property
+    def instance_provides(self):
+        if self.output_path:
+            return [self.output_path]
+        return list()
+
     @defer.inlineCallbacks
     def process(self, baton):
+        # the scope is only available until we wait for something
+        scope = processing.get_current_scope()
         kwargs = self.kwargs.copy()
 
         for key, value in kwargs.items():
@@ -325,12 +335,24 @@ class ClientGetPage(base.Processor):
         # prepend the base url and ensure flatten the url argument in case the url argument is a list (i.e !path request.postpath)
         base_url = self.get_input(baton, self.base_url) or ''
         kwargs['url'] = base_url + self._flatten(kwargs['url'])
+        kwargs['timeout'] = self._get_timeout(kwargs['timeout'], scope)
 
         response = yield client.getPage(**kwargs)
 
         baton = self.get_resulting_baton(baton, self.output_path, response)
         defer.returnValue(baton)
 
+    def _get_timeout(self, timeout, scope):
+        if scope is None or scope.remaining is None:
+            return timeout
+
+        scope.raise_if_cancelled()
+        # a timeout of 0 means no timeout, so always leave a little time for the request.
+        remaining = max(scope.remaining, 0.001)
+        if not timeout:
+            return remaining
+        return min(timeout, remaining)
+
     def _flatten(self, string_or_list, separator='/'):
         if isinstance(string_or_list, list):
             return separator.join(string_or_list)
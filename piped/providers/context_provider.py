@@ -37,6 +37,7 @@ class ContextProvider(object):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['contexts']
     contexts = dict()
 
     def configure(self, runtime_environment):
@@ -81,6 +82,7 @@ class PersistedContextProvider(object):
     parsed, the data in `initial_data` is provided instead.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['persisted_contexts']
     persisted_contexts = dict()
 
     def __init__(self):
@@ -1,8 +1,16 @@
 # Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import logging
+import signal
+
+from twisted.internet import defer, reactor
+from twisted.python import failure
 from zope import interface
 
-from piped import exceptions, processing, resource
+from piped import exceptions, metrics, processing, resource
+
+
+logger = logging.getLogger(__name__)
 
 
 class PipelineProvider(object):
@@ -21,12 +29,30 @@ class PipelineProvider(object):
 
     The above pipelines would be made available as ``pipeline.my_pipeline`` and
     ``pipeline.another.nested-pipeline``.
+
+    The latencies and counters of the pipelines are available as ``pipeline_stats``,
+    which is a :class:`PipelineStatsResource`.
+
+    The pipelines that have changed in the configuration may be rebuilt without
+    restarting the process with :meth:`reload`, which may also be triggered by a
+    signal::
+
+        pipeline_reload:
+            signal: SIGHUP # optional, the pipelines are not reloaded on signals by default
+            timeout: 60 # seconds to wait for the dependencies of the new pipelines
     """
     interface.classProvides(resource.IResourceProvider)
 
     def __init__(self):
         self.pipeline_by_name = dict()
         self.processor_graph_factory = processing.ProcessorGraphFactory()
+        self.stats = PipelineStatsResource(self)
+
+        # the resource dependencies that have been given a pipeline, by pipeline name
+        self._consumers_by_pipeline_name = dict()
+        # the pipeline dependency and the handlers that pass its events on to a consumer, by consumer
+        self._handlers_by_consumer = dict()
+        self._reload_lock = defer.DeferredLock()
 
     def configure(self, runtime_environment):
         self.runtime_environment = runtime_environment
@@ -41,6 +67,30 @@ class PipelineProvider(object):
             resource_manager.register('pipeline.%s' % pipeline_name, provider=self)
 
         resource_manager.register('pipeline_provider', provider=self)
+        resource_manager.register('pipeline_stats', provider=self)
+
+        self.reload_configuration = runtime_environment.get_configuration_value('pipeline_reload', dict())
+        self._install_reload_signal_handler(self.reload_configuration.get('signal'))
+
+    def _install_reload_signal_handler(self, signal_name):
+        if not signal_name:
+            return
+
+        signal_number = getattr(signal, str(signal_name), None)
+        if not isinstance(signal_number, int) or not signal_name.startswith('SIG'):
+            e_msg = 'invalid pipeline reload signal: %r' % signal_name
+            detail = 'The signal must be the name of a signal in the signal module.'
+            hint = 'For example, use "SIGHUP" or "SIGUSR2".'
+            raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+        # signal handlers may be called at any point in the main thread, so the reload is
+        # started by the reactor.
+        signal.signal(signal_number, lambda signal_number, frame: reactor.callFromThread(self._reload_and_log))
+
+    def _reload_and_log(self):
+        d = self.reload()
+        d.addErrback(lambda reason: logger.error('Could not reload the pipelines.', exc_info=(reason.type, reason.value, reason.tb)))
+        return d
 
     def __getitem__(self, item):
         # TODO: This should dissapear. Tests currently depend on it, though.
@@ -52,25 +102,181 @@ class PipelineProvider(object):
 
     def _get_or_create_pipeline(self, pipeline_name):
         if not pipeline_name in self.pipeline_by_name:
-            pipeline = self.processor_graph_factory.make_evaluator(pipeline_name)
+            with metrics.startup_phase('create pipeline: %s' % pipeline_name):
+                self.pipeline_by_name[pipeline_name] = self._create_pipeline(pipeline_name)
+
+        return self.pipeline_by_name[pipeline_name]
 
-            # Configure the processors and give them a chance to request their own dependencies.
-            pipeline.configure_processors(self.runtime_environment)
+    def _create_pipeline(self, pipeline_name):
+        pipeline = self.processor_graph_factory.make_evaluator(pipeline_name)
 
-            # Make the pipeline depend on all its processors. This enables
-            # the processor's to depend on resources as well.
-            for i, processor in enumerate(pipeline):
-                self.dependency_manager.add_dependency(pipeline, processor)
+        # Configure the processors and give them a chance to request their own dependencies.
+        pipeline.configure_processors(self.runtime_environment)
 
-            self.pipeline_by_name[pipeline_name] = pipeline
+        # Make the pipeline depend on all its processors. This enables
+        # the processor's to depend on resources as well.
+        for i, processor in enumerate(pipeline):
+            self.dependency_manager.add_dependency(pipeline, processor)
 
-        return self.pipeline_by_name[pipeline_name]
+        return pipeline
+
+    def reload(self):
+        """ Rebuild the pipelines whose definitions have changed in the configuration.
+
+        If the configuration was loaded from files, the files are loaded again. Only
+        pipelines that have been created are rebuilt, including the pipelines that
+        inlined a changed pipeline when they were optimized. Once the new pipelines
+        and their dependencies are ready, they replace the old pipelines in one
+        step, and every consumer of an old pipeline is given the new pipeline
+        without becoming lost. Batons that are being processed by an old pipeline
+        finish in the old pipeline.
+
+        If the configuration or the new pipelines fail, the old pipelines and the
+        old configuration are kept, and the new pipelines are discarded. Pipelines
+        that are removed from the configuration are kept as well, as their
+        consumers may still use them.
+
+        :return: A Deferred that callbacks with a dict of the names of the pipelines
+            that were ``reloaded``, ``added`` and ``removed``.
+        """
+        return self._reload_lock.run(self._reload)
+
+    @defer.inlineCallbacks
+    def _reload(self):
+        configuration_manager = self.runtime_environment.configuration_manager
+        # what the reload changes, so it can be rolled back if it fails
+        previous = dict(
+            configuration = configuration_manager.get_state(),
+            processor_graph_factory = self.processor_graph_factory,
+            pipeline_by_name = dict(self.pipeline_by_name),
+            consumers_by_pipeline_name = dict((name, list(consumers)) for name, consumers in self._consumers_by_pipeline_name.items()),
+        )
+        registered = list()
+        new_pipeline_by_name = dict()
+
+        try:
+            if configuration_manager.loaded_files:
+                configuration_manager.reload()
+
+            processor_graph_factory = processing.ProcessorGraphFactory()
+            processor_graph_factory.configure(self.runtime_environment)
+
+            old_definitions = self.processor_graph_factory.pipelines_configuration
+            new_definitions = processor_graph_factory.pipelines_configuration
+
+            changed = set(name for name in new_definitions if name in old_definitions and new_definitions[name] != old_definitions[name])
+            added = sorted(set(new_definitions) - set(old_definitions))
+            removed = sorted(set(old_definitions) - set(new_definitions))
+            reloaded = sorted(name for name, pipeline in self.pipeline_by_name.items()
+                              if name in changed or self._has_inlined_any(pipeline, changed))
+
+            # the processors of the new pipelines may depend on pipelines that have not been
+            # created yet, which should be created from the new definitions.
+            self.processor_graph_factory = processor_graph_factory
+            for name in added:
+                self.runtime_environment.resource_manager.register('pipeline.%s' % name, provider=self)
+                registered.append(name)
+
+            for name in reloaded:
+                new_pipeline_by_name[name] = self._create_pipeline(name)
+
+            self.dependency_manager.resolve_initial_states()
+            timeout = self.reload_configuration.get('timeout', 60)
+            d = defer.gatherResults([self.dependency_manager.as_dependency(pipeline).wait_for_resource(timeout)
+                                     for pipeline in new_pipeline_by_name.values()], consumeErrors=True)
+            yield d.addErrback(lambda reason: reason.value.subFailure)
+        except:
+            reason = failure.Failure()
+            self._roll_back_reload(previous, registered, new_pipeline_by_name.values())
+            reason.raiseException()
+
+        for name, pipeline in new_pipeline_by_name.items():
+            self._replace_pipeline(name, pipeline)
+
+        for name in removed:
+            logger.warn('Pipeline %r was removed from the configuration, but is kept until piped is restarted.' % name)
+        logger.info('Reloaded pipelines: %s.' % (', '.join(reloaded) or 'none'))
+
+        defer.returnValue(dict(reloaded=reloaded, added=added, removed=removed))
+
+    def _roll_back_reload(self, previous, registered, new_pipelines):
+        self.runtime_environment.configuration_manager.restore_state(previous['configuration'])
+        self.processor_graph_factory = previous['processor_graph_factory']
+
+        for name in registered:
+            self.runtime_environment.resource_manager.unregister('pipeline.%s' % name)
+
+        # the processors of the new pipelines may have become consumers of pipelines
+        for name, consumers in self._consumers_by_pipeline_name.items():
+            previous_consumers = previous['consumers_by_pipeline_name'].get(name, list())
+            for resource_dependency in consumers:
+                if resource_dependency not in previous_consumers:
+                    self._remove_consumer(resource_dependency)
+        self._consumers_by_pipeline_name = previous['consumers_by_pipeline_name']
+
+        # and the pipelines they depended on may have been created from the new definitions
+        new_pipelines = list(new_pipelines)
+        new_pipelines.extend(pipeline for name, pipeline in self.pipeline_by_name.items() if name not in previous['pipeline_by_name'])
+        self.pipeline_by_name = previous['pipeline_by_name']
+
+        for pipeline in new_pipelines:
+            self._detach_pipeline(pipeline)
+
+    def _remove_consumer(self, resource_dependency):
+        pipeline_dependency, on_ready, on_lost = self._handlers_by_consumer.pop(resource_dependency)
+        pipeline_dependency.on_ready -= on_ready
+        pipeline_dependency.on_lost -= on_lost
+        self.dependency_manager.remove_dependency(resource_dependency, pipeline_dependency)
+
+    def _has_inlined_any(self, pipeline, pipeline_names):
+        for optimization in pipeline.processor_graph.optimizations:
+            if optimization['optimization'] == 'inlined' and optimization['pipeline'] in pipeline_names:
+                return True
+        return False
+
+    def _replace_pipeline(self, pipeline_name, pipeline):
+        old_pipeline = self.pipeline_by_name[pipeline_name]
+        self.pipeline_by_name[pipeline_name] = pipeline
+
+        for resource_dependency in self._consumers_by_pipeline_name.get(pipeline_name, list()):
+            old_pipeline_dependency, on_ready, on_lost = self._handlers_by_consumer[resource_dependency]
+            old_pipeline_dependency.on_ready -= on_ready
+            old_pipeline_dependency.on_lost -= on_lost
+
+            # the new pipeline is ready, so the consumer is given it without becoming lost.
+            self._provide_pipeline(resource_dependency, pipeline)
+            self.dependency_manager.remove_dependency(resource_dependency, old_pipeline_dependency)
+
+        self._detach_pipeline(old_pipeline)
+
+    def _detach_pipeline(self, pipeline):
+        # detach the pipeline from the dependency graph, so it may be garbage collected
+        # once its batons have finished.
+        for processor in pipeline:
+            self.dependency_manager.remove_dependency(pipeline, processor)
+        self.dependency_manager.discard_dependency(pipeline)
+        self._stop_when_idle(pipeline)
+
+    def _stop_when_idle(self, pipeline, interval=1):
+        # evaluators that have resources of their own, such as a process pool, have to be stopped.
+        if not hasattr(pipeline, 'stop'):
+            return
+
+        if pipeline.stats.in_flight:
+            reactor.callLater(interval, self._stop_when_idle, pipeline, interval)
+            return
+
+        pipeline.stop()
 
     def add_consumer(self, resource_dependency):
         if resource_dependency.provider == 'pipeline_provider':
             resource_dependency.on_resource_ready(self)
             return
 
+        if resource_dependency.provider == 'pipeline_stats':
+            resource_dependency.on_resource_ready(self.stats)
+            return
+
         pipeline_name = resource_dependency.provider.split('.', 1)[1]
 
         # Consumers request the pipeline with a provider string. What
@@ -79,13 +285,19 @@ class PipelineProvider(object):
 
         pipeline = self._get_or_create_pipeline(pipeline_name)
 
+        # remember the consumer, so it can be given the new pipeline when the pipeline is reloaded
+        self._consumers_by_pipeline_name.setdefault(pipeline_name, list()).append(resource_dependency)
+        self._provide_pipeline(resource_dependency, pipeline)
+
+    def _provide_pipeline(self, resource_dependency, pipeline):
         pipeline_dependency = self.dependency_manager.as_dependency(pipeline)
 
         # Give the resource_dependency the actual pipeline resource
-        resource = pipeline
-
-        pipeline_dependency.on_ready += lambda dependency: resource_dependency.on_resource_ready(resource)
-        pipeline_dependency.on_lost += lambda dependency, reason: resource_dependency.on_resource_lost(reason)
+        on_ready = lambda dependency: resource_dependency.on_resource_ready(pipeline)
+        on_lost = lambda dependency, reason: resource_dependency.on_resource_lost(reason)
+        pipeline_dependency.on_ready += on_ready
+        pipeline_dependency.on_lost += on_lost
+        self._handlers_by_consumer[resource_dependency] = (pipeline_dependency, on_ready, on_lost)
 
         # this isn't strictly required, but makes for an easier graph to follow
         self.dependency_manager.add_dependency(resource_dependency, pipeline_dependency)
@@ -93,4 +305,33 @@ class PipelineProvider(object):
         # if the pipeline already is ready, the on_ready will not be called later, and we give
         # the resource dependency the pipeline immediately
         if pipeline_dependency.is_ready:
-            resource_dependency.on_resource_ready(resource)
+            resource_dependency.on_resource_ready(pipeline)
+
+
+class PipelineStatsResource(object):
+    """ Read access to the :class:`~piped.metrics.PipelineStats` of the pipelines
+    that have been created by a :class:`PipelineProvider`.
+
+    Example usage from a processor or service that depends on ``pipeline_stats``::
+
+        stats = yield self.pipeline_stats_dependency.wait_for_resource()
+        stats['my_pipeline'].latency.percentile(99)
+        stats.as_dict()
+    """
+
+    def __init__(self, pipeline_provider):
+        self.pipeline_provider = pipeline_provider
+
+    def __getitem__(self, pipeline_name):
+        return self.pipeline_provider[pipeline_name].stats
+
+    def __iter__(self):
+        return iter(sorted(self.pipeline_provider.pipeline_by_name))
+
+    def items(self):
+        return [(pipeline_name, self[pipeline_name]) for pipeline_name in self]
+
+    def as_dict(self):
+        """ Returns a dict of the counters and latency summaries of every pipeline,
+        keyed by pipeline name. """
+        return dict((pipeline_name, stats.as_dict()) for pipeline_name, stats in self.items())
@@ -53,6 +53,7 @@ class ProcessProvider(object, service.Service):
     resource.ISource interface.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['processes']
 
     def __init__(self):
         self.on_start = event.Event()
@@ -65,6 +65,7 @@ class REPLProvider(object):
     Use ``exit()`` or Ctrl-D (i.e. ``EOF``) to exit the REPL.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['repl']
 
     def configure(self, runtime_environment):
         self.runtime_environment = runtime_environment
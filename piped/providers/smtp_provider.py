@@ -4,14 +4,14 @@ from email import parser
 from StringIO import StringIO
 
 from zope import interface
-from twisted.application import service, strports
+from twisted.application import service
 from twisted.cred import portal
 from twisted.python import reflect
 from twisted.internet import defer, reactor
 from twisted.mail import smtp, imap4
 from twisted.internet.interfaces import ISSLTransport
 
-from piped import resource
+from piped import prefork, resource
 from piped.processing import util
 
 
@@ -166,6 +166,7 @@ class SMTPProvider(object, service.MultiService):
         The username of the authenticated user. This key is only set if a checker was configured.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['smtp']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -379,7 +380,7 @@ class PipedSMTPServer(service.MultiService):
         self.server_factory = PipedSMTPServerFactory(self, portal=smtp_portal)
 
         for listen in self.listen:
-            server = strports.service(listen, self.server_factory)
+            server = prefork.listening_service(listen, self.server_factory)
             server.setServiceParent(self)
 
     def prepare_protocol(self, protocol):
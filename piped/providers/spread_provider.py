@@ -5,13 +5,13 @@ import random
 import weakref
 
 from zope import interface
-from twisted.application import service, strports
+from twisted.application import service
 from twisted.internet import error, defer, reactor, endpoints
 from twisted.spread import pb
 from twisted.cred import portal, credentials
 from twisted.python import reflect
 
-from piped import resource, event, exceptions, util
+from piped import resource, event, exceptions, prefork, util, processing
 
 
 logger = logging.getLogger(__name__)
@@ -42,6 +42,7 @@ class PBClientProvider(object, service.MultiService):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['pb.clients']
     name = 'spread-client-provider'
 
     def __init__(self):
@@ -113,6 +114,9 @@ class PBServerProvider(object, service.MultiService):
                     # if the default is not provided, the deferred will be errbacked.
                     default_callback: None
 
+                    # the number of seconds the processor may spend on a baton (default: null, no deadline)
+                    deadline: 30
+
                     # if a checker is specified, access to the processor will be restricted,
                     # and the baton will contain the avatar_id.
                     checker:
@@ -125,6 +129,10 @@ class PBServerProvider(object, service.MultiService):
     ``wait_for_processor`` is ``True``, incoming batons are buffered until the processor
     becomes available, otherwise the client receives an errback immediately.
 
+    If the processor is still processing the baton when the ``deadline`` passes, the
+    processing is cancelled and the client receives a
+    :exc:`~twisted.internet.defer.CancelledError`.
+
     The baton contains the following keys:
 
     message
@@ -145,6 +153,7 @@ class PBServerProvider(object, service.MultiService):
 
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['pb.servers']
     name = 'spread-server-provider'
 
     def __init__(self):
@@ -250,7 +259,7 @@ class PipedPBRealm(object):
 class PipedPBService(pb.Root, service.MultiService):
     """ A perspective broker service for Piped. """
     
-    def __init__(self, listen, processor, wait_for_processor=False, default_callback=Ellipsis, checker=None):
+    def __init__(self, listen, processor, wait_for_processor=False, default_callback=Ellipsis, checker=None, deadline=None):
         service.MultiService.__init__(self)
         
         if isinstance(listen, basestring):
@@ -260,6 +269,7 @@ class PipedPBService(pb.Root, service.MultiService):
         self.processor_config = dict(provider=processor) if isinstance(processor, basestring) else processor
         self.wait_for_processor = wait_for_processor
         self.default_callback = default_callback
+        self.deadline = deadline
 
         self.checker = checker
 
@@ -281,7 +291,7 @@ class PipedPBService(pb.Root, service.MultiService):
         self.factory = PipedPBServerFactory(root)
 
         for listen in self.listen:
-            service = strports.service(listen, self.factory)
+            service = prefork.listening_service(listen, self.factory)
             service.setServiceParent(self)
 
     @defer.inlineCallbacks
@@ -322,7 +332,11 @@ class PipedPBService(pb.Root, service.MultiService):
 
         # from here now, however, the processor is in charge of callbacking or errbacking
         # the deferred.
-        yield processor(baton)
+        scope = util.CancellationScope(self.deadline)
+        try:
+            yield processing.call_in_scope(scope, processor, baton)
+        finally:
+            scope.close()
 
         # we check if we have a result here, because we want to avoid having to monitor
         # the garbage collection of the deferred unless required.
@@ -30,6 +30,7 @@ class StdinProvider(object, service.MultiService):
     no further batons will be produced by this provider.
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['stdin']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -1,8 +1,12 @@
 # Copyright (c) 2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import signal
+
+from twisted.internet import defer
+from twisted.python import filepath
 from twisted.trial import unittest
 
-from piped import processing
+from piped import exceptions, processing, util
 from piped.providers import pipeline_provider
 
 
@@ -30,3 +34,232 @@ class PipelineProviderTest(unittest.TestCase):
         self.assertTrue(hasattr(processor, '__call__'))
         self.assertEquals(processor.__call__.im_func.func_name, 'process')
         self.assertIsInstance(processor, processing.TwistedProcessorGraphEvaluator)
+
+    @defer.inlineCallbacks
+    def test_pipeline_stats(self):
+        pp = pipeline_provider.PipelineProvider()
+        self.configuration_manager.set('pipelines.test_pipeline', ['passthrough'])
+        pp.configure(self.runtime_environment)
+
+        stats_dependency = self.dependency_manager.add_dependency(self, dict(provider='pipeline_stats'))
+        pipeline_dependency = self.dependency_manager.add_dependency(self, dict(provider='pipeline.test_pipeline'))
+
+        self.dependency_manager.resolve_initial_states()
+
+        pipeline = pipeline_dependency.get_resource()
+        yield pipeline(dict())
+
+        stats = stats_dependency.get_resource()
+        self.assertEquals(list(stats), ['test_pipeline'])
+        self.assertTrue(stats['test_pipeline'] is pipeline.stats)
+
+        summary = stats.as_dict()['test_pipeline']
+        self.assertEquals(summary['completed'], 1)
+        self.assertEquals(summary['latency']['count'], 1)
+        self.assertEquals(summary['processors'][pipeline[0].id]['count'], 1)
+
+
+class PipelineReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+        self.configuration_manager = self.runtime_environment.configuration_manager
+        self.dependency_manager = self.runtime_environment.dependency_manager
+
+        self.configuration_manager.set('pipelines.first', [{'set-value': dict(path='value', value=1)}])
+        self.configuration_manager.set('pipelines.second', [{'set-value': dict(path='value', value=2)}])
+
+        self.pipeline_provider = pipeline_provider.PipelineProvider()
+
+    def _depend_on_pipeline(self, pipeline_name):
+        dependency = self.dependency_manager.add_dependency(self, dict(provider='pipeline.%s' % pipeline_name))
+        self.dependency_manager.resolve_initial_states()
+
+        transitions = list()
+        dependency.on_ready += lambda dependency: transitions.append('ready')
+        dependency.on_lost += lambda dependency, reason: transitions.append('lost')
+        return dependency, transitions
+
+    @defer.inlineCallbacks
+    def test_reloading_changed_pipelines(self):
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, first_transitions = self._depend_on_pipeline('first')
+        second, second_transitions = self._depend_on_pipeline('second')
+        old_first, old_second = first.get_resource(), second.get_resource()
+        old_first_dependency = self.dependency_manager.as_dependency(old_first)
+
+        self.configuration_manager.set('pipelines.first', [{'set-value': dict(path='value', value=42)}])
+        reloaded = yield self.pipeline_provider.reload()
+        self.assertEquals(reloaded, dict(reloaded=['first'], added=[], removed=[]))
+
+        self.assertNotEquals(first.get_resource(), old_first)
+        self.assertTrue(self.pipeline_provider['first'] is first.get_resource())
+        self.assertTrue(second.get_resource() is old_second)
+        self.assertEquals((first_transitions, second_transitions), ([], []))
+        self.assertTrue(first.is_ready)
+
+        results = yield first.get_resource()(dict())
+        self.assertEquals(results, [dict(value=42)])
+
+        # the old pipeline is no longer part of the dependency graph
+        self.assertNotIn(old_first_dependency, self.dependency_manager._dependency_graph)
+
+        # and the consumer does not lose the new pipeline when the old pipeline is lost
+        old_first_dependency.fire_on_lost('lost')
+        self.assertEquals(first_transitions, [])
+
+    @defer.inlineCallbacks
+    def test_unchanged_pipelines_with_pipeline_wide_options_are_kept(self):
+        self.configuration_manager.set('pipelines.first', dict(concurrent_consumers=True, consumers=['passthrough']))
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, transitions = self._depend_on_pipeline('first')
+        old_first = first.get_resource()
+
+        self.configuration_manager.set('pipelines.first', dict(concurrent_consumers=True, consumers=['passthrough']))
+        reloaded = yield self.pipeline_provider.reload()
+        self.assertEquals(reloaded, dict(reloaded=[], added=[], removed=[]))
+        self.assertTrue(first.get_resource() is old_first)
+
+    @defer.inlineCallbacks
+    def test_batons_in_flight_finish_in_the_old_pipeline(self):
+        self.configuration_manager.set('pipelines.first', [{'wait': dict(delay=0.01)}, {'set-value': dict(path='value', value=1)}])
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, transitions = self._depend_on_pipeline('first')
+
+        in_flight = first.get_resource()(dict())
+
+        self.configuration_manager.set('pipelines.first', [{'set-value': dict(path='value', value=42)}])
+        yield self.pipeline_provider.reload()
+
+        results = yield in_flight
+        self.assertEquals(results, [dict(value=1)])
+        results = yield first.get_resource()(dict())
+        self.assertEquals(results, [dict(value=42)])
+
+    @defer.inlineCallbacks
+    def test_added_and_removed_pipelines(self):
+        self.pipeline_provider.configure(self.runtime_environment)
+        second, transitions = self._depend_on_pipeline('second')
+
+        self.configuration_manager.set('pipelines', dict(first=['passthrough'], third=[{'run-pipeline': dict(pipeline='second')}]))
+        reloaded = yield self.pipeline_provider.reload()
+        self.assertEquals(reloaded, dict(reloaded=[], added=['third'], removed=['second']))
+
+        # the removed pipeline is kept
+        self.assertEquals(transitions, [])
+        self.assertTrue(second.get_resource() is self.pipeline_provider['second'])
+
+        third, transitions = self._depend_on_pipeline('third')
+        results = yield third.get_resource()(dict())
+        self.assertEquals(results, [dict(value=2)])
+
+    @defer.inlineCallbacks
+    def test_pipelines_that_inlined_a_changed_pipeline_are_reloaded(self):
+        self.configuration_manager.set('pipelines.outer', dict(optimize=True, chained_consumers=[{'run-pipeline': dict(pipeline='first')}]))
+        self.pipeline_provider.configure(self.runtime_environment)
+        outer, transitions = self._depend_on_pipeline('outer')
+
+        self.configuration_manager.set('pipelines.first', [{'set-value': dict(path='value', value=42)}])
+        reloaded = yield self.pipeline_provider.reload()
+        self.assertEquals(reloaded['reloaded'], ['outer'])
+
+        results = yield outer.get_resource()(dict())
+        self.assertEquals(results, [dict(value=42)])
+
+    @defer.inlineCallbacks
+    def test_failing_reload_keeps_the_pipelines(self):
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, transitions = self._depend_on_pipeline('first')
+        old_first = first.get_resource()
+        processor_graph_factory = self.pipeline_provider.processor_graph_factory
+
+        self.configuration_manager.set('pipelines.first', ['no-such-processor'])
+        yield self.assertFailure(self.pipeline_provider.reload(), exceptions.ConfigurationError)
+
+        self.assertTrue(first.get_resource() is old_first)
+        self.assertTrue(self.pipeline_provider.processor_graph_factory is processor_graph_factory)
+
+    def add_consumer(self, resource_dependency):
+        # used as the provider of a pipeline that never becomes ready
+        pass
+
+    @defer.inlineCallbacks
+    def test_timed_out_reload_discards_the_new_pipelines(self):
+        configuration_file = filepath.FilePath(self.mktemp())
+        configuration_file.setContent('pipelines: {first: [passthrough], second: [passthrough]}\npipeline_reload: {timeout: 0.01}')
+        self.configuration_manager.load_from_file(configuration_file.path)
+        self.runtime_environment.resource_manager.register('pipeline.never', provider=self)
+
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, first_transitions = self._depend_on_pipeline('first')
+        second, second_transitions = self._depend_on_pipeline('second')
+        old_first, old_second = first.get_resource(), second.get_resource()
+
+        created, stopped = list(), list()
+        create_pipeline = self.pipeline_provider._create_pipeline
+        self.pipeline_provider._create_pipeline = lambda name: created.append(create_pipeline(name)) or created[-1]
+        self.pipeline_provider._stop_when_idle = stopped.append
+
+        # the first pipeline is created, and depends on a new pipeline, which never becomes ready
+        configuration_file.setContent('pipelines: {first: [{run-pipeline: {pipeline: third}}], second: [{set-value: {path: value, value: 2}}], '
+                                      'third: [{run-pipeline: {pipeline: never}}]}\npipeline_reload: {timeout: 0.01}')
+        yield self.assertFailure(self.pipeline_provider.reload(), exceptions.TimeoutError)
+
+        self.assertEquals(len(created), 3)
+        self.assertEquals(set(stopped), set(created))
+        for pipeline in created:
+            self.assertNotIn(self.dependency_manager.as_dependency(pipeline), self.dependency_manager._dependency_graph)
+
+        self.assertTrue(first.get_resource() is old_first)
+        self.assertTrue(second.get_resource() is old_second)
+        self.assertEquals((first_transitions, second_transitions), ([], []))
+        self.assertEquals(sorted(self.pipeline_provider.pipeline_by_name), ['first', 'second'])
+        self.assertNotIn('pipeline.third', self.runtime_environment.resource_manager.get_registered_resources())
+        self.assertEquals(self.configuration_manager.get('pipelines.first'), ['passthrough'])
+
+        # the pipelines may still be reloaded
+        configuration_file.setContent('pipelines: {first: [{run-pipeline: {pipeline: third}}], third: [{set-value: {path: value, value: 3}}]}')
+        self.pipeline_provider._create_pipeline = create_pipeline
+        reloaded = yield self.pipeline_provider.reload()
+        self.assertEquals(reloaded, dict(reloaded=['first'], added=['third'], removed=['second']))
+
+        results = yield first.get_resource()(dict())
+        self.assertEquals(results, [dict(value=3)])
+
+    @defer.inlineCallbacks
+    def test_reloading_the_configuration_files(self):
+        configuration_file = filepath.FilePath(self.mktemp())
+        configuration_file.setContent('pipelines: {first: [{set-value: {path: value, value: 1}}]}')
+        self.configuration_manager.load_from_file(configuration_file.path)
+        self.configuration_manager.load_overrides(['pipelines.second:[passthrough]'])
+
+        self.pipeline_provider.configure(self.runtime_environment)
+        first, transitions = self._depend_on_pipeline('first')
+
+        configuration_file.setContent('pipelines: {first: [{set-value: {path: value, value: 42}}]}')
+        reloaded = yield self.pipeline_provider.reload()
+        # the overrides are applied again, so the second pipeline is not removed
+        self.assertEquals(reloaded, dict(reloaded=['first'], added=[], removed=[]))
+
+        results = yield first.get_resource()(dict())
+        self.assertEquals(results, [dict(value=42)])
+
+    def test_reloading_on_signals(self):
+        previous_handler = signal.getsignal(signal.SIGUSR2)
+        self.addCleanup(signal.signal, signal.SIGUSR2, previous_handler)
+
+        self.configuration_manager.set('pipeline_reload.signal', 'SIGUSR2')
+        self.pipeline_provider.configure(self.runtime_environment)
+
+        reloads = list()
+        self.pipeline_provider._reload_and_log = lambda: reloads.append(True)
+        handler = signal.getsignal(signal.SIGUSR2)
+        handler(signal.SIGUSR2, None)
+        self.assertEquals(reloads, [])
+
+        return util.wait(0).addCallback(lambda _: self.assertEquals(reloads, [True]))
+
+    def test_invalid_reload_signal(self):
+        self.configuration_manager.set('pipeline_reload.signal', 'NOT_A_SIGNAL')
+        self.assertRaises(exceptions.ConfigurationError, self.pipeline_provider.configure, self.runtime_environment)
@@ -0,0 +1,98 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+import threading
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from piped import exceptions, processing
+from piped.providers import thread_pool_provider
+
+
+class ThreadPoolProviderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+        self.configuration_manager = self.runtime_environment.configuration_manager
+        self.dependency_manager = self.runtime_environment.dependency_manager
+
+    def _make_provider(self, **thread_pools):
+        self.configuration_manager.set('thread_pools', thread_pools)
+        provider = thread_pool_provider.ThreadPoolProvider()
+        provider.configure(self.runtime_environment)
+        for pool_name in provider:
+            self.addCleanup(provider[pool_name].stopService)
+        return provider
+
+    def test_provided_resources(self):
+        provider = self._make_provider(database=dict(max_threads=2), xml=dict())
+
+        database = self.dependency_manager.add_dependency(self, dict(provider='thread_pool.database'))
+        xml = self.dependency_manager.add_dependency(self, dict(provider='thread_pool.xml'))
+        stats = self.dependency_manager.add_dependency(self, dict(provider='thread_pool_stats'))
+        self.dependency_manager.resolve_initial_states()
+
+        self.assertEquals(database.get_resource().max_threads, 2)
+        self.assertEquals(xml.get_resource().max_threads, 10)
+        self.assertEquals(sorted(stats.get_resource().as_dict()), ['database', 'xml'])
+
+    def test_invalid_size(self):
+        self.assertRaises(exceptions.ConfigurationError, self._make_provider, database=dict(max_threads=0))
+        self.assertRaises(exceptions.ConfigurationError, self._make_provider, database=dict(max_threads=2, min_threads=3))
+
+    @defer.inlineCallbacks
+    def test_calls_after_stopping_fail(self):
+        thread_pool = thread_pool_provider.ThreadPool('test')
+        self.addCleanup(thread_pool.stopService)
+        yield thread_pool.run(lambda: None)
+        self.assertTrue(thread_pool.running)
+
+        thread_pool.stopService()
+        yield self.assertFailure(thread_pool.run(lambda: None), exceptions.ThreadPoolStoppedError)
+        self.assertFalse(thread_pool.running)
+        self.assertTrue(thread_pool.thread_pool.joined)
+
+        # the thread pool may be started again by its service parent
+        thread_pool.startService()
+        result = yield thread_pool.run(lambda: 42)
+        self.assertEquals(result, 42)
+
+    @defer.inlineCallbacks
+    def test_running_calls(self):
+        thread_pool = self._make_provider(database=dict(max_threads=1))['database']
+
+        thread_name = yield thread_pool.run(lambda: threading.current_thread().name)
+        self.assertNotEquals(thread_name, threading.current_thread().name)
+
+        yield self.assertFailure(thread_pool.run(lambda: 1/0), ZeroDivisionError)
+
+        summary = thread_pool.as_dict()
+        self.assertEquals((summary['submitted'], summary['completed'], summary['failed']), (2, 1, 1))
+        self.assertEquals(summary['queue_latency']['count'], 2)
+
+    @defer.inlineCallbacks
+    def test_saturation(self):
+        thread_pool = self._make_provider(database=dict(max_threads=1))['database']
+
+        running = threading.Event()
+        release = threading.Event()
+
+        def block():
+            running.set()
+            release.wait()
+
+        # never leave the thread blocked, even if an assertion fails
+        self.addCleanup(release.set)
+
+        first = thread_pool.run(block)
+        # wait until the thread runs the first call, so the second call is certain to be queued
+        running.wait()
+        second = thread_pool.run(lambda: None)
+
+        self.assertEquals((thread_pool.busy, thread_pool.queued, thread_pool.saturation), (1, 1, 1.0))
+        self.assertEquals(thread_pool.stats.saturated, 1)
+
+        release.set()
+        yield defer.gatherResults([first, second])
+        self.assertEquals(thread_pool.stats.queue_latency.count, 2)
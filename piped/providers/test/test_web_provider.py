@@ -4,7 +4,7 @@ import json
 from StringIO import StringIO
 
 from twisted.application import service
-from twisted.internet import defer, address
+from twisted.internet import defer, address, error, task
 from twisted.python import filepath, failure
 from twisted.trial import unittest
 from twisted.web import resource, server, http_headers
@@ -307,6 +307,56 @@ class WebProviderTest(unittest.TestCase):
         self.assertIn('Processing Failed', ''.join(request.written))
         self.assertEquals(request.code, 500)
 
+    def test_web_resource_processing_overloaded(self):
+        web_resource = self._create_configured_web_resource(dict(__config__=dict(processor='pipeline.a_pipeline')))
+
+        request = DummyRequest([''])
+
+        def overloaded(baton):
+            raise exceptions.OverloadedError('pipeline a_pipeline is overloaded')
+
+        web_resource.processor_dependency.on_resource_ready(overloaded)
+
+        # rendering the request should result in a service unavailable response
+        web_resource.render(request)
+
+        self.assertIn('Service Unavailable', ''.join(request.written))
+        self.assertEquals(request.code, 503)
+
+    def _render_with_waiting_processor(self, **resource_config):
+        web_resource = self._create_configured_web_resource(dict(__config__=dict(processor='pipeline.a_pipeline', **resource_config)))
+        request = DummyRequest([''])
+
+        waiting = list()
+        def wait(baton):
+            waiting.append(defer.Deferred())
+            return waiting[-1]
+
+        web_resource.processor_dependency.on_resource_ready(wait)
+        web_resource.render(request)
+        return request, waiting[0]
+
+    def test_web_resource_processing_deadline(self):
+        clock = task.Clock()
+        self.patch(util, 'reactor', clock)
+
+        request, waiting = self._render_with_waiting_processor(deadline=5)
+        clock.advance(4)
+        self.assertFalse(waiting.called)
+
+        # the processing should be cancelled and result in a gateway timeout response
+        clock.advance(1)
+        self.assertTrue(waiting.called)
+        self.assertIn('Gateway Timeout', ''.join(request.written))
+        self.assertEquals(request.code, 504)
+
+    def test_web_resource_processing_cancelled_when_client_disconnects(self):
+        request, waiting = self._render_with_waiting_processor()
+
+        request.processingFailed(failure.Failure(error.ConnectionDone()))
+        self.assertTrue(waiting.called)
+        self.assertEquals(request.written, [])
+
     def test_web_resource_processing_raises_with_debugging(self):
         routing = dict(__config__=dict(processor='pipeline.a_pipeline'))
         site_config = dict(debug=dict(allow=['localhost']))
@@ -0,0 +1,182 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+from twisted.application import service
+from twisted.internet import defer, reactor
+from twisted.python import threadpool
+from zope import interface
+
+from piped import exceptions, metrics, resource
+
+
+class ThreadPoolProvider(object, service.MultiService):
+    """ Provides named thread pools, which are used to run blocking code without
+    blocking the reactor.
+
+    Example configuration::
+
+        thread_pools:
+            database:
+                max_threads: 5
+            xml:
+                min_threads: 1
+                max_threads: 2
+
+    The above thread pools would be made available as ``thread_pool.database`` and
+    ``thread_pool.xml``, and are usually used by setting ``run_in_thread`` in a
+    processor definition::
+
+        pipelines:
+            my_pipeline:
+                - some-blocking-processor:
+                    run_in_thread: database
+
+    Every :class:`ThreadPool` keeps :class:`~piped.metrics.ThreadPoolStats`. The
+    statistics of all the thread pools are available as ``thread_pool_stats``.
+    """
+    interface.classProvides(resource.IResourceProvider)
+
+    def __init__(self):
+        service.MultiService.__init__(self)
+        self.thread_pool_by_name = dict()
+
+    def configure(self, runtime_environment):
+        self.setServiceParent(runtime_environment.application)
+
+        resource_manager = runtime_environment.resource_manager
+        for pool_name, pool_config in runtime_environment.get_configuration_value('thread_pools', dict()).items():
+            thread_pool = ThreadPool(pool_name, **pool_config)
+            thread_pool.setServiceParent(self)
+            self.thread_pool_by_name[pool_name] = thread_pool
+
+            resource_manager.register('thread_pool.%s' % pool_name, provider=self)
+
+        resource_manager.register('thread_pool_stats', provider=self)
+
+    def add_consumer(self, resource_dependency):
+        if resource_dependency.provider == 'thread_pool_stats':
+            resource_dependency.on_resource_ready(self)
+            return
+
+        pool_name = resource_dependency.provider.split('.', 1)[1]
+        resource_dependency.on_resource_ready(self.thread_pool_by_name[pool_name])
+
+    def __getitem__(self, pool_name):
+        return self.thread_pool_by_name[pool_name]
+
+    def __iter__(self):
+        return iter(sorted(self.thread_pool_by_name))
+
+    def as_dict(self):
+        """ Returns the statistics of every thread pool, keyed by thread pool name. """
+        return dict((pool_name, thread_pool.as_dict()) for pool_name, thread_pool in self.thread_pool_by_name.items())
+
+
+class ThreadPool(object, service.Service):
+    """ A thread pool with at most *max_threads* threads.
+
+    Calls that are submitted while every thread is busy wait in a queue until a
+    thread is available. The threads are started on the first call or when the
+    service starts, and stopped when the service stops. Calls that are submitted
+    after the service has stopped fail with a
+    :exc:`~piped.exceptions.ThreadPoolStoppedError`.
+
+    :ivar stats: The :class:`~piped.metrics.ThreadPoolStats` of the thread pool.
+    """
+
+    def __init__(self, name, max_threads=10, min_threads=0):
+        self._fail_if_invalid_size(name, min_threads, max_threads)
+
+        self.name = name
+        self.min_threads = min_threads
+        self.max_threads = max_threads
+
+        self.stats = metrics.ThreadPoolStats()
+        self.thread_pool = threadpool.ThreadPool(min_threads, max_threads, name='piped-%s' % name)
+        self.stopped = False
+
+    def _fail_if_invalid_size(self, name, min_threads, max_threads):
+        if isinstance(max_threads, int) and isinstance(min_threads, int) and 0 <= min_threads <= max_threads and max_threads > 0:
+            return
+
+        e_msg = 'invalid size of thread pool "%s"' % name
+        detail = 'min_threads is %r and max_threads is %r.' % (min_threads, max_threads)
+        hint = 'max_threads must be a positive integer, and min_threads an integer between 0 and max_threads.'
+        raise exceptions.ConfigurationError(e_msg, detail, hint)
+
+    def startService(self):
+        service.Service.startService(self)
+        self.stopped = False
+        # a thread pool that has been stopped is joined, and may be started again
+        if not self.thread_pool.started or self.thread_pool.joined:
+            self.thread_pool.start()
+
+    def stopService(self):
+        service.Service.stopService(self)
+        self.stopped = True
+        if self.thread_pool.started and not self.thread_pool.joined:
+            self.thread_pool.stop()
+
+    @property
+    def busy(self):
+        """ The number of threads that are running a call. """
+        return len(self.thread_pool.working)
+
+    @property
+    def queued(self):
+        """ The number of calls that are waiting for a thread. """
+        return self.thread_pool.q.qsize()
+
+    @property
+    def saturation(self):
+        """ The fraction of the threads that are running a call. """
+        return float(self.busy) / self.max_threads
+
+    def run(self, f, *args, **kwargs):
+        """ Call *f* in a thread of this thread pool.
+
+        :return: A Deferred that callbacks with the return value of *f*.
+        """
+        if self.stopped:
+            e_msg = 'thread pool "%s" has been stopped' % self.name
+            detail = 'The call was submitted after the thread pool stopped, which happens when piped shuts down.'
+            return defer.fail(exceptions.ThreadPoolStoppedError(e_msg, detail))
+
+        if not self.running:
+            # we are used without ever being started, so make sure the threads do not
+            # keep the process alive after the reactor has stopped.
+            self.startService()
+            reactor.addSystemEventTrigger('before', 'shutdown', self.stopService)
+
+        d = defer.Deferred()
+        times = [self.stats.submitted_call(saturated=self.busy + self.queued >= self.max_threads)]
+
+        def run_and_time_call():
+            times.append(metrics.monotonic_time())
+            return f(*args, **kwargs)
+
+        def on_result(success, result):
+            times.append(metrics.monotonic_time())
+            reactor.callFromThread(self._finished, d, success, result, *times)
+
+        self.thread_pool.callInThreadWithCallback(on_result, run_and_time_call)
+        return d
+
+    def _finished(self, d, success, result, submitted, started, finished):
+        self.stats.finished_call(submitted, started, finished, failed=not success)
+        if success:
+            d.callback(result)
+        else:
+            d.errback(result)
+
+    def as_dict(self):
+        """ Returns the size and current load of the thread pool, as well as its
+        :class:`~piped.metrics.ThreadPoolStats`. """
+        summary = self.stats.as_dict()
+        summary.update(
+            max_threads = self.max_threads,
+            threads = len(self.thread_pool.threads),
+            busy = self.busy,
+            queued = self.queued,
+            saturation = self.saturation,
+        )
+        return summary
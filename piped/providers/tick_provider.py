@@ -33,6 +33,7 @@ class TickProvider(object, service.MultiService):
     
     """
     interface.classProvides(resource.IResourceProvider)
+    configuration_paths = ['ticks.interval']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -8,9 +8,9 @@ import weakref
 from zope import interface
 from twisted.internet import defer, task
 from twisted.web import server, resource, static, util as web_util, http
-from twisted.application import service, strports
+from twisted.application import service
 
-from piped import exceptions, util, debugger
+from piped import exceptions, util, debugger, prefork, processing
 from piped import resource as piped_resource
 
 try:
@@ -26,6 +26,14 @@ STANDARD_HTML_TEMPLATE = """
     <html><head><title>Processing Failed</title></head><body><b>Processing Failed</b></body></html>
 """
 
+OVERLOADED_HTML_TEMPLATE = """
+    <html><head><title>Service Unavailable</title></head><body><b>Service Unavailable</b></body></html>
+"""
+
+TIMEOUT_HTML_TEMPLATE = """
+    <html><head><title>Gateway Timeout</title></head><body><b>Gateway Timeout</b></body></html>
+"""
+
 DEBUG_HTML_TEMPLATE = r"""
 <html>
     <head>
@@ -173,6 +181,7 @@ class WebResourceProvider(object, service.MultiService):
 
     """
     interface.classProvides(piped_resource.IResourceProvider)
+    configuration_paths = ['web']
 
     def __init__(self):
         service.MultiService.__init__(self)
@@ -201,6 +210,7 @@ class WebSite(object, service.MultiService):
             port: 8080
             listen: ssl:1234 # overrides the "port" above, see :mod:`twisted.application.strports`
             log_exceptions: DEBUG # a piped.log debug level, or null. (default: null)
+            deadline: 30 # seconds a request may be processed, or null for no deadline. (default: null)
             debug: # configure debugging of the processors
                 reap_interval: 60 # seconds
                 max_inactive_time: 300 # seconds
@@ -217,6 +227,7 @@ class WebSite(object, service.MultiService):
         self.site_configuration = site_configuration
 
         self.log_exceptions_level = site_configuration.get('log_exceptions', None)
+        self.deadline = site_configuration.get('deadline', None)
 
         self.debug_configuration = util.dict_get_path(self.site_configuration, 'debug', dict())
 
@@ -241,7 +252,7 @@ class WebSite(object, service.MultiService):
         self.factory.displayTracebacks = bool(self.debug_configuration)
 
         listen = self.site_configuration.get('listen', str(self.site_configuration.get('port', 8080)))
-        self.tcpserver = strports.service(listen, self.factory)
+        self.tcpserver = prefork.listening_service(listen, self.factory)
         self.tcpserver.setServiceParent(self)
 
     def log_exception(self, failure):
@@ -435,6 +446,9 @@ class WebResource(resource.Resource):
         processing raises an Exception, the request will be closed automatically and debugging will
         become available if debugging is enabled and the client is allowed to debug.
 
+        If the pipeline is overloaded and raises an :exc:`~piped.exceptions.OverloadedError`,
+        the response is a "503 Service Unavailable" instead.
+
     no_resource_processor
         Works similar to the ``processor`` configuration key, but is used when another resource was not found for
         request for either this path or any children. If this processor is used to handle child paths without
@@ -468,6 +482,12 @@ class WebResource(resource.Resource):
     debug
         Overrides the site-wide debug option for this processor. Only applies if a processor is specified.
 
+    deadline
+        Overrides the site-wide deadline for this processor, which is the number of seconds the processor
+        may spend on a request. When the deadline passes, the processing is cancelled and the response is
+        a "504 Gateway Timeout". The processing is also cancelled if the client disconnects. See
+        :func:`piped.processing.call_in_scope`.
+
     Accessing the following resources with the above configuration gives:
 
     - http://hostname:port/ will put a invoke the processor ``processor_name``.
@@ -507,9 +527,11 @@ class WebResource(resource.Resource):
 
             self.putChild(child_path, child)
 
-    def _configure_resource(self, runtime_environment, processor=None, no_resource_processor=None, debug=None, static=None, concatenated=None):
+    def _configure_resource(self, runtime_environment, processor=None, no_resource_processor=None, debug=None, static=None, concatenated=None, deadline=Ellipsis):
         dependency_manager = runtime_environment.dependency_manager
 
+        self.deadline = self.site.deadline if deadline is Ellipsis else deadline
+
         debug_configuration = dict(self.site.debug_configuration)
         debug_overrides = debug or dict()
         debug_configuration.update(debug_overrides)
@@ -626,9 +648,12 @@ class WebResource(resource.Resource):
             # No processor or static_resource for this resource, so consider it non-existing.
             return self.no_resource.render(request)
 
+        # the processing is cancelled if the client disconnects or the deadline passes.
+        scope = util.CancellationScope(self.deadline)
         baton = dict(request=request_proxy)
-        d = defer.maybeDeferred(self._process_baton_with_processor, baton, processor_dependency)
-        d.addErrback(self._delayed_errback, request=request_proxy)
+        d = defer.maybeDeferred(processing.call_in_scope, scope, self._process_baton_with_processor, baton, processor_dependency)
+        d.addBoth(scope.close_callback)
+        d.addErrback(self._delayed_errback, request=request_proxy, scope=scope)
         d.addErrback(lambda reason: logger.error('Exception raised while handling an error in a web processor.', exc_info=(reason.type, reason.value, reason.tb)))
         # The end result of this deferred cannot contain a reference to the request_proxy in any
         # way, since that will affect the garbage collection of the request_proxy. Because of this,
@@ -643,7 +668,7 @@ class WebResource(resource.Resource):
         self._weakrefs.add(ref)
 
         if not request.finished:
-            request.notifyFinish().addErrback(self._delayed_cancelled, deferred=d)
+            request.notifyFinish().addErrback(self._delayed_cancelled, scope=scope)
 
         return server.NOT_DONE_YET
 
@@ -667,26 +692,37 @@ class WebResource(resource.Resource):
 
         return STANDARD_HTML_TEMPLATE
 
-    def _delayed_errback(self, failure, request):
+    def _delayed_errback(self, failure, request, scope=None):
         if failure.check(defer.CancelledError):
+            if scope is not None and scope.expired and not request.finished:
+                logger.warn('Cancelled processing a request because its deadline of %s seconds passed.' % self.deadline)
+                self._write_error_response(request, http.GATEWAY_TIMEOUT, TIMEOUT_HTML_TEMPLATE)
+                return
             # The deferred was cancelled, most likely because the client abandoned the request, so do nothing.
             return
 
+        if failure.check(exceptions.OverloadedError):
+            # The pipeline refused to process the request, which is not an error on our part.
+            logger.warn('Rejected request because the pipeline is overloaded: %s' % failure.value.msg)
+            self._write_error_response(request, http.SERVICE_UNAVAILABLE, OVERLOADED_HTML_TEMPLATE)
+            return
+
         self.site.log_exception(failure)
 
         body = self._get_error_body(request, failure)
+        self._write_error_response(request, http.INTERNAL_SERVER_ERROR, body)
 
-        request.setResponseCode(http.INTERNAL_SERVER_ERROR)
+    def _write_error_response(self, request, code, body):
+        request.setResponseCode(code)
         request.setHeader('content-type', 'text/html')
         request.setHeader('content-length', str(len(body)))
 
         request.write(body)
         request.finish()
 
-    def _delayed_cancelled(self, failure, deferred):
-        # Attempt to cancel further processing on the deferred, if possible
-        if not deferred.called:
-            deferred.cancel()
+    def _delayed_cancelled(self, failure, scope):
+        # Cancel further processing of the request, including the pipelines invoked by its processors.
+        scope.cancel()
 
     def _get_processor_dependency_for_request(self, request):
         # if there are non-empty elements left in request.postpath, we're handling the request on behalf of
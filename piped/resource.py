@@ -4,9 +4,10 @@
 This module contains base implementations and managers for the resource system.
 """
 from twisted.plugin import IPlugin
+from twisted.python import reflect
 from zope import interface
 
-from piped import plugin, exceptions, providers as piped_providers, plugins
+from piped import plugin, exceptions, metrics, providers as piped_providers, plugins
 
 
 class IResourceProvider(IPlugin):
@@ -25,6 +26,11 @@ class IResourceProvider(IPlugin):
     plugin_manager = interface.Attribute("""Set by the plugin manager that
         loaded the provider.""")
 
+    configuration_paths = interface.Attribute("""Optional list of the configuration
+        paths the provider is configured by. If none of them are in the configuration,
+        the provider does not provide anything, and it is not imported when the
+        providers are loaded from the :ref:`plugin index <topic-plugin-index>`.""")
+
     def configure(self, runtime_environment):
         """ Configure the provider.
 
@@ -121,6 +127,10 @@ class ResourceManager(object):
         self._fail_if_resource_is_already_provided(resource_path, provider)
         self._provider_by_path[resource_path] = provider
 
+    def unregister(self, resource_path):
+        """ Remove the provider of the resource identified by *resource_path*, if any. """
+        self._provider_by_path.pop(resource_path, None)
+
     def get_registered_resources(self):
         """ Get a dictionary of currently registered resources in this manager.
 
@@ -183,6 +193,7 @@ class ResourceManager(object):
 class ProviderPluginManager(plugin.PluginManager):
     plugin_packages = [piped_providers, plugins]
     plugin_interface = IResourceProvider
+    import_plugins_lazily = True
 
     def __init__(self):
         super(ProviderPluginManager, self).__init__()
@@ -191,11 +202,13 @@ class ProviderPluginManager(plugin.PluginManager):
     def configure(self, runtime_environment):
         super(ProviderPluginManager, self).configure(runtime_environment)
 
-        # Instantiate all providers
-        for Plugin in self._plugins:
+        # Instantiate all providers, except the ones that are not configured and have
+        # not been imported.
+        for Plugin in self.import_configured_plugins():
             instance = Plugin()
             instance.plugin_manager = self
             self.providers.add(instance)
 
         for provider in self.providers:
-            provider.configure(runtime_environment)
+            with metrics.startup_phase('configure provider: %s' % reflect.qual(provider.__class__)):
+                provider.configure(runtime_environment)
@@ -54,9 +54,14 @@ def run_piped():
         # arguments.
         args = parser.parse_args()
 
+    if args.workers and args.script:
+        parser.error('--workers cannot be used with -s/--script')
+
     # pass the configuration file as an environment variable that is read in the service.tac
     if args.conf:
         os.environ['PIPED_CONFIGURATION_FILE'] = args.conf
+    if args.configuration_cache:
+        os.environ['PIPED_CONFIGURATION_CACHE'] = os.path.abspath(args.configuration_cache)
 
     # append the command line overrides to the environment overrides
     overrides = json.loads(os.environ.get('PIPED_CONFIGURATION_OVERRIDES', '[]'))
@@ -64,6 +69,19 @@ def run_piped():
         overrides.append('{"repl.enabled": true}')
     os.environ['PIPED_CONFIGURATION_OVERRIDES'] = json.dumps(overrides+args.override)
 
+    if args.profile_startup or args.profile_startup_output:
+        profile_options = dict(output=args.profile_startup_output and os.path.abspath(args.profile_startup_output), format=args.profile_startup_format, exit=args.profile_startup_exit)
+        os.environ['PIPED_PROFILE_STARTUP'] = json.dumps(profile_options)
+
+    if args.precompile:
+        from piped import log
+        log.configure(args)
+        sys.exit(_precompile(args.conf, overrides+args.override, os.environ.get('PIPED_CONFIGURATION_CACHE')))
+
+    if args.workers:
+        os.environ['PIPED_WORKERS'] = str(args.workers)
+        os.environ['PIPED_WORKER_ARGUMENTS'] = json.dumps(_make_worker_arguments(args))
+
     twistd_config = _create_configuration_for_twistd(args)
 
     # If we had this import further up, it'd end up importing twisted.internet.reactor,
@@ -73,6 +91,51 @@ def run_piped():
     _run_twistd_with_config(twistd_config)
 
 
+def _precompile(configuration_file, overrides, configuration_cache=None):
+    """ Build the pipeline cache of *configuration_file*, so the pipeline definitions
+    do not have to be processed when piped starts. The configuration cache is built
+    as well if *configuration_cache* is given. Returns the exit code. """
+    from piped import processing
+
+    runtime_environment = processing.RuntimeEnvironment()
+    runtime_environment.configure()
+
+    configuration_manager = runtime_environment.configuration_manager
+    configuration_manager.parse_cache_path = configuration_cache
+    configuration_manager.load_from_file(configuration_file)
+    configuration_manager.load_overrides(overrides)
+
+    if not configuration_manager.get('pipeline_cache.enabled', False):
+        sys.stderr.write('Warning: pipeline_cache.enabled is not set, so the cache will not be used when starting piped.\n')
+        configuration_manager.set('pipeline_cache.enabled', True)
+
+    processor_graph_factory = processing.ProcessorGraphFactory()
+    processor_graph_factory.configure(runtime_environment)
+
+    if processor_graph_factory.pipeline_cache.load() is None:
+        sys.stderr.write('Could not write the pipeline cache %s.\n' % processor_graph_factory.pipeline_cache.path)
+        return 1
+
+    message = 'Cached %i pipeline definitions in %s.\n'
+    sys.stdout.write(message % (len(processor_graph_factory.pipelines_configuration), processor_graph_factory.pipeline_cache.path))
+    return 0
+
+
+def _make_worker_arguments(args):
+    """ Returns the command line arguments of the worker processes that are started
+    when piped is run with *args*. The configuration overrides and caches are passed
+    to the workers in the environment. """
+    # the workers are started in the directory piped runs in, and must not daemonize
+    arguments = ['--nodaemon', '--conf', os.path.abspath(args.conf)]
+    if args.logging_config:
+        arguments += ['--logging-config', os.path.abspath(args.logging_config)]
+    if args.reactor:
+        arguments += ['--reactor', args.reactor]
+    if args.D:
+        arguments.append('-D')
+    return arguments
+
+
 class VersionAction(argparse.Action):
     """ We provide our own argparse.Action in order to provide our own formatting. """
 
@@ -131,6 +194,20 @@ def _make_parser():
     parser.add_argument('--help-reactors', action='store_true', help='Display a list of possibly available reactor names.')
 
     parser.add_argument('--repl', action='store_true', help='Starts the REPL by adding {"repl.enabled": true} to the configuration overrides')
+    parser.add_argument('--configuration-cache', metavar='PATH',
+                        help='Keep the parsed configuration files in PATH, and only parse the files that have changed. [PIPED_CONFIGURATION_CACHE]')
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help=('Start N worker processes that share the sockets of the web sites, PB servers and SMTP servers, '
+                              'and restart the workers that exit unexpectedly. See the workers configuration key.'))
+    parser.add_argument('--precompile', action='store_true',
+                        help='Build the pipeline cache for the configuration file and exit. See the pipeline_cache configuration key.')
+
+    parser.add_argument('--profile-startup', action='store_true', help='Log how long each phase of the startup takes, and how much it allocates.')
+    parser.add_argument('--profile-startup-output', metavar='PATH',
+                        help='Write a profile of the whole startup to PATH. Implies --profile-startup.')
+    parser.add_argument('--profile-startup-format', choices=('pstats', 'collapsed'), default='pstats',
+                        help='Format of the startup profile: cProfile statistics, or sampled collapsed stacks for flame graphs. (default: pstats)')
+    parser.add_argument('--profile-startup-exit', action='store_true', help='Exit after the startup has been profiled.')
 
     return parser
 
@@ -141,6 +218,8 @@ def _create_configuration_for_twistd(args):
     config = dict(args.__dict__)
 
     config['python'] = util.sibpath(__file__, 'service.tac')
+    if args.workers:
+        config['python'] = util.sibpath(__file__, 'supervisor.tac')
     config['no_save'] = True
 
     conf_without_extension = os.path.basename(config['conf']).rsplit('.', 1)[0]
@@ -151,6 +230,10 @@ def _create_configuration_for_twistd(args):
 
     config['pidfile'] = config['pidfile'].replace('%d', default_pidfile)
 
+    # only the supervisor of the worker processes writes the pidfile
+    if os.environ.get('PIPED_WORKER'):
+        config['pidfile'] = ''
+
     twistd_config = twistd.ServerOptions()
     twistd_config.update(config)
 
@@ -3,8 +3,9 @@ import functools
 from twisted.internet import defer
 from twisted.plugin import IPlugin
 from twisted.application import service
+from twisted.python import reflect
 
-from piped import plugin, plugins, util
+from piped import metrics, plugin, plugins, util
 
 
 class IPipedService(IPlugin, service.IService):
@@ -45,7 +46,8 @@ class ServicePluginManager(plugin.PluginManager, service.MultiService):
         for Service in self._plugins:
             service_instance = Service()
             service_instance.plugin_manager = self
-            service_instance.configure(runtime_environment)
+            with metrics.startup_phase('configure service: %s' % reflect.qual(Service)):
+                service_instance.configure(runtime_environment)
 
             if not service_instance.is_enabled():
                 continue
@@ -7,7 +7,7 @@ import tempfile
 from twisted.python import filepath
 from twisted.trial import unittest
 
-from piped import conf, exceptions
+from piped import conf, exceptions, yamlutil
 
 
 class ConfigurationManagerTest(unittest.TestCase):
@@ -103,6 +103,91 @@ class ConfigurationManagerTest(unittest.TestCase):
     def test_non_dict_config(self):
         self.assertRaises(exceptions.ConfigurationError, self.cm._load_config, [1,2,3], ['a_file'])
 
+    def test_load_overrides(self):
+        self.cm.load_overrides(['foo.bar:42', 'baz:{a: b}'])
+        self.assertEquals(self.cm.get(''), dict(foo=dict(bar=42), baz=dict(a='b')))
+        self.assertEquals(self.cm.overrides, ['foo.bar:42', 'baz:{a: b}'])
+
+        self.assertRaises(exceptions.ConfigurationError, self.cm.load_overrides, ['not a mapping'])
+
+    def test_content_hash(self):
+        self.assertEquals(self.cm.get_content_hash(), None)
+
+        included = filepath.FilePath(self.mktemp())
+        included.setContent('foo: 42')
+        config = filepath.FilePath(self.mktemp())
+        config.setContent('includes: [%s]' % included.path)
+
+        self.cm.load_from_file(config.path)
+        self.assertEquals(self.cm.loaded_files, [config.path, included.path])
+        content_hash = self.cm.get_content_hash()
+        self.assertEquals(content_hash, self.cm.get_content_hash())
+
+        self.cm.set('foo', 93)
+        self.assertEquals(self.cm.get_content_hash(), content_hash)
+
+        included.setContent('foo: 93')
+        changed_content_hash = self.cm.get_content_hash()
+        self.assertNotEquals(changed_content_hash, content_hash)
+
+        self.cm.load_overrides(['foo:42'])
+        self.assertNotEquals(self.cm.get_content_hash(), changed_content_hash)
+
+
+class ConfigurationParseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = os.path.abspath(self.mktemp())
+
+        self.included = filepath.FilePath(os.path.abspath(self.mktemp()))
+        self.included.setContent('included: {path: !path foo.bar, file: !filepath data}')
+        self.config = filepath.FilePath(os.path.abspath(self.mktemp()))
+        self.config.setContent('includes: [{prefixed: %s}]\nalias: !alias:prefixed.included {}\n' % self.included.path)
+
+    def _load(self):
+        cm = conf.ConfigurationManager()
+        cm.parse_cache_path = self.cache_path
+        cm.load_from_file(self.config.path)
+        return cm
+
+    def test_cached_files_are_not_parsed(self):
+        cold = self._load()
+        self.assertEquals((cold.parse_cache.hits, cold.parse_cache.misses), (0, 2))
+
+        warm = self._load()
+        self.assertEquals((warm.parse_cache.hits, warm.parse_cache.misses), (2, 0))
+
+        self.assertEquals(warm.get(''), cold.get(''))
+        self.assertIsInstance(warm.get('prefixed.included.path'), yamlutil.BatonPath)
+        self.assertEquals(warm.get('prefixed.included.file'), filepath.FilePath('data'))
+        self.assertEquals(warm.get('alias'), warm.get('prefixed.included'))
+
+    def test_changed_files_are_parsed(self):
+        self._load()
+
+        self.included.setContent('included: {changed: true}')
+        cm = self._load()
+        self.assertEquals((cm.parse_cache.hits, cm.parse_cache.misses), (1, 1))
+        self.assertEquals(cm.get('prefixed.included'), dict(changed=True))
+
+    def test_files_are_parsed_if_the_paths_resolve_differently(self):
+        self._load()
+
+        os.mkdir('elsewhere')
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir('elsewhere')
+
+        cm = self._load()
+        self.assertEquals((cm.parse_cache.hits, cm.parse_cache.misses), (1, 1))
+        self.assertEquals(cm.get('prefixed.included.file'), filepath.FilePath('data'))
+
+    def test_unreadable_cache_is_ignored(self):
+        filepath.FilePath(self.cache_path).setContent('not a pickle')
+
+        cm = self._load()
+        self.assertEquals(cm.parse_cache.misses, 2)
+        self.assertEquals(self._load().parse_cache.hits, 2)
+
 
 class TestAliases(unittest.TestCase):
 
@@ -2,7 +2,7 @@
 # See LICENSE for details.
 import itertools
 
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, task
 from twisted.trial import unittest
 
 from piped import util, dependencies, processing, exceptions
@@ -751,6 +751,54 @@ class DependencyManagerTest(unittest.TestCase):
         self.dependency_manager.add_dependency('D', 'A')
         self.assertRaises(exceptions.CircularDependencyGraph, self.dependency_manager.resolve_initial_states)
 
+    def test_removing_another_edge_of_a_cycle(self):
+        # A -> B -> C -> A
+        self.dependency_manager.add_dependency('A', 'B')
+        self.dependency_manager.add_dependency('B', 'C')
+        self.dependency_manager.add_dependency('C', 'A')
+        self.assertRaises(exceptions.CircularDependencyGraph, self.dependency_manager.resolve_initial_states)
+
+        # the cycle is detected when C -> A is added, but removing any of its edges breaks it
+        self.dependency_manager.remove_dependency('A', 'B')
+        self.dependency_manager.resolve_initial_states()
+
+    def test_dependencies_are_kept_in_topological_order(self):
+        random = __import__('random').Random(42)
+        nodes = range(1, 201)
+        edges = set()
+        for i in range(600):
+            consumer, dependency = random.sample(nodes, 2)
+            if consumer > dependency and (consumer, dependency) not in edges:
+                # only adding edges from higher to lower numbers keeps the graph acyclic
+                self.dependency_manager.add_dependency(consumer, dependency)
+                edges.add((consumer, dependency))
+
+        as_dependency = self.dependency_manager.as_dependency
+        order = self.dependency_manager._order
+        for consumer, dependency in edges:
+            self.assertTrue(order[as_dependency(dependency)] < order[as_dependency(consumer)])
+
+        resolved = list()
+        for node in nodes:
+            if node in self.dependency_manager._instance_dependencies:
+                as_dependency(node).resolve_initial_state = lambda node=node: resolved.append(node)
+
+        self.dependency_manager.resolve_initial_states()
+        for consumer, dependency in edges:
+            self.assertTrue(resolved.index(dependency) < resolved.index(consumer))
+
+    def test_only_new_dependencies_are_resolved(self):
+        self.dependency_manager.add_dependency('A', 'B')
+        self.dependency_manager.resolve_initial_states()
+
+        resolved = list()
+        for node in 'A', 'B', 'C':
+            self.dependency_manager.as_dependency(node).resolve_initial_state = lambda node=node: resolved.append(node)
+
+        self.dependency_manager.add_dependency('B', 'C')
+        self.dependency_manager.resolve_initial_states()
+        self.assertEquals(resolved, ['C'])
+
 
     def test_adding_existing_dependency_raises(self):
         self.dependency_manager.add_dependency('A', 'B')
@@ -797,6 +845,113 @@ class DependencyManagerTest(unittest.TestCase):
         e_dependency.fire_on_ready()
         self.assertEquals(is_ready, dict(A=True, B=True, C=True, D=True, E=True))
 
+    def test_discarding_dependencies(self):
+        self.dependency_manager.add_dependency('A', 'B')
+        b_dependency = self.dependency_manager.as_dependency('B')
+
+        # B is still a dependency of A
+        self.assertFalse(self.dependency_manager.discard_dependency('B'))
+        self.assertIn(b_dependency, self.dependency_manager._dependency_graph)
+
+        self.dependency_manager.remove_dependency('A', 'B')
+        self.assertTrue(self.dependency_manager.discard_dependency('B'))
+        self.assertNotIn(b_dependency, self.dependency_manager._dependency_graph)
+        self.assertNotIn(b_dependency, self.dependency_manager._order)
+
+        # discarded dependencies are not resolved, and may be added again
+        self.assertFalse(self.dependency_manager.discard_dependency('B'))
+        self.dependency_manager.resolve_initial_states()
+        self.assertFalse(b_dependency.is_ready)
+        self.assertFalse(self.dependency_manager.as_dependency('B') is b_dependency)
+
+
+class CoalescedDependencyManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+        self.dependency_manager = self.runtime_environment.dependency_manager
+        self.dependency_manager.clock = self.clock = task.Clock()
+
+        self.events = list()
+        for char in 'A', 'B', 'C':
+            dependency = self.dependency_manager.as_dependency(char)
+            dependency.on_ready += lambda dep, char=char: self.events.append((char, True))
+            dependency.on_lost += lambda dep, reason, char=char: self.events.append((char, False))
+
+        # C <- B <- A
+        self.dependency_manager.add_dependency('B', 'A')
+        self.dependency_manager.add_dependency('C', 'B')
+
+    def _resolve(self, **config):
+        self.runtime_environment.configuration_manager.set('dependencies', config)
+        self.dependency_manager.resolve_initial_states()
+        del self.events[:]
+
+    def _get_suppressed_transitions(self):
+        return dict((dependency.instance, count) for dependency, count in self.dependency_manager.suppressed_transitions.items())
+
+    def _get_consumer_events(self):
+        return [event for event in self.events if event[0] != 'A']
+
+    def test_initial_states_are_propagated_immediately(self):
+        self._resolve(coalesce=True)
+        self.assertTrue(self.dependency_manager.as_dependency('C').is_ready)
+
+    def test_transitions_are_propagated_in_the_next_iteration(self):
+        self._resolve(coalesce=True)
+        a = self.dependency_manager.as_dependency('A')
+
+        a.fire_on_lost('lost')
+        self.assertEquals(self.events, [('A', False)])
+
+        self.clock.advance(0)
+        self.assertEquals(self.events, [('A', False), ('B', False), ('C', False)])
+        self.assertEquals(self._get_suppressed_transitions(), dict())
+
+    def test_final_state_wins(self):
+        self._resolve(coalesce=True)
+        a = self.dependency_manager.as_dependency('A')
+
+        for i in range(3):
+            a.fire_on_lost('lost')
+            a.fire_on_ready()
+        a.fire_on_lost('lost')
+
+        self.clock.advance(0)
+        self.assertEquals(self._get_consumer_events(), [('B', False), ('C', False)])
+        self.assertEquals(self._get_suppressed_transitions(), dict(A=6))
+
+        # if the final state is the state the consumers already have, no transitions are propagated
+        for i in range(2):
+            a.fire_on_ready()
+            a.fire_on_lost('lost')
+
+        self.clock.advance(0)
+        self.assertEquals(self._get_consumer_events(), [('B', False), ('C', False)])
+        self.assertEquals(self._get_suppressed_transitions(), dict(A=10))
+
+    def test_debouncing(self):
+        self._resolve(coalesce=True, debounce=1)
+        a = self.dependency_manager.as_dependency('A')
+
+        a.fire_on_lost('lost')
+        self.clock.advance(0.5)
+        a.fire_on_ready()
+        self.clock.advance(0.5)
+        a.fire_on_lost('lost')
+        self.clock.advance(0.9)
+        self.assertEquals(self._get_consumer_events(), [])
+
+        # A has been lost for a second
+        self.clock.advance(0.1)
+        self.assertEquals(self._get_consumer_events(), [('B', False), ('C', False)])
+        self.assertEquals(self._get_suppressed_transitions(), dict(A=2))
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_invalid_debounce(self):
+        self.assertRaises(exceptions.ConfigurationError, self._resolve, coalesce=True, debounce=-1)
+
 
 class DependencyMapTest(unittest.TestCase):
     def setUp(self):
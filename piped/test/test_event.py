@@ -1,5 +1,7 @@
 # Copyright (c) 2010-2012, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import gc
+
 from twisted.internet import defer
 from twisted.trial import unittest
 
@@ -40,6 +42,105 @@ class TestEvent(unittest.TestCase):
         e = event.Event()
         self.assertRaises(ValueError, e.unhandle,  lambda: None)
 
+    def test_callbacks_added_while_calling_are_called_the_next_time(self):
+        e = event.Event()
+        l = list()
+
+        def add_another():
+            l.append(1)
+            e.handle(lambda: l.append(2))
+
+        e += add_another
+        e()
+        self.assertEquals(l, [1])
+        e()
+        self.assertEquals(l, [1, 1, 2])
+
+    def test_callbacks_removed_while_calling_are_called_this_time(self):
+        e = event.Event()
+        l = list()
+
+        def remove_the_other():
+            l.append(1)
+            if append_two in e:
+                e.unhandle(append_two)
+
+        def append_two():
+            l.append(2)
+
+        e += remove_the_other
+        e += append_two
+        e()
+        self.assertEquals(l, [1, 2])
+        e()
+        self.assertEquals(l, [1, 2, 1])
+
+    def test_a_callback_may_be_added_more_than_once(self):
+        e = event.Event()
+        l = list()
+
+        first = lambda: l.append(1)
+        second = lambda: l.append(2)
+        e += first
+        e += second
+        e += first
+
+        e()
+        self.assertEquals(l, [1, 2, 1])
+
+        # the first one is removed first
+        e -= first
+        e()
+        self.assertEquals(l, [1, 2, 1, 2, 1])
+
+        e -= first
+        self.assertNotIn(first, e)
+        self.assertEquals(len(e), 1)
+
+    def test_weak_callbacks(self):
+        e = event.Event()
+        l = list()
+
+        class Consumer(object):
+            def on_event(self, value):
+                l.append(value)
+
+        def function(value):
+            l.append(-value)
+
+        consumer = Consumer()
+        e.handle(consumer.on_event, weak=True)
+        e.handle(function, weak=True)
+        self.assertIn(consumer.on_event, e)
+        self.assertIn(function, e)
+
+        e(1)
+        self.assertEquals(l, [1, -1])
+
+        del consumer, function
+        gc.collect()
+        self.assertEquals(len(e), 0)
+
+        e(2)
+        self.assertEquals(l, [1, -1])
+
+    def test_unhandling_weak_callbacks(self):
+        e = event.Event()
+
+        class Consumer(object):
+            def on_event(self):
+                pass
+
+        consumer = Consumer()
+        e.handle(consumer.on_event, weak=True)
+        e.unhandle(consumer.on_event)
+        self.assertEquals(len(e), 0)
+
+        # the callback is already removed, which should be fine when it is collected.
+        del consumer
+        gc.collect()
+        self.assertEquals(len(e), 0)
+
     @defer.inlineCallbacks
     def test_wait_until_fired(self):
         e = event.Event()
@@ -0,0 +1,247 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+import pstats
+import threading
+
+from twisted.trial import unittest
+
+from piped import metrics
+
+
+class TestMonotonicTime(unittest.TestCase):
+
+    def test_monotonic_time_does_not_decrease(self):
+        times = [metrics.monotonic_time() for i in range(100)]
+        self.assertEquals(times, sorted(times))
+
+    def test_monotonic_time_in_threads(self):
+        times_by_thread = [list() for i in range(4)]
+
+        def measure(times):
+            for i in range(10000):
+                times.append(metrics.monotonic_time())
+
+        threads = [threading.Thread(target=measure, args=(times, )) for times in times_by_thread]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # concurrent calls must not mix up the seconds and nanoseconds of each other
+        for times in times_by_thread:
+            self.assertEquals(times, sorted(times))
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = metrics.LatencyHistogram()
+        self.assertEquals(histogram.percentile(50), None)
+        self.assertEquals(histogram.mean, None)
+        self.assertEquals(histogram.as_dict()['count'], 0)
+
+    def test_percentiles_are_within_the_bucket_precision(self):
+        histogram = metrics.LatencyHistogram(buckets_per_doubling=4)
+        latencies = [i / 10000.0 for i in range(1, 1001)]
+        for latency in latencies:
+            histogram.record(latency)
+
+        for percent in 10, 50, 90, 99:
+            expected = latencies[int(len(latencies) * percent / 100.0) - 1]
+            actual = histogram.percentile(percent)
+            # the buckets are 2**(1/4) ~ 1.19 times as large as the previous bucket
+            self.assertTrue(expected <= actual <= expected * 1.19, (percent, expected, actual))
+
+        self.assertEquals(histogram.percentile(0), 0.0001)
+        self.assertEquals(histogram.percentile(100), 0.1)
+        self.assertAlmostEquals(histogram.mean, sum(latencies) / len(latencies))
+
+    def test_fixed_memory(self):
+        histogram = metrics.LatencyHistogram(min_latency=0.001, max_latency=1)
+        buckets = len(histogram.counts)
+
+        for latency in 0, 0.0001, 0.5, 10, 1000:
+            histogram.record(latency)
+
+        self.assertEquals(len(histogram.counts), buckets)
+        self.assertEquals(histogram.counts[0], 2)
+        self.assertEquals(histogram.counts[-1], 2)
+        self.assertEquals(histogram.min, 0)
+        self.assertEquals(histogram.max, 1000)
+        self.assertEquals(histogram.percentile(100), 1000)
+
+    def test_reset(self):
+        histogram = metrics.LatencyHistogram()
+        histogram.record(1)
+        histogram.reset()
+
+        self.assertEquals(histogram.count, 0)
+        self.assertEquals(sum(histogram.counts), 0)
+        self.assertEquals(histogram.percentile(50), None)
+
+    def test_merge(self):
+        first, second = metrics.LatencyHistogram(), metrics.LatencyHistogram()
+        for latency in 0.001, 0.002:
+            first.record(latency)
+        second.record(0.5)
+
+        merged = metrics.LatencyHistogram()
+        merged.merge(first)
+        merged.merge(second)
+        merged.merge(metrics.LatencyHistogram())
+
+        self.assertEquals((merged.count, merged.min, merged.max), (3, 0.001, 0.5))
+        self.assertAlmostEquals(merged.total, 0.503)
+        self.assertTrue(0.002 <= merged.percentile(50) < 0.0025)
+
+        self.assertRaises(ValueError, merged.merge, metrics.LatencyHistogram(max_latency=1))
+
+
+class TestPipelineStats(unittest.TestCase):
+
+    def test_counting_batons(self):
+        stats = metrics.PipelineStats()
+
+        first = stats.started()
+        second = stats.started()
+        third = stats.started()
+        self.assertEquals(stats.in_flight, 3)
+
+        stats.finished(first)
+        stats.finished(second, failed=True)
+        self.assertEquals((stats.in_flight, stats.completed, stats.failed), (1, 1, 1))
+        self.assertEquals(stats.latency.count, 2)
+
+        stats.reset()
+        self.assertEquals((stats.in_flight, stats.completed, stats.failed, stats.latency.count), (1, 0, 0, 0))
+
+        stats.finished(third)
+        self.assertEquals((stats.in_flight, stats.completed), (0, 1))
+
+    def test_counting_queued_batons(self):
+        stats = metrics.PipelineStats()
+
+        first = stats.enqueued()
+        stats.enqueued()
+        stats.dequeued(first)
+        self.assertEquals((stats.queued, stats.max_queued, stats.queue_latency.count), (1, 2, 1))
+
+        stats.reset()
+        self.assertEquals((stats.queued, stats.max_queued, stats.queue_latency.count), (1, 1, 0))
+
+    def test_as_dict(self):
+        class Processor(object):
+            id = 'processor-1'
+
+        stats = metrics.PipelineStats()
+        stats.get_processor_latency(Processor()).record(0.5)
+        stats.error_routed += 1
+
+        summary = stats.as_dict()
+        self.assertEquals(summary['error_routed'], 1)
+        self.assertEquals(summary['processors']['processor-1']['p50'], 0.5)
+        self.assertEquals(summary['latency']['count'], 0)
+
+    def test_merging_stats_from_other_processes(self):
+        class Processor(object):
+            def __init__(self, id):
+                self.id = id
+
+        first, second = metrics.PipelineStats(), metrics.PipelineStats()
+        for stats in first, second:
+            stats.finished(stats.started())
+            stats.enqueued()
+            stats.get_processor_latency(Processor('processor-1')).record(0.5)
+        second.started()
+        second.get_processor_latency(Processor('processor-2')).record(1)
+
+        merged = metrics.PipelineStats()
+        merged.merge(first.by_processor_id())
+        merged.merge(second.by_processor_id())
+
+        self.assertEquals((merged.in_flight, merged.completed, merged.queued, merged.max_queued), (1, 2, 2, 2))
+        self.assertEquals(merged.latency.count, 2)
+        self.assertEquals(sorted(merged.processor_latency), ['processor-1', 'processor-2'])
+        self.assertEquals(merged.as_dict()['processors']['processor-1']['count'], 2)
+
+
+class TestThreadPoolStats(unittest.TestCase):
+
+    def test_counting_calls(self):
+        stats = metrics.ThreadPoolStats()
+
+        submitted = stats.submitted_call()
+        stats.submitted_call(saturated=True)
+        stats.finished_call(submitted, submitted + 1, submitted + 3)
+        self.assertEquals((stats.submitted, stats.saturated, stats.completed, stats.failed), (2, 1, 1, 0))
+        self.assertEquals((stats.queue_latency.max, stats.latency.max), (1, 2))
+
+        stats.reset()
+        self.assertEquals(stats.as_dict()['submitted'], 0)
+
+
+class TestStartupProfile(unittest.TestCase):
+
+    def test_phases_are_not_recorded_without_a_profile(self):
+        with metrics.startup_phase('not recorded') as phase:
+            self.assertEquals(phase, None)
+
+    def test_recording_nested_phases(self):
+        profile = metrics.StartupProfile()
+        profile.start()
+        self.addCleanup(profile.stop)
+
+        with metrics.startup_phase('outer'):
+            with metrics.startup_phase('inner'):
+                objects = [object() for i in range(1000)]
+        profile.stop()
+
+        with metrics.startup_phase('after stopping'):
+            pass
+
+        self.assertEquals([(phase['name'], phase['depth']) for phase in profile.phases], [('outer', 0), ('inner', 1)])
+        outer, inner = profile.phases
+        self.assertTrue(outer['seconds'] >= inner['seconds'])
+        # the objects that were created are not tracked by the gc, but the list is
+        self.assertTrue(inner['objects'] >= 1)
+
+        lines = profile.format().splitlines()
+        self.assertEquals(len(lines), 3)
+        self.assertTrue(lines[1].endswith('  outer'))
+        self.assertTrue(lines[2].endswith('      inner'))
+
+    def test_dumping_pstats(self):
+        profile = metrics.StartupProfile('pstats')
+        profile.start()
+        self.addCleanup(profile.stop)
+        sorted(range(100))
+        profile.stop()
+
+        path = self.mktemp()
+        profile.dump(path)
+        stats = pstats.Stats(path)
+        self.assertIn('sorted', ' '.join(function for filename, line, function in stats.stats))
+
+    def test_dumping_collapsed_stacks(self):
+        profile = metrics.StartupProfile('collapsed', interval=0.001)
+        profile.start()
+        self.addCleanup(profile.stop)
+
+        started = metrics.monotonic_time()
+        while not profile.stack_counts and metrics.monotonic_time() - started < 5:
+            sum(range(1000))
+        profile.stop()
+
+        path = self.mktemp()
+        profile.dump(path)
+        with open(path) as collapsed_file:
+            lines = collapsed_file.read().splitlines()
+
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+            self.assertIn('test_dumping_collapsed_stacks', stack)
+
+
+__doctests__ = [metrics]
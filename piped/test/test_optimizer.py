@@ -0,0 +1,207 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+from copy import deepcopy
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from piped import exceptions, processing
+from piped.processors import util_processors
+
+
+class OptimizerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+
+    def _make_evaluators(self, **pipelines):
+        for pipeline_name, pipeline in pipelines.items():
+            self.runtime_environment.configuration_manager.set('pipelines.%s' % pipeline_name, pipeline)
+
+        pgf = processing.ProcessorGraphFactory()
+        pgf.configure(self.runtime_environment)
+
+        evaluators = pgf.make_all_pipelines()
+        for evaluator in evaluators.values():
+            evaluator.configure_processors(self.runtime_environment)
+        return evaluators
+
+    def _get_processor_ids(self, evaluator):
+        return sorted(processor.id for processor in evaluator.processor_graph)
+
+
+class ProcessorGraphOptimizerTest(OptimizerTestCase):
+
+    @defer.inlineCallbacks
+    def _assert_same_results(self, pipeline, baton, expected):
+        evaluators = self._make_evaluators(optimized=dict(deepcopy(pipeline), optimize=True), unoptimized=pipeline)
+        for pipeline_name in 'optimized', 'unoptimized':
+            results = yield evaluators[pipeline_name](dict(baton))
+            self.assertEquals(results, expected)
+        defer.returnValue(evaluators['optimized'])
+
+    @defer.inlineCallbacks
+    def test_removing_passthroughs(self):
+        pipeline = dict(consumers=[
+            {'passthrough': dict(id='start', consumers=[
+                {'set-value': dict(path='a', value=1)},
+                {'passthrough': dict(consumers=[{'set-value': dict(path='b', value=2)}])},
+            ])},
+        ])
+        evaluator = yield self._assert_same_results(pipeline, dict(), [dict(a=1, b=2), dict(a=1, b=2)])
+
+        self.assertEquals(self._get_processor_ids(evaluator), ['set-value-1', 'set-value-2'])
+        self.assertEquals(evaluator.processor_graph.sources, list(evaluator.processor_graph))
+        self.assertEquals([optimization['processor'] for optimization in evaluator.processor_graph.optimizations], ['start', 'passthrough-1'])
+        self.assertEquals(set(optimization['optimization'] for optimization in evaluator.processor_graph.optimizations), set(['removed']))
+
+    @defer.inlineCallbacks
+    def test_merging_setters(self):
+        pipeline = dict(chained_consumers=[
+            {'set-value': dict(path='a.b', value=1)},
+            {'set-values': dict(path_prefix='a.', mapping=dict(c=2, d=3))},
+            {'set-value': dict(path='a', value=4)},
+        ])
+        evaluator = yield self._assert_same_results(pipeline, dict(), [dict(a=4)])
+
+        self.assertEquals(self._get_processor_ids(evaluator), ['set-value-1', 'set-value-2'])
+        merged = evaluator.processor_graph.sources[0]
+        self.assertIsInstance(merged, util_processors.MappingSetter)
+        self.assertEquals(merged.mapping, {'a.b': 1, 'a.c': 2, 'a.d': 3})
+
+        optimization, = evaluator.processor_graph.optimizations
+        self.assertEquals(optimization['optimization'], 'merged')
+        self.assertEquals(optimization['processors'], ['set-value-1', 'set-values-1'])
+
+    @defer.inlineCallbacks
+    def test_merging_remaps(self):
+        pipeline = dict(chained_consumers=[
+            {'remap': dict(mapping=dict(a='b'))},
+            {'remap': dict(input_path_prefix='b', mapping={'': 'c'})},
+            {'remap': dict(mapping=dict(c='d'), deep_copy=True)},
+        ])
+        evaluator = yield self._assert_same_results(pipeline, dict(a=1), [dict(a=1, b=1, c=1, d=1)])
+
+        self.assertEquals(self._get_processor_ids(evaluator), ['remap-1', 'remap-3'])
+        optimization, = evaluator.processor_graph.optimizations
+        self.assertEquals(optimization['processors'], ['remap-1', 'remap-2'])
+
+    @defer.inlineCallbacks
+    def test_inlining_pipelines(self):
+        inner = dict(chained_consumers=[
+            {'set-value': dict(path='inner', value=True)},
+            {'eval-lambda': dict(input_path='n', output_path='n', **{'lambda': 'n: n + 1'})},
+        ])
+        outer = dict(
+            optimize = True,
+            chained_consumers = [
+                {'run-pipeline': dict(id='run', pipeline='.inner')},
+                {'set-value': dict(path='outer', value=True)},
+            ]
+        )
+        evaluators = self._make_evaluators(inner=inner, outer=outer)
+
+        results = yield evaluators['outer'](dict(n=1))
+        self.assertEquals(results, [dict(n=2, inner=True, outer=True)])
+
+        self.assertEquals(self._get_processor_ids(evaluators['outer']), ['run.eval-lambda-1', 'run.set-value-1', 'set-value-1'])
+        optimization, = evaluators['outer'].processor_graph.optimizations
+        self.assertEquals(optimization, dict(optimization='inlined', processor='run', pipeline='inner',
+                                             processors=['run.set-value-1', 'run.eval-lambda-1']))
+
+    def test_branching_pipelines_are_not_inlined(self):
+        inner = dict(consumers=[{'set-value': dict(path='a', value=1)}, {'set-value': dict(path='b', value=2)}])
+        outer = dict(optimize=True, consumers=[{'run-pipeline': dict(pipeline='.inner')}])
+        evaluators = self._make_evaluators(inner=inner, outer=outer)
+
+        self.assertEquals(self._get_processor_ids(evaluators['outer']), ['run-pipeline-1'])
+        self.assertEquals(evaluators['outer'].processor_graph.optimizations, [])
+
+    @defer.inlineCallbacks
+    def test_error_consumers_are_kept(self):
+        pipeline = dict(chained_consumers=[
+            {'passthrough': dict(error_consumers=[{'set-value': dict(path='failed', value=True)}])},
+            {'raise-exception': dict(type='exceptions.ValueError')},
+        ])
+        evaluator = yield self._assert_same_results(pipeline, dict(), [dict(failed=True)])
+
+        self.assertEquals(len(list(evaluator.processor_graph)), 3)
+        self.assertEquals(evaluator.processor_graph.optimizations, [])
+
+    def test_cyclic_graphs_are_not_optimized(self):
+        pipeline = dict(optimize=True, consumers=[
+            {'passthrough': dict(id='loop', consumers=[
+                {'lambda-decider': {'lambda': 'baton: [0] if baton.get("again") else []', 'consumers': [{'existing': 'loop'}]}},
+            ])},
+        ])
+        evaluator = self._make_evaluators(loop=pipeline)['loop']
+        self.assertEquals(len(list(evaluator.processor_graph)), 2)
+        self.assertEquals(evaluator.processor_graph.optimizations, [])
+
+
+class BatonPrunerTest(OptimizerTestCase):
+
+    def _get_pruned(self, evaluator):
+        return [(optimization['producer'], optimization['paths']) for optimization in evaluator.processor_graph.optimizations]
+
+    @defer.inlineCallbacks
+    def test_pruning_paths_that_are_no_longer_read(self):
+        pipeline = dict(prune_batons=['length'], chained_consumers=[
+            {'set-value': dict(path='page', value='a large page')},
+            {'eval-lambda': dict(input_path='page', output_path='length', **{'lambda': 'page: len(page)'})},
+            {'set-value': dict(path='done', value=True)},
+        ])
+        evaluator = self._make_evaluators(pruned=pipeline)['pruned']
+
+        results = yield evaluator(dict(request='kept'))
+        self.assertEquals(results, [dict(request='kept', length=12, done=True)])
+        self.assertEquals(self._get_pruned(evaluator), [('eval-lambda-1', ['page'])])
+        self.assertIn('eval-lambda-1.clean-baton-1', self._get_processor_ids(evaluator))
+
+    @defer.inlineCallbacks
+    def test_processors_that_may_read_anything_keep_paths_alive(self):
+        pipeline = dict(prune_batons=True, chained_consumers=[
+            {'set-value': dict(path='a', value=1)},
+            {'set-value': dict(path='b', value=2)},
+            {'wait': dict(delay=0)},
+        ])
+        evaluator = self._make_evaluators(pruned=pipeline)['pruned']
+
+        results = yield evaluator(dict())
+        self.assertEquals(results, [dict(a=1, b=2)])
+        self.assertEquals(evaluator.processor_graph.optimizations, [])
+
+    @defer.inlineCallbacks
+    def test_paths_read_by_other_consumers_are_kept(self):
+        pipeline = dict(prune_batons=['c'], consumers=[
+            {'set-value': dict(path='a', value=1, consumers=[
+                {'set-value': dict(path='b', value=2)},
+                {'eval-lambda': dict(input_path='a', output_path='c', consumers=[{'set-value': dict(path='d', value=3)}], **{'lambda': 'a: a + 1'})},
+            ])},
+        ])
+        evaluator = self._make_evaluators(pruned=pipeline)['pruned']
+
+        results = yield evaluator(dict())
+        # the first consumer does not read a, but the processor after it does
+        self.assertEquals(results, [dict(b=2, c=2, d=3)] * 2)
+        self.assertEquals(self._get_pruned(evaluator), [('eval-lambda-1', ['a'])])
+
+    @defer.inlineCallbacks
+    def test_paths_read_by_error_consumers_are_kept(self):
+        pipeline = dict(prune_batons=True, chained_consumers=[
+            {'set-value': dict(path='a', value=1, error_consumers=[
+                {'eval-lambda': dict(input_path='a', output_path='failed', **{'lambda': 'a: a'})},
+            ])},
+            {'set-value': dict(path='b', value=2)},
+            {'eval-lambda': dict(input_path='nonexistent', skip_if_nonexistent=False, **{'lambda': 'value: 1 / 0'})},
+        ])
+        evaluator = self._make_evaluators(pruned=pipeline)['pruned']
+
+        results = yield evaluator(dict())
+        self.assertEquals(results, [dict(a=1, failed=1)])
+        self.assertEquals(self._get_pruned(evaluator), [('set-value-2', ['b'])])
+
+    def test_invalid_paths_to_keep(self):
+        pipeline = dict(prune_batons='a', consumers=[{'set-value': dict(path='a', value=1)}])
+        self.assertRaises(exceptions.ConfigurationError, self._make_evaluators, invalid=pipeline)
@@ -1,6 +1,9 @@
 # Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import sys
+
 from twisted.plugin import IPlugin
+from twisted.python import filepath, reflect
 from twisted.trial import unittest
 
 from piped import plugin, processing
@@ -45,3 +48,126 @@ class PluginManagerTest(unittest.TestCase):
 
         self.manager.configure(self.runtime_environment)
         self.assertEquals(self.get_available_plugin_names(), ['bar'])
+
+
+class PluginIndexTest(unittest.TestCase):
+    plugin_source = '\n'.join([
+        'from twisted import plugin',
+        'from zope import interface',
+        'class %(class_name)s(object):',
+        '    interface.classProvides(plugin.IPlugin)',
+        '    name = %(name)r',
+        '    configuration_paths = %(configuration_paths)r',
+    ])
+
+    def setUp(self):
+        self.directory = filepath.FilePath(self.mktemp())
+        self.package_directory = self.directory.child('indexed_plugins')
+        self.package_directory.makedirs()
+        self.package_directory.child('__init__.py').setContent('')
+        self.add_plugin('first', 'First', 'first')
+
+        sys.path.insert(0, self.directory.path)
+        self.addCleanup(sys.path.remove, self.directory.path)
+        self.addCleanup(self._remove_modules)
+
+        self.configuration_manager = processing.RuntimeEnvironment().configuration_manager
+        self.configuration_manager.set('plugins.index', dict(enabled=True, directory=self.directory.path))
+        self.index_file = self.directory.child('twisted.plugin.IPlugin.plugins.index')
+
+    def _remove_modules(self):
+        for module_name in list(sys.modules):
+            if module_name.startswith('indexed_plugins'):
+                del sys.modules[module_name]
+
+    def add_plugin(self, module_name, class_name, name, configuration_paths=None):
+        self.package_directory.child(module_name + '.py').setContent(self.plugin_source % locals())
+
+    def make_manager(self, import_plugins_lazily=False):
+        class IndexedPluginManager(plugin.PluginManager):
+            plugin_packages = [reflect.namedAny('indexed_plugins')]
+            plugin_interface = IPlugin
+
+        IndexedPluginManager.import_plugins_lazily = import_plugins_lazily
+
+        runtime_environment = processing.RuntimeEnvironment()
+        runtime_environment.configuration_manager = self.configuration_manager
+        manager = IndexedPluginManager()
+        manager.configure(runtime_environment)
+        return manager
+
+    def _fail_if_packages_are_searched(self):
+        def fail(manager, package):
+            self.fail('The plugins should have been found in the index.')
+        self.patch(plugin.PluginManager, '_get_plugins_from_package', fail)
+
+    def test_plugins_are_loaded_from_the_index(self):
+        self.make_manager()
+        self.assertTrue(self.index_file.exists())
+
+        self._fail_if_packages_are_searched()
+        manager = self.make_manager()
+        self.assertEquals([name for name, cls in manager.get_all_plugins()], ['first'])
+        self.assertEquals(manager.get_plugin_factory('first'), reflect.namedAny('indexed_plugins.first.First'))
+
+    def test_plugins_are_imported_lazily(self):
+        self.make_manager()
+        self._remove_modules()
+
+        self._fail_if_packages_are_searched()
+        manager = self.make_manager(import_plugins_lazily=True)
+        self.assertEquals(manager.get_qualified_plugin_names(), (('first', 'indexed_plugins.first.First'), ))
+        self.assertNotIn('indexed_plugins.first', sys.modules)
+
+        manager.get_plugin_factory('first')
+        self.assertIn('indexed_plugins.first', sys.modules)
+
+        record = plugin.import_records[-1]
+        self.assertEquals(record['name'], 'indexed_plugins.first.First')
+        self.assertEquals(record['modules'], ['indexed_plugins.first'])
+        self.assertIn('indexed_plugins.first.First', plugin.format_import_report([record]))
+
+    def test_lazy_imports_may_be_disabled(self):
+        self.make_manager()
+        self._remove_modules()
+
+        self.configuration_manager.set('plugins.index.lazy_imports', False)
+        self.make_manager(import_plugins_lazily=True)
+        self.assertIn('indexed_plugins.first', sys.modules)
+
+    def test_only_configured_plugins_are_imported(self):
+        self.add_plugin('configured', 'Configured', 'configured', ['configured'])
+        self.add_plugin('unconfigured', 'Unconfigured', 'unconfigured', ['unconfigured.a', 'unconfigured.b'])
+        self.make_manager()
+        self._remove_modules()
+
+        self.configuration_manager.set('configured', dict())
+        manager = self.make_manager(import_plugins_lazily=True)
+        plugins = manager.import_configured_plugins()
+
+        self.assertEquals(sorted(cls.name for cls in plugins), ['configured', 'first'])
+        self.assertNotIn('indexed_plugins.unconfigured', sys.modules)
+
+        # plugins that are requested by name are imported regardless
+        self.assertEquals(manager.get_plugin_factory('unconfigured').name, 'unconfigured')
+
+    def test_added_modules_invalidate_the_index(self):
+        self.make_manager()
+        self.add_plugin('second', 'Second', 'second')
+
+        manager = self.make_manager()
+        self.assertEquals(sorted(name for name, cls in manager.get_all_plugins()), ['first', 'second'])
+
+    def test_changed_modules_invalidate_the_index(self):
+        manager = self.make_manager()
+
+        first = self.package_directory.child('first.py')
+        first.setContent(first.getContent() + '\n')
+        index = manager._get_plugin_index(manager.plugin_packages)
+        self.assertEquals(index.load(), None)
+
+    def test_unreadable_index(self):
+        self.index_file.setContent('not a pickle')
+        manager = self.make_manager()
+        self.assertEquals([name for name, cls in manager.get_all_plugins()], ['first'])
+        self.assertNotEquals(self.index_file.getContent(), 'not a pickle')
@@ -0,0 +1,215 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+import json
+import os
+
+import yaml
+from twisted.internet import defer, endpoints, protocol, reactor, ssl
+from twisted.protocols import basic
+from twisted.python import filepath
+from twisted.trial import unittest
+from twisted.web import client
+
+from piped import conf, exceptions, prefork, util
+
+
+class TestListenDescriptions(unittest.TestCase):
+
+    def test_descriptions_of_web_pb_and_smtp_servers(self):
+        configuration_manager = conf.ConfigurationManager()
+        configuration_manager.set('web', dict(
+            default = dict(routing=dict()),
+            port = dict(port=8081),
+            listen = dict(listen='tcp:8082:interface=127.0.0.1', port=8083),
+            disabled = dict(port=8084, enabled=False),
+        ))
+        configuration_manager.set('pb.servers.server', dict(listen=['tcp:8790', 'tcp:8791'], processor='pipeline.pb'))
+        configuration_manager.set('smtp.server', dict(listen='tcp:8025', processor='pipeline.smtp'))
+
+        descriptions = prefork.get_listen_descriptions(configuration_manager)
+        self.assertEquals(sorted(descriptions), ['8080', '8081', 'tcp:8025', 'tcp:8082:interface=127.0.0.1', 'tcp:8790', 'tcp:8791'])
+
+
+class TestSharingSockets(unittest.TestCase):
+    description = 'tcp:0:interface=127.0.0.1'
+
+    def _bind(self, description):
+        listener = prefork.bind(description)
+        self.addCleanup(listener.close)
+        return listener
+
+    def test_binding_tcp_sockets(self):
+        listener = self._bind(self.description)
+        host, port = listener.getsockname()
+        self.assertEquals(host, '127.0.0.1')
+        self.assertNotEquals(port, 0)
+
+    def test_only_tcp_sockets_are_shared(self):
+        self.assertRaises(exceptions.ConfigurationError, prefork.bind, 'unix:%s' % self.mktemp())
+
+    def test_services_use_the_sockets_of_the_supervisor(self):
+        self.assertEquals(prefork.get_inherited_listeners(), dict())
+        listener = self._bind(self.description)
+
+        inherited_listeners = {self.description: [listener.fileno(), listener.family]}
+        self.patch(os, 'environ', dict(os.environ, PIPED_INHERITED_LISTENERS=json.dumps(inherited_listeners)))
+        self.assertEquals(prefork.get_inherited_listeners(), {self.description: (listener.fileno(), listener.family)})
+
+        other_service = prefork.listening_service('tcp:0', protocol.Factory())
+        self.assertNotIsInstance(other_service.endpoint, prefork.InheritedListenerEndpoint)
+
+        factory = protocol.ServerFactory()
+        factory.protocol = protocol.Protocol
+        service = prefork.listening_service(self.description, factory)
+        self.assertIsInstance(service.endpoint, prefork.InheritedListenerEndpoint)
+        return self._assert_service_accepts_connections(service, listener.getsockname()[1])
+
+    @defer.inlineCallbacks
+    def test_ssl_on_inherited_sockets(self):
+        data_dir = filepath.FilePath(__file__).parent().parent().child('providers').child('test').child('data')
+        description = 'ssl:0:interface=127.0.0.1:privateKey=%s:certKey=%s' % (data_dir.child('server.key').path, data_dir.child('server.crt').path)
+        listener = self._bind(description)
+
+        inherited_listeners = {description: [listener.fileno(), listener.family]}
+        self.patch(os, 'environ', dict(os.environ, PIPED_INHERITED_LISTENERS=json.dumps(inherited_listeners)))
+
+        factory = protocol.ServerFactory()
+        factory.protocol = EchoLine
+        service = prefork.listening_service(description, factory)
+        service.startService()
+        self.addCleanup(service.stopService)
+
+        client_endpoint = endpoints.SSL4ClientEndpoint(reactor, '127.0.0.1', listener.getsockname()[1], ssl.ClientContextFactory())
+        client_factory = protocol.ClientFactory()
+        client_factory.protocol = EchoLine
+        connection = yield client_endpoint.connect(client_factory)
+        connection.lines, connection.lost = defer.DeferredQueue(), defer.Deferred()
+        connection.sendLine('hello')
+        line = yield connection.lines.get()
+        connection.transport.loseConnection()
+        yield connection.lost
+        self.assertEquals(line, 'hello')
+
+    @defer.inlineCallbacks
+    def _assert_service_accepts_connections(self, service, port):
+        client_endpoint = endpoints.TCP4ClientEndpoint(reactor, '127.0.0.1', port)
+        client_factory = protocol.ClientFactory()
+        client_factory.protocol = protocol.Protocol
+
+        # the socket is kept open when the service stops, so it can be started again
+        for i in range(2):
+            service.startService()
+            connection = yield client_endpoint.connect(client_factory)
+            connection.transport.loseConnection()
+            yield service.stopService()
+
+
+class EchoLine(basic.LineReceiver):
+    """ Echoes lines when it is a server, and collects them when it is a client. """
+    lines = lost = None
+
+    def lineReceived(self, line):
+        if self.lines is None:
+            self.sendLine(line)
+        else:
+            self.lines.put(line)
+
+    def connectionLost(self, reason):
+        if self.lost is not None:
+            self.lost.callback(None)
+
+
+class TestSupervisor(unittest.TestCase):
+    timeout = 60
+    description = 'tcp:0:interface=127.0.0.1'
+
+    def setUp(self):
+        self.configuration_path = os.path.abspath(self.mktemp())
+        self.logging_configuration_path = os.path.abspath(self.mktemp())
+
+    def _write_configuration(self, processor='pipeline.pid'):
+        configuration = dict(
+            web = dict(site=dict(listen=self.description, routing=dict(__config__=dict(processor=processor)))),
+            pipelines = dict(pid=[
+                {'eval-lambda': {'lambda': 'baton: str(os.getpid())', 'namespace': dict(os='os'), 'output_path': 'content'}},
+                'write-web-response',
+            ]),
+            workers = dict(stats_interval=0.1),
+        )
+        for path, contents in (self.configuration_path, configuration), (self.logging_configuration_path, dict(version=1)):
+            with open(path, 'w') as configuration_file:
+                yaml.dump(contents, configuration_file)
+
+    def _make_supervisor(self, processor='pipeline.pid', **kwargs):
+        self._write_configuration(processor)
+        configuration_manager = conf.ConfigurationManager()
+        configuration_manager.load_from_file(self.configuration_path)
+
+        worker_arguments = ['--nodaemon', '--conf', self.configuration_path, '--logging-config', self.logging_configuration_path]
+        supervisor = prefork.Supervisor(2, worker_arguments, prefork.get_listen_descriptions(configuration_manager),
+                                        stats_interval=0.1, **kwargs)
+        self.addCleanup(lambda: supervisor.running and supervisor.stopService())
+        return supervisor
+
+    @defer.inlineCallbacks
+    def _wait_for_workers(self, supervisor):
+        while len(supervisor.workers) < supervisor.size or any(worker.state != 'running' for worker in supervisor.workers):
+            yield util.wait(0.05)
+
+    @defer.inlineCallbacks
+    def test_serving_with_workers(self):
+        stats_file = os.path.abspath(self.mktemp())
+        supervisor = self._make_supervisor(stats_file=stats_file)
+        supervisor.startService()
+        yield self._wait_for_workers(supervisor)
+
+        port = supervisor.listeners[self.description].getsockname()[1]
+        pids = set()
+        for i in range(4):
+            pid = yield client.getPage('http://127.0.0.1:%i/' % port)
+            pids.add(int(pid))
+        self.assertTrue(pids.issubset(worker.pid for worker in supervisor.workers))
+
+        # the stats of the pipeline are summed over the workers
+        while supervisor.get_stats()['pipelines'].get('pid', dict()).get('completed') != 4:
+            yield util.wait(0.05)
+        self.assertEquals(supervisor.get_stats()['pipelines']['pid']['latency']['count'], 4)
+
+        crashed_worker = supervisor.workers[0]
+        crashed_worker.kill()
+        yield crashed_worker.ended
+        yield self._wait_for_workers(supervisor)
+        self.assertEquals(supervisor.crashed, 1)
+        self.assertNotIn(crashed_worker, supervisor.workers)
+
+        pid = yield client.getPage('http://127.0.0.1:%i/' % port)
+        self.assertIn(int(pid), [worker.pid for worker in supervisor.workers])
+
+        workers = list(supervisor.workers)
+        stopped = list()
+        for worker in workers:
+            worker.ended.addCallback(lambda _, worker=worker: stopped.append((worker, [other.state for other in workers])))
+
+        yield supervisor.stopService()
+
+        # the workers were stopped one at a time
+        self.assertEquals(stopped, [(workers[0], ['stopped', 'running']), (workers[1], ['stopped', 'stopped'])])
+        self.assertEquals(supervisor.workers, [])
+        self.assertEquals(supervisor.listeners, dict())
+
+        with open(stats_file) as stats:
+            self.assertEquals(json.load(stats)['crashed'], 1)
+
+    @defer.inlineCallbacks
+    def test_workers_that_fail_to_start_are_restarted_later(self):
+        supervisor = self._make_supervisor('pipeline.nonexistent', restart_delay=60)
+        supervisor.startService()
+
+        while supervisor.crashed < 2:
+            yield util.wait(0.05)
+
+        self.assertEquals(supervisor.workers, [])
+        self.assertEquals(sorted(supervisor._delayed_spawns), [0, 1])
+
+        yield supervisor.stopService()
+        self.assertEquals(supervisor._delayed_spawns, dict())
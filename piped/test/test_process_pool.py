@@ -0,0 +1,179 @@
+# Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
+# See LICENSE for details.
+import os
+import signal
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from piped import exceptions, process_pool, processing, util
+from piped.providers import pipeline_provider
+
+
+class ProcessPoolEvaluatorTest(unittest.TestCase):
+    timeout = 30
+
+    def setUp(self):
+        self.runtime_environment = processing.RuntimeEnvironment()
+        self.runtime_environment.configure()
+
+    def _make_evaluator(self, consumers, **evaluator_options):
+        evaluator_options['kind'] = 'process-pool'
+        self.runtime_environment.configuration_manager.set('pipelines.test_pipeline', dict(
+            evaluator=evaluator_options,
+            chained_consumers=consumers,
+        ))
+
+        pgf = processing.ProcessorGraphFactory()
+        pgf.configure(self.runtime_environment)
+        evaluator = pgf.make_evaluator('test_pipeline')
+        evaluator.configure_processors(self.runtime_environment)
+        self.addCleanup(evaluator.stop)
+        return evaluator
+
+    def _make_sleeping_evaluator(self, **evaluator_options):
+        return self._make_evaluator([{'eval-lambda': {'lambda': 'baton: time.sleep(baton["sleep"])', 'namespace': dict(time='time')}}], **evaluator_options)
+
+    def _make_pid_evaluator(self, **evaluator_options):
+        get_pid = {'eval-lambda': {'lambda': 'baton: os.getpid()', 'namespace': dict(os='os'), 'output_path': 'pid'}}
+        return self._make_evaluator([get_pid], **evaluator_options)
+
+    def test_evaluator_kind(self):
+        evaluator = self._make_pid_evaluator(size=2)
+        self.assertIsInstance(evaluator, process_pool.ProcessPoolEvaluator)
+        self.assertEquals(evaluator.pool.size, 2)
+
+    def test_invalid_evaluator_options(self):
+        self.runtime_environment.configuration_manager.set('pipelines.test_pipeline', dict(
+            evaluator=dict(kind='process-pool', sizes=2),
+            chained_consumers=['passthrough'],
+        ))
+        pgf = processing.ProcessorGraphFactory()
+        pgf.configure(self.runtime_environment)
+        self.assertRaises(exceptions.ConfigurationError, pgf.make_evaluator, 'test_pipeline')
+
+    @defer.inlineCallbacks
+    def test_processing_in_workers(self):
+        evaluator = self._make_pid_evaluator(size=2)
+
+        results = yield defer.gatherResults([evaluator(dict(n=i)) for i in range(10)])
+
+        pids = set()
+        for i, (baton, ) in enumerate(results):
+            self.assertEquals(baton['n'], i)
+            pids.add(baton['pid'])
+
+        self.assertFalse(os.getpid() in pids)
+        self.assertTrue(pids.issubset(worker.pid for worker in evaluator.pool.workers))
+        self.assertEquals(len(evaluator.pool.workers), 2)
+
+        summary = evaluator.stats.as_dict()
+        self.assertEquals(summary['completed'], 10)
+        self.assertEquals(sum(worker['tasks'] for worker in summary['workers']), 10)
+        # a worker that did not get any batons may still be starting.
+        self.assertFalse('busy' in set(worker['state'] for worker in summary['workers']))
+
+    @defer.inlineCallbacks
+    def test_processing_failures(self):
+        evaluator = self._make_evaluator([{'raise-exception': dict(type='exceptions.ValueError', args=['failed'])}], size=1)
+
+        e = yield self.assertFailure(evaluator(dict()), ValueError)
+        self.assertEquals(e.args, ('failed', ))
+        self.assertEquals(evaluator.stats.failed, 1)
+
+    @defer.inlineCallbacks
+    def test_unpicklable_baton(self):
+        evaluator = self._make_pid_evaluator(size=1)
+        yield self.assertFailure(evaluator(dict(f=lambda: None)), exceptions.ProcessPoolError)
+        self.assertEquals(evaluator.stats.failed, 1)
+
+    @defer.inlineCallbacks
+    def test_recycling_workers(self):
+        evaluator = self._make_pid_evaluator(size=1, max_tasks=2)
+
+        pids = list()
+        for i in range(5):
+            baton, = yield evaluator(dict())
+            pids.append(baton['pid'])
+
+        self.assertEquals(pids[0], pids[1])
+        self.assertEquals(pids[2], pids[3])
+        self.assertEquals(len(set(pids)), 3)
+        self.assertEquals(evaluator.stats.recycled, 2)
+        self.assertEquals(evaluator.stats.crashed, 0)
+
+    @defer.inlineCallbacks
+    def test_crashed_worker_is_replaced(self):
+        evaluator = self._make_sleeping_evaluator(size=1)
+
+        yield evaluator(dict(sleep=0))
+        worker, = evaluator.pool.workers
+        d = evaluator(dict(sleep=10))
+        os.kill(worker.pid, signal.SIGKILL)
+        yield self.assertFailure(d, exceptions.ProcessPoolError)
+
+        yield evaluator(dict(sleep=0))
+        self.assertEquals(evaluator.stats.crashed, 1)
+        self.assertNotEquals(evaluator.pool.workers[0].pid, worker.pid)
+
+    @defer.inlineCallbacks
+    def test_cancelled_batons_are_not_sent_to_workers(self):
+        evaluator = self._make_sleeping_evaluator(size=1)
+        scope = util.CancellationScope()
+        scope.cancel()
+
+        yield self.assertFailure(processing.call_in_scope(scope, evaluator, dict(sleep=0)), defer.CancelledError)
+        self.assertEquals(evaluator.pool.workers, [])
+        self.assertEquals((evaluator.stats.completed, evaluator.stats.failed), (0, 0))
+
+    @defer.inlineCallbacks
+    def test_cancelling_queued_batons(self):
+        evaluator = self._make_sleeping_evaluator(size=1)
+        yield evaluator(dict(sleep=0))
+
+        d = evaluator(dict(sleep=0.2))
+        scope = util.CancellationScope()
+        cancelled = processing.call_in_scope(scope, evaluator, dict(sleep=0))
+        self.assertEquals(len(evaluator.pool.queue), 1)
+
+        scope.cancel()
+        self.assertEquals(len(evaluator.pool.queue), 0)
+        yield self.assertFailure(cancelled, defer.CancelledError)
+        yield d
+        self.assertEquals(evaluator.pool.workers[0].tasks, 2)
+
+    @defer.inlineCallbacks
+    def test_building_the_pipeline_of_a_worker(self):
+        evaluator_kinds = dict(processing.ProcessorGraphFactory.evaluator_kinds)
+        created = list()
+        create_pipeline = pipeline_provider.PipelineProvider._create_pipeline
+        def _create_pipeline(provider, pipeline_name):
+            created.append(pipeline_name)
+            return create_pipeline(provider, pipeline_name)
+        self.patch(pipeline_provider.PipelineProvider, '_create_pipeline', _create_pipeline)
+
+        configuration = dict(
+            pipelines = dict(
+                pooled = dict(evaluator='process-pool', chained_consumers=['passthrough']),
+                served = ['passthrough'],
+                started = ['passthrough'],
+            ),
+            web = dict(site=dict(routing=dict(__config__=dict(processor='pipeline.served')))),
+            thread_pools = dict(blocking=dict()),
+        )
+        configuration['system-events'] = dict(startup=dict(started='pipeline.started'))
+        pipeline = yield process_pool._build_pipeline('pooled', configuration)
+        yield util.wait(0)
+
+        # the pipeline is evaluated in the worker itself, and neither the web site nor the
+        # startup event is configured, so their pipelines are not built.
+        self.assertIsInstance(pipeline, processing.TwistedProcessorGraphEvaluator)
+        self.assertNotIsInstance(pipeline, process_pool.ProcessPoolEvaluator)
+        self.assertEquals(created, ['pooled'])
+        self.assertEquals(processing.ProcessorGraphFactory.evaluator_kinds, evaluator_kinds)
+
+    @defer.inlineCallbacks
+    def test_worker_startup_failure(self):
+        evaluator = self._make_evaluator([{'eval-lambda': {'lambda': 'baton: baton', 'namespace': dict(missing='no_such_module')}}], size=1, restart_delay=60)
+        yield self.assertFailure(evaluator(dict()), exceptions.ProcessPoolError)
+        self.assertEquals(evaluator.stats.crashed, 1)
@@ -1,17 +1,21 @@
 # encoding: utf8
 # Copyright (c) 2010-2011, Found IT A/S and Piped Project Contributors.
 # See LICENSE for details.
+import copy
 import difflib
 import pprint
+import sys
+import threading
 import warnings
 
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, task
 from twisted.trial import unittest
-from twisted.python import failure
+from twisted.python import failure, filepath
 from zope import interface
 
 from piped import exceptions, processing, util
 from piped.processors import base, util_processors, pipeline_processors
+from piped.providers import thread_pool_provider
 
 
 class StubProcessorGraphFactory(processing.ProcessorGraphFactory):
@@ -34,7 +38,7 @@ class StubException(Exception):
 class StubPluginManager(object):
 
     def __init__(self):
-        self.plugins = set([ReversingProcessor, UppercasingProcessor, LowercasingProcessor, ExceptionRaisingProcessor])
+        self.plugins = set([ReversingProcessor, UppercasingProcessor, LowercasingProcessor, ExceptionRaisingProcessor, ThreadNamingProcessor])
         self.plugin_by_name = {}
         self._providers_by_keyword = dict()
         for plugin_class in self.plugins:
@@ -117,13 +121,53 @@ class DelayedErrbackProcessor(StubProcessor):
         raise StubException
 
 
+class WaitingProcessor(StubProcessor):
+    """ Processor that sets a key in the baton when the test callbacks its deferred. """
+
+    def __init__(self, key, **kw):
+        super(WaitingProcessor, self).__init__(**kw)
+        self.key = key
+        self.deferreds = list()
+
+    def process(self, baton):
+        d = defer.Deferred()
+        d.addCallback(lambda _: baton.__setitem__(self.key, True) or baton)
+        self.deferreds.append(d)
+        return d
+
+
+class ThreadNamingProcessor(StubProcessor):
+    """ Processor that returns the name of the thread it processes batons in. """
+    name = 'thread-name'
+
+    def process(self, baton):
+        return threading.current_thread().name
+
+
+class BatchUppercasingProcessor(UppercasingProcessor):
+    """ Uppercases batches of batons, remembering the size of each batch. """
+    name = 'batch-uppercase'
+
+    def __init__(self, **kw):
+        super(BatchUppercasingProcessor, self).__init__(**kw)
+        self.batch_sizes = list()
+
+    def process_batch(self, batons):
+        self.batch_sizes.append(len(batons))
+        if 'raise' in batons:
+            raise StubException()
+        return [baton.upper() for baton in batons]
+
+
 class ProcessorGraphTest(unittest.TestCase):
+    evaluator_class = processing.TwistedProcessorGraphEvaluator
 
     def setUp(self):
         self.plugin_manager = StubPluginManager()
 
     def get_processor_graph_factory(self, pipelines_configuration):
         pgf = processing.ProcessorGraphFactory()
+        pgf.default_graph_evaluator = self.evaluator_class
         runtime_environment = processing.RuntimeEnvironment()
         runtime_environment.configuration_manager.set('pipelines', pipelines_configuration)
         pgf.configure(runtime_environment)
@@ -176,10 +220,78 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         last_processor = list(pg.sinks)[0]
         pg.add_producer_and_consumer(last_processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
         self.assertEquals(l, ['CBA'])
 
+    def test_concurrent_consumers_options(self):
+        pipeline_configuration = dict(
+            concurrent_consumers = True,
+            consumers = [
+                dict(__processor__='uppercase', consumer_baton_copy='deep', consumers=['reverse', 'lowercase']),
+                dict(__processor__='reverse', concurrent_consumers=False),
+            ]
+        )
+        pgf = self.get_processor_graph_factory(dict(pipeline=pipeline_configuration))
+        definition = copy.deepcopy(pgf.pipelines_configuration['pipeline'])
+        evaluator = pgf.make_evaluator('pipeline')
+
+        # the options are not written into the pipeline definition
+        self.assertEquals(pgf.pipelines_configuration['pipeline'], definition)
+
+        options = [(processor.name, processor.concurrent_consumers, processor.consumer_baton_copy) for processor in evaluator]
+        self.assertEquals(sorted(options), [
+            ('lowercase', True, 'shallow'),
+            ('reverse', False, 'shallow'),
+            ('reverse', True, 'shallow'),
+            ('uppercase', True, 'deep'),
+        ])
+
+    def test_admission_control_options(self):
+        pipelines_configuration = dict(
+            limited = dict(max_in_flight=10, max_queued=100, consumers=['uppercase']),
+            inheriting = dict(inherits='limited', max_queued=0, overrides=list()),
+            unlimited = ['uppercase'],
+        )
+        pgf = self.get_processor_graph_factory(pipelines_configuration)
+
+        admission_control = pgf.make_evaluator('limited').admission_control
+        self.assertEquals((admission_control.max_in_flight, admission_control.max_queued), (10, 100))
+        admission_control = pgf.make_evaluator('inheriting').admission_control
+        self.assertEquals((admission_control.max_in_flight, admission_control.max_queued), (10, 0))
+        self.assertEquals(pgf.make_evaluator('unlimited').admission_control, None)
+
+    def test_invalid_admission_control_options(self):
+        pgf = self.get_processor_graph_factory(dict(pipeline=dict(max_in_flight=0, consumers=['uppercase'])))
+        exc = self.assertRaises(exceptions.ConfigurationError, pgf.make_evaluator, 'pipeline')
+        self.assertIn('max_in_flight', exc.msg)
+
+    @defer.inlineCallbacks
+    def test_run_in_thread(self):
+        runtime_environment = processing.RuntimeEnvironment()
+        runtime_environment.configure()
+        runtime_environment.configuration_manager.set('thread_pools.test_pool', dict(max_threads=1))
+        provider = thread_pool_provider.ThreadPoolProvider()
+        provider.configure(runtime_environment)
+        self.addCleanup(provider['test_pool'].stopService)
+
+        pgf = self.get_processor_graph_factory(dict(pipeline=[dict(__processor__='thread-name', run_in_thread='test_pool'), 'thread-name']))
+        evaluator = pgf.make_evaluator('pipeline')
+        evaluator.configure_processors(runtime_environment)
+        runtime_environment.dependency_manager.resolve_initial_states()
+
+        threaded, unthreaded = evaluator.processor_graph.sources[0], evaluator.processor_graph.sinks[0]
+        self.assertEquals((threaded.run_in_thread, unthreaded.run_in_thread), ('test_pool', None))
+
+        self.assertIn('piped-test_pool', (yield threaded.process(None)))
+        self.assertEquals(unthreaded.process(None), threading.current_thread().name)
+        self.assertEquals(provider['test_pool'].stats.completed, 1)
+
+    def test_invalid_consumer_baton_copy(self):
+        pgf = self.get_processor_graph_factory(dict(pipeline=[dict(uppercase=dict(consumer_baton_copy='some'))]))
+        exc = self.assertRaises(exceptions.ConfigurationError, pgf.make_evaluator, 'pipeline')
+        self.assertIn('consumer_baton_copy', exc.msg)
+
     def test_unicode_in_processor_configuration_key_raises(self):
         # source -> uppercase -> reverse -> sink
         pipeline_configuration = {
@@ -210,7 +322,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         gf = self.get_processor_graph_factory(pipeline_configuration)
         pg = gf.make_processor_graph('only-pipeline')
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
 
         try:
             yield evaluator.process('abc')
@@ -247,7 +359,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         for sink in list(pg.sinks):
             pg.add_producer_and_consumer(sink, list_appender)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
         self.assertEquals(l, ['cba'])
 
@@ -278,7 +390,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         for sink in list(pg.sinks):
             pg.add_producer_and_consumer(sink, list_appender)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
         self.assertEquals(l, ['cba'])
 
@@ -314,7 +426,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         for sink in list(pg.sinks):
             pg.add_producer_and_consumer(sink, list_appender)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
         self.assertEquals(l, ['CBA', 'cba'])
 
@@ -345,7 +457,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         last_processor = list(pg.sinks)[0]
         pg.add_producer_and_consumer(last_processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
         self.assertEquals(l, ['CBA'])
 
@@ -379,7 +491,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         for processor in list(pg.sinks):
             pg.add_producer_and_consumer(processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('aBc')
         self.assertEquals(l, ['CBA', 'cba'])
 
@@ -409,7 +521,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         for processor in list(pg.sinks):
             pg.add_producer_and_consumer(processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('aBc')
         self.assertEquals(l, ['ABC', 'abc'])
 
@@ -446,7 +558,7 @@ class TestProcessorGraphFactory(ProcessorGraphTest):
         last_processor = list(pg.sinks)[0]
         pg.add_producer_and_consumer(last_processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('aBc')
         self.assertEquals(l, ['CBA', 'cba'])
 
@@ -1714,6 +1826,68 @@ class TestMisconfigurationHinting(ProcessorGraphTest):
         self.assertEquals([repr(w.message) for w in recorded_warnings], [expected_warning])
 
 
+class TestPipelineDefinitionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.configuration_file = filepath.FilePath(self.mktemp())
+        self.configuration_file.setContent('\n'.join([
+            'pipeline_cache:',
+            '    enabled: true',
+            'pipelines:',
+            '    base: [passthrough]',
+            '    inheriting:',
+            '        inherits: base',
+            '        overrides: []',
+        ]))
+        self.cache_file = filepath.FilePath(self.configuration_file.path + '.pipelines.cache')
+
+    def _configure_factory(self, *overrides):
+        runtime_environment = processing.RuntimeEnvironment()
+        runtime_environment.configure()
+        runtime_environment.configuration_manager.load_from_file(self.configuration_file.path)
+        runtime_environment.configuration_manager.load_overrides(overrides)
+
+        pgf = processing.ProcessorGraphFactory()
+        pgf.configure(runtime_environment)
+        return pgf
+
+    def _fail_if_pipelines_are_processed(self):
+        def fail():
+            self.fail('The pipeline definitions should have been cached.')
+        self.patch(processing.ProcessorGraphFactory, '_nest_chained_consumers', lambda pgf: fail())
+
+    def test_caching_pipeline_definitions(self):
+        pipelines_configuration = self._configure_factory().pipelines_configuration
+        self.assertTrue(self.cache_file.exists())
+
+        self._fail_if_pipelines_are_processed()
+        pgf = self._configure_factory()
+        self.assertEquals(pgf.pipelines_configuration, pipelines_configuration)
+        self.assertEquals(pgf.pipelines_configuration['inheriting']['consumers'], [dict(__processor__='passthrough')])
+        pgf.make_evaluator('inheriting')
+
+    def test_changed_configuration_invalidates_the_cache(self):
+        self._configure_factory()
+
+        self.configuration_file.setContent(self.configuration_file.getContent().replace('passthrough', 'set-value'))
+        pgf = self._configure_factory()
+        self.assertEquals(pgf.pipelines_configuration['inheriting']['consumers'], [dict(__processor__='set-value')])
+
+        pgf = self._configure_factory('pipelines.base:[stop]')
+        self.assertEquals(pgf.pipelines_configuration['inheriting']['consumers'], [dict(__processor__='stop')])
+
+    def test_unreadable_cache(self):
+        self.cache_file.setContent('not a pickle')
+        pgf = self._configure_factory()
+        self.assertEquals(pgf.pipelines_configuration['base']['consumers'], [dict(__processor__='passthrough')])
+        self.assertNotEquals(self.cache_file.getContent(), 'not a pickle')
+
+    def test_disabled_cache(self):
+        pgf = self._configure_factory('pipeline_cache.enabled:false')
+        self.assertEquals(pgf.pipeline_cache, None)
+        self.assertFalse(self.cache_file.exists())
+
+
 class TestConditional(ProcessorGraphTest):
 
     def setUp(self):
@@ -1762,7 +1936,7 @@ class TestConditional(ProcessorGraphTest):
         last_processor = list(pg.sinks)[0]
         pg.add_producer_and_consumer(last_processor, sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         evaluator.configure_processors(processing.RuntimeEnvironment())
         yield evaluator.process('uPpEr')
         self.assertEquals(l, ['REPPU', 'rEpPu'])
@@ -1783,7 +1957,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         builder.add_processor(passthrough).add_processor(incrementing)
         builder.add_processor(waiter)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         self.assertEquals([evaluator[i] for i in range(3)], [passthrough, incrementing, waiter])
         self.assertEquals([evaluator[-i] for i in range(1, 4)], [waiter, incrementing, passthrough])
@@ -1794,7 +1968,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         only_processor = ListAppendingProcessor(l)
         pipeline = processing.ProcessorGraph()
         pipeline.get_builder().add_processor(only_processor)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pipeline)
+        evaluator = self.evaluator_class(pipeline)
         yield evaluator.process('foo')
         self.assertEquals(l, ['foo'])
 
@@ -1809,7 +1983,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder = pipeline.get_builder()
         builder.add_processor(uppercaser).add_processor(reverser).add_processor(sink)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pipeline)
+        evaluator = self.evaluator_class(pipeline)
         yield evaluator.process('foo')
         yield evaluator.process('bar')
         self.assertEquals(l, ['OOF', 'RAB'])
@@ -1827,7 +2001,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder = pipeline.get_builder()
         builder.add_processor(uppercaser).add_processor(later).add_processor(reverser).add_processor(later2).add_processor(sink)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pipeline)
+        evaluator = self.evaluator_class(pipeline)
         yield evaluator.process('foo')
         yield evaluator.process('bar')
         self.assertEquals(l, ['OOF', 'RAB'])
@@ -1844,7 +2018,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         builder.add_processor(UppercasingProcessor()).add_processor(a)
         builder.add_processor(ReversingProcessor()).add_processor(b)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
 
         self.assertEquals(collected_by_a, ['ABC'])
@@ -1859,7 +2033,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         builder = pg.get_builder()
         builder.add_processors(UppercasingProcessor(), ReversingProcessor()).add_processor(sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
 
         self.assertEquals(l, ['ABC', 'cba'])
@@ -1873,7 +2047,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         builder = pg.get_builder()
         builder.add_processors(ReversingProcessor(), UppercasingProcessor()).add_processor(sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('abc')
 
         self.assertEquals(l, ['cba', 'ABC'])
@@ -1889,7 +2063,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
                                                    LowercasingProcessor())
         upper_and_lower.add_processor(sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('aBc')
 
         self.assertEquals(l, ['CBA', 'cba'])
@@ -1905,7 +2079,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
                                                    UppercasingProcessor())
         upper_and_lower.add_processor(sink)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process('aBc')
 
         self.assertEquals(l, ['cba', 'CBA'])
@@ -1931,13 +2105,250 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         runtime_environment = processing.RuntimeEnvironment()
         runtime_environment.configure()
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         evaluator.configure_processors(runtime_environment)
 
         baton = dict(n=0)
         yield evaluator.process(baton)
         self.assertEquals(baton, dict(n=10))
 
+    @defer.inlineCallbacks
+    def test_error_consumers_of_producers_handle_failing_consumers(self):
+        l = []
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        uppercaser = builder.add_processor(UppercasingProcessor())
+        uppercaser.add_processor(CallbackingLaterProcessor()).add_processor(ExceptionRaisingProcessor())
+        uppercaser.add_processor(ListAppendingProcessor(l, node_name='skipped'))
+        uppercaser.add_processor(ReversingProcessor(), is_error_consumer=True)
+
+        evaluator = self.evaluator_class(pg)
+        results = yield evaluator.process('abc')
+
+        # the failing consumer stops the remaining consumers, and the
+        # error consumer gets the input of the uppercaser.
+        self.assertEquals(results, ['cba'])
+        self.assertEquals(l, [])
+
+    @defer.inlineCallbacks
+    def test_concurrent_consumers(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        producer = util_processors.Passthrough()
+        producer.concurrent_consumers = True
+        waiters = [WaitingProcessor(key) for key in 'abc']
+
+        producer_builder = builder.add_processor(producer)
+        for waiter in waiters:
+            producer_builder.add_processor(waiter)
+
+        evaluator = self.evaluator_class(pg)
+        d = evaluator.process(dict(n=0))
+
+        # all the consumers are processing at the same time
+        self.assertEquals([len(waiter.deferreds) for waiter in waiters], [1, 1, 1])
+
+        for waiter in reversed(waiters):
+            waiter.deferreds[0].callback(None)
+        results = yield d
+
+        # the results are in the order of the consumers, and every consumer got its own copy of the baton.
+        self.assertEquals(results, [dict(n=0, a=True), dict(n=0, b=True), dict(n=0, c=True)])
+
+    @defer.inlineCallbacks
+    def test_concurrent_consumers_without_copying(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        producer = util_processors.Passthrough()
+        producer.concurrent_consumers = True
+        producer.consumer_baton_copy = 'none'
+
+        builder.add_processor(producer).add_processors(IncrementingProcessor(), IncrementingProcessor())
+
+        evaluator = self.evaluator_class(pg)
+        baton = dict(n=0)
+        results = yield evaluator.process(baton)
+
+        self.assertEquals(baton, dict(n=2))
+        self.assertEquals([result is baton for result in results], [True, True])
+
+    @defer.inlineCallbacks
+    def test_error_consumers_of_producers_handle_failing_concurrent_consumers(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        producer = UppercasingProcessor()
+        producer.concurrent_consumers = True
+        uppercaser = builder.add_processor(producer)
+        uppercaser.add_processor(CallbackingLaterProcessor()).add_processor(ReversingProcessor())
+        uppercaser.add_processor(DelayedErrbackProcessor())
+        uppercaser.add_processor(LowercasingProcessor())
+        uppercaser.add_processor(ListAppendingProcessor([], node_name='error-consumer'), is_error_consumer=True)
+
+        evaluator = self.evaluator_class(pg)
+        results = yield evaluator.process('abc')
+
+        # the results of the consumers before the failing consumer are kept, and the
+        # error consumer gets the input of the uppercaser, just as if the consumers had
+        # been processed one at a time.
+        self.assertEquals(results, ['CBA', 'abc'])
+        self.assertEquals(evaluator.stats.error_routed, 1)
+
+    @defer.inlineCallbacks
+    def test_tracing_concurrent_consumers(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        producer = util_processors.Passthrough()
+        producer.concurrent_consumers = True
+        incrementing = IncrementingProcessor()
+        raiser = DelayedErrbackProcessor()
+
+        builder.add_processor(producer).add_processors(incrementing, raiser)
+
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
+        results, trace = yield evaluator.traced_process(dict(n=0))
+
+        self.assertEquals(results.type, StubException)
+        self.assertTraceEquals(trace, [
+            dict(source=self, destination=producer, baton=dict(n=0)),
+            dict(source=producer, destination=incrementing, baton=dict(n=0)),
+            dict(source=incrementing, destination=None, baton=dict(n=1)),
+            dict(source=producer, destination=raiser, baton=dict(n=0)),
+            dict(source=raiser, destination=producer, baton=dict(n=0), failure=dict(type=StubException, args=())),
+            dict(source=producer, destination=self, baton=dict(n=0), failure=dict(type=StubException, args=()))
+        ])
+
+    @defer.inlineCallbacks
+    def test_process_batch(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        batch_processor = BatchUppercasingProcessor()
+        later = CallbackingLaterProcessor()
+        reverser = ReversingProcessor()
+        second_batch_processor = BatchUppercasingProcessor()
+
+        builder.add_processor(later).add_processor(batch_processor).add_processor(reverser).add_processor(second_batch_processor)
+
+        evaluator = self.evaluator_class(pg)
+        results = yield evaluator.process_batch(['foo', 'bar', 'baz'])
+
+        # the batons are given to the batch processors together, even though they
+        # were waiting for another processor first
+        self.assertEquals(results, [['OOF'], ['RAB'], ['ZAB']])
+        self.assertEquals(batch_processor.batch_sizes, [3])
+        self.assertEquals(second_batch_processor.batch_sizes, [3])
+        self.assertEquals(evaluator.stats.get_processor_latency(batch_processor).count, 3)
+        self.assertEquals(evaluator.stats.completed, 3)
+
+    @defer.inlineCallbacks
+    def test_process_batch_failures(self):
+        class FailingProcessor(StubProcessor):
+            def process(self, baton):
+                if baton == 'fail':
+                    raise StubException()
+                return baton
+
+        pg = processing.ProcessorGraph()
+        batch_processor = BatchUppercasingProcessor()
+        builder = pg.get_builder().add_processor(FailingProcessor()).add_processor(batch_processor)
+        builder.add_processor(LowercasingProcessor(), is_error_consumer=True)
+
+        evaluator = self.evaluator_class(pg)
+        results = yield evaluator.process_batch(['foo', 'fail', 'raise'])
+
+        # the failing baton fails by itself, while a batch processor failing fails the batch,
+        # which is handled by the error consumer for every baton.
+        self.assertEquals(results[0], ['foo'])
+        self.assertIsInstance(results[1], failure.Failure)
+        self.assertEquals(results[1].type, StubException)
+        self.assertEquals(results[2], ['raise'])
+        self.assertEquals(batch_processor.batch_sizes, [2])
+
+    @defer.inlineCallbacks
+    def test_process_empty_batch(self):
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(BatchUppercasingProcessor())
+        evaluator = self.evaluator_class(pg)
+
+        results = yield evaluator.process_batch([])
+        self.assertEquals(results, [])
+
+    def _make_waiting_evaluator(self):
+        pg = processing.ProcessorGraph()
+        waiter = WaitingProcessor('done')
+        pg.get_builder().add_processor(waiter)
+        return self.evaluator_class(pg, name='test_pipeline'), waiter
+
+    @defer.inlineCallbacks
+    def test_limit_in_flight(self):
+        evaluator, waiter = self._make_waiting_evaluator()
+        evaluator.limit_in_flight(2)
+
+        ds = [evaluator.process(dict(n=i)) for i in range(4)]
+
+        # only two batons are processed, while the others wait
+        self.assertEquals(len(waiter.deferreds), 2)
+        self.assertEquals((evaluator.stats.queued, evaluator.stats.max_queued), (2, 2))
+
+        # the waiting batons are processed in the order they arrived
+        waiter.deferreds[1].callback(None)
+        self.assertEquals(len(waiter.deferreds), 3)
+        waiter.deferreds[0].callback(None)
+        self.assertEquals(len(waiter.deferreds), 4)
+        for d in waiter.deferreds[2:]:
+            d.callback(None)
+
+        results = yield defer.gatherResults(ds)
+        self.assertEquals(results, [[dict(n=i, done=True)] for i in range(4)])
+        self.assertEquals(evaluator.stats.queued, 0)
+        self.assertEquals(evaluator.stats.queue_latency.count, 2)
+        self.assertEquals(evaluator.admission_control.in_flight, 0)
+
+    @defer.inlineCallbacks
+    def test_limit_in_flight_of_synchronous_processing(self):
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(CallbackingLaterProcessor()).add_processor(IncrementingProcessor())
+        evaluator = self.evaluator_class(pg)
+        evaluator.limit_in_flight(1)
+
+        results = yield defer.gatherResults([evaluator.process(dict(n=i)) for i in range(50)])
+        self.assertEquals(results, [[dict(n=i+1)] for i in range(50)])
+        self.assertEquals(evaluator.stats.max_queued, 49)
+
+    @defer.inlineCallbacks
+    def test_overloaded_when_the_queue_is_full(self):
+        evaluator, waiter = self._make_waiting_evaluator()
+        evaluator.limit_in_flight(1, max_queued=1)
+
+        first = evaluator.process(dict())
+        second = evaluator.process(dict())
+        yield self.assertFailure(evaluator.process(dict()), exceptions.OverloadedError)
+        self.assertEquals(evaluator.stats.rejected, 1)
+
+        # cancelling a waiting baton makes room in the queue
+        second.cancel()
+        yield self.assertFailure(second, defer.CancelledError)
+        third = evaluator.process(dict())
+        self.assertEquals(evaluator.stats.queued, 1)
+
+        waiter.deferreds[0].callback(None)
+        waiter.deferreds[1].callback(None)
+        yield first
+        yield third
+        self.assertEquals(len(waiter.deferreds), 2)
+
+    @defer.inlineCallbacks
+    def test_overloaded_when_waiting_too_long(self):
+        evaluator, waiter = self._make_waiting_evaluator()
+        evaluator.limit_in_flight(1, queue_timeout=0)
+
+        first = evaluator.process(dict())
+        second = evaluator.process(dict())
+        yield self.assertFailure(second, exceptions.OverloadedError)
+        self.assertEquals((evaluator.stats.queued, evaluator.stats.rejected), (0, 1))
+
+        waiter.deferreds[0].callback(None)
+        yield first
+
     @defer.inlineCallbacks
     def test_profiling(self):
         """ The evaluator should track the time spent processing, as
@@ -1951,7 +2362,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         waiter2 = util_processors.Waiter(2 * delay)
         builder.add_processor(waiter).add_processor(waiter2)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg)
+        evaluator = self.evaluator_class(pg)
         yield evaluator.process(dict())
 
         # wait for delay -> wait for two times delay
@@ -1961,6 +2372,54 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
     test_profiling.timeout=1
 
+    @defer.inlineCallbacks
+    def test_stats(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+
+        waiter = util_processors.Waiter(0)
+        raiser = ExceptionRaisingProcessor()
+        handler = util_processors.Passthrough()
+        builder.add_processor(waiter).add_processor(raiser).add_processor(handler, is_error_consumer=True)
+
+        evaluator = self.evaluator_class(pg)
+        stats = evaluator.stats
+
+        d = evaluator.process(dict())
+        self.assertEquals(stats.in_flight, 1)
+        yield d
+
+        self.assertEquals((stats.in_flight, stats.completed, stats.failed, stats.error_routed), (0, 1, 0, 1))
+        self.assertEquals(stats.latency.count, 1)
+        self.assertEquals(stats.get_processor_latency(waiter).count, 1)
+        self.assertEquals(stats.get_processor_latency(handler).count, 1)
+        # the raiser never finishes processing
+        self.assertEquals(stats.get_processor_latency(raiser).count, 0)
+
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(ExceptionRaisingProcessor())
+        evaluator = self.evaluator_class(pg)
+        yield self.assertFailure(evaluator.process(dict()), StubException)
+
+        self.assertEquals((evaluator.stats.in_flight, evaluator.stats.completed, evaluator.stats.failed), (0, 0, 1))
+
+    @defer.inlineCallbacks
+    def test_coloring_dot_by_percentile(self):
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(util_processors.Passthrough()).add_processor(util_processors.Waiter(0.01))
+
+        evaluator = self.evaluator_class(pg)
+        evaluator.configure_processors(processing.RuntimeEnvironment())
+        yield evaluator.process(dict())
+
+        dot = pg.get_dot(color_by='p99')
+        self.assertIn('p99: ', dot)
+        # the waiter is a lot slower than the passthrough, and should be red
+        self.assertIn('color="#FF', dot)
+
+        self.assertRaises(exceptions.ConfigurationError, pg.get_dot, color_by='p101')
+        self.assertRaises(exceptions.ConfigurationError, pg.get_dot, color_by='median')
+
     def assertTraceEquals(self, actual, expected):
         # set some defaults in order to make the calls to this function easier to read
         for step in expected:
@@ -1984,7 +2443,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder.add_processor(passthrough).add_processor(incrementing)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
         results, trace = yield evaluator.traced_process(dict(n=0))
 
         self.assertEquals(results, [dict(n=1)])
@@ -1994,6 +2453,30 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
             dict(source=incrementing, destination=None, baton=dict(n=1))
         ])
 
+    @defer.inlineCallbacks
+    def test_tracing_with_snapshots(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        passthrough = util_processors.Passthrough()
+        incrementing = IncrementingProcessor()
+
+        builder.add_processor(passthrough).add_processor(incrementing)
+
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
+        results, trace = yield evaluator.traced_process(dict(n=0, page='x'*10), snapshots=True, max_value_size=5)
+
+        self.assertEquals(results, [dict(n=1, page='x'*10)])
+        for step in trace:
+            self.assertIsInstance(step['baton'], util.BatonSnapshot)
+            step['baton'] = step['baton'].rebuild()
+
+        page = 'xxxxx... (5 characters truncated)'
+        self.assertTraceEquals(trace, [
+            dict(source=self, destination=passthrough, baton=dict(n=0, page=page)),
+            dict(source=passthrough, destination=incrementing, baton=dict(n=0, page=page)),
+            dict(source=incrementing, destination=None, baton=dict(n=1, page=page))
+        ])
+
     @defer.inlineCallbacks
     def test_tracing_across_pipelines(self):
         runtime_environment = processing.RuntimeEnvironment()
@@ -2002,7 +2485,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         nested_pg = processing.ProcessorGraph()
         nested_incrementing = IncrementingProcessor()
         nested_pg.get_builder().add_processor(nested_incrementing)
-        nested_evaluator = processing.TwistedProcessorGraphEvaluator(nested_pg, name='test_pipeline2')
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
         
         pg = processing.ProcessorGraph()
         builder = pg.get_builder()
@@ -2012,7 +2495,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2')
 
         builder.add_processor(passthrough).add_processor(incrementing).add_processor(run_pipeline)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         evaluator.configure_processors(runtime_environment)
         run_pipeline.pipeline_dependency.is_ready = True
@@ -2031,6 +2514,150 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
             dict(source=run_pipeline, destination=None, baton=dict(n=2)),
         ])
 
+    @defer.inlineCallbacks
+    def test_tracing_nested_traced_pipelines(self):
+        """ A traced pipeline that traces another pipeline should get the nested trace
+        entries in both traces. """
+        runtime_environment = processing.RuntimeEnvironment()
+        runtime_environment.configure()
+
+        nested_pg = processing.ProcessorGraph()
+        nested_incrementing = IncrementingProcessor()
+        nested_pg.get_builder().add_processor(nested_incrementing)
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
+
+        pg = processing.ProcessorGraph()
+        run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2', input_path='nested', output_path='nested', trace_path='trace')
+        pg.get_builder().add_processor(run_pipeline)
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
+
+        evaluator.configure_processors(runtime_environment)
+        run_pipeline.pipeline_dependency.is_ready = True
+        run_pipeline.pipeline_dependency.on_resource_ready(nested_evaluator)
+
+        results, trace = yield evaluator.traced_process(dict(nested=dict(n=0)))
+
+        nested_trace = [
+            dict(source=run_pipeline, destination=nested_incrementing, baton=dict(n=0)),
+            dict(source=nested_incrementing, destination=None, baton=dict(n=1)),
+        ]
+        self.assertEquals(results[0]['nested'], dict(n=1))
+        self.assertTraceEquals(results[0]['trace'], nested_trace)
+
+        # the last entry contains the nested trace in the baton
+        self.assertEquals((trace[-1]['source'], trace[-1]['destination']), (run_pipeline, None))
+        self.assertTraceEquals(trace[:-1], [dict(source=self, destination=run_pipeline, baton=dict(nested=dict(n=0)))] + nested_trace)
+
+    @defer.inlineCallbacks
+    def test_untraced_processing_is_not_traced(self):
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(IncrementingProcessor())
+        evaluator = self.evaluator_class(pg)
+
+        results, trace = yield evaluator.traced_process(dict(n=0))
+        self.assertEquals(len(trace), 2)
+
+        # the tracing context should not leak out of the traced processing
+        self.assertEquals(processing._EvaluationContext.current, None)
+        results = yield evaluator.process(dict(n=0))
+        self.assertEquals(results, [dict(n=1)])
+        self.assertEquals(len(trace), 2)
+
+    def _make_evaluator_running_waiting_pipeline(self):
+        runtime_environment = processing.RuntimeEnvironment()
+        runtime_environment.configure()
+
+        nested_pg = processing.ProcessorGraph()
+        waiter = WaitingProcessor('waited')
+        nested_incrementing = IncrementingProcessor()
+        nested_pg.get_builder().add_processor(waiter).add_processor(nested_incrementing)
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
+
+        pg = processing.ProcessorGraph()
+        run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2')
+        pg.get_builder().add_processor(run_pipeline).add_processor(IncrementingProcessor())
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
+
+        evaluator.configure_processors(runtime_environment)
+        run_pipeline.pipeline_dependency.is_ready = True
+        run_pipeline.pipeline_dependency.on_resource_ready(nested_evaluator)
+        return evaluator, waiter
+
+    @defer.inlineCallbacks
+    def test_cancelling_nested_pipelines(self):
+        evaluator, waiter = self._make_evaluator_running_waiting_pipeline()
+
+        scope = util.CancellationScope()
+        d = processing.call_in_scope(scope, evaluator.process, dict(n=0))
+        self.assertEquals(processing._EvaluationContext.current, None)
+        self.assertFalse(d.called)
+
+        scope.cancel()
+        yield self.assertFailure(d, defer.CancelledError)
+
+        # the deferred of the processor in the nested pipeline is cancelled as well
+        nested_deferred, = waiter.deferreds
+        self.assertTrue(nested_deferred.called)
+
+    @defer.inlineCallbacks
+    def test_deadline_of_nested_pipelines(self):
+        evaluator, waiter = self._make_evaluator_running_waiting_pipeline()
+
+        clock = task.Clock()
+        scope = util.CancellationScope(timeout=10, clock=clock)
+        d = processing.call_in_scope(scope, evaluator.process, dict(n=0))
+
+        clock.advance(9)
+        self.assertFalse(d.called)
+        self.assertEquals(scope.remaining, 1)
+
+        clock.advance(1)
+        self.assertTrue(scope.expired)
+        yield self.assertFailure(d, defer.CancelledError)
+
+    @defer.inlineCallbacks
+    def test_processing_in_a_finished_scope(self):
+        evaluator, waiter = self._make_evaluator_running_waiting_pipeline()
+
+        scope = util.CancellationScope()
+        d = processing.call_in_scope(scope, evaluator.process, dict(n=0))
+        waiter.deferreds[0].callback(None)
+        results = yield d
+        self.assertEquals(results, [dict(n=2, waited=True)])
+
+        scope.cancel()
+        # processors are not invoked in a cancelled scope
+        yield self.assertFailure(processing.call_in_scope(scope, evaluator.process, dict(n=0)), defer.CancelledError)
+        self.assertEquals(len(waiter.deferreds), 1)
+
+    @defer.inlineCallbacks
+    def test_evaluations_do_not_resume_in_the_scope_of_other_evaluations(self):
+        scopes = list()
+
+        class ScopeRecordingProcessor(StubProcessor):
+            def process(self, baton):
+                scopes.append(processing.get_current_scope())
+                return baton
+
+        class FiringProcessor(StubProcessor):
+            def process(self, baton):
+                waiter.deferreds[0].callback(None)
+                return baton
+
+        waiter = WaitingProcessor('waited')
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(waiter).add_processor(ScopeRecordingProcessor())
+        d = self.evaluator_class(pg).process(dict())
+
+        # the waiting evaluation is resumed by a processor of an evaluation in a scope
+        firing_pg = processing.ProcessorGraph()
+        firing_pg.get_builder().add_processor(FiringProcessor())
+        yield processing.call_in_scope(util.CancellationScope(), self.evaluator_class(firing_pg).process, dict())
+
+        results = yield d
+        self.assertEquals(results, [dict(waited=True)])
+        self.assertEquals(scopes, [None])
+
     @defer.inlineCallbacks
     def test_tracing_across_pipelines_with_delayed_failures(self):
         """ If a target pipeline raises an exception asynchronously, much of the stack is
@@ -2041,7 +2668,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         nested_pg = processing.ProcessorGraph()
         nested_raiser = DelayedErrbackProcessor()
         nested_pg.get_builder().add_processor(nested_raiser)
-        nested_evaluator = processing.TwistedProcessorGraphEvaluator(nested_pg, name='test_pipeline2')
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
 
         pg = processing.ProcessorGraph()
         builder = pg.get_builder()
@@ -2051,7 +2678,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         for_each = pipeline_processors.ForEach(pipeline='test_pipeline2', input_path='for_each_input', output_path=None)
 
         builder.add_processor(passthrough).add_processor(incrementing).add_processor(for_each)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         evaluator.configure_processors(runtime_environment)
         for_each.pipeline_dependency.is_ready = True
@@ -2087,7 +2714,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         nested_pg = processing.ProcessorGraph()
         nested_incrementing = IncrementingProcessor()
         nested_pg.get_builder().add_processor(nested_incrementing)
-        nested_evaluator = processing.TwistedProcessorGraphEvaluator(nested_pg, name='test_pipeline2')
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
 
         class EvaluatorProxy(object):
             def __init__(self, evaluator):
@@ -2106,7 +2733,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2')
 
         builder.add_processor(passthrough).add_processor(incrementing).add_processor(run_pipeline)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         evaluator.configure_processors(runtime_environment)
         run_pipeline.pipeline_dependency.is_ready = True
@@ -2137,7 +2764,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder.add_processor(passthrough).add_processor(waiter).add_processor(incrementing)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         traced_process_deferred = evaluator.traced_process(dict(n=0))
         # this will cause _process to be called with another stack
@@ -2168,7 +2795,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
                 run_pipeline = pipeline_processors.PipelineRunner('test_pipeline')
                 builder.add_processor(run_pipeline)
 
-            evaluator = processing.TwistedProcessorGraphEvaluator(pg, name=pipeline_name)
+            evaluator = self.evaluator_class(pg, name=pipeline_name)
             evaluator.configure_processors(runtime_environment)
 
             return evaluator
@@ -2228,7 +2855,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         nested_raiser = ExceptionRaisingProcessor()
         nested_incrementing = util_processors.Passthrough()
         nested_pg.get_builder().add_processor(nested_raiser).add_processor(nested_incrementing)
-        nested_evaluator = processing.TwistedProcessorGraphEvaluator(nested_pg, name='test_pipeline2')
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
 
         pg = processing.ProcessorGraph()
         builder = pg.get_builder()
@@ -2236,7 +2863,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2')
 
         builder.add_processor(run_pipeline)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         evaluator.configure_processors(runtime_environment)
         run_pipeline.pipeline_dependency.is_ready = True
@@ -2265,7 +2892,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         nested_handler = util_processors.Passthrough()
         nested_incrementing = IncrementingProcessor()
         nested_pg.get_builder().add_processor(nested_raiser).add_processor(nested_handler, is_error_consumer=True).add_processor(nested_incrementing)
-        nested_evaluator = processing.TwistedProcessorGraphEvaluator(nested_pg, name='test_pipeline2')
+        nested_evaluator = self.evaluator_class(nested_pg, name='test_pipeline2')
 
         pg = processing.ProcessorGraph()
         builder = pg.get_builder()
@@ -2273,7 +2900,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
         run_pipeline = pipeline_processors.PipelineRunner(pipeline='test_pipeline2')
 
         builder.add_processor(run_pipeline)
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
 
         evaluator.configure_processors(runtime_environment)
         run_pipeline.pipeline_dependency.is_ready = True
@@ -2301,7 +2928,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder.add_processor(passthrough).add_processor(raiser)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
         results, trace = yield evaluator.traced_process(dict(n=0))
 
         self.assertIsInstance(results, failure.Failure)
@@ -2323,7 +2950,7 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
 
         builder.add_processor(passthrough).add_processor(raiser).add_processor(error_raiser, is_error_consumer=True)
 
-        evaluator = processing.TwistedProcessorGraphEvaluator(pg, name='test_pipeline')
+        evaluator = self.evaluator_class(pg, name='test_pipeline')
         results, trace = yield evaluator.traced_process(dict(n=0))
 
         self.assertIsInstance(results, failure.Failure)
@@ -2336,3 +2963,66 @@ class TwistedEvaluatorTest(ProcessorGraphTest):
             dict(source=raiser, destination=passthrough, baton=dict(n=0), failure=dict(type=StubException, args=())),
             dict(source=passthrough, destination=self, baton=dict(n=0), failure=dict(type=StubException, args=()))
         ])
+
+
+class CompiledEvaluatorFactoryTest(TestProcessorGraphFactory):
+    evaluator_class = processing.CompiledProcessorGraphEvaluator
+
+
+class CompiledEvaluatorConditionalTest(TestConditional):
+    evaluator_class = processing.CompiledProcessorGraphEvaluator
+
+
+class CompiledEvaluatorTest(TwistedEvaluatorTest):
+    evaluator_class = processing.CompiledProcessorGraphEvaluator
+
+    def test_synchronous_processors_are_evaluated_inline(self):
+        pg = processing.ProcessorGraph()
+        pg.get_builder().add_processor(UppercasingProcessor()).add_processor(ReversingProcessor())
+
+        evaluator = self.evaluator_class(pg)
+        d = evaluator.process('foo')
+
+        # no processor returned a deferred, so the processing is already done
+        self.assertEquals(d.result, ['OOF'])
+
+    @defer.inlineCallbacks
+    def test_long_chains_are_not_evaluated_recursively(self):
+        pg = processing.ProcessorGraph()
+        builder = pg.get_builder()
+        for i in range(5 * sys.getrecursionlimit()):
+            builder = builder.add_processor(IncrementingProcessor())
+
+        evaluator = self.evaluator_class(pg)
+        results = yield evaluator.process(dict(n=0))
+
+        self.assertEquals(results, [dict(n=5 * sys.getrecursionlimit())])
+
+    def test_evaluator_kind_by_name(self):
+        pgf = self.get_processor_graph_factory(dict(pipeline=['uppercase']))
+
+        evaluator = pgf.make_evaluator('pipeline', evaluator_factory='compiled')
+        self.assertIsInstance(evaluator, processing.CompiledProcessorGraphEvaluator)
+
+        evaluator = pgf.make_evaluator('pipeline', evaluator_factory='twisted')
+        self.assertNotIsInstance(evaluator, processing.CompiledProcessorGraphEvaluator)
+
+        self.assertRaises(exceptions.ConfigurationError, pgf.make_evaluator, 'pipeline', evaluator_factory='nonexistent')
+
+    def test_evaluator_options(self):
+        class Evaluator(processing.TwistedProcessorGraphEvaluator):
+            def __init__(self, processor_graph, name=None, factor=1):
+                super(Evaluator, self).__init__(processor_graph, name)
+                self.factor = 1 / factor
+
+        pgf = self.get_processor_graph_factory(dict(
+            valid = dict(evaluator=dict(kind='test', factor=2), chained_consumers=['uppercase']),
+            unknown = dict(evaluator=dict(kind='test', factors=2), chained_consumers=['uppercase']),
+            failing = dict(evaluator=dict(kind='test', factor=0), chained_consumers=['uppercase']),
+        ))
+        pgf.evaluator_kinds = dict(test=Evaluator)
+
+        self.assertIsInstance(pgf.make_evaluator('valid'), Evaluator)
+        self.assertRaises(exceptions.ConfigurationError, pgf.make_evaluator, 'unknown')
+        # errors raised by the evaluator itself are not mistaken for invalid options
+        self.assertRaises(ZeroDivisionError, pgf.make_evaluator, 'failing')
@@ -4,8 +4,10 @@
 """ Tests for utilities """
 import copy
 import datetime
+import json
+import os
 
-from twisted.internet import defer
+from twisted.internet import defer, task
 from twisted.python import failure
 from twisted.trial import unittest
 
@@ -234,6 +236,132 @@ class TestDictRemovePath(unittest.TestCase):
         self.assertEquals(d, dict(foo='bar', bar=dict()))
 
 
+class TestPathAccessor(unittest.TestCase):
+
+    def test_accessors_are_cached(self):
+        self.assertTrue(util.get_path_accessor('a.b') is util.get_path_accessor('a.b'))
+        self.assertFalse(util.get_path_accessor('a.b') is util.get_path_accessor('a.b', separator='/'))
+        self.assertEquals(util.get_path_accessor('a/b', separator='/').keys, ('a', 'b'))
+
+    def test_cache_is_bounded(self):
+        self.patch(util, 'max_cached_path_accessors', 3)
+        for i in range(10):
+            util.get_path_accessor('path.%i' % i)
+        self.assertTrue(len(util._path_accessors) <= 3)
+
+    def test_paths_of_different_lengths(self):
+        for path in 'a', 'a.b', 'a.b.c', 'a.b.c.d':
+            accessor = util.PathAccessor(path)
+            d = dict()
+            self.assertEquals(accessor.get(d, 'fallback'), 'fallback')
+
+            accessor.set(d, 42)
+            self.assertEquals(accessor.get(d), 42)
+            self.assertEquals(util.dict_get_path(d, path.split('.')), 42)
+
+            accessor.remove(d)
+            self.assertEquals(accessor.get(d, 'fallback'), 'fallback')
+            self.assertRaises(KeyError, accessor.remove, d, ignore_missing=False)
+
+    def test_traversing_objects(self):
+        class Foo(object):
+            def __init__(self, wrapped):
+                self.wrapped = wrapped
+
+        d = dict(a=Foo(dict(b=Foo('c'))))
+        self.assertEquals(util.PathAccessor('a.wrapped.b.wrapped').get(d), 'c')
+        self.assertEquals(util.PathAccessor('a.wrapped.nonexistent').get(d, 'fallback'), 'fallback')
+
+        util.PathAccessor('a.wrapped.b.wrapped').set(d, 'd')
+        self.assertEquals(d['a'].wrapped['b'].wrapped, 'd')
+        util.PathAccessor('a.wrapped.c.d').set(d, 'e')
+        self.assertEquals(d['a'].wrapped['c'], dict(d='e'))
+
+        self.assertRaises(AttributeError, util.PathAccessor('a.nonexistent').set, d, 'f')
+
+    def test_getting_the_empty_path(self):
+        d = dict()
+        self.assertTrue(util.PathAccessor('').get(d) is d)
+
+
+class TestCopyOnWriteDict(unittest.TestCase):
+
+    def setUp(self):
+        self.original = dict(a=dict(b=dict(c=1)), d=[1], e='f')
+        self.expected_original = copy.deepcopy(self.original)
+
+    def tearDown(self):
+        self.assertEquals(self.original, self.expected_original)
+
+    def test_nested_dicts_are_copied_when_used(self):
+        cow = util.CopyOnWriteDict(self.original)
+        self.assertTrue(dict.__getitem__(cow, 'a') is self.original['a'])
+
+        util.dict_set_path(cow, 'a.b.c', 2)
+        cow['a']['g'] = 3
+        self.assertEquals(cow, dict(a=dict(b=dict(c=2), g=3), d=[1], e='f'))
+        self.assertIsInstance(cow['a']['b'], util.CopyOnWriteDict)
+
+    def test_dict_methods_do_not_change_the_original(self):
+        cow = util.CopyOnWriteDict(self.original)
+        cow.get('a')['x'] = 1
+        cow.setdefault('a', None)['y'] = 1
+        for key, value in cow.items():
+            if key == 'a':
+                value['b']['z'] = 1
+        cow.pop('a')['popped'] = 1
+        self.assertEquals(cow, dict(d=[1], e='f'))
+
+        cow = util.CopyOnWriteDict(self.original)
+        cow.update(e=dict(), a=1)
+        cow['e']['h'] = 2
+        self.assertEquals(cow, dict(a=1, d=[1], e=dict(h=2)))
+
+    def test_views_do_not_change_the_original(self):
+        cow = util.CopyOnWriteDict(self.original)
+        for value in cow.viewvalues():
+            if isinstance(value, dict):
+                value['b']['c'] = 2
+        for key, value in cow.viewitems():
+            if key == 'a':
+                value['x'] = 3
+        self.assertEquals(cow['a'], dict(b=dict(c=2), x=3))
+        self.assertTrue(('e', 'f') in cow.viewitems())
+
+    def test_plain_dicts_share_the_nested_dicts_that_are_not_copied(self):
+        def get_keywords(**kw):
+            return kw
+
+        cow = util.CopyOnWriteDict(self.original)
+        # these read the storage of the dict directly, just like a shallow copy
+        self.assertTrue(dict(cow)['a'] is self.original['a'])
+        self.assertTrue(get_keywords(**cow)['a'] is self.original['a'])
+
+        cow['a']['b']['c'] = 2
+        for plain in dict(cow), get_keywords(**cow):
+            self.assertFalse(plain['a'] is self.original['a'])
+            self.assertEquals(plain['a']['b']['c'], 2)
+
+    def test_copying_a_copy(self):
+        cow = util.CopyOnWriteDict(self.original)
+        cow['a']['b']['c'] = 2
+        for other in cow.copy(), copy.copy(cow), util.copy_on_write(cow):
+            self.assertIsInstance(other, util.CopyOnWriteDict)
+            other['a']['b']['c'] = 3
+            self.assertEquals(cow['a']['b']['c'], 2)
+
+    def test_encoding_and_copying(self):
+        cow = util.CopyOnWriteDict(self.original)
+        cow['a']['b']['c'] = 2
+        expected = dict(a=dict(b=dict(c=2)), d=[1], e='f')
+
+        self.assertEquals(json.loads(json.dumps(cow, cls=util.BatonJSONEncoder)), expected)
+        deep_copy = copy.deepcopy(cow)
+        self.assertEquals(type(deep_copy), dict)
+        self.assertEquals(deep_copy, expected)
+        self.assertFalse(deep_copy['d'] is self.original['d'])
+
+
 class TestAttributeDict(unittest.TestCase):
 
     def test_setting_and_getting(self):
@@ -292,6 +420,25 @@ class TestDictIterator(unittest.TestCase):
         self.assertEqual(result, [('bar', 456), ('baz', {'foobar': 42, 'zip': 'zap'}), ('baz.foobar', 42), ('baz.zip', 'zap'), ('foo', 123)])
 
 
+class TestCacheFiles(unittest.TestCase):
+
+    def test_saving_and_loading(self):
+        path = self.mktemp()
+        self.assertEquals(util.load_cache_file(path, 'key', 'test cache'), None)
+
+        self.assertTrue(util.save_cache_file(path, 'key', dict(a=1), 'test cache'))
+        self.assertEquals(util.load_cache_file(path, 'key', 'test cache'), dict(a=1))
+        self.assertEquals(util.load_cache_file(path, 'other key', 'test cache'), None)
+
+        with open(path, 'wb') as cache_file:
+            cache_file.write('not a pickle')
+        self.assertEquals(util.load_cache_file(path, 'key', 'test cache'), None)
+
+    def test_unwritable_cache_file(self):
+        path = os.path.join(self.mktemp(), 'missing directory', 'cache')
+        self.assertFalse(util.save_cache_file(path, 'key', dict(a=1), 'test cache'))
+
+
 class TestInTrial(unittest.TestCase):
     def test_trial_detection(self):
         self.assertTrue(util.in_unittest(), 'Failed to detect that we are running trial')
@@ -413,6 +560,69 @@ class TestBatonJSONEncoder(unittest.TestCase):
         self.assertEquals(encoded, '{"foo": [1, 2, 3], "object": "%r"}' % obj)
 
 
+class TestBatonSnapshotter(unittest.TestCase):
+
+    def test_rebuilding_like_json(self):
+        snapshotter = util.BatonSnapshotter()
+        obj = object()
+        baton = {'list': [1, (2, 3)], 1: None, 'nested': dict(object=obj, date=datetime.date(2011, 1, 2))}
+
+        snapshot = snapshotter.snapshot(baton)
+        self.assertEquals(snapshot.rebuild(), json.loads(util.BatonJSONEncoder().encode(baton)))
+
+    def test_snapshots_are_not_affected_by_changes(self):
+        snapshotter = util.BatonSnapshotter()
+        baton = dict(foo=dict(bar=[1, 2]))
+
+        snapshot = snapshotter.snapshot(baton)
+        baton['foo']['bar'].append(3)
+        baton['foo']['baz'] = 42
+
+        self.assertEquals(snapshot.rebuild(), dict(foo=dict(bar=[1, 2])))
+        self.assertEquals(snapshotter.snapshot(baton).rebuild(), dict(foo=dict(bar=[1, 2, 3], baz=42)))
+
+    def test_rebuilding_returns_new_copies(self):
+        snapshot = util.BatonSnapshotter().snapshot(dict(foo=dict(bar=[1, 2])))
+
+        rebuilt = snapshot.rebuild()
+        rebuilt['foo']['bar'].append(3)
+        self.assertEquals(snapshot.rebuild(), dict(foo=dict(bar=[1, 2])))
+
+    def test_unchanged_parts_are_shared(self):
+        snapshotter = util.BatonSnapshotter()
+        page = 'x' * 100000
+        baton = dict(page=page, response=dict(code=200, headers=['a', 'b']), processed=list())
+
+        first = snapshotter.snapshot(baton)
+        second = snapshotter.snapshot(baton)
+        self.assertTrue(second.frozen is first.frozen)
+
+        baton['processed'].append('step')
+        third = snapshotter.snapshot(baton)
+        self.assertFalse(third.frozen is second.frozen)
+        self.assertTrue(third.frozen['response'] is second.frozen['response'])
+        self.assertTrue(third.frozen['page'] is page)
+        self.assertEquals(third.frozen['processed'], ('step',))
+
+    def test_truncating_long_values(self):
+        snapshotter = util.BatonSnapshotter(max_value_size=3)
+        baton = dict(short='abc', long='abcdef', unicode=u'\xe6\xf8\xe5\xe6')
+
+        first = snapshotter.snapshot(baton)
+        self.assertEquals(first.rebuild(), dict(short='abc', long='abc... (3 characters truncated)', unicode=u'\xe6\xf8\xe5... (1 characters truncated)'))
+
+        # the truncated value is reused as long as the value is the same object
+        second = snapshotter.snapshot(baton)
+        self.assertTrue(second.frozen['long'] is first.frozen['long'])
+
+    def test_recursive_batons(self):
+        baton = dict()
+        baton['self'] = baton
+
+        snapshot = util.BatonSnapshotter().snapshot(baton)
+        self.assertEquals(snapshot.rebuild(), dict(self='<recursive reference to dict>'))
+
+
 class TestFailAfterDelay(unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -434,6 +644,47 @@ class _FakeException(Exception):
     pass
 
 
+class TestMaybeInlineCallbacks(unittest.TestCase):
+
+    @util.maybe_inline_callbacks
+    def add(self, *values):
+        total = 0
+        for value in values:
+            total += yield value
+        defer.returnValue(total)
+
+    def test_plain_values_are_returned_directly(self):
+        self.assertEquals(self.add(1, defer.succeed(2), 3), 6)
+
+    def test_exceptions_are_raised_directly(self):
+        self.assertRaises(_FakeException, self.add, 1, defer.fail(_FakeException()))
+
+    def test_failures_can_be_caught_by_the_generator(self):
+        @util.maybe_inline_callbacks
+        def catching():
+            try:
+                yield defer.fail(_FakeException())
+            except _FakeException:
+                defer.returnValue('caught')
+
+        self.assertEquals(catching(), 'caught')
+
+    def test_waiting_returns_a_deferred(self):
+        d = defer.Deferred()
+        result = self.add(1, d, 3)
+        self.assertIsInstance(result, defer.Deferred)
+        self.assertFalse(result.called)
+
+        d.callback(2)
+        self.assertEquals(result.result, 6)
+
+    def test_failing_after_waiting_errbacks(self):
+        d = defer.Deferred()
+        result = self.add(d, defer.fail(_FakeException()))
+        d.callback(1)
+        return self.assertFailure(result, _FakeException)
+
+
 class TestWaitForFirst(unittest.TestCase):
 
     @defer.inlineCallbacks
@@ -526,4 +777,59 @@ class TestWait(unittest.TestCase):
         waiting.addErrback(lambda failure: failure.trap(defer.CancelledError))
 
 
+class TestCancellationScope(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def test_cancelling(self):
+        scope = util.CancellationScope(clock=self.clock)
+        d = scope.cancellable(defer.Deferred())
+        child = scope.child()
+        child_d = child.cancellable(defer.Deferred())
+
+        scope.cancel()
+        self.assertTrue(child.cancelled)
+        self.assertFalse(scope.expired)
+        for cancelled in d, child_d:
+            self.assertFailure(cancelled, defer.CancelledError)
+
+        # deferreds made cancellable after the scope was cancelled are cancelled right away
+        self.assertFailure(scope.cancellable(defer.Deferred()), defer.CancelledError)
+        self.assertRaises(defer.CancelledError, scope.raise_if_cancelled)
+
+    def test_deadline(self):
+        scope = util.CancellationScope(timeout=10, clock=self.clock)
+        d = scope.cancellable(defer.Deferred())
+
+        self.clock.advance(4)
+        self.assertEquals(scope.remaining, 6)
+        self.assertFalse(d.called)
+
+        self.clock.advance(6)
+        self.assertTrue(scope.expired)
+        self.assertEquals(scope.remaining, 0)
+        return self.assertFailure(d, defer.CancelledError)
+
+    def test_child_deadlines(self):
+        scope = util.CancellationScope(timeout=10, clock=self.clock)
+        self.assertEquals(scope.child().deadline, 10)
+        self.assertEquals(scope.child(timeout=5).deadline, 5)
+        self.assertEquals(scope.child(timeout=20).deadline, 10)
+
+        without_deadline = util.CancellationScope(clock=self.clock)
+        self.assertEquals(without_deadline.remaining, None)
+        self.assertEquals(without_deadline.child(timeout=5).deadline, 5)
+
+    def test_closing(self):
+        scope = util.CancellationScope(timeout=10, clock=self.clock)
+        child = scope.child(timeout=5)
+        child.close()
+        scope.close()
+
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        scope.cancel()
+        self.assertFalse(child.cancelled)
+
+
 __doctests__ = [util]
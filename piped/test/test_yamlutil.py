@@ -76,4 +76,22 @@ class TestLoadDumpConfiguration(unittest.TestCase):
         """
 
         # the !path should be a scalar
-        self.assertRaises(constructor.ConstructorError, yaml.load, saved_config)
\ No newline at end of file
+        self.assertRaises(constructor.ConstructorError, yaml.load, saved_config)
+
+    def test_loading_with_the_fastest_loader(self):
+        saved_config = """
+            path: !path foo
+            file: !filepath /foo
+            piped: !pipedpath test
+            alias: !alias:path.to.alias {default: 42}
+        """
+
+        resolved_paths = list()
+        config = yamlutil.load(saved_config, resolved_paths)
+        self.assertEquals(config, yaml.load(saved_config))
+        self.assertEquals(config['alias'].path, 'path.to.alias')
+
+        expected_piped_path = filepath.FilePath(__file__).parent().path
+        self.assertEquals(sorted(resolved_paths), [(u'!filepath', '/foo', '/foo'), (u'!pipedpath', 'test', expected_piped_path)])
+        self.assertTrue(yamlutil.paths_are_unchanged(resolved_paths))
+        self.assertFalse(yamlutil.paths_are_unchanged([(u'!filepath', 'relative', '/not/relative')]))
\ No newline at end of file
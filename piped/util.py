@@ -12,7 +12,9 @@ import os
 import random
 import sys
 import xmlrpclib
+import collections
 import copy
+import cPickle as pickle
 import json
 
 import twisted
@@ -102,14 +104,14 @@ def dict_get_path(dict_like, path_or_list, fallback=None, separator='.'):
 
     .. note ::
 
-        This is not a performant way to look up things. It's meant to
-        be flexible and make it easy to delve into graphs of
-        dicts/objects, but do not use it in performance critical
-        paths.
+        String paths are looked up with a cached :class:`PathAccessor`,
+        so they are only split once. Code that looks up the same path
+        repeatedly should keep the accessor returned by
+        :func:`get_path_accessor` instead.
 
     """
-    if path_or_list == '':
-        return dict_like
+    if isinstance(path_or_list, basestring):
+        return get_path_accessor(path_or_list, separator).get(dict_like, fallback)
 
     for key in _get_paths(path_or_list, separator):
         try:
@@ -145,18 +147,27 @@ def dict_set_path(dict_like, path_or_list, value, separator='.'):
         >>> d
         {'a': 'b', 'b': {'c': 'd'}}
     """
-    # We don't simply reuse dict_get_path here, because we want to be
-    # stricter about missing path components.
+    if isinstance(path_or_list, basestring):
+        return get_path_accessor(path_or_list, separator).set(dict_like, value)
+
     keys = _get_paths(path_or_list, separator)
     for key in keys[:-1]:
-        try:
-            dict_like.setdefault(key, dict()) # Failing will raise AttributeError
-            dict_like = dict_like[key] # Failling will raise TypeError or KeyError
-        except (KeyError, TypeError, AttributeError):
-            # It's not a dict. Try to reach an attribute. If that fails, give up.
-            dict_like = getattr(dict_like, key)
+        dict_like = _get_or_create_child(dict_like, key)
+    _set_child(dict_like, keys[-1], value)
+
+
+def _get_or_create_child(dict_like, key):
+    # We don't simply reuse dict_get_path here, because we want to be
+    # stricter about missing path components.
+    try:
+        dict_like.setdefault(key, dict()) # Failing will raise AttributeError
+        return dict_like[key] # Failling will raise TypeError or KeyError
+    except (KeyError, TypeError, AttributeError):
+        # It's not a dict. Try to reach an attribute. If that fails, give up.
+        return getattr(dict_like, key)
+
 
-    key = keys[-1]
+def _set_child(dict_like, key, value):
     try:
         dict_like[key] = value
     except (TypeError, ValueError, AttributeError):
@@ -176,22 +187,174 @@ def dict_remove_path(dict_like, path_or_list, separator='.', ignore_missing=True
     If *ignore_missing* is false, then a `KeyError` is raised if the
     path cannot be removed.
     """
+    if isinstance(path_or_list, basestring):
+        return get_path_accessor(path_or_list, separator).remove(dict_like, ignore_missing)
+
     keys = _get_paths(path_or_list, separator)
-    path_of_parent = keys[:-1]
-    key_to_remove = keys[-1]
-    parent = dict_get_path(dict_like, path_of_parent)
+    parent = dict_get_path(dict_like, keys[:-1])
+    _remove_child(parent, keys[-1], dict_like, path_or_list, ignore_missing)
+
 
+def _remove_child(parent, key, dict_like, path, ignore_missing):
     try:
         if parent:
-            del parent[key_to_remove]
+            del parent[key]
         else:
             if not ignore_missing:
-                raise KeyError('Could not remove "%s" from %r' % (path_or_list, dict_like))
+                raise KeyError('Could not remove "%s" from %r' % (path, dict_like))
     except KeyError:
         if not ignore_missing:
             raise
 
 
+class PathAccessor(object):
+    """ Gets, sets and removes the value at a path in nested dicts and
+    objects, with the same semantics as :func:`dict_get_path`,
+    :func:`dict_set_path` and :func:`dict_remove_path`.
+
+    The path is split once, and the accessor functions are specialized
+    for the length of the path. As long as only dicts are traversed,
+    the values are looked up directly --- attribute lookups are only
+    attempted when something that is not a dict is found.
+
+    Like the functions above, *path* may also be an iterable of keys.
+    Accessors are usually created with :func:`get_path_accessor`, which
+    caches them by path.
+
+    Example: ::
+
+        >>> accessor = PathAccessor('a.b')
+        >>> d = dict()
+        >>> accessor.set(d, 42)
+        >>> d
+        {'a': {'b': 42}}
+        >>> accessor.get(d)
+        42
+        >>> accessor.remove(d)
+        >>> d
+        {'a': {}}
+        >>> accessor.get(d, 'fallback')
+        'fallback'
+    """
+    __slots__ = ('path', 'keys', 'get', 'set', 'remove')
+
+    def __init__(self, path, separator='.'):
+        self.path = path
+        self.keys = tuple(_get_paths(path, separator))
+
+        self.get = self._make_getter(path, self.keys)
+        self.set = self._make_setter(self.keys)
+        self.remove = self._make_remover(path, self.keys)
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.path)
+
+    @classmethod
+    def _make_getter(cls, path, keys):
+        if path == '':
+            def get(dict_like, fallback=None):
+                return dict_like
+            return get
+
+        def slow_get(dict_like, fallback):
+            for key in keys:
+                try:
+                    dict_like = dict_like[key]
+                except (KeyError, TypeError, AttributeError):
+                    try:
+                        dict_like = getattr(dict_like, key)
+                    except AttributeError:
+                        return fallback
+            return dict_like
+
+        if len(keys) == 1:
+            key = keys[0]
+            def get(dict_like, fallback=None):
+                try:
+                    return dict_like[key]
+                except (KeyError, TypeError, AttributeError):
+                    return getattr(dict_like, key, fallback)
+
+        elif len(keys) == 2:
+            first, second = keys
+            def get(dict_like, fallback=None):
+                try:
+                    return dict_like[first][second]
+                except (KeyError, TypeError, AttributeError):
+                    return slow_get(dict_like, fallback)
+
+        else:
+            def get(dict_like, fallback=None):
+                value = dict_like
+                try:
+                    for key in keys:
+                        value = value[key]
+                    return value
+                except (KeyError, TypeError, AttributeError):
+                    return slow_get(dict_like, fallback)
+
+        return get
+
+    @classmethod
+    def _make_setter(cls, keys):
+        parent_keys, last_key = keys[:-1], keys[-1]
+
+        def set(dict_like, value):
+            for key in parent_keys:
+                if type(dict_like) is dict:
+                    try:
+                        dict_like = dict_like[key]
+                    except KeyError:
+                        dict_like[key] = dict_like = dict()
+                else:
+                    dict_like = _get_or_create_child(dict_like, key)
+
+            if type(dict_like) is dict:
+                dict_like[last_key] = value
+            else:
+                _set_child(dict_like, last_key, value)
+
+        return set
+
+    @classmethod
+    def _make_remover(cls, path, keys):
+        get_parent = cls._make_getter(None, keys[:-1]) if len(keys) > 1 else None
+        last_key = keys[-1]
+
+        def remove(dict_like, ignore_missing=True):
+            parent = get_parent(dict_like) if get_parent else dict_like
+            _remove_child(parent, last_key, dict_like, path, ignore_missing)
+
+        return remove
+
+
+_path_accessors = dict()
+#: The maximum number of accessors cached by :func:`get_path_accessor`.
+max_cached_path_accessors = 10000
+
+
+def get_path_accessor(path, separator='.'):
+    """ Returns a :class:`PathAccessor` for *path*.
+
+    Accessors for string paths are cached by path and separator, so calling
+    this repeatedly with the same path is cheap.
+    """
+    if not isinstance(path, basestring):
+        return PathAccessor(path, separator)
+
+    try:
+        return _path_accessors[path, separator]
+    except KeyError:
+        pass
+
+    if len(_path_accessors) >= max_cached_path_accessors:
+        # paths that are created on the fly should not make the cache grow without bounds.
+        _path_accessors.clear()
+
+    accessor = _path_accessors[path, separator] = PathAccessor(path, separator)
+    return accessor
+
+
 def dict_setdefault_path(dict_like, path_or_list, value, separator='.'):
     """ Sets the configuration key specified by *path* to *value*,
     unless a value is already defined for that path. Returns the value
@@ -269,6 +432,52 @@ def expand_filepath(path):
     return os.path.expandvars(os.path.expanduser(getattr(path, 'path', path)))
 
 
+def load_cache_file(path, key, description):
+    """ Returns the value that was saved in the file *path* by :func:`save_cache_file`
+    with the same *key*, or None if the file is missing, unreadable or outdated.
+
+    :param description: What the file is, such as "plugin index", for the log messages.
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'rb') as cache_file:
+            saved_key, value = pickle.load(cache_file)
+    except Exception:
+        logger.warn('Ignoring unreadable %s %r.' % (description, path), exc_info=True)
+        return None
+
+    if saved_key != key:
+        logger.info('The %s %r is outdated.' % (description, path))
+        return None
+
+    logger.debug('Using the %s %r.' % (description, path))
+    return value
+
+
+def save_cache_file(path, key, value, description):
+    """ Pickles *value* along with *key* to the file *path*, which is loaded
+    with :func:`load_cache_file`.
+
+    The file is replaced atomically, so other processes either see the previous
+    or the new file.
+
+    :return: Whether the file was written.
+    """
+    temporary_path = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(temporary_path, 'wb') as cache_file:
+            pickle.dump((key, value), cache_file, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_path, path)
+    except Exception:
+        logger.warn('Could not write the %s %r.' % (description, path), exc_info=True)
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return False
+    return True
+
+
 def flatten(list_like, recursive=True):
     """ Flattens a list-like datastructure (returning a new list). """
     retval = []
@@ -430,6 +639,139 @@ class AttributeDict(dict):
     __delattr__ = dict.__delitem__
 
 
+class CopyOnWriteDict(dict):
+    """ A copy of a dict that shares the nested dicts of the original.
+
+    A nested dict is only copied the first time it is used through the copy,
+    and then again as a :class:`CopyOnWriteDict`, so changing a copy through
+    its methods does not change the original, yet copying a large baton only
+    costs as much as a shallow copy. Since it is a dict, it can be used wherever
+    a baton is, and it is pickled and deep-copied as a plain dict.
+
+    Example: ::
+
+        >>> original = dict(a=dict(b=1), c=[1])
+        >>> copy = CopyOnWriteDict(original)
+        >>> copy['a']['b'] = 2
+        >>> copy
+        {'a': {'b': 2}, 'c': [1]}
+        >>> original
+        {'a': {'b': 1}, 'c': [1]}
+
+    .. note ::
+
+        Only dicts are copied on write. Other mutable values, such as lists,
+        are shared just as with :meth:`dict.copy`. The original should not be
+        changed while the copy is in use, since the copy only sees the
+        changes to the nested dicts it has not copied yet.
+
+        Since a nested dict that is read may be changed by the reader, reading
+        it copies it as well, but only the one level that is read.
+
+        ``dict(copy)``, ``**copy``, ``other.update(copy)`` and the JSON encoder
+        read the storage of the dict directly, and therefore get the nested
+        dicts that have not been copied yet, just as with a shallow copy. Use
+        :meth:`copy` to get an independent copy of a copy.
+    """
+    __slots__ = ('_owned',)
+
+    def __init__(self, *a, **kw):
+        dict.__init__(self, *a, **kw)
+        # the keys whose values are not shared with the original
+        self._owned = set(kw)
+
+    def _own(self, key, value):
+        if isinstance(value, dict) and key not in self._owned:
+            value = CopyOnWriteDict(value)
+            dict.__setitem__(self, key, value)
+        self._owned.add(key)
+        return value
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._owned:
+            return value
+        return self._own(key, value)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._owned.add(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._owned.discard(key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        if isinstance(value, dict) and key not in self._owned:
+            value = CopyOnWriteDict(value)
+        self._owned.discard(key)
+        return key, value
+
+    def update(self, *a, **kw):
+        other = dict(*a, **kw)
+        dict.update(self, other)
+        self._owned.update(other)
+
+    def clear(self):
+        dict.clear(self)
+        self._owned.clear()
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self[key]
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def viewvalues(self):
+        return collections.ValuesView(self)
+
+    def viewitems(self):
+        return collections.ItemsView(self)
+
+    def copy(self):
+        return CopyOnWriteDict(self)
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+def copy_on_write(value):
+    """ Returns a :class:`CopyOnWriteDict` of *value* if it is a dict, or
+    else a shallow copy of it. """
+    if isinstance(value, dict):
+        return CopyOnWriteDict(value)
+    return copy.copy(value)
+
+
 class OrderedDictionary(OrderedDict):
 
     def replace_key(self, existing_key, new_key, new_value):
@@ -517,6 +859,152 @@ class BatonJSONEncoder(PipedJSONEncoder):
             return repr(obj)
 
 
+class BatonSnapshot(object):
+    """ An immutable snapshot of a baton, taken by a :class:`BatonSnapshotter`.
+
+    Use :meth:`rebuild` to get a copy of the baton as it was when the snapshot was
+    taken.
+    """
+    __slots__ = ('frozen',)
+
+    def __init__(self, frozen):
+        self.frozen = frozen
+
+    def rebuild(self):
+        """ Returns a new copy of the baton, with dicts and lists as they would be after
+        encoding and decoding the baton as JSON. """
+        return _thaw(self.frozen)
+
+    def __json__(self):
+        return self.rebuild()
+
+
+def _thaw(frozen):
+    if isinstance(frozen, dict):
+        return dict((key, _thaw(value)) for key, value in frozen.iteritems())
+    if isinstance(frozen, tuple):
+        return [_thaw(value) for value in frozen]
+    return frozen
+
+
+class BatonSnapshotter(object):
+    """ Takes :class:`BatonSnapshot`\s of batons that may be changed between the snapshots.
+
+    Copying the whole baton for every snapshot is expensive if the baton carries large
+    values. Instead, dicts and lists are frozen into dicts and tuples that are shared
+    with the previous snapshot of the same object if none of their items have changed,
+    so every snapshot only stores the parts of the baton that changed since the last
+    snapshot. Strings and numbers are immutable, and are never copied.
+
+    Example: ::
+
+        >>> snapshotter = BatonSnapshotter(max_value_size=5)
+        >>> baton = dict(page='a long string', status=dict(code=200))
+        >>> first = snapshotter.snapshot(baton)
+        >>> baton['foo'] = 'bar'
+        >>> second = snapshotter.snapshot(baton)
+        >>> second.frozen['status'] is first.frozen['status']
+        True
+        >>> second.rebuild() == dict(page='a lon... (8 characters truncated)', status=dict(code=200), foo='bar')
+        True
+
+    :param max_value_size: If set, strings that are longer than this are truncated,
+        ending with a marker that tells how many characters were left out. Objects
+        that are not JSON-serializable are represented as in :class:`BatonJSONEncoder`.
+    """
+    scalar_types = (bool, int, long, float, type(None))
+
+    def __init__(self, max_value_size=None):
+        self.max_value_size = max_value_size
+        self.encoder = BatonJSONEncoder()
+
+        # maps id(obj) to (obj, frozen). we keep a reference to obj to make sure the id is not reused.
+        self._frozen_by_id = dict()
+        self._freezing = set()
+
+    def snapshot(self, baton):
+        """ Returns a :class:`BatonSnapshot` of the current state of *baton*. """
+        return BatonSnapshot(self._freeze(baton))
+
+    def clear(self):
+        """ Forget the previous snapshots, which means the next snapshots will not share any
+        parts with them. """
+        self._frozen_by_id.clear()
+
+    def _freeze(self, value):
+        if isinstance(value, self.scalar_types):
+            return value
+        if isinstance(value, basestring):
+            return self._freeze_string(value)
+        if isinstance(value, dict):
+            return self._freeze_container(value, self._freeze_dict)
+        if isinstance(value, (list, tuple)):
+            return self._freeze_container(value, self._freeze_sequence)
+        return self._freeze(self.encoder.default(value))
+
+    def _freeze_string(self, value):
+        if self.max_value_size is None or len(value) <= self.max_value_size:
+            return value
+
+        previous = self._frozen_by_id.get(id(value))
+        if previous and previous[0] is value:
+            return previous[1]
+
+        frozen = value[:self.max_value_size] + '... (%i characters truncated)' % (len(value) - self.max_value_size)
+        self._frozen_by_id[id(value)] = (value, frozen)
+        return frozen
+
+    def _freeze_container(self, value, freezer):
+        if id(value) in self._freezing:
+            return '<recursive reference to %s>' % type(value).__name__
+
+        previous = self._frozen_by_id.get(id(value))
+        if previous and previous[0] is not value:
+            previous = None
+
+        self._freezing.add(id(value))
+        try:
+            frozen = freezer(value, previous[1] if previous else None)
+        finally:
+            self._freezing.discard(id(value))
+
+        if not previous or frozen is not previous[1]:
+            self._frozen_by_id[id(value)] = (value, frozen)
+        return frozen
+
+    def _freeze_dict(self, value, previous):
+        frozen = dict()
+        for key, item in value.iteritems():
+            frozen[self._freeze_key(key)] = self._freeze(item)
+
+        if previous is not None and len(previous) == len(frozen):
+            for key, item in frozen.iteritems():
+                if previous.get(key, frozen) is not item:
+                    break
+            else:
+                return previous
+        return frozen
+
+    def _freeze_sequence(self, value, previous):
+        frozen = tuple(self._freeze(item) for item in value)
+
+        if previous is not None and len(previous) == len(frozen):
+            for previous_item, item in zip(previous, frozen):
+                if previous_item is not item:
+                    break
+            else:
+                return previous
+        return frozen
+
+    def _freeze_key(self, key):
+        # keys are converted in the same way as when encoding the baton as JSON.
+        if isinstance(key, basestring):
+            return key
+        if isinstance(key, self.scalar_types):
+            return json.dumps(key)
+        return repr(key)
+
+
 class PullFromQueueAndProcessWithDependency(service.Service):
     _waiting_on_queue = None
     _waiting_on_processor = None
@@ -641,6 +1129,90 @@ def create_deferred_state_watcher(obj, attribute_name='_currently'):
     return wrapper
 
 
+def maybe_inline_callbacks(f):
+    """ Like :func:`twisted.internet.defer.inlineCallbacks`, but the generator is
+    continued inline as long as it yields plain values or Deferreds that have
+    already fired.
+
+    If the generator never has to wait for a Deferred, its return value is returned
+    (or its exception raised) directly, without creating any Deferreds. Otherwise, a
+    Deferred is returned that fires with the return value.
+
+    Example: ::
+
+        >>> @maybe_inline_callbacks
+        ... def double(value):
+        ...     value = yield value
+        ...     defer.returnValue(value * 2)
+        ...
+        >>> double(21)
+        42
+        >>> double(defer.succeed(21)) # doctest: +ELLIPSIS
+        42
+        >>> d = defer.Deferred()
+        >>> result = double(d)
+        >>> result # doctest: +ELLIPSIS
+        <Deferred at ...>
+        >>> d.callback(21)
+        >>> result.result
+        42
+    """
+    @functools.wraps(f)
+    def wrapper(*a, **kw):
+        return _maybe_inline_callbacks(None, f(*a, **kw), None)
+    wrapper.__wrapped__ = f
+    return wrapper
+
+
+def _maybe_inline_callbacks(result, generator, deferred):
+    while True:
+        try:
+            if isinstance(result, failure.Failure):
+                result = result.throwExceptionIntoGenerator(generator)
+            else:
+                result = generator.send(result)
+        except StopIteration:
+            value = None
+            break
+        except defer._DefGen_Return as e:
+            value = e.value
+            break
+        except:
+            if deferred is None:
+                raise
+            deferred.errback()
+            return deferred
+
+        if not isinstance(result, defer.Deferred):
+            continue
+
+        # waiting[0] is True until the deferred has fired or we have given up waiting for it.
+        waiting = [True, None, deferred]
+
+        def on_result(r, waiting=waiting):
+            if waiting[0]:
+                waiting[0] = False
+                waiting[1] = r
+            else:
+                _maybe_inline_callbacks(r, generator, waiting[2])
+
+        result.addBoth(on_result)
+
+        if waiting[0]:
+            waiting[0] = False
+            if deferred is None:
+                deferred = waiting[2] = defer.Deferred()
+            return deferred
+
+        result = waiting[1]
+
+    if deferred is None:
+        return value
+
+    deferred.callback(value)
+    return deferred
+
+
 def fail_after_delay(delay, exception):
     """ Returns a Deferred that will errback with `exception` after `delay`. """
     d = defer.Deferred()
@@ -799,6 +1371,98 @@ class Cancellable(object):
         return result
 
 
+class CancellationScope(Cancellable):
+    """ A unit of work that may be cancelled as a whole, optionally with a deadline.
+
+    Deferreds that are made :meth:`cancellable` are cancelled when the scope is
+    cancelled, as are the child scopes. If the scope has a deadline, the scope is
+    cancelled when the deadline passes, and :attr:`expired` becomes true.
+
+    :param timeout: The number of seconds until the deadline, or None for no deadline.
+        A child scope never has a later deadline than its parent.
+    :param parent: The parent scope, which cancels this scope when it is cancelled.
+    :param clock: The clock used for the deadline. Defaults to the clock of the
+        parent, or the reactor.
+    """
+    cancelled = False
+    expired = False
+
+    def __init__(self, timeout=None, parent=None, clock=None):
+        super(CancellationScope, self).__init__()
+        self.clock = clock or getattr(parent, 'clock', reactor)
+
+        self.deadline = None
+        if timeout is not None:
+            self.deadline = self.clock.seconds() + timeout
+
+        self._timer = None
+
+        if parent is not None:
+            self.set_cancellable_parent(parent)
+            if parent.deadline is not None and (self.deadline is None or parent.deadline < self.deadline):
+                self.deadline = parent.deadline
+            if parent.cancelled:
+                self.expired = parent.expired
+                self.cancelled = True
+                return
+
+        if self.deadline is not None:
+            self._timer = self.clock.callLater(max(0, self.deadline - self.clock.seconds()), self._expire)
+
+    @property
+    def remaining(self):
+        """ The number of seconds until the deadline, or None if there is no deadline. """
+        if self.deadline is None:
+            return None
+        return max(0, self.deadline - self.clock.seconds())
+
+    def child(self, timeout=None):
+        """ Returns a new scope that is cancelled along with this scope. """
+        return CancellationScope(timeout, parent=self)
+
+    def cancellable(self, d):
+        if self.cancelled and isinstance(d, defer.Deferred):
+            d.cancel()
+            return d
+        return super(CancellationScope, self).cancellable(d)
+
+    def cancel(self):
+        """ Cancel the deferreds and child scopes of this scope. """
+        self.cancelled = True
+        self._stop_timer()
+
+        for child in list(self._children_cancellables):
+            child.cancel()
+        super(CancellationScope, self).cancel()
+
+    def raise_if_cancelled(self):
+        """ Raises :exc:`twisted.internet.defer.CancelledError` if the scope is cancelled. """
+        if self.cancelled:
+            reason = 'the deadline has passed' if self.expired else 'cancelled'
+            raise defer.CancelledError(reason)
+
+    def close(self):
+        """ Called when the work of the scope is done. Stops waiting for the deadline
+        and detaches the scope from its parent. """
+        self._stop_timer()
+        self.disown_cancellable_parent()
+
+    def close_callback(self, result):
+        """ Calls :meth:`close` and returns *result*, for use as a callback. """
+        self.close()
+        return result
+
+    def _expire(self):
+        self._timer = None
+        self.expired = True
+        self.cancel()
+
+    def _stop_timer(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+
+
 class DeferredLock(defer.DeferredLock):
     entered = False
 
@@ -13,6 +13,10 @@ it is relative to the current working directory of the python process.
 with a path that is relative to the root of the piped source, and is
 often used for including configuration mix-ins that is part of the
 piped distribution.
+
+The constructors are registered with both the pure-Python loader and
+:data:`Loader`, which uses libyaml if it is available, and is used by
+:func:`load` to parse the configuration files.
 """
 import os
 import types
@@ -24,14 +28,65 @@ import piped
 from piped import util
 
 
-def filepath_constructor(loader, node):
-    path = loader.construct_python_str(node)
+#: The fastest available loader, which is backed by libyaml if PyYAML was built with it.
+Loader = getattr(yaml, 'CLoader', yaml.Loader)
+#: The loaders that the constructors are registered with.
+loaders = [yaml.Loader] if Loader is yaml.Loader else [yaml.Loader, Loader]
+
+
+def add_constructor(tag, constructor):
+    for loader in loaders:
+        yaml.add_constructor(tag, constructor, Loader=loader)
+
+
+def add_multi_constructor(tag_prefix, multi_constructor):
+    for loader in loaders:
+        yaml.add_multi_constructor(tag_prefix, multi_constructor, Loader=loader)
+
+
+def load(stream, resolved_paths=None):
+    """ Parses the document in *stream* with :data:`Loader`.
+
+    The files that are referred to by ``!filepath`` and ``!pipedpath`` depend on the
+    environment, such as the current working directory. If *resolved_paths* is a list,
+    ``(tag, original_path, path)`` is appended to it for every file, which can be used
+    with :func:`paths_are_unchanged` later.
+    """
+    loader = Loader(stream)
+    loader.resolved_paths = resolved_paths
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+def _record_resolved_path(loader, tag, fp):
+    resolved_paths = getattr(loader, 'resolved_paths', None)
+    if resolved_paths is not None:
+        resolved_paths.append((tag, fp.origpath, fp.path))
+
+
+def paths_are_unchanged(resolved_paths):
+    """ Returns whether the paths recorded by :func:`load` still resolve to the same files. """
+    for tag, original_path, path in resolved_paths:
+        if path_resolvers[tag](original_path).path != path:
+            return False
+    return True
+
+
+def make_filepath(path):
     fp = filepath.FilePath(util.expand_filepath(path))
 
     # add a marker to dump the configuration
     fp.origpath = path
     return fp
-yaml.add_constructor(u'!filepath', filepath_constructor)
+
+
+def filepath_constructor(loader, node):
+    fp = make_filepath(loader.construct_python_str(node))
+    _record_resolved_path(loader, u'!filepath', fp)
+    return fp
+add_constructor(u'!filepath', filepath_constructor)
 
 
 def is_package(any):
@@ -39,8 +94,7 @@ def is_package(any):
         return True
     return False
 
-def pipedpath_constructor(loader, node):
-    path = loader.construct_python_str(node)
+def make_pipedpath(path):
     original_path = path
     package = piped
     
@@ -74,7 +128,15 @@ def pipedpath_constructor(loader, node):
     fp.pipedpath = True
     return fp
 
-yaml.add_constructor(u'!pipedpath', pipedpath_constructor)
+
+def pipedpath_constructor(loader, node):
+    fp = make_pipedpath(loader.construct_python_str(node))
+    _record_resolved_path(loader, u'!pipedpath', fp)
+    return fp
+
+add_constructor(u'!pipedpath', pipedpath_constructor)
+
+path_resolvers = {u'!filepath': make_filepath, u'!pipedpath': make_pipedpath}
 
 
 def filepath_representer(dumper, path):
@@ -129,7 +191,7 @@ class YAMLAlias(object):
         return dumper.represent_scalar(cls.yaml_tag+data.name, u'')
 
 yaml.add_representer(Alias, YAMLAlias.to_yaml)
-yaml.add_multi_constructor(YAMLAlias.yaml_tag, YAMLAlias.from_yaml)
+add_multi_constructor(YAMLAlias.yaml_tag, YAMLAlias.from_yaml)
 
 
 class BatonPath(str):
@@ -154,4 +216,4 @@ class BatonPath(str):
         return dumper.represent_scalar(cls.yaml_tag, data)
 
 yaml.add_representer(BatonPath, BatonPath.to_yaml)
-yaml.add_constructor(BatonPath.yaml_tag, BatonPath.from_yaml)
\ No newline at end of file
+add_constructor(BatonPath.yaml_tag, BatonPath.from_yaml)
\ No newline at end of file